@@ -0,0 +1,48 @@
+import logging
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.query_utils import Q
+
+from seqr.models import Project, Sample
+from seqr.utils.elasticsearch.local_es import generate_local_es_index, write_local_es_index
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Generate a store of variants for the active samples in the given projects, to serve with run_local_es_server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('store_dir', help='directory to write the generated indices to')
+        parser.add_argument('projects', nargs='+', help='Project(s) to generate variants for')
+        parser.add_argument('--num-variants', type=int, default=10000, help='number of variants to generate per index')
+        parser.add_argument('--seed', type=int, default=0, help='random seed for the generated variants')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.filter(Q(name__in=options['projects']) | Q(guid__in=options['projects']))
+        if not projects:
+            raise CommandError('Invalid projects: {}'.format(', '.join(options['projects'])))
+
+        samples = Sample.objects.filter(
+            individual__family__project__in=projects, is_active=True,
+            dataset_type__in=[Sample.DATASET_TYPE_VARIANT_CALLS, Sample.DATASET_TYPE_SV_CALLS],
+        ).select_related('individual__family__project').order_by('sample_id')
+
+        index_family_sample_ids = defaultdict(lambda: defaultdict(list))
+        index_metadata = {}
+        for sample in samples:
+            family = sample.individual.family
+            index_family_sample_ids[sample.elasticsearch_index][family.guid].append(sample.sample_id)
+            index_metadata[sample.elasticsearch_index] = {
+                'dataset_type': sample.dataset_type, 'sample_type': sample.sample_type,
+                'genome_version': family.project.genome_version,
+            }
+
+        for i, index_name in enumerate(sorted(index_family_sample_ids.keys())):
+            family_sample_ids = [
+                sample_ids for _, sample_ids in sorted(index_family_sample_ids[index_name].items())]
+            mapping, docs = generate_local_es_index(
+                options['num_variants'], family_sample_ids, seed=options['seed'] + i, **index_metadata[index_name])
+            write_local_es_index(options['store_dir'], index_name, mapping, docs)
+            logger.info('Generated {} variants in {} for {} families'.format(
+                len(docs), index_name, len(family_sample_ids)))
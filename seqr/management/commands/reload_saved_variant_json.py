@@ -1,13 +1,22 @@
 import logging
+from datetime import timedelta
 from django.core.management.base import BaseCommand
 from django.db.models.query_utils import Q
+from timeit import default_timer as timer
 from tqdm import tqdm
 import traceback
 from seqr.models import Project
-from seqr.views.utils.variant_utils import update_project_saved_variant_json
+from seqr.utils.redis_utils import safe_redis_hmget_json, safe_redis_hset_json
+from seqr.views.utils.variant_utils import update_project_saved_variant_json, MAX_CONCURRENT_SAVED_VARIANT_JSON_FETCHES
 
 logger = logging.getLogger(__name__)
 
+CHECKPOINT_EXPIRE = timedelta(weeks=1)
+
+
+def _get_checkpoint_key(family_id):
+    return 'reload_saved_variant_json_checkpoint__{}'.format(family_id or 'all')
+
 
 class Command(BaseCommand):
     help = 'Transfer projects to the new seqr schema'
@@ -15,6 +24,14 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('projects', nargs="*", help='Project(s) to transfer. If not specified, defaults to all projects.')
         parser.add_argument('--family-id', help='optional family to reload variants for')
+        parser.add_argument(
+            '--workers', type=int, default=MAX_CONCURRENT_SAVED_VARIANT_JSON_FETCHES,
+            help='number of variant chunks to fetch concurrently for each project')
+        parser.add_argument(
+            '--resume', action='store_true', help='skip projects which were reloaded by a previous run of this command')
+        parser.add_argument(
+            '--changed-only', action='store_true',
+            help='only reload variants whose family data was loaded since their json was last reloaded')
 
     def handle(self, *args, **options):
         """transfer project"""
@@ -28,27 +45,43 @@ class Command(BaseCommand):
             projects = Project.objects.all()
             logging.info("Processing all %s projects" % len(projects))
 
+        checkpoint_key = _get_checkpoint_key(family_id)
+        if options['resume']:
+            checkpoints = safe_redis_hmget_json(checkpoint_key, [project.guid for project in projects])
+            completed_projects = [project for project in projects if checkpoints.get(project.guid) is not None]
+            if completed_projects:
+                logger.info('Skipping {} projects reloaded by a previous run'.format(len(completed_projects)))
+            projects = [project for project in projects if checkpoints.get(project.guid) is None]
+
         success = {}
         error = {}
+        start_time = timer()
         for project in tqdm(projects, unit=" projects"):
             logger.info("Project: " + project.name)
             try:
-                updated_saved_variant_guids = update_project_saved_variant_json(project, family_id=family_id)
+                updated_saved_variant_guids = update_project_saved_variant_json(
+                    project, family_id=family_id, changed_sources_only=options['changed_only'],
+                    max_workers=options['workers'])
                 success[project.name] = len(updated_saved_variant_guids)
                 logger.info('Updated {0} variants for project {1}'.format(len(updated_saved_variant_guids), project.name))
+                safe_redis_hset_json(
+                    checkpoint_key, {project.guid: len(updated_saved_variant_guids)}, expire=CHECKPOINT_EXPIRE)
             except Exception as e:
                 traceback_message = traceback.format_exc()
                 logger.error(traceback_message)
                 logger.error('Error in project {0}: {1}'.format(project.name, e))
                 error[project.name] = e
+        elapsed_time = timer() - start_time
 
         logger.info("Done")
         logger.info("Summary: ")
         for k, v in success.items():
             if v > 0:
                 logger.info("  {0}: Updated {1} variants".format(k, v))
+        total_updated = sum(success.values())
+        logger.info('Updated {0} variants in {1:.1f}s ({2:.1f} variants/s)'.format(
+            total_updated, elapsed_time, total_updated / elapsed_time if elapsed_time else 0))
         if len(error):
             logger.info("{0} failed projects".format(len(error)))
         for k, v in error.items():
             logger.info("  {0}: {1}".format(k, v))
-
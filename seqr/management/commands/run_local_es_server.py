@@ -0,0 +1,27 @@
+import logging
+from django.core.management.base import BaseCommand
+
+from seqr.utils.elasticsearch.local_es import LocalEsStore, create_local_es_server
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Serve a generated variant store with a local stand-in for elasticsearch, for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('store_dir', help='directory created by generate_local_es_store')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--port', type=int, default=9200)
+
+    def handle(self, *args, **options):
+        store = LocalEsStore.load(options['store_dir'])
+        server = create_local_es_server(store, host=options['host'], port=options['port'])
+        logger.info('Serving {} indices from {} at http://{}:{}'.format(
+            len(store.cat_indices()), options['store_dir'], options['host'], server.server_address[1]))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,101 @@
+import json
+import logging
+from django.core.management.base import BaseCommand, CommandError
+
+from seqr.utils.elasticsearch.benchmark_utils import BENCHMARKS
+from seqr.utils.redis_utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+STATS_COLUMNS = ['min', 'max', 'mean', 'stddev', 'median']
+
+
+def _get_timed_stats(results):
+    return [
+        ('{}[{}]'.format(result['name'], k), v) for result in results for k, v in result.items() if isinstance(v, dict)
+    ]
+
+
+def _format_stats_table(results):
+    # Formatted like the pytest-benchmark summary table, sorted from fastest to slowest
+    timed_stats = sorted(_get_timed_stats(results), key=lambda stat: stat[1]['min'])
+    name_width = max([len(name) for name, _ in timed_stats] + [len('Name (time in ms)')])
+    rows = ['{}{}{:>8}'.format(
+        'Name (time in ms)'.ljust(name_width), ''.join(column.title().rjust(12) for column in STATS_COLUMNS), 'Rounds')]
+    rows += ['{}{}{:>8}'.format(
+        name.ljust(name_width), ''.join('{:12.4f}'.format(stats[column] * 1000) for column in STATS_COLUMNS),
+        stats['rounds'],
+    ) for name, stats in timed_stats]
+    return '\n'.join(rows)
+
+
+def _get_regressions(results, baseline_results, max_regression):
+    # Compares minimum times, which are the least affected by other load on the machine
+    baseline_stats = dict(_get_timed_stats(baseline_results))
+    regressions = []
+    for name, stats in _get_timed_stats(results):
+        baseline = baseline_stats.get(name)
+        if not baseline or not baseline['min']:
+            continue
+        change = (stats['min'] - baseline['min']) / baseline['min'] * 100
+        logger.info('{} {:.4f}s vs {:.4f}s ({:+.1f}%)'.format(name, stats['min'], baseline['min'], change))
+        if change > max_regression:
+            regressions.append('{} ({:+.1f}%)'.format(name, change))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = 'Run offline performance benchmarks for variant search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmarks', nargs='*', help='Benchmark(s) to run ({}). If not specified, defaults to all benchmarks.'.format(
+            ', '.join(sorted(BENCHMARKS.keys()))))
+        parser.add_argument('--num-variants', type=int, default=10000, help='number of variants to benchmark with')
+        parser.add_argument('--num-families', type=int, help='number of families in the generated searches and hits')
+        parser.add_argument('--samples-per-family', type=int, help='number of samples in each generated family')
+        parser.add_argument('--repeat', type=int, default=3, help='number of times to run each benchmark')
+        parser.add_argument('--redis', action='store_true', help='measure memory usage in the configured redis')
+        parser.add_argument('--es-response-file', help='recorded elasticsearch response JSON to benchmark parsing with')
+        parser.add_argument('--save-results', help='file to save the benchmark results JSON to')
+        parser.add_argument('--compare', help='saved benchmark results JSON to compare against')
+        parser.add_argument(
+            '--max-regression', type=float, default=10.0,
+            help='percent slowdown from the compared results at which the command fails')
+
+    def handle(self, *args, **options):
+        invalid_benchmarks = [benchmark for benchmark in options['benchmarks'] if benchmark not in BENCHMARKS]
+        if invalid_benchmarks:
+            raise CommandError('Invalid benchmarks: {}'.format(', '.join(invalid_benchmarks)))
+
+        benchmark_kwargs = {
+            'num_variants': options['num_variants'], 'repeat': options['repeat'],
+            'redis_client': get_redis_client() if options['redis'] else None,
+            'es_response_file': options['es_response_file'],
+        }
+        benchmark_kwargs.update({
+            key: options[key] for key in ['num_families', 'samples_per_family'] if options[key] is not None
+        })
+
+        all_results = []
+        for benchmark in options['benchmarks'] or sorted(BENCHMARKS.keys()):
+            results = BENCHMARKS[benchmark](**benchmark_kwargs)
+            for result in results:
+                logger.info('{name}: {details}'.format(name=result['name'], details=', '.join([
+                    '{} {:.4f}s (mean {:.4f}s)'.format(k, v['min'], v['mean']) if isinstance(v, dict) else
+                    '{} {}'.format(k, v) for k, v in result.items() if k != 'name'
+                ])))
+            all_results += results
+
+        self.stdout.write(_format_stats_table(all_results))
+
+        if options['save_results']:
+            with open(options['save_results'], 'w') as f:
+                json.dump(all_results, f, indent=2)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline_results = json.load(f)
+            regressions = _get_regressions(all_results, baseline_results, options['max_regression'])
+            if regressions:
+                raise CommandError('Benchmarks slower than the compared results by more than {}%: {}'.format(
+                    options['max_regression'], ', '.join(regressions)))
@@ -0,0 +1,156 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import re
+import requests
+from threading import Lock
+from timeit import default_timer as timer
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from settings import CSRF_COOKIE_NAME
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOAD_TEST_SEARCH = {
+    'annotations': {
+        'frameshift': ['frameshift_variant'], 'nonsense': ['stop_gained'], 'missense': ['missense_variant'],
+    },
+    'freqs': {'callset': {'af': 0.1}},
+}
+PERCENTILES = [50, 95, 99]
+SERVER_TIMING_REGEX = re.compile(r'([\w.-]+);dur=([\d.]+)')
+
+
+def _percentile(sorted_values, percentile):
+    return sorted_values[min(int(len(sorted_values) * percentile / 100), len(sorted_values) - 1)]
+
+
+class LoadTestStats(object):
+    """Collects the latency and failures of the requests made by all the load test users"""
+
+    def __init__(self):
+        self._latencies = defaultdict(list)
+        self._failures = defaultdict(int)
+        self._server_timings = defaultdict(lambda: defaultdict(float))
+        self._lock = Lock()
+
+    def add_request(self, name, latency, success, server_timing=None):
+        with self._lock:
+            self._latencies[name].append(latency)
+            if not success:
+                self._failures[name] += 1
+            for stage, duration in SERVER_TIMING_REGEX.findall(server_timing or ''):
+                self._server_timings[name][stage] += float(duration)
+
+    def get_summary(self, duration):
+        with self._lock:
+            summary = []
+            for name, latencies in sorted(self._latencies.items()):
+                latencies = sorted(latencies)
+                summary.append(dict(
+                    name=name, requests=len(latencies), failures=self._failures[name],
+                    mean=sum(latencies) / len(latencies), max=latencies[-1], rps=len(latencies) / duration,
+                    server_timings={
+                        stage: total / len(latencies) for stage, total in self._server_timings[name].items()},
+                    **{'p{}'.format(percentile): _percentile(latencies, percentile) for percentile in PERCENTILES}
+                ))
+            return summary
+
+
+class SearchLoadTestUser(object):
+    """A logged in seqr user who repeatedly runs a new search, pages through the results, and loads the gene breakdown
+    and export for the search, like a locust user"""
+
+    def __init__(self, url, email, password, stats):
+        self._url = url.rstrip('/')
+        self._stats = stats
+        self._session = requests.Session()
+        # The login page sets the CSRF cookie needed for all other requests
+        self._session.get('{}/login'.format(self._url))
+        response = self._request('login', 'POST', '/api/login', data=json.dumps({'email': email, 'password': password}))
+        if response is None or not response.ok:
+            raise CommandError('Unable to login as {}: {}'.format(
+                email, response.reason if response is not None else 'no response'))
+
+    def _request(self, name, method, path, **kwargs):
+        start = timer()
+        response = None
+        try:
+            response = self._session.request(
+                method, '{}{}'.format(self._url, path), headers={'X-CSRFToken': self._session.cookies.get(CSRF_COOKIE_NAME)},
+                **kwargs)
+        except requests.RequestException as e:
+            logger.warning('{} request failed: {}'.format(name, str(e)))
+        self._stats.add_request(
+            name, timer() - start, response is not None and response.ok,
+            server_timing=response.headers.get('Server-Timing') if response is not None else None)
+        return response
+
+    def run_search(self, search_context, num_pages=1, export=False):
+        search_hash = uuid.uuid4().hex
+        search_path = '/api/search/{}?sort=xpos&page={{}}'.format(search_hash)
+        response = self._request('search', 'POST', search_path.format(1), data=json.dumps(search_context))
+        if response is None or not response.ok:
+            return
+
+        # Later pages and the gene breakdown are loaded from the cached search results
+        for page in range(2, num_pages + 1):
+            self._request('search_page', 'POST', search_path.format(page))
+        self._request('gene_breakdown', 'GET', '/api/search/{}/gene_breakdown'.format(search_hash))
+        if export:
+            self._request('export', 'GET', '/api/search/{}/download?file_format=tsv'.format(search_hash))
+
+
+class Command(BaseCommand):
+    help = 'Load test variant search against a running seqr server, and report the latency and throughput of each request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('projects', nargs='+', help='Project GUID(s) to search')
+        parser.add_argument('--url', default='http://localhost:8000', help='seqr server to load test')
+        parser.add_argument('--email', required=True, help='email of the user to search as')
+        parser.add_argument('--password', required=True, help='password of the user to search as')
+        parser.add_argument('--users', type=int, default=4, help='number of concurrent users')
+        parser.add_argument('--duration', type=float, default=60, help='number of seconds to run new searches for')
+        parser.add_argument('--iterations', type=int, help='maximum number of searches to run for each user')
+        parser.add_argument('--pages', type=int, default=3, help='number of result pages to load for each search')
+        parser.add_argument('--export', action='store_true', help='export the results of each search')
+        parser.add_argument('--search-file', help='JSON file with the search to run')
+
+    def handle(self, *args, **options):
+        search = DEFAULT_LOAD_TEST_SEARCH
+        if options['search_file']:
+            with open(options['search_file']) as f:
+                search = json.load(f)
+        search_context = {'projectGuids': options['projects'], 'search': search}
+
+        stats = LoadTestStats()
+        users = [
+            SearchLoadTestUser(options['url'], options['email'], options['password'], stats)
+            for _ in range(options['users'])
+        ]
+
+        start = timer()
+        deadline = start + options['duration']
+
+        def _run_user(user):
+            num_searches = 0
+            while timer() < deadline and (options['iterations'] is None or num_searches < options['iterations']):
+                user.run_search(search_context, num_pages=options['pages'], export=options['export'])
+                num_searches += 1
+
+        with ThreadPoolExecutor(max_workers=len(users)) as executor:
+            list(executor.map(_run_user, users))
+        duration = timer() - start
+
+        for summary in stats.get_summary(duration):
+            logger.info(
+                '{name}: {requests} requests, {failures} failures, {rps:.2f} req/s, mean {mean:.3f}s, {percentiles}, max {max:.3f}s'.format(
+                    percentiles=', '.join(
+                        'p{0} {1:.3f}s'.format(percentile, summary['p{}'.format(percentile)]) for percentile in PERCENTILES
+                    ), **summary))
+            if summary['server_timings']:
+                logger.info('  server timings: {}'.format(', '.join(
+                    '{} {:.1f}ms'.format(stage, stage_duration) for stage, stage_duration in summary['server_timings'].items())))
@@ -35,6 +35,6 @@ class Command(BaseCommand):
                 variant_tags.update(variant_tag_type=to_tag_type)
 
         logger.info("Updating families")
-        families.update(project=to_project)
+        Family.bulk_update(user=None, update_json={'project': to_project}, queryset=families)
 
         logger.info("Done.")
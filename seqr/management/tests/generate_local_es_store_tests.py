@@ -0,0 +1,42 @@
+import json
+import mock
+import os
+from tempfile import TemporaryDirectory
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+
+class GenerateLocalEsStoreTest(TestCase):
+    fixtures = ['users', '1kg_project']
+
+    @mock.patch('seqr.management.commands.generate_local_es_store.logger')
+    def test_command(self, mock_logger):
+        with self.assertRaises(CommandError) as ce:
+            call_command('generate_local_es_store', 'store', 'R9999_missing')
+        self.assertEqual(str(ce.exception), 'Invalid projects: R9999_missing')
+
+        with TemporaryDirectory() as store_dir:
+            call_command('generate_local_es_store', store_dir, 'R0001_1kg', '--num-variants=20')
+
+            self.assertListEqual(sorted(os.listdir(store_dir)), ['test_index', 'test_index_old', 'test_index_sv'])
+            with open(os.path.join(store_dir, 'test_index_sv', 'mapping.json')) as f:
+                mapping = json.load(f)
+            self.assertDictEqual(mapping['_meta'], {
+                'genomeVersion': '37', 'sampleType': 'WES', 'datasetType': 'SV', 'sourceFilePath': 'generated.bed',
+            })
+            with open(os.path.join(store_dir, 'test_index', 'docs.jsonl')) as f:
+                docs = [json.loads(line) for line in f]
+
+        self.assertEqual(len(docs), 20)
+        self.assertSetEqual(
+            {genotype['sample_id'] for doc in docs for genotype in doc['_source']['genotypes']},
+            {'NA19675', 'HG00731', 'HG00732', 'HG00733', 'NA20870', 'NA20874'},
+        )
+        self.assertTrue(all(doc['_source']['xstop'] == doc['_source']['xpos'] for doc in docs))
+        mock_logger.info.assert_has_calls([
+            mock.call('Generated 20 variants in test_index for 4 families'),
+            mock.call('Generated 20 variants in test_index_old for 1 families'),
+            mock.call('Generated 20 variants in test_index_sv for 1 families'),
+        ])
@@ -3,7 +3,6 @@ import mock
 from copy import deepcopy
 from django.core.management.base import CommandError
 from seqr.models import Family
-from pyliftover.liftover import LiftOver
 from seqr.views.utils.test_utils import VARIANTS, SINGLE_VARIANT
 
 from django.core.management import call_command
@@ -21,19 +20,16 @@ INDEX_METADATA = {
 }
 SAMPLE_IDS = ["NA19679", "NA19675_1", "NA19678", "HG00731", "HG00732", "HG00733"]
 
-liftover_to_38 = LiftOver('hg19', 'hg38')
-
 LIFT_MAP = {
-    21003343353: [('chr21', 3343400)],
-    1248367227: [('chr1', 248203925)],
-    1001562437: [('chr1',   1627057)],
-    1001560662: [('chr1',  46394160)],
+    21003343353: ('21', 3343400),
+    1248367227: ('1', 248203925),
+    1001562437: ('1',   1627057),
+    1001560662: ('1',  46394160),
 }
 
 
-def mock_convert_coordinate(chrom, pos):
-    pos = int(chrom.replace('chr', ''))*int(1e9) + pos
-    return(LIFT_MAP[pos])
+def mock_lift_many(chrom, positions):
+    return [LIFT_MAP[int(chrom)*int(1e9) + pos] for pos in positions]
 
 
 @mock.patch('seqr.management.commands.lift_project_to_hg38.logger')
@@ -43,12 +39,12 @@ class LiftProjectToHg38Test(TestCase):
 
     @mock.patch('seqr.management.commands.lift_project_to_hg38.input')
     @mock.patch('seqr.management.commands.lift_project_to_hg38.get_es_variants_for_variant_tuples')
-    @mock.patch('seqr.management.commands.lift_project_to_hg38.LiftOver')
-    def test_command(self, mock_liftover, mock_get_es_variants, mock_input, mock_get_es_samples, mock_logger):
+    @mock.patch('seqr.management.commands.lift_project_to_hg38.get_liftover')
+    def test_command(self, mock_get_liftover, mock_get_es_variants, mock_input, mock_get_es_samples, mock_logger):
         mock_get_es_samples.return_value = SAMPLE_IDS, INDEX_METADATA
         mock_get_es_variants.return_value = VARIANTS
-        mock_liftover_to_38 = mock_liftover.return_value
-        mock_liftover_to_38.convert_coordinate.side_effect = mock_convert_coordinate
+        mock_liftover_to_38 = mock_get_liftover.return_value
+        mock_liftover_to_38.lift_many.side_effect = mock_lift_many
         mock_input.return_value = 'y'
         call_command('lift_project_to_hg38', '--project={}'.format(PROJECT_NAME),
                      '--es-index={}'.format(ELASTICSEARCH_INDEX))
@@ -66,13 +62,12 @@ class LiftProjectToHg38Test(TestCase):
 
         mock_get_es_samples.assert_called_with(ELASTICSEARCH_INDEX)
 
-        calls = [
-            mock.call('chr21', 3343353),
-            mock.call('chr1', 1562437),
-            mock.call('chr1', 248367227),
-            mock.call('chr1', 1560662),
-        ]
-        mock_liftover_to_38.convert_coordinate.assert_has_calls(calls, any_order = True)
+        mock_get_liftover.assert_called_with('37')
+        self.assertEqual(mock_liftover_to_38.lift_many.call_count, 2)
+        lifted_positions = {
+            call.args[0]: sorted(call.args[1]) for call in mock_liftover_to_38.lift_many.call_args_list
+        }
+        self.assertDictEqual(lifted_positions, {'21': [3343353], '1': [1560662, 1562437, 248367227]})
         
         families = {family for family in Family.objects.filter(pk__in = [1, 2])}
         self.assertSetEqual(families, mock_get_es_variants.call_args.args[0])
@@ -150,14 +145,22 @@ class LiftProjectToHg38Test(TestCase):
     @mock.patch('seqr.management.commands.lift_project_to_hg38.input')
     @mock.patch('seqr.management.commands.lift_project_to_hg38.get_es_variants_for_variant_tuples')
     @mock.patch('seqr.management.commands.lift_project_to_hg38.get_single_es_variant')
-    @mock.patch('seqr.management.commands.lift_project_to_hg38.LiftOver')
-    def test_command_other_exceptions(self, mock_liftover, mock_single_es_variants,
+    @mock.patch('seqr.management.commands.lift_project_to_hg38.get_liftover')
+    def test_command_other_exceptions(self, mock_get_liftover, mock_single_es_variants,
             mock_get_es_variants, mock_input, mock_get_es_samples, mock_logger):
         mock_get_es_samples.return_value = SAMPLE_IDS, INDEX_METADATA
 
+        # Test error loading liftover
+        mock_get_liftover.return_value = None
+        with self.assertRaises(CommandError) as ce:
+            call_command('lift_project_to_hg38', '--project={}'.format(PROJECT_NAME),
+                    '--es-index={}'.format(ELASTICSEARCH_INDEX))
+        self.assertEqual(str(ce.exception), 'Error: unable to load liftover chain file')
+
         # Test discontinue on a failed lift
-        mock_liftover_to_38 = mock_liftover.return_value
-        mock_liftover_to_38.convert_coordinate.return_value = None
+        mock_liftover_to_38 = mock.MagicMock()
+        mock_get_liftover.return_value = mock_liftover_to_38
+        mock_liftover_to_38.lift_many.side_effect = lambda chrom, positions: [None for _ in positions]
         mock_input.return_value = 'n'
         with self.assertRaises(CommandError) as ce:
             call_command('lift_project_to_hg38', '--project={}'.format(PROJECT_NAME),
@@ -174,7 +177,7 @@ class LiftProjectToHg38Test(TestCase):
 
         # Test discontinue on failure of finding a variant in the index
         mock_get_es_variants.return_value = VARIANTS
-        mock_liftover_to_38.convert_coordinate.side_effect = mock_convert_coordinate
+        mock_liftover_to_38.lift_many.side_effect = mock_lift_many
         mock_logger.reset_mock()
         with self.assertRaises(CommandError) as ce:
             call_command('lift_project_to_hg38', '--project={}'.format(PROJECT_NAME),
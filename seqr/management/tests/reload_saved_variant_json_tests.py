@@ -1,9 +1,11 @@
 #-*- coding: utf-8 -*-
 import mock
+from datetime import timedelta
 
 from django.core.management import call_command
 from django.test import TestCase
-from seqr.models import Family
+from django.utils import timezone
+from seqr.models import Family, SavedVariant, Sample
 
 PROJECT_NAME = '1kg project n\u00e5me with uni\u00e7\u00f8de'
 PROJECT_GUID = 'R0001_1kg'
@@ -13,13 +15,16 @@ FAMILY_ID = '1'
 class ReloadSavedVariantJsonTest(TestCase):
     fixtures = ['users', '1kg_project']
 
-    @mock.patch('logging.getLogger')
-    @mock.patch('seqr.views.utils.variant_utils.get_es_variants_for_variant_ids')
-    def test_with_param_command(self, mock_get_variants, mock_get_logger):
-        mock_get_variants.side_effect = lambda families, variant_ids: \
-            [{'variantId': variant_id, 'familyGuids': [family.guid for family in families]}
-             for variant_id in variant_ids]
-        mock_logger = mock_get_logger.return_value
+    @mock.patch('seqr.management.commands.reload_saved_variant_json.timer')
+    @mock.patch('seqr.management.commands.reload_saved_variant_json.safe_redis_hset_json')
+    @mock.patch('seqr.management.commands.reload_saved_variant_json.safe_redis_hmget_json')
+    @mock.patch('seqr.management.commands.reload_saved_variant_json.logger')
+    @mock.patch('seqr.views.utils.variant_utils.get_es_variants_for_variant_id_chunks')
+    def test_with_param_command(self, mock_get_variants, mock_logger, mock_redis_hmget, mock_redis_hset, mock_timer):
+        mock_get_variants.side_effect = lambda families, variant_id_chunks, **kwargs: (
+            [{'variantId': variant_id, 'familyGuids': [family.guid for family in families]} for variant_id in variant_ids]
+            for variant_ids in variant_id_chunks)
+        mock_timer.side_effect = [10, 12]
 
         # Test with a specific project and a family id.
         call_command('reload_saved_variant_json',
@@ -28,30 +33,56 @@ class ReloadSavedVariantJsonTest(TestCase):
 
         family_1 = Family.objects.get(id=1)
         mock_get_variants.assert_called_with(
-            [family_1], ['1-1562437-G-C', '1-46859832-G-A','21-3343353-GAGA-G'])
+            [family_1], [['1-1562437-G-C', '1-46859832-G-A','21-3343353-GAGA-G']], max_workers=4)
 
         logger_info_calls = [
             mock.call('Project: 1kg project n\xe5me with uni\xe7\xf8de'),
             mock.call('Updated 3 variants for project 1kg project n\xe5me with uni\xe7\xf8de'),
             mock.call('Done'),
             mock.call('Summary: '),
-            mock.call('  1kg project n\xe5me with uni\xe7\xf8de: Updated 3 variants')
+            mock.call('  1kg project n\xe5me with uni\xe7\xf8de: Updated 3 variants'),
+            mock.call('Updated 3 variants in 2.0s (1.5 variants/s)'),
         ]
         mock_logger.info.assert_has_calls(logger_info_calls)
+        mock_redis_hmget.assert_not_called()
+        mock_redis_hset.assert_called_with(
+            'reload_saved_variant_json_checkpoint__1', {PROJECT_GUID: 3}, expire=timedelta(weeks=1))
+        self.assertDictEqual(
+            SavedVariant.objects.get(variant_id='1-1562437-G-C', family=family_1).saved_variant_json,
+            {'variantId': '1-1562437-G-C', 'familyGuids': ['F000001_1']},
+        )
         mock_get_variants.reset_mock()
         mock_logger.reset_mock()
+        mock_redis_hset.reset_mock()
+
+        # Test resuming skips projects which were already reloaded
+        mock_timer.side_effect = [10, 11]
+        mock_redis_hmget.side_effect = lambda key, guids: {guid: 3 if guid == PROJECT_GUID else None for guid in guids}
+        call_command('reload_saved_variant_json', PROJECT_GUID, '--family-id={}'.format(FAMILY_ID), '--resume')
+        mock_redis_hmget.assert_called_with('reload_saved_variant_json_checkpoint__1', [PROJECT_GUID])
+        mock_get_variants.assert_not_called()
+        mock_redis_hset.assert_not_called()
+        mock_logger.info.assert_has_calls([
+            mock.call('Skipping 1 projects reloaded by a previous run'),
+            mock.call('Done'),
+            mock.call('Summary: '),
+            mock.call('Updated 0 variants in 1.0s (0.0 variants/s)'),
+        ])
+        mock_logger.reset_mock()
+        mock_timer.side_effect = [10, 14]
 
         # Test for all projects and no specific family ids
-        call_command('reload_saved_variant_json')
+        call_command('reload_saved_variant_json', '--workers=2')
 
         self.assertEqual(mock_get_variants.call_count, 3)
         family_2 = Family.objects.get(id=2)
         mock_get_variants.assert_has_calls([
             mock.call(
-                [family_1, family_2], ['1-1562437-G-C', '1-46859832-G-A', '12-48367227-TC-T', '21-3343353-GAGA-G'],
+                [family_1, family_2], [['1-1562437-G-C', '1-46859832-G-A', '12-48367227-TC-T', '21-3343353-GAGA-G']],
+                max_workers=2,
             ),
-            mock.call([Family.objects.get(id=11)], ['12-48367227-TC-T', 'prefix_19107_DEL']),
-            mock.call([Family.objects.get(id=14)], ['12-48367227-TC-T'])
+            mock.call([Family.objects.get(id=11)], [['12-48367227-TC-T', 'prefix_19107_DEL']], max_workers=2),
+            mock.call([Family.objects.get(id=14)], [['12-48367227-TC-T']], max_workers=2)
         ], any_order=True)
 
         logger_info_calls = [
@@ -68,26 +99,87 @@ class ReloadSavedVariantJsonTest(TestCase):
             mock.call('  1kg project n\xe5me with uni\xe7\xf8de: Updated 4 variants'),
             mock.call('  Test Reprocessed Project: Updated 2 variants'),
             mock.call('  Non-Analyst Project: Updated 1 variants'),
+            mock.call('Updated 7 variants in 4.0s (1.8 variants/s)'),
         ]
         mock_logger.info.assert_has_calls(logger_info_calls)
+        self.assertDictEqual(
+            SavedVariant.objects.get(variant_id='prefix_19107_DEL', family_id=11).saved_variant_json,
+            {'variantId': 'prefix_19107_DEL', 'familyGuids': ['F000011_11']},
+        )
+        mock_redis_hset.assert_has_calls([
+            mock.call('reload_saved_variant_json_checkpoint__all', {PROJECT_GUID: 4}, expire=timedelta(weeks=1)),
+            mock.call('reload_saved_variant_json_checkpoint__all', {'R0002_empty': 0}, expire=timedelta(weeks=1)),
+        ])
         mock_get_variants.reset_mock()
         mock_logger.reset_mock()
+        mock_redis_hset.reset_mock()
 
         # Test with an exception.
+        mock_timer.side_effect = [10, 11]
         mock_get_variants.side_effect = Exception("Database error.")
         call_command('reload_saved_variant_json',
                      PROJECT_GUID,
                      '--family-id={}'.format(FAMILY_ID))
 
-        mock_get_variants.assert_called_with([family_1], ['1-1562437-G-C', '1-46859832-G-A', '21-3343353-GAGA-G'])
+        mock_get_variants.assert_called_with(
+            [family_1], [['1-1562437-G-C', '1-46859832-G-A', '21-3343353-GAGA-G']], max_workers=4)
 
         logger_info_calls = [
             mock.call('Project: 1kg project n\xe5me with uni\xe7\xf8de'),
             mock.call('Done'),
             mock.call('Summary: '),
+            mock.call('Updated 0 variants in 1.0s (0.0 variants/s)'),
             mock.call('1 failed projects'),
             mock.call('  1kg project n\xe5me with uni\xe7\xf8de: Database error.')
         ]
         mock_logger.info.assert_has_calls(logger_info_calls)
 
         mock_logger.error.assert_called_with('Error in project 1kg project n\xe5me with uni\xe7\xf8de: Database error.')
+        mock_redis_hset.assert_not_called()
+
+    @mock.patch('seqr.views.utils.variant_utils.SAVED_VARIANT_JSON_CHUNK_SIZE', 2)
+    @mock.patch('seqr.management.commands.reload_saved_variant_json.safe_redis_hset_json', mock.MagicMock())
+    @mock.patch('seqr.views.utils.variant_utils.get_es_variants_for_variant_id_chunks')
+    def test_chunked_command(self, mock_get_variants):
+        mock_get_variants.side_effect = lambda families, variant_id_chunks, **kwargs: (
+            [{'variantId': variant_id, 'familyGuids': [family.guid for family in families]} for variant_id in variant_ids]
+            for variant_ids in variant_id_chunks)
+
+        call_command('reload_saved_variant_json', PROJECT_GUID)
+
+        families = [Family.objects.get(id=1), Family.objects.get(id=2)]
+        mock_get_variants.assert_called_once_with(families, [
+            ['1-1562437-G-C', '1-46859832-G-A'], ['12-48367227-TC-T', '21-3343353-GAGA-G'],
+        ], max_workers=4)
+        self.assertDictEqual(
+            SavedVariant.objects.get(variant_id='21-3343353-GAGA-G', family=families[0]).saved_variant_json,
+            {'variantId': '21-3343353-GAGA-G', 'familyGuids': ['F000001_1', 'F000002_2']},
+        )
+
+    @mock.patch('seqr.management.commands.reload_saved_variant_json.safe_redis_hset_json', mock.MagicMock())
+    @mock.patch('seqr.views.utils.variant_utils.get_es_variants_for_variant_id_chunks')
+    def test_changed_only_command(self, mock_get_variants):
+        mock_get_variants.side_effect = lambda families, variant_id_chunks, **kwargs: (
+            [{'variantId': variant_id, 'familyGuids': [family.guid for family in families]} for variant_id in variant_ids]
+            for variant_ids in variant_id_chunks)
+
+        # Variants with no recorded data source are always reloaded
+        call_command('reload_saved_variant_json', PROJECT_GUID, '--changed-only')
+        families = [Family.objects.get(id=1), Family.objects.get(id=2)]
+        mock_get_variants.assert_called_with(
+            families, [['1-1562437-G-C', '1-46859832-G-A', '12-48367227-TC-T', '21-3343353-GAGA-G']], max_workers=4)
+        saved_variant = SavedVariant.objects.get(variant_id='21-3343353-GAGA-G', family=families[0])
+        self.assertEqual(saved_variant.saved_variant_json_index, 'test_index,test_index_old')
+        self.assertEqual(
+            saved_variant.saved_variant_json_loaded_date,
+            Sample.objects.get(guid='S000129_na19675').loaded_date,
+        )
+
+        mock_get_variants.reset_mock()
+        call_command('reload_saved_variant_json', PROJECT_GUID, '--changed-only')
+        mock_get_variants.assert_not_called()
+
+        # Only variants in families with newly loaded data are reloaded
+        Sample.objects.filter(individual__family=families[1]).update(loaded_date=timezone.now())
+        call_command('reload_saved_variant_json', PROJECT_GUID, '--changed-only')
+        mock_get_variants.assert_called_once_with([families[1]], [['12-48367227-TC-T']], max_workers=4)
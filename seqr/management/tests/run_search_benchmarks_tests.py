@@ -0,0 +1,134 @@
+import json
+import mock
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+
+class RunSearchBenchmarksTest(TestCase):
+
+    @mock.patch('seqr.utils.redis_utils.redis.StrictRedis')
+    @mock.patch('seqr.management.commands.run_search_benchmarks.logger')
+    def test_command(self, mock_logger, mock_redis):
+        call_command('run_search_benchmarks', 'cache_codec', '--num-variants=10', '--repeat=1', stdout=StringIO())
+        self.assertEqual(mock_logger.info.call_count, 3)
+        log_messages = [call.args[0] for call in mock_logger.info.call_args_list]
+        self.assertListEqual([message.split(':')[0] for message in log_messages], [
+            'cache_codec_json', 'cache_codec_1', 'cache_codec_2',
+        ])
+        self.assertRegex(log_messages[0], r'^cache_codec_json: encode [\d.]+s \(mean [\d.]+s\), decode [\d.]+s \(mean [\d.]+s\), bytes \d+$')
+        mock_redis.assert_not_called()
+
+        mock_logger.reset_mock()
+        call_command('run_search_benchmarks', 'parse_hits', '--num-variants=10', '--repeat=1', stdout=StringIO())
+        mock_logger.info.assert_called_once()
+        self.assertRegex(mock_logger.info.call_args.args[0], r'^parse_hits: parse [\d.]+s \(mean [\d.]+s\), hits 10$')
+
+        mock_logger.reset_mock()
+        call_command('run_search_benchmarks', 'parse_cached_hits', '--num-variants=10', '--repeat=1', stdout=StringIO())
+        mock_logger.info.assert_called_once()
+        self.assertRegex(
+            mock_logger.info.call_args.args[0], r'^parse_cached_hits: parse [\d.]+s \(mean [\d.]+s\), hits 10$')
+
+        mock_logger.reset_mock()
+        call_command('run_search_benchmarks', 'compound_het_validation', '--num-variants=50', '--repeat=1', stdout=StringIO())
+        log_messages = [call.args[0] for call in mock_logger.info.call_args_list]
+        self.assertListEqual([message.split(':')[0] for message in log_messages], [
+            'compound_het_validation_iterative', 'compound_het_validation_vectorized',
+        ])
+        self.assertRegex(log_messages[1], r'^compound_het_validation_vectorized: validate [\d.]+s \(mean [\d.]+s\), pairs \d+$')
+        self.assertEqual(log_messages[0].split(', ')[-1], log_messages[1].split(', ')[-1])
+
+        # test with a recorded response
+        hits = [{
+            '_index': 'test_index', '_id': '1-248367227-TC-T', 'matched_queries': ['F000001_1'], 'sort': [1248367227],
+            '_source': {
+                'contig': '1', 'start': 248367227, 'end': 248367227, 'ref': 'TC', 'alt': 'T', 'xpos': 1248367227,
+                'variantId': '1-248367227-TC-T', 'samples_num_alt_1': ['NA19675'],
+                'genotypes': [{'sample_id': 'NA19675', 'num_alt': 1, 'gq': 99}], 'sortedTranscriptConsequences': [],
+            },
+        }]
+        mock_logger.reset_mock()
+        with NamedTemporaryFile(mode='w', suffix='.json') as f:
+            json.dump({'responses': [{'hits': {'hits': hits}}]}, f)
+            f.flush()
+            call_command('run_search_benchmarks', 'parse_hits', '--repeat=1', '--es-response-file={}'.format(f.name), stdout=StringIO())
+        self.assertTrue(mock_logger.info.call_args.args[0].endswith('hits 1'))
+
+        mock_logger.reset_mock()
+        mock_redis.return_value.memory_usage.return_value = 1024
+        out = StringIO()
+        call_command('run_search_benchmarks', '--num-variants=10', '--repeat=1', '--redis', stdout=out)
+        self.assertTrue(mock_logger.info.call_args_list[2].args[0].endswith('redis_memory 1024'))
+        self.assertListEqual(
+            [message.split(':')[0] for message in [call.args[0] for call in mock_logger.info.call_args_list]], [
+                'cache_codec_json', 'cache_codec_1', 'cache_codec_2', 'compound_het_validation_iterative',
+                'compound_het_validation_vectorized', 'compound_hets', 'deduplication', 'pagination',
+                'parse_cached_hits', 'parse_hits', 'parse_sv_hits', 'query_building',
+            ])
+        self.assertEqual(out.getvalue().split('\n')[0].split(), [
+            'Name', '(time', 'in', 'ms)', 'Min', 'Max', 'Mean', 'Stddev', 'Median', 'Rounds'])
+        self.assertEqual(len(out.getvalue().strip().split('\n')), 16)
+        self.assertEqual(mock_redis.return_value.set.call_count, 3)
+        mock_redis.return_value.delete.assert_called_with('benchmark__cache_codec_2')
+
+        with self.assertRaises(CommandError) as ce:
+            call_command('run_search_benchmarks', 'invalid')
+        self.assertEqual(str(ce.exception), 'Invalid benchmarks: invalid')
+
+    @mock.patch('seqr.utils.redis_utils.redis.StrictRedis')
+    @mock.patch('seqr.management.commands.run_search_benchmarks.logger')
+    def test_search_engine_benchmarks(self, mock_logger, mock_redis):
+        call_command(
+            'run_search_benchmarks', 'parse_sv_hits', 'query_building', 'compound_hets', 'deduplication', 'pagination',
+            '--num-variants=200', '--num-families=4', '--samples-per-family=3', '--repeat=2', stdout=StringIO())
+        log_messages = [call.args[0] for call in mock_logger.info.call_args_list]
+        self.assertEqual(len(log_messages), 5)
+        self.assertRegex(log_messages[0], r'^parse_sv_hits: parse [\d.]+s \(mean [\d.]+s\), hits 200$')
+        self.assertRegex(
+            log_messages[1], r'^query_building: build [\d.]+s \(mean [\d.]+s\), families 4, clauses \d+$')
+        self.assertRegex(
+            log_messages[2], r'^compound_hets: process [\d.]+s \(mean [\d.]+s\), genes 40, hits 200, pairs \d+$')
+        self.assertRegex(
+            log_messages[3], r'^deduplication: deduplicate [\d.]+s \(mean [\d.]+s\), variants 400, duplicates 200$')
+        self.assertRegex(log_messages[4], r'^pagination: paginate [\d.]+s \(mean [\d.]+s\), pages 3, variants 300$')
+
+    @mock.patch('seqr.utils.redis_utils.redis.StrictRedis')
+    @mock.patch('seqr.management.commands.run_search_benchmarks.logger')
+    def test_compare_benchmarks(self, mock_logger, mock_redis):
+        with NamedTemporaryFile(mode='w', suffix='.json') as f:
+            out = StringIO()
+            call_command(
+                'run_search_benchmarks', 'parse_hits', '--num-variants=10', '--repeat=3',
+                '--save-results={}'.format(f.name), stdout=out)
+            with open(f.name) as saved_f:
+                saved_results = json.load(saved_f)
+            self.assertEqual(len(saved_results), 1)
+            self.assertEqual(saved_results[0]['name'], 'parse_hits')
+            self.assertEqual(saved_results[0]['hits'], 10)
+            self.assertSetEqual(
+                set(saved_results[0]['parse'].keys()), {'min', 'max', 'mean', 'median', 'stddev', 'rounds'})
+            self.assertEqual(saved_results[0]['parse']['rounds'], 3)
+            self.assertRegex(out.getvalue().split('\n')[1], r'^parse_hits\[parse\]( +[\d.]+){5} +3$')
+
+            # Benchmarks which are no slower than the compared results pass
+            saved_results[0]['parse']['min'] = 100
+            json.dump(saved_results, open(f.name, 'w'))
+            mock_logger.reset_mock()
+            call_command(
+                'run_search_benchmarks', 'parse_hits', '--num-variants=10', '--repeat=1', '--compare={}'.format(f.name),
+                stdout=StringIO())
+            self.assertRegex(mock_logger.info.call_args.args[0], r'^parse_hits\[parse\] [\d.]+s vs 100.0000s \(-[\d.]+%\)$')
+
+            saved_results[0]['parse']['min'] = 0.000001
+            json.dump(saved_results, open(f.name, 'w'))
+            with self.assertRaises(CommandError) as ce:
+                call_command(
+                    'run_search_benchmarks', 'parse_hits', '--num-variants=10', '--repeat=1',
+                    '--compare={}'.format(f.name), '--max-regression=50', stdout=StringIO())
+            self.assertRegex(
+                str(ce.exception),
+                r'^Benchmarks slower than the compared results by more than 50.0%: parse_hits\[parse\] \(\+[\d.]+%\)$')
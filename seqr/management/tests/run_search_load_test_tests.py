@@ -0,0 +1,60 @@
+import json
+import mock
+import re
+import responses
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+URL = 'http://seqr.test'
+
+
+class RunSearchLoadTestTest(TestCase):
+
+    @responses.activate
+    @mock.patch('seqr.management.commands.run_search_load_test.logger')
+    def test_command(self, mock_logger):
+        responses.add(responses.GET, '{}/login'.format(URL), headers={'Set-Cookie': 'csrf_token=abc123; Path=/'})
+        responses.add(responses.POST, '{}/api/login'.format(URL), status=401)
+
+        with self.assertRaises(CommandError) as ce:
+            call_command(
+                'run_search_load_test', 'R0001_1kg', '--url={}'.format(URL), '--email=test@test.com', '--password=pw')
+        self.assertEqual(str(ce.exception), 'Unable to login as test@test.com: Unauthorized')
+
+        responses.replace(responses.POST, '{}/api/login'.format(URL), json={'success': True})
+        search_url = re.compile(r'{}/api/search/\w+\?sort=xpos&page=\d'.format(URL))
+        responses.add(responses.POST, search_url, json={}, headers={'Server-Timing': 'es_search;dur=20.0, total;dur=25'})
+        responses.add(responses.GET, re.compile(r'{}/api/search/\w+/gene_breakdown'.format(URL)), json={})
+        responses.add(responses.GET, re.compile(r'{}/api/search/\w+/download'.format(URL)), status=500)
+
+        responses.calls.reset()
+        call_command(
+            'run_search_load_test', 'R0001_1kg', 'R0002_empty', '--url={}'.format(URL), '--email=test@test.com',
+            '--password=pw', '--users=2', '--iterations=2', '--pages=2', '--export',
+        )
+
+        self.assertEqual(len(responses.calls), 2 * 2 + 2 * 2 * 4)
+        search_calls = [call for call in responses.calls if call.request.url.endswith('page=1')]
+        self.assertEqual(len(search_calls), 4)
+        self.assertDictEqual(json.loads(search_calls[0].request.body), {
+            'projectGuids': ['R0001_1kg', 'R0002_empty'],
+            'search': {
+                'annotations': {
+                    'frameshift': ['frameshift_variant'], 'nonsense': ['stop_gained'], 'missense': ['missense_variant'],
+                },
+                'freqs': {'callset': {'af': 0.1}},
+            },
+        })
+        self.assertEqual(search_calls[0].request.headers['X-CSRFToken'], 'abc123')
+        self.assertEqual(len({call.request.url for call in search_calls}), 4)
+
+        log_messages = [call.args[0] for call in mock_logger.info.call_args_list]
+        self.assertListEqual([message.split(':')[0] for message in log_messages], [
+            'export', 'gene_breakdown', 'login', 'search', '  server timings', 'search_page', '  server timings',
+        ])
+        self.assertRegex(
+            log_messages[0], r'^export: 4 requests, 4 failures, [\d.]+ req/s, mean [\d.]+s, p50 [\d.]+s, p95 [\d.]+s, p99 [\d.]+s, max [\d.]+s$')
+        self.assertRegex(log_messages[3], r'^search: 4 requests, 0 failures')
+        self.assertEqual(log_messages[4], '  server timings: es_search 20.0ms, total 25.0ms')
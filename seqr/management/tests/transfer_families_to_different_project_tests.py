@@ -8,8 +8,9 @@ from seqr.models import Family, VariantTagType, VariantTag
 class TransferFamiliesTest(TestCase):
     fixtures = ['users', '1kg_project']
 
+    @mock.patch('seqr.utils.elasticsearch.utils.safe_redis_incr')
     @mock.patch('seqr.management.commands.transfer_families_to_different_project.logger.info')
-    def test_command(self, mock_loger):
+    def test_command(self, mock_loger, mock_redis_incr):
         call_command(
             'transfer_families_to_different_project', '--from-project=R0001_1kg', '--to-project=R0003_test', '12', '2',
         )
@@ -23,6 +24,7 @@ class TransferFamiliesTest(TestCase):
 
         family = Family.objects.get(family_id='2')
         self.assertEqual(family.project.guid, 'R0003_test')
+        mock_redis_incr.assert_called_once_with('search_samples_version')
 
         old_tag_type = VariantTagType.objects.get(name='Excluded', project__guid='R0001_1kg')
         new_tag_type = VariantTagType.objects.get(name='Excluded', project__guid='R0003_test')
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.3 on 2021-03-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('seqr', '0023_auto_20210304_2315'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='savedvariant',
+            name='saved_variant_json_index',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='savedvariant',
+            name='saved_variant_json_loaded_date',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
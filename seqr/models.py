@@ -21,9 +21,9 @@ from settings import MME_DEFAULT_CONTACT_NAME, MME_DEFAULT_CONTACT_HREF, MME_DEF
 
 logger = logging.getLogger(__name__)
 
-#  Allow adding the custom json_fields and internal_json_fields to the model Meta
+#  Allow adding the custom json_fields, internal_json_fields and search_samples_fields to the model Meta
 # (from https://stackoverflow.com/questions/1088431/adding-attributes-into-django-models-meta-class)
-options.DEFAULT_NAMES = options.DEFAULT_NAMES + ('json_fields', 'internal_json_fields',)
+options.DEFAULT_NAMES = options.DEFAULT_NAMES + ('json_fields', 'internal_json_fields', 'search_samples_fields',)
 
 CAN_VIEW = 'can_view'
 CAN_EDIT = 'can_edit'
@@ -34,6 +34,12 @@ def _slugify(text):
     return __slugify(text).replace('-', '_')
 
 
+def _bump_search_samples_version():
+    # imported here as the search utils import these models
+    from seqr.utils.elasticsearch.utils import bump_search_samples_version
+    bump_search_samples_version()
+
+
 class ModelWithGUID(models.Model):
     MAX_GUID_SIZE = 30
 
@@ -51,6 +57,18 @@ class ModelWithGUID(models.Model):
         json_fields = []
         internal_json_fields = []
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        model = super(ModelWithGUID, cls).from_db(db, field_names, values)
+        model._loaded_search_samples_values = model._get_search_samples_values()
+        return model
+
+    def _get_search_samples_values(self):
+        """Returns the current values of the fields used to look up the samples to search, changes to which
+        invalidate the cached search samples"""
+        search_samples_fields = getattr(self._meta, 'search_samples_fields', None) or []
+        return {field: self.__dict__.get(self._meta.get_field(field).attname) for field in search_samples_fields}
+
     @abstractmethod
     def _compute_guid(self):
         """Returns a human-readable label (aka. slug) for this object with only alphanumeric
@@ -94,6 +112,17 @@ class ModelWithGUID(models.Model):
             self.guid = self._compute_guid()[:ModelWithGUID.MAX_GUID_SIZE]
             super(ModelWithGUID, self).save()
 
+        search_samples_values = self._get_search_samples_values()
+        if search_samples_values and search_samples_values != getattr(self, '_loaded_search_samples_values', None):
+            _bump_search_samples_version()
+        self._loaded_search_samples_values = search_samples_values
+
+    def delete(self, *args, **kwargs):
+        deleted = super(ModelWithGUID, self).delete(*args, **kwargs)
+        if getattr(self._meta, 'search_samples_fields', None):
+            _bump_search_samples_version()
+        return deleted
+
     def delete_model(self, user, user_can_delete=False):
         """Helper delete method that logs the deletion"""
         if not (user_can_delete or self.created_by == user):
@@ -118,6 +147,8 @@ class ModelWithGUID(models.Model):
 
         entity_ids = log_model_bulk_update(logger, queryset, user, 'update', update_fields=update_json.keys())
         queryset.update(**update_json)
+        if entity_ids and set(getattr(cls._meta, 'search_samples_fields', None) or []).intersection(update_json.keys()):
+            _bump_search_samples_version()
         return entity_ids
 
     @classmethod
@@ -126,7 +157,10 @@ class ModelWithGUID(models.Model):
         if queryset is None:
             queryset = cls.objects.filter(**filter_kwargs)
         log_model_bulk_update(logger, queryset, user, 'delete')
-        return queryset.delete()
+        deleted = queryset.delete()
+        if deleted[0] and getattr(cls._meta, 'search_samples_fields', None):
+            _bump_search_samples_version()
+        return deleted
 
 
 class UserPolicy(models.Model):
@@ -315,6 +349,7 @@ class Family(ModelWithGUID):
         internal_json_fields = [
             'success_story_types', 'success_story'
         ]
+        search_samples_fields = ['project']
 
 
 # TODO should be an ArrayField directly on family once family fields have audit trail (https://github.com/broadinstitute/seqr-private/issues/449)
@@ -521,6 +556,7 @@ class Individual(ModelWithGUID):
         internal_json_fields = [
             'proband_relationship'
         ]
+        search_samples_fields = ['family', 'affected', 'sex']
 
 
 class Sample(ModelWithGUID):
@@ -572,6 +608,9 @@ class Sample(ModelWithGUID):
        json_fields = [
            'guid', 'created_date', 'sample_type', 'dataset_type', 'sample_id', 'is_active', 'loaded_date',
        ]
+       search_samples_fields = [
+           'individual', 'sample_type', 'dataset_type', 'sample_id', 'elasticsearch_index', 'is_active',
+       ]
 
 
 class IgvSample(ModelWithGUID):
@@ -617,6 +656,9 @@ class SavedVariant(ModelWithGUID):
 
     selected_main_transcript_id = models.CharField(max_length=20, null=True)
     saved_variant_json = JSONField(default=dict)
+    # The active indices and their loaded date when the json was fetched, used to only refresh variants with new data
+    saved_variant_json_index = models.TextField(null=True)
+    saved_variant_json_loaded_date = models.DateTimeField(null=True)
 
     def __unicode__(self):
         chrom, pos = get_chrom_pos(self.xpos)
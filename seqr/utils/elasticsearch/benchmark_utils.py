@@ -0,0 +1,583 @@
+from collections import defaultdict
+from copy import deepcopy
+from elasticsearch_dsl.response import Response
+import heapq
+from itertools import combinations
+import json
+import random
+from statistics import mean, median, stdev
+from timeit import default_timer as timer
+
+from seqr.models import Individual, Sample
+from seqr.utils.elasticsearch.constants import QUERY_FIELD_NAMES, POPULATIONS, PREDICTION_FIELDS_CONFIG, \
+    CLINVAR_FIELDS, HGMD_FIELDS, XPOS_SORT_KEY, RECESSIVE
+from seqr.utils.elasticsearch.es_search import EsSearch, _get_sample_quality_filter, VARIANT_ANNOTATION_KEYS
+from seqr.utils.elasticsearch.utils import SearchSample, SearchIndividual, _build_es_search, _count_query_clauses
+from seqr.utils.redis_utils import encode_cache_value, decode_cache_value, CACHE_CODECS, MSGPACK_ZSTD_CODEC
+from seqr.utils.xpos_utils import get_xpos
+
+MAX_BENCHMARK_GENE_VARIANTS = 1000
+BENCHMARK_GENE_VARIANTS = 5
+BENCHMARK_PAGE_SIZE = 100
+
+BENCHMARK_INDICES = {
+    Sample.DATASET_TYPE_VARIANT_CALLS: 'benchmark_variants',
+    Sample.DATASET_TYPE_SV_CALLS: 'benchmark_svs',
+}
+SNV_INDEX_FIELDS = [field for field in QUERY_FIELD_NAMES if field != 'samples'] + [
+    'samples_no_call', 'geneIds', 'transcriptConsequenceTerms']
+SV_INDEX_FIELDS = [field for field in QUERY_FIELD_NAMES if field not in {'samples_num_alt_1', 'samples_num_alt_2'}] + [
+    'samples_cn_0', 'samples_cn_2', 'samples_cn_gte_4', 'geneIds', 'transcriptConsequenceTerms']
+
+BENCHMARK_SEARCH = {
+    'freqs': {'callset': {'af': 0.05}, 'gnomad_genomes': {'af': 0.01}, 'exac': {'ac': 10, 'hh': 2}},
+    'inheritance': {'mode': RECESSIVE},
+    'qualityFilter': {'min_gq': 20, 'min_ab': 10},
+    'annotations': {
+        'frameshift': ['frameshift_variant'], 'nonsense': ['stop_gained'], 'missense': ['missense_variant'],
+        'structural': ['DEL', 'DUP'],
+    },
+}
+
+CHROMOSOMES = [str(chrom) for chrom in range(1, 23)] + ['X']
+NUCLEOTIDES = ['A', 'C', 'G', 'T']
+CONSEQUENCES = [
+    'frameshift_variant', 'stop_gained', 'missense_variant', 'synonymous_variant', 'intron_variant',
+    'splice_region_variant', '5_prime_UTR_variant',
+]
+SV_TYPES = ['DEL', 'DUP']
+POPULATION_KEYS = ['callset', 'topmed', 'g1k', 'exac', 'gnomad_exomes', 'gnomad_genomes', 'sv_callset']
+PREDICTION_KEYS = [
+    'cadd', 'dann', 'eigen', 'fathmm', 'gerp_rs', 'mpc', 'metasvm', 'mut_taster', 'phastcons_100_vert', 'polyphen',
+    'primate_ai', 'splice_ai', 'splice_ai_consequence', 'revel', 'sift', 'strvctvre',
+]
+
+
+def _family_guid(i):
+    return 'F{:06d}_{}'.format(i, i)
+
+
+def _individual_guid(family_index, i):
+    return 'I{:06d}_{}'.format(family_index, i)
+
+
+def _sample_id(family_index, i):
+    return 'NA{:05d}{}'.format(family_index, i)
+
+
+def _generate_transcript(rng, gene_id, transcript_index):
+    return {
+        'aminoAcids': 'P/X', 'biotype': 'protein_coding', 'canonical': 1 if transcript_index == 0 else None,
+        'cdnaStart': rng.randint(1, 5000), 'cdnaEnd': rng.randint(1, 5000), 'codons': 'Ccc/cc',
+        'consequenceTerms': [rng.choice(CONSEQUENCES)], 'domains': ['Pfam_domain:PF00001'],
+        'geneId': gene_id, 'geneSymbol': 'GENE{}'.format(gene_id[-5:]),
+        'hgvs': 'ENSP00000389625.1:p.Leu288SerfsTer10', 'hgvsc': 'ENST00000456743.1:c.862delC',
+        'hgvsp': 'ENSP00000389625.1:p.Leu288SerfsTer10', 'lof': None, 'lofFilter': None, 'lofFlags': None,
+        'majorConsequence': rng.choice(CONSEQUENCES), 'majorConsequenceRank': rng.randint(1, 30),
+        'proteinId': 'ENSP{:011d}'.format(rng.randint(0, 10**9)), 'category': 'missense',
+        'transcriptId': 'ENST{:011d}'.format(rng.randint(0, 10**9)), 'transcriptRank': transcript_index,
+    }
+
+
+def generate_parsed_variants(num_variants, num_families=10, samples_per_family=3, num_genes=2, seed=0):
+    """Generates realistically sized variants in the format returned by EsSearch._parse_hit"""
+    rng = random.Random(seed)
+    variants = []
+    for i in range(num_variants):
+        chrom = CHROMOSOMES[i * len(CHROMOSOMES) // max(num_variants, 1)]
+        pos = rng.randint(1, 10**8)
+        ref = rng.choice(NUCLEOTIDES)
+        alt = rng.choice(NUCLEOTIDES)
+        xpos = get_xpos(chrom, pos)
+        family_indices = rng.sample(range(num_families), min(num_families, rng.randint(1, 3)))
+
+        genotypes = {}
+        for family_index in family_indices:
+            for sample_index in range(samples_per_family):
+                genotypes[_individual_guid(family_index, sample_index)] = {
+                    'ab': rng.random(), 'ad': None, 'dp': rng.randint(10, 100), 'gq': rng.randint(0, 99),
+                    'pl': None, 'cn': 2, 'end': None, 'start': None, 'numExon': None, 'defragged': None,
+                    'qs': None, 'sampleId': _sample_id(family_index, sample_index), 'sampleType': 'WES',
+                    'numAlt': rng.randint(0, 2),
+                }
+
+        transcripts = {}
+        for gene_index in range(num_genes):
+            gene_id = 'ENSG{:011d}'.format(rng.randint(0, 60000))
+            transcripts[gene_id] = [_generate_transcript(rng, gene_id, t) for t in range(gene_index, gene_index + 2)]
+        main_transcript = next(iter(transcripts.values()))[0]
+
+        variants.append({
+            'alt': alt, 'chrom': chrom, 'end': pos, 'genotypeFilters': '', 'numExon': None, 'originalAltAlleles': [],
+            'pos': pos, 'ref': ref, 'rsid': None, 'svType': None, 'variantId': '{}-{}-{}-{}'.format(chrom, pos, ref, alt),
+            'xpos': xpos,
+            'clinvar': {'clinicalSignificance': None, 'variationId': None, 'alleleId': None, 'goldStars': None},
+            'hgmd': {'accession': None, 'class': None},
+            '_sort': [xpos],
+            'familyGuids': sorted(_family_guid(family_index) for family_index in family_indices),
+            'genotypes': genotypes,
+            'genomeVersion': '37', 'liftedOverGenomeVersion': None, 'liftedOverChrom': None, 'liftedOverPos': None,
+            'mainTranscriptId': main_transcript['transcriptId'],
+            'populations': {pop: {
+                'af': rng.random() / 100, 'filter_af': rng.random() / 100, 'ac': rng.randint(0, 100),
+                'an': rng.randint(100, 1000), 'hom': rng.randint(0, 10), 'hemi': rng.randint(0, 10),
+            } for pop in POPULATION_KEYS},
+            'predictions': {pred: str(round(rng.random() * 30, 3)) for pred in PREDICTION_KEYS},
+            'transcripts': transcripts,
+        })
+    return variants
+
+
+def _generate_es_transcript(rng, gene_id, transcript_index):
+    return {
+        'amino_acids': 'P/X', 'biotype': 'protein_coding', 'canonical': 1 if transcript_index == 0 else None,
+        'cdna_start': rng.randint(1, 5000), 'cdna_end': rng.randint(1, 5000), 'codons': 'Ccc/cc',
+        'consequence_terms': [rng.choice(CONSEQUENCES)], 'domains': ['Pfam_domain:PF00001'],
+        'gene_id': gene_id, 'gene_symbol': 'GENE{}'.format(gene_id[-5:]),
+        'hgvs': 'ENSP00000389625.1:p.Leu288SerfsTer10', 'hgvsc': 'ENST00000456743.1:c.862delC',
+        'hgvsp': 'ENSP00000389625.1:p.Leu288SerfsTer10', 'lof': None, 'lof_filter': None, 'lof_flags': None,
+        'major_consequence': rng.choice(CONSEQUENCES), 'major_consequence_rank': rng.randint(1, 30),
+        'protein_id': 'ENSP{:011d}'.format(rng.randint(0, 10**9)), 'category': 'missense',
+        'transcript_id': 'ENST{:011d}'.format(rng.randint(0, 10**9)), 'transcript_rank': transcript_index,
+    }
+
+
+def _generate_es_sv_genotype(rng, sample_id, pos, end):
+    cn = rng.choice([0, 1, 3, 4])
+    return {
+        'cn': cn, 'qs': rng.randint(0, 1000), 'sample_id': sample_id, 'num_alt': 2 if cn in {0, 4} else 1,
+        'defragged': rng.random() < 0.1, 'num_exon': rng.randint(0, 10),
+        'start': pos if rng.random() < 0.8 else pos - rng.randint(1, 100),
+        'end': end if rng.random() < 0.8 else end + rng.randint(1, 100),
+    }
+
+
+def generate_es_hits(num_variants, index_name='benchmark_index', num_families=10, samples_per_family=3, num_genes=2,
+                     seed=0, is_sv=False, gene_ids=None, family_sample_ids=None):
+    """Generates realistically sized raw hits in the format returned by elasticsearch for a variant search, for either
+    an SNV/ indel or an SV index. Transcripts are in random genes unless a set of gene IDs to choose from is given, and
+    genotypes are for synthetic families unless the sample IDs for each family are given"""
+    if family_sample_ids is None:
+        family_sample_ids = [
+            [_sample_id(family_index, sample_index) for sample_index in range(samples_per_family)]
+            for family_index in range(num_families)
+        ]
+    num_families = len(family_sample_ids)
+
+    rng = random.Random(seed)
+    hits = []
+    for i in range(num_variants):
+        chrom = CHROMOSOMES[i * len(CHROMOSOMES) // max(num_variants, 1)]
+        pos = rng.randint(1, 10**8)
+        ref = rng.choice(NUCLEOTIDES)
+        alt = rng.choice(NUCLEOTIDES)
+        end = pos + rng.randint(100, 100000) if is_sv else pos
+        sv_type = rng.choice(SV_TYPES) if is_sv else None
+        variant_id = 'batch_{}_{}_{}'.format(i, sv_type, chrom) if is_sv else '{}-{}-{}-{}'.format(chrom, pos, ref, alt)
+        xpos = get_xpos(chrom, pos)
+        family_indices = rng.sample(range(num_families), min(num_families, rng.randint(1, 3)))
+
+        genotypes = []
+        samples_by_num_alt = defaultdict(list)
+        for family_index in family_indices:
+            for sample_index, sample_id in enumerate(family_sample_ids[family_index]):
+                if is_sv:
+                    # Family members with no variants are not included in the SV index
+                    if sample_index and rng.random() < 0.5:
+                        continue
+                    genotype = _generate_es_sv_genotype(rng, sample_id, pos, end)
+                else:
+                    genotype = {
+                        'ab': rng.random(), 'dp': rng.randint(10, 100), 'gq': rng.randint(0, 99),
+                        'sample_id': sample_id, 'num_alt': rng.randint(0, 2),
+                    }
+                genotypes.append(genotype)
+                samples_by_num_alt[genotype['num_alt']].append(sample_id)
+
+        variant_gene_ids = [
+            rng.choice(gene_ids) if gene_ids else 'ENSG{:011d}'.format(rng.randint(0, 60000)) for _ in range(num_genes)]
+        if is_sv:
+            transcripts = [{'gene_id': gene_id, 'gene_symbol': 'GENE{}'.format(gene_id[-5:])} for gene_id in variant_gene_ids]
+        else:
+            transcripts = [
+                _generate_es_transcript(rng, gene_id, t) for gene_id in variant_gene_ids for t in range(2)]
+
+        source = {
+            'alt': None if is_sv else alt, 'contig': chrom, 'end': end, 'filters': [], 'originalAltAlleles': [],
+            'ref': None if is_sv else ref, 'rsid': None, 'start': pos, 'variantId': variant_id, 'xpos': xpos,
+            'genotypes': genotypes, 'geneIds': sorted(set(variant_gene_ids)), 'sortedTranscriptConsequences': transcripts,
+        }
+        if is_sv:
+            source.update({
+                'svType': sv_type, 'num_exon': rng.randint(0, 10),
+                'samples': samples_by_num_alt[1] + samples_by_num_alt[2],
+            })
+        else:
+            source.update({'samples_num_alt_1': samples_by_num_alt[1], 'samples_num_alt_2': samples_by_num_alt[2]})
+        source.update({'clinvar_{}'.format(field): None for field in CLINVAR_FIELDS})
+        source.update({'hgmd_{}'.format(field): None for field in HGMD_FIELDS})
+        source.update({field: round(rng.random() * 30, 3) for field in PREDICTION_FIELDS_CONFIG.keys()})
+        for pop_config in POPULATIONS.values():
+            for freq_field, pop_field in pop_config.items():
+                for field in (pop_field if isinstance(pop_field, list) else [pop_field]):
+                    source[field] = rng.random() / 100 if 'AF' in freq_field else rng.randint(0, 1000)
+
+        hits.append({
+            '_index': index_name, '_id': variant_id, '_type': 'variant', '_score': None, '_source': source,
+            'sort': [xpos, variant_id],
+        })
+    return hits
+
+
+def generate_compound_het_response(search, hits):
+    """Returns the response for a compound het search, with the given hits aggregated by gene as returned by
+    elasticsearch"""
+    hits_by_gene = defaultdict(list)
+    for hit in hits:
+        for gene_id in hit['_source']['geneIds']:
+            hits_by_gene[gene_id].append(hit)
+
+    return Response(search, {
+        'took': 1, 'timed_out': False,
+        'hits': {'total': {'value': len(hits), 'relation': 'eq'}, 'max_score': None, 'hits': hits[:1]},
+        'aggregations': {'genes': {'buckets': [{
+            'key': {'gene_id': gene_id}, 'doc_count': len(gene_hits),
+            'vars_by_gene': {'hits': {
+                'total': {'value': len(gene_hits), 'relation': 'eq'}, 'max_score': None, 'hits': gene_hits,
+            }},
+        } for gene_id, gene_hits in sorted(hits_by_gene.items())]}},
+    })
+
+
+def get_benchmark_search(num_families=10, samples_per_family=3, dataset_types=None):
+    """Returns an EsSearch for synthetic families, with the sample IDs used by the hit generators, which can build
+    queries and parse hits without any database models or elasticsearch. The first individual in each family is
+    affected and the rest are unaffected"""
+    samples_by_family_index = {}
+    index_metadata = {}
+    for dataset_type in dataset_types or sorted(BENCHMARK_INDICES.keys()):
+        index_name = BENCHMARK_INDICES[dataset_type]
+        index_fields = SV_INDEX_FIELDS if dataset_type == Sample.DATASET_TYPE_SV_CALLS else SNV_INDEX_FIELDS
+        index_metadata[index_name] = {
+            'genomeVersion': '37', 'datasetType': dataset_type, 'fields': {field: 'keyword' for field in index_fields},
+        }
+        samples_by_family_index[index_name] = {
+            _family_guid(family_index): {
+                _sample_id(family_index, sample_index): SearchSample(
+                    _sample_id(family_index, sample_index), Sample.SAMPLE_TYPE_WES, SearchIndividual(
+                        _individual_guid(family_index, sample_index),
+                        Individual.AFFECTED_STATUS_UNAFFECTED if sample_index else Individual.AFFECTED_STATUS_AFFECTED,
+                        Individual.SEX_FEMALE if sample_index % 2 else Individual.SEX_MALE))
+                for sample_index in range(samples_per_family)
+            } for family_index in range(num_families)
+        }
+
+    es_search = EsSearch.from_samples(samples_by_family_index, index_metadata)
+    es_search.sort(XPOS_SORT_KEY)
+    return es_search
+
+
+def _build_benchmark_search(es_search):
+    _build_es_search(es_search, deepcopy(BENCHMARK_SEARCH), XPOS_SORT_KEY, False, [], [], [], [])
+    return es_search
+
+
+def _generate_sorted_es_hits(num_variants, dataset_type, seed=0, **kwargs):
+    hits = generate_es_hits(
+        num_variants, index_name=BENCHMARK_INDICES[dataset_type], is_sv=dataset_type == Sample.DATASET_TYPE_SV_CALLS,
+        seed=seed, **kwargs)
+    return sorted(hits, key=lambda hit: hit['sort'])
+
+
+def get_hit_parser_search(hits):
+    """Returns an EsSearch which can parse the given hits without any database models or index metadata"""
+    samples_by_family_index = defaultdict(lambda: defaultdict(dict))
+    index_metadata = {}
+    for hit in hits:
+        index_name = hit['_index']
+        if index_name not in index_metadata:
+            index_metadata[index_name] = {'genomeVersion': '37', 'fields': set(QUERY_FIELD_NAMES)}
+        for genotype in hit['_source'].get('genotypes', []):
+            sample_id = genotype['sample_id']
+            family_guid = 'F_{}'.format(sample_id)
+            samples_by_family_index[index_name][family_guid][sample_id] = SearchSample(
+                sample_id, Sample.SAMPLE_TYPE_WES, SearchIndividual(
+                    'I_{}'.format(sample_id), Individual.AFFECTED_STATUS_AFFECTED, Individual.SEX_UNKNOWN))
+    es_search = EsSearch.from_samples(samples_by_family_index, index_metadata)
+    es_search.sort(XPOS_SORT_KEY)
+    return es_search
+
+
+def _load_es_response_hits(es_response_file):
+    with open(es_response_file) as f:
+        es_response = json.load(f)
+    hits = []
+    for response in es_response.get('responses', [es_response]):
+        for hit in response['hits']['hits']:
+            # Matched queries reference the families in the original search, so families are instead determined by sample
+            hit.pop('matched_queries', None)
+            hits.append(hit)
+    return hits
+
+
+def time_function(func, repeat=3, setup=None):
+    """Runs the function repeatedly and returns its last result and pytest-benchmark style timing stats. If given, setup
+    is run untimed before each round and its return value is passed to the function"""
+    durations = []
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = timer()
+        result = func(*args)
+        durations.append(timer() - start)
+    return result, {
+        'min': min(durations), 'max': max(durations), 'mean': mean(durations), 'median': median(durations),
+        'stddev': stdev(durations) if len(durations) > 1 else 0.0, 'rounds': len(durations),
+    }
+
+
+def benchmark_cache_codec(num_variants=10000, repeat=3, redis_client=None, **kwargs):
+    """Compares encode/ decode time and cached size for the search results cache codecs"""
+    variants = generate_parsed_variants(num_variants)
+    previous_search_results = {
+        'all_results': variants, 'total_results': num_variants, 'duplicate_doc_count': 0,
+        'loaded_variant_counts': {'test_index': {'loaded': num_variants, 'total': num_variants}},
+    }
+
+    results = []
+    for codec in [None] + sorted(CACHE_CODECS.keys()):
+        encoded, encode_time = time_function(lambda: encode_cache_value(previous_search_results, codec=codec), repeat)
+        _, decode_time = time_function(lambda: decode_cache_value(encoded), repeat)
+        result = {
+            'name': 'cache_codec_{}'.format(codec or 'json'),
+            'encode': encode_time,
+            'decode': decode_time,
+            'bytes': len(encoded if isinstance(encoded, bytes) else encoded.encode('utf-8')),
+        }
+        if redis_client:
+            cache_key = 'benchmark__cache_codec_{}'.format(codec or 'json')
+            redis_client.set(cache_key, encoded, ex=60)
+            result['redis_memory'] = redis_client.memory_usage(cache_key)
+            redis_client.delete(cache_key)
+        results.append(result)
+    return results
+
+
+def benchmark_parse_hits(num_variants=10000, repeat=3, es_response_file=None, num_families=10, samples_per_family=3,
+                         **kwargs):
+    """Measures the time to parse raw elasticsearch hits into variants, using either generated hits or the hits from a
+    recorded search or multi-search response"""
+    hits = _load_es_response_hits(es_response_file) if es_response_file else generate_es_hits(
+        num_variants, num_families=num_families, samples_per_family=samples_per_family)
+    es_search = get_hit_parser_search(hits)
+
+    _, parse_time = time_function(lambda: [es_search._parse_hit(hit) for hit in hits], repeat)
+    return [{'name': 'parse_hits', 'parse': parse_time, 'hits': len(hits)}]
+
+
+def benchmark_parse_cached_hits(num_variants=10000, repeat=3, num_families=10, samples_per_family=3, **kwargs):
+    """Measures the time to parse generated raw hits for variants with cached annotations, including decoding the
+    cached annotations"""
+    hits = generate_es_hits(num_variants, num_families=num_families, samples_per_family=samples_per_family)
+    es_search = get_hit_parser_search(hits)
+    cached_annotations = [
+        encode_cache_value({key: variant[key] for key in VARIANT_ANNOTATION_KEYS}, codec=MSGPACK_ZSTD_CODEC)
+        for variant in [es_search._parse_hit(hit) for hit in hits]
+    ]
+
+    _, parse_time = time_function(lambda: [
+        es_search._parse_hit(hit, decode_cache_value(annotations)) for hit, annotations in zip(hits, cached_annotations)
+    ], repeat)
+    return [{'name': 'parse_cached_hits', 'parse': parse_time, 'hits': len(hits)}]
+
+
+def benchmark_parse_sv_hits(num_variants=10000, repeat=3, num_families=10, samples_per_family=3, **kwargs):
+    """Measures the time to parse generated raw SV hits, which need reference genotypes and SV coordinates added"""
+    hits = generate_es_hits(
+        num_variants, index_name=BENCHMARK_INDICES[Sample.DATASET_TYPE_SV_CALLS], num_families=num_families,
+        samples_per_family=samples_per_family, is_sv=True)
+    es_search = get_benchmark_search(num_families, samples_per_family)
+
+    _, parse_time = time_function(lambda: [es_search._parse_hit(hit) for hit in hits], repeat)
+    return [{'name': 'parse_sv_hits', 'parse': parse_time, 'hits': len(hits)}]
+
+
+def benchmark_query_building(repeat=3, num_families=10, samples_per_family=3, **kwargs):
+    """Measures the time to build and compile the queries for a recessive search with frequency, annotation and quality
+    filters across SNV and SV indices"""
+    def _setup():
+        # Sample quality filters are cached across searches, so each round builds them from scratch
+        _get_sample_quality_filter.cache_clear()
+        return get_benchmark_search(num_families, samples_per_family)
+
+    compiled_search, build_time = time_function(
+        lambda es_search: _build_benchmark_search(es_search).get_compiled_search(), repeat, setup=_setup)
+    return [{
+        'name': 'query_building', 'build': build_time, 'families': num_families,
+        'clauses': _count_query_clauses(compiled_search),
+    }]
+
+
+def benchmark_compound_hets(num_variants=10000, repeat=3, num_families=10, samples_per_family=3, **kwargs):
+    """Measures the time to process a compound het gene aggregation response into validated compound het pairs"""
+    num_variants = min(num_variants, MAX_BENCHMARK_GENE_VARIANTS * 10)
+    gene_ids = ['ENSG{:011d}'.format(i) for i in range(max(num_variants // BENCHMARK_GENE_VARIANTS, 1))]
+    hits = _generate_sorted_es_hits(
+        num_variants, Sample.DATASET_TYPE_VARIANT_CALLS, num_families=num_families,
+        samples_per_family=samples_per_family, num_genes=1, gene_ids=gene_ids)
+
+    es_search = _build_benchmark_search(get_benchmark_search(
+        num_families, samples_per_family, dataset_types=[Sample.DATASET_TYPE_VARIANT_CALLS]))
+    index_name = BENCHMARK_INDICES[Sample.DATASET_TYPE_VARIANT_CALLS]
+    compound_het_search = next(
+        search for search in es_search._index_searches[index_name] if search.aggs.to_dict()).index([index_name])
+    response = generate_compound_het_response(compound_het_search, hits)
+
+    def _setup():
+        es_search.previous_search_results = {}
+        return response
+
+    (compound_het_results, _), process_time = time_function(
+        es_search._parse_compound_het_response, repeat, setup=_setup)
+    return [{
+        'name': 'compound_hets', 'process': process_time, 'genes': len(gene_ids), 'hits': len(hits),
+        'pairs': len(compound_het_results),
+    }]
+
+
+def benchmark_deduplication(num_variants=10000, repeat=3, num_families=10, samples_per_family=3, **kwargs):
+    """Measures the time to merge the variants returned for the same families by two indices"""
+    hits = _generate_sorted_es_hits(
+        num_variants, Sample.DATASET_TYPE_VARIANT_CALLS, num_families=num_families,
+        samples_per_family=samples_per_family)
+    es_search = get_benchmark_search(
+        num_families, samples_per_family, dataset_types=[Sample.DATASET_TYPE_VARIANT_CALLS])
+
+    def _setup():
+        es_search.previous_search_results = {'total_results': len(hits) * 2}
+        # Duplicated variants are merged in place, so each round deduplicates newly parsed variants
+        return list(heapq.merge(
+            es_search._parse_hits(hits), es_search._parse_hits(hits), key=lambda variant: variant['_sort']))
+
+    variant_results, dedup_time = time_function(es_search._deduplicate_results, repeat, setup=_setup)
+    return [{
+        'name': 'deduplication', 'deduplicate': dedup_time, 'variants': len(hits) * 2,
+        'duplicates': len(hits) * 2 - len(variant_results),
+    }]
+
+
+def _paginate_multi_search_results(es_search, parsed_results_by_index, num_results=BENCHMARK_PAGE_SIZE):
+    es_search.previous_search_results = {es_search.CACHED_COUNTS_KEY: {
+        index_name: {'loaded': 0, 'total': 0} for index_name in parsed_results_by_index.keys()}}
+    loaded_counts = es_search.previous_search_results[es_search.CACHED_COUNTS_KEY]
+    total_results = sum(len(variants) for variants in parsed_results_by_index.values())
+
+    # Each page loads the next page of results for every index which is not fully loaded, as in _execute_multi_search
+    num_pages = 0
+    while num_pages * num_results < total_results:
+        num_pages += 1
+        parsed_responses = []
+        for index_name, variants in sorted(parsed_results_by_index.items()):
+            start_index = loaded_counts[index_name]['loaded']
+            if num_pages == 1 or start_index < loaded_counts[index_name]['total']:
+                parsed_responses.append(
+                    (variants[start_index:start_index + num_results], len(variants), False, index_name))
+        es_search._process_multi_search_responses(parsed_responses, page=num_pages, num_results=num_results)
+    return num_pages
+
+
+def benchmark_pagination(num_variants=10000, repeat=3, num_families=10, samples_per_family=3, **kwargs):
+    """Measures the time to merge, deduplicate and paginate through all the results of a search across SNV and SV
+    indices, a page at a time"""
+    num_variants = min(num_variants, MAX_BENCHMARK_GENE_VARIANTS * 10)
+    es_search = get_benchmark_search(num_families, samples_per_family)
+    hits_by_index = {
+        BENCHMARK_INDICES[dataset_type]: _generate_sorted_es_hits(
+            num_variants // 2 if dataset_type == Sample.DATASET_TYPE_SV_CALLS else num_variants, dataset_type,
+            num_families=num_families, samples_per_family=samples_per_family)
+        for dataset_type in BENCHMARK_INDICES.keys()
+    }
+
+    num_pages, paginate_time = time_function(
+        lambda parsed_results_by_index: _paginate_multi_search_results(es_search, parsed_results_by_index), repeat,
+        setup=lambda: {index_name: es_search._parse_hits(hits) for index_name, hits in hits_by_index.items()})
+    return [{
+        'name': 'pagination', 'paginate': paginate_time, 'pages': num_pages,
+        'variants': sum(len(hits) for hits in hits_by_index.values()),
+    }]
+
+
+def _iterative_valid_family_compound_hets(gene_id, gene_variants, family_unaffected_individual_guids,
+                                          allowed_consequences, allowed_consequences_secondary):
+    """Reference implementation of compound het pair validation which checks each pair of variants individually"""
+    family_variants = defaultdict(list)
+    for variant in gene_variants:
+        for family_guid in variant['familyGuids']:
+            family_variants[family_guid].append(variant)
+
+    family_compound_het_pairs = {}
+    for family_guid, variants in family_variants.items():
+        unaffected_individuals = family_unaffected_individual_guids.get(family_guid, [])
+        valid_pairs = []
+        for variant_1, variant_2 in combinations(variants, 2):
+            if any(_is_carrier(variant_1, individual_guid) and _is_carrier(variant_2, individual_guid)
+                   for individual_guid in unaffected_individuals):
+                continue
+            if allowed_consequences and allowed_consequences_secondary:
+                consequences = variant_1['gene_consequences'].get(gene_id, []) + \
+                               variant_2['gene_consequences'].get(gene_id, [])
+                if all(consequence not in allowed_consequences for consequence in consequences) or all(
+                        consequence not in allowed_consequences_secondary for consequence in consequences):
+                    continue
+            valid_pairs.append([variant_1, variant_2])
+        family_compound_het_pairs[family_guid] = valid_pairs
+    return family_compound_het_pairs
+
+
+def _is_carrier(variant, individual_guid):
+    genotype = variant['genotypes'].get(individual_guid)
+    return bool(genotype) and genotype.get('numAlt') != 0 and not genotype.get('isRef')
+
+
+def benchmark_compound_het_validation(num_variants=10000, repeat=3, num_families=5, **kwargs):
+    """Compares compound het pair validation for a single large gene against the pairwise reference implementation"""
+    gene_id = 'ENSG00000155657'
+    gene_variants = generate_parsed_variants(min(num_variants, MAX_BENCHMARK_GENE_VARIANTS), num_families=num_families)
+    for variant in gene_variants:
+        variant['gene_consequences'] = {gene_id: [
+            transcript['majorConsequence'] for transcripts in variant['transcripts'].values()
+            for transcript in transcripts]}
+    family_unaffected_individual_guids = {
+        _family_guid(family_index): {_individual_guid(family_index, 1), _individual_guid(family_index, 2)}
+        for family_index in range(num_families)
+    }
+
+    es_search = EsSearch.from_samples({}, {})
+    es_search._allowed_consequences = ['frameshift_variant', 'stop_gained']
+    es_search._allowed_consequences_secondary = ['missense_variant']
+
+    expected_pairs, iterative_time = time_function(lambda: _iterative_valid_family_compound_hets(
+        gene_id, gene_variants, family_unaffected_individual_guids, es_search._allowed_consequences,
+        es_search._allowed_consequences_secondary), repeat)
+    pairs, vectorized_time = time_function(lambda: es_search._get_valid_family_compound_hets(
+        gene_id, gene_variants, family_unaffected_individual_guids), repeat)
+    if pairs != expected_pairs:
+        raise ValueError('Vectorized compound het validation does not match the reference implementation')
+
+    num_pairs = sum(len(family_pairs) for family_pairs in pairs.values())
+    return [
+        {'name': 'compound_het_validation_iterative', 'validate': iterative_time, 'pairs': num_pairs},
+        {'name': 'compound_het_validation_vectorized', 'validate': vectorized_time, 'pairs': num_pairs},
+    ]
+
+
+BENCHMARKS = {
+    'cache_codec': benchmark_cache_codec,
+    'parse_hits': benchmark_parse_hits,
+    'parse_cached_hits': benchmark_parse_cached_hits,
+    'parse_sv_hits': benchmark_parse_sv_hits,
+    'query_building': benchmark_query_building,
+    'compound_het_validation': benchmark_compound_het_validation,
+    'compound_hets': benchmark_compound_hets,
+    'deduplication': benchmark_deduplication,
+    'pagination': benchmark_pagination,
+}
@@ -1,11 +1,37 @@
+from datetime import timedelta
+
 from reference_data.models import Omim, GeneConstraint
 from seqr.models import Individual
 
 MAX_VARIANTS = 10000
-MAX_COMPOUND_HET_GENES = 1000
+# Genes are aggregated a page at a time using a composite aggregation
+GENE_AGG_PAGE_SIZE = 1000
+# top_hits aggregations can not return more hits than the index max_inner_result_window, which defaults to 100
+MAX_GENE_AGG_HITS = 100
 MAX_INDEX_NAME_LENGTH = 7500
+# Searches across multiple indices are run concurrently, and must all complete within the search timeout (in seconds)
+MAX_CONCURRENT_INDEX_SEARCHES = 8
+MULTI_INDEX_SEARCH_TIMEOUT = 55
+# ES limits the number of clauses in a single bool query (indices.query.bool.max_clause_count defaults to 1024)
+MAX_FAMILY_QUERY_CLAUSES = 1000
+QUALITY_FILTER_CACHE_SIZE = 1024
+# Sort script params built from reference data are cached for each version of the reference data they are built from.
+# The version is itself cached, so reference data updates are used by searches once the cached version expires
+SORT_SCRIPT_REFERENCE_MODELS = {'in_omim': Omim, 'constraint': GeneConstraint}
+SORT_SCRIPT_PARAMS_VERSION_CACHE_EXPIRE = timedelta(minutes=10)
+SORT_SCRIPT_PARAMS_CACHE_EXPIRE = timedelta(weeks=1)
+SORT_SCRIPT_PARAMS_CACHE_SIZE = 8
+# Variants with known IDs are fetched directly by document ID in chunks. Indices which are not keyed by variant ID are
+# searched instead, and indices which are confirmed to be keyed by variant ID are cached
+VARIANT_ID_FETCH_CHUNK_SIZE = 1000
+VARIANT_ID_KEYED_INDEX_CACHE_EXPIRE = timedelta(weeks=1)
+# The family independent annotations parsed for each variant are shared across searches, until the index is reloaded.
+# Annotations updated in place without changing the index _meta are only picked up once the cached annotations expire
+VARIANT_ANNOTATIONS_CACHE_EXPIRE = timedelta(days=1)
 
 XPOS_SORT_KEY = 'xpos'
+# Unique per variant so sorts are deterministic, which is required to paginate with search_after
+VARIANT_ID_SORT_KEY = 'variantId'
 
 AFFECTED = Individual.AFFECTED_STATUS_AFFECTED
 UNAFFECTED = Individual.AFFECTED_STATUS_UNAFFECTED
@@ -159,13 +185,13 @@ SORT_FIELDS = {
             'order': 'desc',
             'script': {
                 'params': {
-                    'omim_gene_ids': lambda *args: [omim.gene.gene_id for omim in Omim.objects.filter(
-                        phenotype_mim_number__isnull=False).only('gene__gene_id')]
+                    'omim_gene_ids': lambda *args: {omim.gene.gene_id: 1 for omim in Omim.objects.filter(
+                        phenotype_mim_number__isnull=False).only('gene__gene_id')}
                 },
                 'source': """
                     int total = 0; 
                     for (int i = 0; i < doc['geneIds'].length; ++i) {
-                        if (params.omim_gene_ids.contains(doc['geneIds'][i])) {
+                        if (params.omim_gene_ids.containsKey(doc['geneIds'][i])) {
                             total += 1;
                             if (doc.containsKey('mainTranscript_gene_id') && 
                                 doc['geneIds'][i] == doc['mainTranscript_gene_id'].value) {
@@ -233,6 +259,11 @@ SORT_FIELDS.update({
     sort: [{sort_field: {'order': 'desc', 'unmapped_type': True}}]
     for sort, sort_field in PREDICTOR_SORT_FIELDS.items()
 })
+# Indices annotated with precomputed ranks can be sorted on directly instead of with the reference data scripts
+PRECOMPUTED_SORT_FIELDS = {
+    'in_omim': 'in_omim_rank',
+    'constraint': 'constraint_rank',
+}
 
 CLINVAR_FIELDS = ['clinical_significance', 'variation_id', 'allele_id', 'gold_stars']
 HGMD_FIELDS = ['accession', 'class']
@@ -307,3 +338,8 @@ for pop_config in POPULATIONS.values():
             QUERY_FIELD_NAMES += pop_field
         else:
             QUERY_FIELD_NAMES.append(pop_field)
+# Fields which are only used to parse the family independent annotations for a variant
+ANNOTATION_FIELD_NAMES = [
+    field for field in QUERY_FIELD_NAMES
+    if field not in CORE_FIELDS_CONFIG and field not in HAS_ALT_FIELD_KEYS and field != GENOTYPES_FIELD_KEY
+]
@@ -1,7 +1,7 @@
 from collections import defaultdict
 import logging
 
-from seqr.utils.elasticsearch.constants import MAX_COMPOUND_HET_GENES, HAS_ALT_FIELD_KEYS
+from seqr.utils.elasticsearch.constants import GENE_AGG_PAGE_SIZE, MAX_GENE_AGG_HITS, HAS_ALT_FIELD_KEYS
 from seqr.utils.elasticsearch.es_search import EsSearch
 
 logger = logging.getLogger(__name__)
@@ -10,22 +10,34 @@ logger = logging.getLogger(__name__)
 class EsGeneAggSearch(EsSearch):
     AGGREGATION_NAME = 'gene aggregation'
     CACHED_COUNTS_KEY = None
+    COMPOUND_HET_AFTER_KEYS_KEY = None
+
+    def _init_search(self, *args, **kwargs):
+        super(EsGeneAggSearch, self)._init_search(*args, **kwargs)
+        self._families_by_sample = {
+            sample_id: families[-1][0]
+            for sample_families in self._sample_families_by_index.values()
+            for sample_id, families in sample_families.items()
+        }
 
     def aggregate_by_gene(self):
         searches = [self._search]
         for index_searches in self._index_searches.values():
             searches += [index_search for index_search in index_searches]
 
+        # Families searched with a grouped query are determined from the alt samples in the hit
+        hit_source = HAS_ALT_FIELD_KEYS if any(self._family_query_groups_by_index.values()) else 'none'
         for search in searches:
             agg = search.aggs.bucket(
-                'genes', 'terms', field='mainTranscript_gene_id', size=MAX_COMPOUND_HET_GENES+1
+                'genes', 'composite', size=GENE_AGG_PAGE_SIZE,
+                sources=[{'gene_id': {'terms': {'field': 'mainTranscript_gene_id'}}}],
             )
             if self._no_sample_filters or self._any_affected_sample_filters:
                 for key in HAS_ALT_FIELD_KEYS:
                     agg.bucket(key, 'terms', field=key, size=10000)
             else:
                 agg.metric(
-                    'vars_by_gene', 'top_hits', size=100, _source='none'
+                    'vars_by_gene', 'top_hits', size=MAX_GENE_AGG_HITS, _source=hit_source
                 )
 
     def _should_execute_single_search(self, page=1, num_results=100):
@@ -56,42 +68,46 @@ class EsGeneAggSearch(EsSearch):
 
         return gene_aggs
 
-    def _parse_response(self, response):
-        if len(response.aggregations.genes.buckets) > MAX_COMPOUND_HET_GENES:
-            from seqr.utils.elasticsearch.utils import InvalidSearchException
-            raise InvalidSearchException('This search returned too many genes')
-
+    def _parse_response(self, response, **kwargs):
+        # Counts are needed for every gene, so all the gene pages are loaded
         gene_counts = defaultdict(lambda: {'total': 0, 'families': defaultdict(int), 'sample_ids': set()})
-        for gene_agg in response.aggregations.genes.buckets:
-            gene_id = gene_agg['key']
-            gene_counts[gene_id]['total'] += gene_agg['doc_count']
-            if 'vars_by_gene' in gene_agg:
-                for hit in gene_agg['vars_by_gene']:
-                    gene_counts[gene_id]['sample_ids'].add(hit.meta.id)
-                    for family_guid in hit.meta.matched_queries:
-                        gene_counts[gene_id]['families'][family_guid] += 1
-            else:
-                families_by_sample = {}
-                for index_samples_by_family in self.samples_by_family_index.values():
-                    for family_guid, samples_by_id in index_samples_by_family.items():
-                        for sample_id in samples_by_id.keys():
-                            families_by_sample[sample_id] = family_guid
-
-                for key in HAS_ALT_FIELD_KEYS:
-                    for sample_agg in gene_agg[key]['buckets']:
-                        family_guid = families_by_sample.get(sample_agg['key'])
-                        if family_guid:
-                            gene_counts[gene_id]['families'][family_guid] += sample_agg['doc_count']
-                            gene_counts[gene_id]['sample_ids'].add(sample_agg['key'])
-                        else:
-                            # samples may be returned that are not part of the searched families if they have no
-                            # affected individuals and were removed from the "any affected" search.
-                            gene_counts[gene_id]['total'] -= sample_agg['doc_count']
+        for search, gene_aggs, _ in self._iter_gene_agg_pages(response):
+            hits_by_gene = {}
+            if 'vars_by_gene' in search.aggs['genes'].aggs:
+                source = search.aggs['genes']['vars_by_gene'].to_dict()['top_hits']['_source']
+                hits_by_gene = self._get_gene_agg_hits(gene_aggs, 'mainTranscript_gene_id', search, source)
+            for gene_agg in gene_aggs:
+                self._parse_gene_agg(gene_agg, hits_by_gene, gene_counts)
 
         return gene_counts
 
+    def _parse_gene_agg(self, gene_agg, hits_by_gene, gene_counts):
+        gene_id = gene_agg['key']['gene_id']
+        gene_counts[gene_id]['total'] += gene_agg['doc_count']
+        if 'vars_by_gene' in gene_agg:
+            for hit in hits_by_gene[gene_id]:
+                gene_counts[gene_id]['sample_ids'].add(hit['_id'])
+                family_guids = hit.get('matched_queries', [])
+                family_query_groups = self._family_query_groups_by_index.get(hit['_index'])
+                if family_query_groups and any(query_name in family_query_groups for query_name in family_guids):
+                    family_guids = self._get_grouped_family_guids(
+                        family_guids, family_query_groups, hit.get('_source', {}), hit['_index'])
+                for family_guid in family_guids:
+                    gene_counts[gene_id]['families'][family_guid] += 1
+        else:
+            for key in HAS_ALT_FIELD_KEYS:
+                for sample_agg in gene_agg[key]['buckets']:
+                    family_guid = self._families_by_sample.get(sample_agg['key'])
+                    if family_guid:
+                        gene_counts[gene_id]['families'][family_guid] += sample_agg['doc_count']
+                        gene_counts[gene_id]['sample_ids'].add(sample_agg['key'])
+                    else:
+                        # samples may be returned that are not part of the searched families if they have no
+                        # affected individuals and were removed from the "any affected" search.
+                        gene_counts[gene_id]['total'] -= sample_agg['doc_count']
+
     def _add_compound_hets(self, gene_counts):
-        # Compound hets are always loaded as part of the initial search and are not part of the fetched aggregation
+        # Compound hets loaded by the variant search are not part of the fetched aggregation
         loaded_compound_hets = self.previous_search_results.get('grouped_results', []) + \
                                self.previous_search_results.get('compound_het_results', [])
         for group in loaded_compound_hets:
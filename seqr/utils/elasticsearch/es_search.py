@@ -1,13 +1,18 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from django.db.models import Count, Max
 import elasticsearch
-from elasticsearch_dsl import Search, Q, MultiSearch
+from elasticsearch_dsl import Search, Q, A, MultiSearch
 import hashlib
+import heapq
 import json
 import logging
-from pyliftover.liftover import LiftOver
+from operator import or_
 from sys import maxsize
-from itertools import combinations
+from functools import lru_cache, reduce
+import numpy as np
+from timeit import default_timer as timer
 
 from reference_data.models import GENOME_VERSION_GRCh38, GENOME_VERSION_GRCh37
 from seqr.models import Sample, Individual
@@ -15,34 +20,70 @@ from seqr.utils.elasticsearch.constants import XPOS_SORT_KEY, COMPOUND_HET, RECE
     HAS_ALT_FIELD_KEYS, GENOTYPES_FIELD_KEY, GENOTYPE_FIELDS_CONFIG, POPULATION_RESPONSE_FIELD_CONFIGS, POPULATIONS, \
     SORTED_TRANSCRIPTS_FIELD_KEY, CORE_FIELDS_CONFIG, NESTED_FIELDS, PREDICTION_FIELDS_CONFIG, INHERITANCE_FILTERS, \
     QUERY_FIELD_NAMES, REF_REF, ANY_AFFECTED, GENOTYPE_QUERY_MAP, CLINVAR_SIGNFICANCE_MAP, HGMD_CLASS_MAP, \
-    SORT_FIELDS, MAX_VARIANTS, MAX_COMPOUND_HET_GENES, MAX_INDEX_NAME_LENGTH, QUALITY_FIELDS, \
-    GRCH38_LOCUS_FIELD
-from seqr.utils.redis_utils import safe_redis_get_json, safe_redis_set_json
+    SORT_FIELDS, MAX_VARIANTS, GENE_AGG_PAGE_SIZE, MAX_GENE_AGG_HITS, MAX_INDEX_NAME_LENGTH, QUALITY_FIELDS, \
+    GRCH38_LOCUS_FIELD, VARIANT_ID_SORT_KEY, MAX_CONCURRENT_INDEX_SEARCHES, MULTI_INDEX_SEARCH_TIMEOUT, \
+    MAX_FAMILY_QUERY_CLAUSES, QUALITY_FILTER_CACHE_SIZE, PRECOMPUTED_SORT_FIELDS, SORT_SCRIPT_REFERENCE_MODELS, \
+    SORT_SCRIPT_PARAMS_VERSION_CACHE_EXPIRE, SORT_SCRIPT_PARAMS_CACHE_EXPIRE, SORT_SCRIPT_PARAMS_CACHE_SIZE, \
+    VARIANT_ID_FETCH_CHUNK_SIZE, \
+    VARIANT_ID_KEYED_INDEX_CACHE_EXPIRE, ANNOTATION_FIELD_NAMES, VARIANT_ANNOTATIONS_CACHE_EXPIRE
+from seqr.utils.liftover_utils import get_liftover
+from seqr.utils.redis_utils import safe_redis_get_json, safe_redis_set_json, safe_redis_mget_json, \
+    safe_redis_mset_json, MSGPACK_ZSTD_CODEC
+from seqr.utils.timing_utils import timed_span, add_span_duration, add_span_count, add_es_profile, \
+    with_request_timings
 from seqr.utils.xpos_utils import get_xpos, MIN_POS, MAX_POS
 from seqr.views.utils.json_utils import _to_camel_case
 
 logger = logging.getLogger(__name__)
 
+PRIMARY_CONSEQUENCE_MASK = 1
+SECONDARY_CONSEQUENCE_MASK = 2
+ALL_CONSEQUENCES_MASK = PRIMARY_CONSEQUENCE_MASK | SECONDARY_CONSEQUENCE_MASK
+
+# Parsed variant fields which do not depend on the searched families, and are cached per variant across searches
+VARIANT_ANNOTATION_KEYS = ['mainTranscriptId', 'populations', 'predictions', 'transcripts'] + list(NESTED_FIELDS.keys())
+VARIANT_FIELD_NAMES = [field for field in QUERY_FIELD_NAMES if field not in ANNOTATION_FIELD_NAMES]
+
 
 class EsSearch(object):
 
     AGGREGATION_NAME = 'compound het'
     CACHED_COUNTS_KEY = 'loaded_variant_counts'
+    SEARCH_AFTER_KEY = 'search_after'
+    VARIANT_RESULT_RUNS_KEY = 'variant_result_runs'
+    COMPOUND_HET_AFTER_KEYS_KEY = 'compound_het_after_keys'
+    COMPOUND_HET_PAIR_KEYS_KEY = 'compound_het_pair_keys'
 
     def __init__(self, families, previous_search_results=None, skip_unaffected_families=False,
                  return_all_queried_families=False):
-        from seqr.utils.elasticsearch.utils import get_es_client, InvalidIndexException, InvalidSearchException
+        from seqr.utils.elasticsearch.utils import get_es_client, get_search_samples_by_family_index, \
+            InvalidSearchException
         self._client = get_es_client()
 
-        self.samples_by_family_index = defaultdict(lambda: defaultdict(dict))
-        samples = Sample.objects.filter(is_active=True, individual__family__in=families)
-        for s in samples.select_related('individual__family'):
-            self.samples_by_family_index[s.elasticsearch_index][s.individual.family.guid][s.sample_id] = s
+        samples_by_family_index = get_search_samples_by_family_index(families)
 
-        if len(self.samples_by_family_index) < 1:
+        if len(samples_by_family_index) < 1:
             raise InvalidSearchException('No es index found for families {}'.format(
                 ', '.join([f.family_id for f in families])))
 
+        self._init_search(
+            samples_by_family_index, previous_search_results=previous_search_results,
+            skip_unaffected_families=skip_unaffected_families, return_all_queried_families=return_all_queried_families)
+
+    @classmethod
+    def from_samples(cls, samples_by_family_index, index_metadata, client=None, **kwargs):
+        """Returns a search of the given samples, as {index: {family_guid: {sample_id: SearchSample}}}, using the given
+        index metadata instead of loading the samples from the database and the metadata from elasticsearch"""
+        es_search = cls.__new__(cls)
+        es_search._client = client
+        es_search._init_search(samples_by_family_index, index_metadata=index_metadata, **kwargs)
+        return es_search
+
+    def _init_search(self, samples_by_family_index, index_metadata=None, previous_search_results=None,
+                     skip_unaffected_families=False, return_all_queried_families=False):
+        from seqr.utils.elasticsearch.utils import InvalidIndexException, InvalidSearchException
+        self.samples_by_family_index = samples_by_family_index
+
         self._skipped_sample_count = defaultdict(int)
         if skip_unaffected_families:
             for index, family_samples in list(self.samples_by_family_index.items()):
@@ -66,7 +107,12 @@ class EsSearch(object):
                 raise InvalidSearchException('Inheritance based search is disabled in families with no data loaded for affected individuals')
 
         self._indices = sorted(list(self.samples_by_family_index.keys()))
-        self._set_index_metadata()
+        self._set_sample_families()
+        if index_metadata is None:
+            self._set_index_metadata()
+        else:
+            self._set_index_name()
+            self.index_metadata = index_metadata
 
         if len(self.samples_by_family_index) > len(self.index_metadata):
             raise InvalidIndexException('Could not find expected indices: {}'.format(
@@ -80,6 +126,8 @@ class EsSearch(object):
 
         self.previous_search_results = previous_search_results or {}
         self._return_all_queried_families = return_all_queried_families
+        self._population_parsers_by_index = {}
+        self._index_versions = {}
 
         self._search = Search()
         self._index_searches = defaultdict(list)
@@ -90,6 +138,9 @@ class EsSearch(object):
         self._no_sample_filters = False
         self._any_affected_sample_filters = False
         self._family_individual_affected_status = {}
+        self._family_query_groups_by_index = defaultdict(dict)
+        self._missing_liftover = False
+        self._profile = False
 
     def _set_index_name(self):
         self.index_name = ','.join(sorted(self._indices))
@@ -108,6 +159,11 @@ class EsSearch(object):
         from seqr.utils.elasticsearch.utils import get_index_metadata
         self.index_metadata = get_index_metadata(self.index_name, self._client, include_fields=True)
 
+    def enable_profile(self):
+        """Captures the ES query profile for each executed search, for analysts debugging slow searches"""
+        self._profile = True
+        return self
+
     def update_dataset_type(self, dataset_type, keep_previous=False):
         new_indices = self.indices_by_dataset_type[dataset_type]
         if keep_previous:
@@ -126,15 +182,24 @@ class EsSearch(object):
         return self
 
     def sort(self, sort):
-        self._sort = SORT_FIELDS.get(sort, [])
+        precomputed_sort_field = PRECOMPUTED_SORT_FIELDS.get(sort)
+        if precomputed_sort_field and all(
+                precomputed_sort_field in metadata['fields'] for metadata in self.index_metadata.values()):
+            self._sort = [{precomputed_sort_field: {'order': SORT_FIELDS[sort][0]['_script']['order']}}]
+        else:
+            self._sort = deepcopy(SORT_FIELDS.get(sort, []))
 
         main_sort_dict = self._sort[0] if len(self._sort) and isinstance(self._sort[0], dict) else None
 
-        # Add parameters to scripts
-        if main_sort_dict and main_sort_dict.get('_script', {}).get('script', {}).get('params'):
-            for key, val_func in self._sort[0]['_script']['script']['params'].items():
-                if callable(val_func):
-                    self._sort[0]['_script']['script']['params'][key] = val_func()
+        # Scripts with parameters built from reference data are run as stored scripts with cached parameters. ES stored
+        # scripts can not include params, so the params are still sent with every search that is not sorted on a
+        # precomputed field
+        script = main_sort_dict.get('_script', {}).get('script', {}) if main_sort_dict else {}
+        if any(callable(val_func) for val_func in script.get('params', {}).values()):
+            params = _get_sort_script_params(sort, get_sort_script_params_version(sort))
+            script_id = _get_stored_sort_script_id(self._client, sort, script['source'])
+            main_sort_dict['_script']['script'] = {'id': script_id, 'params': params} if script_id else {
+                'source': script['source'], 'params': params}
 
         # Add unmapped_type
         if main_sort_dict and 'unmapped_type' in list(main_sort_dict.values())[0]:
@@ -147,6 +212,8 @@ class EsSearch(object):
 
         if XPOS_SORT_KEY not in self._sort:
             self._sort.append(XPOS_SORT_KEY)
+        if VARIANT_ID_SORT_KEY not in self._sort:
+            self._sort.append(VARIANT_ID_SORT_KEY)
 
         self._search = self._search.sort(*self._sort)
 
@@ -192,17 +259,23 @@ class EsSearch(object):
         variant_id_genome_versions = {variant_id: genome_version for variant_id in variant_ids or []}
         if variant_id_genome_versions and genome_version:
             lifted_genome_version = GENOME_VERSION_GRCh37 if genome_version == GENOME_VERSION_GRCh38 else GENOME_VERSION_GRCh38
-            liftover = _liftover_grch38_to_grch37() if genome_version == GENOME_VERSION_GRCh38 else _liftover_grch37_to_grch38()
-            if liftover:
-                for variant_id in deepcopy(variant_ids):
+            liftover = get_liftover(genome_version)
+            if not liftover:
+                self._missing_liftover = True
+            else:
+                parsed_variant_ids_by_chrom = defaultdict(list)
+                for variant_id in variant_ids:
                     chrom, pos, ref, alt = self.parse_variant_id(variant_id)
-                    lifted_coord = liftover.convert_coordinate('chr{}'.format(chrom), pos)
-                    if lifted_coord and lifted_coord[0]:
-                        lifted_variant_id = '{chrom}-{pos}-{ref}-{alt}'.format(
-                            chrom=lifted_coord[0][0].lstrip('chr'), pos=lifted_coord[0][1], ref=ref, alt=alt
-                        )
-                        variant_id_genome_versions[lifted_variant_id] = lifted_genome_version
-                        variant_ids.append(lifted_variant_id)
+                    parsed_variant_ids_by_chrom[chrom].append((pos, ref, alt))
+                for chrom, parsed_variant_ids in parsed_variant_ids_by_chrom.items():
+                    lifted_coords = liftover.lift_many(chrom, [pos for pos, _, _ in parsed_variant_ids])
+                    for lifted_coord, (_, ref, alt) in zip(lifted_coords, parsed_variant_ids):
+                        if lifted_coord:
+                            lifted_variant_id = '{chrom}-{pos}-{ref}-{alt}'.format(
+                                chrom=lifted_coord[0], pos=lifted_coord[1], ref=ref, alt=alt
+                            )
+                            variant_id_genome_versions[lifted_variant_id] = lifted_genome_version
+                            variant_ids.append(lifted_variant_id)
 
         self.filter(_location_filter(genes, intervals, rs_ids, variant_ids, locus))
         if not (genes or intervals or rs_ids) and len({genome_version for genome_version in variant_id_genome_versions.values()}) > 1:
@@ -210,7 +283,7 @@ class EsSearch(object):
         return self
 
     def filter_by_annotation_and_genotype(self, inheritance, quality_filter=None, annotations=None, annotations_secondary=None, pathogenicity=None, skip_genotype_filter=False):
-        has_previous_compound_hets = self.previous_search_results.get('grouped_results')
+        has_previous_compound_hets = self.has_loaded_compound_hets()
 
         inheritance_mode = (inheritance or {}).get('mode')
         inheritance_filter = (inheritance or {}).get('filter') or {}
@@ -264,6 +337,14 @@ class EsSearch(object):
         all_sample_search = (not quality_filters_by_family) and (inheritance_mode == ANY_AFFECTED or not has_inheritance_filter)
         no_filter_indices = set()
 
+        if has_inheritance_filter and inheritance_mode != ANY_AFFECTED:
+            if inheritance_mode:
+                inheritance_filter.update(INHERITANCE_FILTERS[inheritance_mode])
+
+            if list(inheritance_filter.keys()) == ['affected']:
+                from seqr.utils.elasticsearch.utils import InvalidSearchException
+                raise InvalidSearchException('Inheritance must be specified if custom affected status is set')
+
         indices = self._indices
         if secondary_dataset_type:
             secondary_only_indices = self.indices_by_dataset_type[secondary_dataset_type]
@@ -276,7 +357,8 @@ class EsSearch(object):
             genotypes_q = None
             if all_sample_search:
                 search_sample_count = sum(len(samples) for samples in family_samples_by_id.values()) + self._skipped_sample_count[index]
-                index_sample_count = Sample.objects.filter(elasticsearch_index=index, is_active=True).count()
+                from seqr.utils.elasticsearch.utils import get_index_active_sample_count
+                index_sample_count = get_index_active_sample_count(index)
                 if search_sample_count == index_sample_count:
                     if inheritance_mode == ANY_AFFECTED:
                         sample_ids = []
@@ -294,15 +376,10 @@ class EsSearch(object):
                         continue
 
             if not genotypes_q:
-                for family_guid in sorted(family_samples_by_id.keys()):
-                    family_samples_q = self._get_family_sample_query(
-                        family_guid, family_samples_by_id, quality_filters_by_family,
-                        index_fields, inheritance_mode, inheritance_filter
-                    )
-                    if not genotypes_q:
-                        genotypes_q = family_samples_q
-                    else:
-                        genotypes_q |= family_samples_q
+                genotypes_q = self._get_family_samples_query(
+                    index, family_samples_by_id, quality_filters_by_family, index_fields, inheritance_mode,
+                    inheritance_filter,
+                )
 
             self._index_searches[index].append(self._search.filter(genotypes_q))
 
@@ -310,6 +387,72 @@ class EsSearch(object):
             for index in no_filter_indices:
                 self._index_searches[index].append(self._search)
 
+    def _get_family_samples_query(self, index, family_samples_by_id, quality_filters_by_family, index_fields, inheritance_mode, inheritance_filter):
+        # Families where a variant only needs an alt allele in any one of a set of samples, in the same genotype fields,
+        # are grouped and searched with a single terms query per field instead of a separate query per family. Families
+        # which also exclude genotypes for other samples, such as de novo or recessive trios, can not be grouped. For
+        # example "proband in (P1, P2) and not parent in (M1, M2)" excludes a de novo variant in P1 if M2 has the variant,
+        # so these families still have a query each, nested in batches by _or_family_queries to stay within clause limits
+        family_queries = []
+        grouped_family_samples = defaultdict(dict)
+        for family_guid in sorted(family_samples_by_id.keys()):
+            genotype_fields = None
+            if family_guid not in quality_filters_by_family:
+                genotype_fields, sample_ids = self._get_family_alt_sample_ids(
+                    family_guid, family_samples_by_id[family_guid], index_fields, inheritance_mode, inheritance_filter)
+            if genotype_fields:
+                grouped_family_samples[genotype_fields][family_guid] = sample_ids
+            else:
+                family_queries.append(self._get_family_sample_query(
+                    family_guid, family_samples_by_id, quality_filters_by_family, index_fields, inheritance_mode,
+                    inheritance_filter,
+                ))
+
+        for genotype_fields, sample_ids_by_family in sorted(grouped_family_samples.items()):
+            if len(sample_ids_by_family) < 2:
+                family_guid = next(iter(sample_ids_by_family.keys()))
+                family_queries.append(self._get_family_sample_query(
+                    family_guid, family_samples_by_id, quality_filters_by_family, index_fields, inheritance_mode,
+                    inheritance_filter,
+                ))
+                continue
+
+            # Groups are named so the matching families can still be determined from a hit's matched_queries
+            group_name = 'family_group_{}'.format(len(self._family_query_groups_by_index[index]))
+            sample_families = defaultdict(list)
+            for family_guid, sample_ids in sample_ids_by_family.items():
+                for sample_id in sample_ids:
+                    sample_families[sample_id].append(family_guid)
+            self._family_query_groups_by_index[index][group_name] = (genotype_fields, dict(sample_families))
+
+            group_q = _build_or_filter('terms', [
+                {field: sorted(sample_families.keys())} for field in genotype_fields
+            ])
+            family_queries.append(Q('bool', must=[group_q], _name=group_name))
+
+        return _or_family_queries(family_queries)
+
+    def _get_family_alt_sample_ids(self, family_guid, samples_by_id, index_fields, inheritance_mode, inheritance_filter):
+        affected_status = self._family_individual_affected_status.get(family_guid)
+        if inheritance_mode == ANY_AFFECTED:
+            return tuple(HAS_ALT_FIELD_KEYS), [
+                sample_id for sample_id, sample in samples_by_id.items()
+                if affected_status[sample.individual.guid] == Individual.AFFECTED_STATUS_AFFECTED
+            ]
+        elif not (inheritance_filter or inheritance_mode):
+            return tuple(HAS_ALT_FIELD_KEYS), list(samples_by_id.keys())
+        elif inheritance_mode in {RECESSIVE, X_LINKED_RECESSIVE}:
+            return None, None
+
+        sample_filters = _family_genotype_sample_filters(
+            inheritance_mode, inheritance_filter, samples_by_id, affected_status, index_fields)
+        if len(sample_filters) == 1:
+            sample_id, num_alt_fields, is_excluded = sample_filters[0]
+            # Only fields returned in the hit can be used to determine which families in the group matched
+            if num_alt_fields and not is_excluded and set(num_alt_fields).issubset(HAS_ALT_FIELD_KEYS):
+                return tuple(num_alt_fields), [sample_id]
+        return None, None
+
     def _get_family_sample_query(self, family_guid, family_samples_by_id, quality_filters_by_family, index_fields, inheritance_mode, inheritance_filter):
         samples_by_id = family_samples_by_id[family_guid]
         affected_status = self._family_individual_affected_status.get(family_guid)
@@ -321,13 +464,6 @@ class EsSearch(object):
                           if affected_status[sample.individual.guid] == Individual.AFFECTED_STATUS_AFFECTED]
             family_samples_q = _any_affected_sample_filter(sample_ids)
         elif inheritance_filter or inheritance_mode:
-            if inheritance_mode:
-                inheritance_filter.update(INHERITANCE_FILTERS[inheritance_mode])
-
-            if list(inheritance_filter.keys()) == ['affected']:
-                from seqr.utils.elasticsearch.utils import InvalidSearchException
-                raise InvalidSearchException('Inheritance must be specified if custom affected status is set')
-
             family_samples_q = _family_genotype_inheritance_filter(
                 inheritance_mode, inheritance_filter, samples_by_id, affected_status, index_fields,
             )
@@ -365,7 +501,7 @@ class EsSearch(object):
                             paired_index_families[var_index].update({sv_index: overlapping_families})
 
         seen_paired_indices = set()
-        comp_het_q_by_index = {}
+        comp_het_qs_by_index = defaultdict(list)
         for index in sorted(indices, reverse = True):
             family_samples_by_id = self.samples_by_family_index[index]
             index_fields = self.index_metadata[index]['fields']
@@ -396,20 +532,16 @@ class EsSearch(object):
                     )
                     index = ','.join(sorted([index, paired_index]))
 
-                samples_q = _named_family_sample_q(family_samples_q, family_guid, quality_filters_by_family)
-
-                index_comp_het_q = comp_het_q_by_index.get(index)
-                if not index_comp_het_q:
-                    comp_het_q_by_index[index] = samples_q
-                else:
-                    comp_het_q_by_index[index] |= samples_q
+                comp_het_qs_by_index[index].append(
+                    _named_family_sample_q(family_samples_q, family_guid, quality_filters_by_family))
 
-        for index, compound_het_q in comp_het_q_by_index.items():
-            compound_het_search = (annotations_secondary_search or self._search).filter(compound_het_q)
+        for index, compound_het_qs in comp_het_qs_by_index.items():
+            compound_het_search = (annotations_secondary_search or self._search).filter(
+                _or_family_queries(compound_het_qs))
             compound_het_search.aggs.bucket(
-                'genes', 'terms', field='geneIds', min_doc_count=2, size=MAX_COMPOUND_HET_GENES + 1
+                'genes', 'composite', size=GENE_AGG_PAGE_SIZE, sources=[{'gene_id': {'terms': {'field': 'geneIds'}}}]
             ).metric(
-                'vars_by_gene', 'top_hits', size=100, sort=self._sort, _source=QUERY_FIELD_NAMES
+                'vars_by_gene', 'top_hits', size=MAX_GENE_AGG_HITS, sort=self._sort, _source=QUERY_FIELD_NAMES
             )
             self._index_searches[index].append(compound_het_search)
 
@@ -427,12 +559,64 @@ class EsSearch(object):
         else:
             return self._execute_multi_search(**search_kwargs)
 
+    def get_variants_by_id(self, variant_ids):
+        # Fetching documents by ID is much faster than searching, so variants are only searched for in indices that
+        # may not use the variant ID as the document ID
+        variant_ids = list(dict.fromkeys(variant_ids))
+        logger.info('Fetching {} variants by id in elasticsearch indices: {}'.format(
+            len(variant_ids), ', '.join(self._indices)))
+
+        raw_hits = []
+        variant_annotations = {}
+        for index_name in self._indices:
+            is_variant_id_keyed = _is_variant_id_keyed_index(index_name)
+            variant_annotations[index_name] = {}
+            for chunk_start in range(0, len(variant_ids), VARIANT_ID_FETCH_CHUNK_SIZE):
+                chunk_variant_ids = variant_ids[chunk_start:chunk_start + VARIANT_ID_FETCH_CHUNK_SIZE]
+                # Annotation fields are not fetched for variants with cached annotations. Documents can only be matched
+                # to their cached annotations before they are fetched if they are keyed by variant ID
+                cached_annotations = self._load_variant_annotations(
+                    {index_name: chunk_variant_ids})[index_name] if is_variant_id_keyed else {}
+                variant_annotations[index_name].update(cached_annotations)
+                uncached_variant_ids = [
+                    variant_id for variant_id in chunk_variant_ids if variant_id not in cached_annotations]
+                found_docs = []
+                for fetch_variant_ids, source_fields in [
+                    (uncached_variant_ids, QUERY_FIELD_NAMES), (list(cached_annotations.keys()), VARIANT_FIELD_NAMES),
+                ]:
+                    if fetch_variant_ids:
+                        docs = self._client.mget(
+                            body={'ids': fetch_variant_ids}, index=index_name, _source_includes=source_fields)['docs']
+                        found_docs += [doc for doc in docs if doc.get('found')]
+                raw_hits += [{'_index': index_name, '_id': doc['_id'], '_source': doc['_source']} for doc in found_docs]
+
+                if not is_variant_id_keyed and any(doc['_id'] == doc['_source'].get('variantId') for doc in found_docs):
+                    is_variant_id_keyed = True
+                    safe_redis_set_json(
+                        _get_variant_id_keyed_index_cache_key(index_name), True,
+                        expire=VARIANT_ID_KEYED_INDEX_CACHE_EXPIRE)
+
+                if not is_variant_id_keyed:
+                    found_variant_ids = {doc['_source'].get('variantId') for doc in found_docs}
+                    missing_variant_ids = [
+                        variant_id for variant_id in chunk_variant_ids if variant_id not in found_variant_ids]
+                    search = Search(index=index_name).filter(Q('terms', variantId=missing_variant_ids)).source(
+                        QUERY_FIELD_NAMES)[:len(missing_variant_ids)]
+                    raw_hits += self._execute_search(search).to_dict()['hits']['hits']
+
+        variant_results = sorted(
+            self._parse_hits(raw_hits, variant_annotations), key=lambda variant: (variant['xpos'], variant['variantId']))
+        self.previous_search_results['total_results'] = len(variant_results)
+        return self._deduplicate_results(variant_results)
+
     def _is_single_search(self):
         return len(self._indices) == 1 and len(self._index_searches) < 2 and \
                len(self._index_searches.get(self._indices[0], [])) <= 1
 
     def _should_execute_single_search(self, page=1, num_results=100):
-        is_single_search = self._is_single_search()
+        # Compound het genes are loaded a page at a time across requests, which is tracked by the multi search
+        is_single_search = self._is_single_search() and not any(
+            search.aggs.to_dict() for search in self._index_searches.get(self._indices[0], []))
         num_loaded = len(self.previous_search_results.get('all_results', []))
 
         if is_single_search and not self.previous_search_results.get('grouped_results'):
@@ -460,21 +644,23 @@ class EsSearch(object):
             self.index_name, page=page, num_results=num_results_for_search, start_index=start_index
         )[0]
         response = self._execute_search(search)
+        if start_index is None:
+            start_index = (page - 1) * num_results_for_search
+        num_loaded = len(self.previous_search_results.get('all_results', []))
+        if deduplicate:
+            num_loaded += self.previous_search_results.get('duplicate_doc_count', 0)
+        if start_index == num_loaded:
+            # Skipped pages are not cached, so only track the cursor for contiguously loaded results
+            self._update_search_after(self.index_name, start_index, response)
         parsed_response = self._parse_response(response)
         return self._process_single_search_response(
             parsed_response, page=page, num_results=num_results, deduplicate=deduplicate, **kwargs)
 
     def _process_single_search_response(self, parsed_response, page=1, num_results=100, deduplicate=False, **kwargs):
-        variant_results, total_results, is_compound_het, _ = parsed_response
+        variant_results, total_results, _, _ = parsed_response
         self.previous_search_results['total_results'] = total_results
 
         results_start_index = (page - 1) * num_results
-        if is_compound_het:
-            variant_results = _sort_compound_hets(variant_results)
-            self.previous_search_results['grouped_results'] = variant_results
-            end_index = min(results_start_index + num_results, total_results)
-            return _get_compound_het_page(variant_results, results_start_index, end_index)
-
         if deduplicate:
             variant_results = self._deduplicate_results(variant_results)
 
@@ -492,40 +678,77 @@ class EsSearch(object):
         if self.CACHED_COUNTS_KEY and not self.previous_search_results.get(self.CACHED_COUNTS_KEY):
             self.previous_search_results[self.CACHED_COUNTS_KEY] = {}
 
-        ms = MultiSearch()
+        index_searches = []
         for index_name in indices:
             start_index = 0
+            variants_loaded = False
             if self.CACHED_COUNTS_KEY:
                 if self.previous_search_results[self.CACHED_COUNTS_KEY].get(index_name):
                     index_total = self.previous_search_results[self.CACHED_COUNTS_KEY][index_name]['total']
                     start_index = self.previous_search_results[self.CACHED_COUNTS_KEY][index_name]['loaded']
-                    if start_index >= index_total:
-                        continue
+                    variants_loaded = start_index >= index_total
                 else:
                     self.previous_search_results[self.CACHED_COUNTS_KEY][index_name] = {'loaded': 0, 'total': 0}
 
-            searches = self._get_paginated_searches(index_name, start_index=start_index, **kwargs)
-            ms = ms.index(index_name.split(','))
+            searches = self._get_paginated_searches(
+                index_name, start_index=start_index, variants_loaded=variants_loaded, **kwargs)
+            if searches:
+                index_searches.append((index_name, start_index, searches))
+
+        responses = []
+        for (index_name, start_index, _), index_responses in zip(
+                index_searches, self._execute_index_searches(index_searches)):
+            for response in index_responses:
+                self._update_search_after(index_name, start_index, response)
+                responses.append(response)
+        parsed_responses = [
+            self._parse_response(response, num_results=kwargs.get('num_results')) for response in responses]
+        return self._process_multi_search_responses(parsed_responses, **kwargs)
+
+    def _execute_index_searches(self, index_searches):
+        multi_searches = []
+        for index_name, _, searches in index_searches:
+            ms = MultiSearch(index=index_name.split(','))
             for search in searches:
                 ms = ms.add(search)
+            multi_searches.append(ms)
 
-        responses = self._execute_search(ms) if ms._searches else []
-        parsed_responses = [self._parse_response(response) for response in responses]
-        return self._process_multi_search_responses(parsed_responses, **kwargs)
+        if len(multi_searches) < 2:
+            return [self._execute_search(ms) for ms in multi_searches]
+
+        # Each index is searched in a separate request so a slow index does not block sending the others. All requests
+        # share a single deadline, so queued searches only get the remaining time
+        deadline = timer() + MULTI_INDEX_SEARCH_TIMEOUT
+
+        def _execute_index_search(ms):
+            return self._execute_search(ms.params(request_timeout=max(deadline - timer(), 1)))
+
+        with ThreadPoolExecutor(max_workers=min(len(multi_searches), MAX_CONCURRENT_INDEX_SEARCHES)) as executor:
+            futures = [executor.submit(with_request_timings(_execute_index_search), ms) for ms in multi_searches]
+            try:
+                return [future.result() for future in futures]
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                raise e
 
     def _process_multi_search_responses(self, parsed_responses, page=1, num_results=100):
-        new_results = []
+        sorted_runs = []
         compound_het_results = self.previous_search_results.get('compound_het_results', [])
+        new_compound_het_results = []
         for response_hits, response_total, is_compound_het, index_name in parsed_responses:
-            if not response_total:
-                continue
-
             if is_compound_het:
-                compound_het_results += response_hits
-                self.previous_search_results['loaded_variant_counts']['{}_compound_het'.format(index_name)] = {
-                    'total': response_total, 'loaded': response_total}
-            else:
-                new_results += response_hits
+                # Until all the gene pages are loaded the total is not known, so it is counted as having at least one
+                # more result to allow loading the next page
+                new_compound_het_results += response_hits
+                counts_key = '{}_compound_het'.format(index_name)
+                loaded = self.previous_search_results['loaded_variant_counts'].get(counts_key, {}).get('loaded', 0)
+                loaded += response_total
+                has_more_genes = self._get_compound_het_after_key(index_name) is not None
+                self.previous_search_results['loaded_variant_counts'][counts_key] = {
+                    'total': loaded + 1 if has_more_genes else loaded, 'loaded': loaded}
+            elif response_total:
+                sorted_runs.append(response_hits)
                 self.previous_search_results['loaded_variant_counts'][index_name]['total'] = response_total
                 self.previous_search_results['loaded_variant_counts'][index_name]['loaded'] += len(response_hits)
 
@@ -533,16 +756,19 @@ class EsSearch(object):
             counts['total'] for counts in self.previous_search_results['loaded_variant_counts'].values())
         self.previous_search_results['total_results'] = total_results
 
-        # combine new results with unsorted previously loaded results to correctly sort/paginate
+        # ES returns hits for each index already sorted, and the previously loaded but unreturned results are kept as
+        # sorted runs as well, so they only need to be merged to correctly sort/paginate
         all_loaded_results = self.previous_search_results.get('all_results', [])
-        new_results += self.previous_search_results.get('variant_results', [])
-
-        new_results = sorted(new_results, key=lambda variant: variant['_sort'])
-        variant_results = self._deduplicate_results(new_results)
-
-        if compound_het_results or self.previous_search_results.get('grouped_results'):
+        sorted_runs += self.previous_search_results.get(self.VARIANT_RESULT_RUNS_KEY, [])
+
+        if compound_het_results or new_compound_het_results or self.previous_search_results.get('grouped_results'):
+            # Single variants are interleaved with the compound hets, so all the loaded variants are merged
+            variant_results = self._deduplicate_results(
+                list(heapq.merge(*sorted_runs, key=lambda variant: variant['_sort'])))
+            if new_compound_het_results:
+                compound_het_results = self._deduplicate_compound_het_results(
+                    compound_het_results, new_compound_het_results)
             if compound_het_results:
-                compound_het_results = self._deduplicate_compound_het_results(compound_het_results)
                 compound_het_results = _sort_compound_hets(compound_het_results)
             loaded_results = sum(
                 counts['loaded'] for counts in self.previous_search_results['loaded_variant_counts'].values())
@@ -551,28 +777,166 @@ class EsSearch(object):
         else:
             end_index = num_results * page
             num_loaded = num_results * page - len(all_loaded_results)
-            self.previous_search_results['all_results'] = all_loaded_results + variant_results[:num_loaded]
-            self.previous_search_results['variant_results'] = variant_results[num_loaded:]
+            variant_results, remaining_runs = self._merge_sorted_runs(sorted_runs, num_loaded)
+            self.previous_search_results['all_results'] = all_loaded_results + variant_results
+            self.previous_search_results[self.VARIANT_RESULT_RUNS_KEY] = remaining_runs
             return self.previous_search_results['all_results'][end_index-num_results:end_index]
 
-    def _parse_response(self, response):
-        index_name = response.hits[0].meta.index if response.hits else None
-        if hasattr(response.aggregations, 'genes') and response.hits:
-            response_hits, response_total = self._parse_compound_het_response(response)
-            return response_hits, response_total, True, index_name
+    def _merge_sorted_runs(self, sorted_runs, num_results):
+        """Lazily merges the sorted runs until num_results deduplicated variants are loaded, and returns the loaded
+        variants and the remaining parts of the runs"""
+        if len({metadata['genomeVersion'] for metadata in self.index_metadata.values()}) > 1:
+            # Variants are not sorted next to their duplicates from a different genome build, so all results are merged
+            variant_results = self._deduplicate_results(
+                list(heapq.merge(*sorted_runs, key=lambda variant: variant['_sort'])))
+            remaining_runs = [variant_results[num_results:]] if len(variant_results) > num_results else []
+            return variant_results[:num_results], remaining_runs
+
+        with timed_span('deduplicate'):
+            # The heap has the next unmerged position in each run, so the remaining parts of the runs are kept as is
+            heap = [(run[0]['_sort'], run_index, 0) for run_index, run in enumerate(sorted_runs) if run]
+            heapq.heapify(heap)
+            variant_results = []
+            num_removed = 0
+            while heap:
+                _, run_index, position = heap[0]
+                run = sorted_runs[run_index]
+                variant = run[position]
+                is_duplicate = bool(variant_results) and variant_results[-1]['variantId'] == variant['variantId']
+                if len(variant_results) >= num_results and not is_duplicate:
+                    break
+
+                if position + 1 < len(run):
+                    heapq.heapreplace(heap, (run[position + 1]['_sort'], run_index, position + 1))
+                else:
+                    heapq.heappop(heap)
+
+                if self._filtered_variant_ids and \
+                        self._filtered_variant_ids.get(variant['variantId']) != variant['genomeVersion']:
+                    num_removed += 1
+                elif is_duplicate:
+                    self._merge_duplicate_variants(variant_results[-1], variant)
+                    num_removed += 1
+                else:
+                    variant_results.append(variant)
+
+            self._update_duplicate_doc_count(num_removed)
+
+        remaining_runs = [
+            sorted_runs[run_index][position:] for _, run_index, position in sorted(heap, key=lambda item: item[1])]
+        return variant_results, remaining_runs
+
+    def _parse_response(self, response, num_results=None):
+        raw_hits = response.to_dict()['hits']['hits']
+        index_name = raw_hits[0]['_index'] if raw_hits else None
+        if hasattr(response.aggregations, 'genes'):
+            response_hits, response_total = self._parse_compound_het_response(response, num_results=num_results)
+            return response_hits, response_total, True, ','.join(response._search._index)
 
         response_total = response.hits.total['value']
         logger.info('Total hits: {} ({} seconds)'.format(response_total, response.took / 1000.0))
-        return [self._parse_hit(hit) for hit in response], response_total, False, index_name
-
-    def _parse_hit(self, raw_hit):
-        hit = {k: raw_hit[k] for k in QUERY_FIELD_NAMES if k in raw_hit}
-        index_name = raw_hit.meta.index
+        return self._parse_hits(raw_hits), response_total, False, index_name
+
+    def _parse_hits(self, raw_hits, variant_annotations=None):
+        add_span_count('hits_parsed', len(raw_hits))
+        with timed_span('parse_hits'):
+            return self._parse_lifted_hits(raw_hits, variant_annotations)
+
+    def _parse_lifted_hits(self, raw_hits, variant_annotations=None):
+        # Hits without a lifted over locus from the pipeline are lifted in one batch per chromosome, so parsing each
+        # hit only needs to look up the memoized result
+        unlifted_positions_by_chrom = defaultdict(set)
+        for raw_hit in raw_hits:
+            if self.index_metadata[raw_hit['_index']]['genomeVersion'] == GENOME_VERSION_GRCh38 and \
+                    not raw_hit['_source'].get(GRCH38_LOCUS_FIELD):
+                unlifted_positions_by_chrom[raw_hit['_source']['contig']].add(int(raw_hit['_source']['start']))
+        liftover = unlifted_positions_by_chrom and get_liftover(GENOME_VERSION_GRCh38)
+        if liftover:
+            for chrom, positions in unlifted_positions_by_chrom.items():
+                liftover.lift_many(chrom, sorted(positions))
+
+        return self._parse_annotated_hits(raw_hits, variant_annotations)
+
+    def _parse_annotated_hits(self, raw_hits, variant_annotations=None):
+        # Family independent annotations are parsed once per variant and shared across searches, so only the genotypes
+        # and families need to be parsed for cached variants
+        variant_annotations = variant_annotations or {}
+        uncached_variant_ids = defaultdict(set)
+        for raw_hit in raw_hits:
+            variant_id = raw_hit['_source'].get('variantId')
+            if variant_id not in variant_annotations.get(raw_hit['_index'], {}):
+                uncached_variant_ids[raw_hit['_index']].add(variant_id)
+        loaded_annotations = self._load_variant_annotations(uncached_variant_ids)
+        for index_name, index_annotations in variant_annotations.items():
+            loaded_annotations[index_name].update(index_annotations)
+
+        results = []
+        new_annotations = {}
+        for raw_hit in raw_hits:
+            variant_id = raw_hit['_source'].get('variantId')
+            # Cached annotations are only used once, so results never share mutable annotations
+            annotations = loaded_annotations[raw_hit['_index']].pop(variant_id, None)
+            result = self._parse_hit(raw_hit, annotations)
+            if annotations is None and variant_id:
+                new_annotations[self._get_variant_annotations_cache_key(raw_hit['_index'], variant_id)] = {
+                    key: result[key] for key in VARIANT_ANNOTATION_KEYS
+                }
+            results.append(result)
+
+        if new_annotations:
+            safe_redis_mset_json(new_annotations, expire=VARIANT_ANNOTATIONS_CACHE_EXPIRE, codec=MSGPACK_ZSTD_CODEC)
+        return results
+
+    def _get_variant_annotations_cache_key(self, index_name, variant_id):
+        # Index metadata includes the loaded source file and fields, so reloaded indices do not use stale annotations.
+        # Documents updated in place without changing the index _meta keep the same version, so their cached annotations
+        # are used until they expire unless the _meta is also updated
+        index_version = self._index_versions.get(index_name)
+        if index_version is None:
+            index_version = hashlib.md5(
+                json.dumps(self.index_metadata[index_name], sort_keys=True).encode('utf-8')).hexdigest()[:12]
+            self._index_versions[index_name] = index_version
+        return 'variant_annotations__{}__{}__{}'.format(index_name, index_version, variant_id)
+
+    def _load_variant_annotations(self, variant_ids_by_index):
+        cache_keys = {
+            (index_name, variant_id): self._get_variant_annotations_cache_key(index_name, variant_id)
+            for index_name, variant_ids in variant_ids_by_index.items() for variant_id in variant_ids if variant_id
+        }
+        cached_annotations = safe_redis_mget_json(list(cache_keys.values())) if cache_keys else {}
+
+        annotations_by_index = defaultdict(dict)
+        for (index_name, variant_id), cache_key in cache_keys.items():
+            if cached_annotations[cache_key] is not None:
+                annotations_by_index[index_name][variant_id] = cached_annotations[cache_key]
+        return annotations_by_index
+
+    def _set_sample_families(self):
+        # Samples are mapped to their families once, so each hit is only attributed using its own alt samples. The same
+        # sample ID can be loaded in multiple projects, so a sample can map to more than one family
+        self._sample_families_by_index = {}
+        self._family_positions_by_index = {}
+        for index, family_samples in self.samples_by_family_index.items():
+            sample_families = defaultdict(list)
+            for family_guid, samples_by_id in family_samples.items():
+                for sample_id, sample in samples_by_id.items():
+                    sample_families[sample_id].append((family_guid, sample.individual.guid))
+            self._sample_families_by_index[index] = dict(sample_families)
+            self._family_positions_by_index[index] = {
+                family_guid: i for i, family_guid in enumerate(family_samples.keys())}
+
+    def _parse_hit(self, raw_hit, annotations=None):
+        # Hits are parsed from the raw response dicts, as wrapping every field access in an AttrDict is slow
+        hit = dict(raw_hit['_source'])
+        index_name = raw_hit['_index']
         index_family_samples = self.samples_by_family_index[index_name]
         is_sv = self.index_metadata[index_name].get('datasetType') == Sample.DATASET_TYPE_SV_CALLS
 
-        if hasattr(raw_hit.meta, 'matched_queries'):
-            family_guids = list(raw_hit.meta.matched_queries)
+        if 'matched_queries' in raw_hit:
+            family_guids = list(raw_hit['matched_queries'])
+            family_query_groups = self._family_query_groups_by_index.get(index_name)
+            if family_query_groups and any(query_name in family_query_groups for query_name in family_guids):
+                family_guids = self._get_grouped_family_guids(family_guids, family_query_groups, hit, index_name)
         elif self._return_all_queried_families:
             family_guids = list(index_family_samples.keys())
         else:
@@ -582,17 +946,16 @@ class EsSearch(object):
                 if alt_samples_field in hit:
                     alt_allele_samples.update(hit[alt_samples_field])
 
-            if self._any_affected_sample_filters:
-                # If using the any inheritance filter only include matched families
-                def _is_matched_sample(family_guid, sample):
-                    return self._family_individual_affected_status[family_guid][sample.individual.guid] == \
-                           Individual.AFFECTED_STATUS_AFFECTED
-            else:
-                _is_matched_sample = lambda *args: True
-
-            family_guids = [family_guid for family_guid, samples_by_id in index_family_samples.items()
-                            if any(sample_id in alt_allele_samples and _is_matched_sample(family_guid, sample)
-                                   for sample_id, sample in samples_by_id.items())]
+            sample_families = self._sample_families_by_index[index_name]
+            matched_family_guids = set()
+            for sample_id in alt_allele_samples.intersection(sample_families.keys()):
+                for family_guid, individual_guid in sample_families[sample_id]:
+                    # If using the any inheritance filter only include families with affected alt samples
+                    if not self._any_affected_sample_filters or \
+                            self._family_individual_affected_status[family_guid][individual_guid] == \
+                            Individual.AFFECTED_STATUS_AFFECTED:
+                        matched_family_guids.add(family_guid)
+            family_guids = sorted(matched_family_guids, key=self._family_positions_by_index[index_name].get)
 
         genotypes = {}
         for family_guid in family_guids:
@@ -601,14 +964,13 @@ class EsSearch(object):
                 sample = samples_by_id.get(genotype_hit['sample_id'])
                 if sample:
                     genotype_hit['sample_type'] = sample.sample_type
-                    genotypes[sample.individual.guid] = _get_field_values(genotype_hit, GENOTYPE_FIELDS_CONFIG)
+                    genotypes[sample.individual.guid] = GENOTYPE_FIELDS_PARSER(genotype_hit)
 
             if len(samples_by_id) != len(genotypes) and is_sv:
                 # Family members with no variants are not included in the SV index
                 for sample_id, sample in samples_by_id.items():
                     if sample.individual.guid not in genotypes:
-                        genotypes[sample.individual.guid] = _get_field_values(
-                            {'sample_id': sample_id}, GENOTYPE_FIELDS_CONFIG)
+                        genotypes[sample.individual.guid] = GENOTYPE_FIELDS_PARSER({'sample_id': sample_id})
                         genotypes[sample.individual.guid]['isRef'] = True
                         if hit['contig'] == 'X' and sample.individual.sex == Individual.SEX_MALE:
                             genotypes[sample.individual.guid]['cn'] = 1
@@ -631,13 +993,14 @@ class EsSearch(object):
                     gen['start'] = None
                     gen['end'] = None
 
-        result = _get_field_values(hit, CORE_FIELDS_CONFIG, format_response_key=str)
-        result.update({
-            field_name: _get_field_values(hit, fields, lookup_field_prefix=field_name)
-            for field_name, fields in NESTED_FIELDS.items()
-        })
-        if hasattr(raw_hit.meta, 'sort'):
-            result['_sort'] = [_parse_es_sort(sort, self._sort[i]) for i, sort in enumerate(raw_hit.meta.sort)]
+        result = CORE_FIELDS_PARSER(hit)
+        result.update(annotations or self._parse_hit_annotations(hit, index_name))
+        if 'sort' in raw_hit:
+            # The variant ID tiebreaker is only needed to page through results in ES, and is not returned
+            sort_configs = [sort for sort in self._sort if sort != VARIANT_ID_SORT_KEY]
+            result['_sort'] = [
+                _parse_es_sort(sort, sort_configs[i]) for i, sort in enumerate(raw_hit['sort'][:len(sort_configs)])
+            ]
 
 
         genome_version = self.index_metadata[index_name]['genomeVersion']
@@ -652,28 +1015,32 @@ class EsSearch(object):
                 lifted_over_pos = grch37_locus['position']
             else:
                 # TODO once all projects are lifted in pipeline, remove this code (https://github.com/broadinstitute/seqr/issues/1010)
-                liftover_grch38_to_grch37 = _liftover_grch38_to_grch37()
+                liftover_grch38_to_grch37 = get_liftover(GENOME_VERSION_GRCh38)
                 if liftover_grch38_to_grch37:
-                    grch37_coord = liftover_grch38_to_grch37.convert_coordinate(
-                        'chr{}'.format(hit['contig'].lstrip('chr')), int(hit['start'])
-                    )
-                    if grch37_coord and grch37_coord[0]:
+                    grch37_coord = liftover_grch38_to_grch37.lift(hit['contig'], int(hit['start']))
+                    if grch37_coord:
                         lifted_over_genome_version = GENOME_VERSION_GRCh37
-                        lifted_over_chrom = grch37_coord[0][0].lstrip('chr')
-                        lifted_over_pos = grch37_coord[0][1]
-
-        populations = {
-            population: _get_field_values(
-                hit, POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
-                lookup_field_prefix=population,
-                existing_fields=self.index_metadata[index_name]['fields'],
-                get_addl_fields=lambda field: pop_config[field] if isinstance(pop_config[field], list) else [pop_config[field]],
-            )
-            for population, pop_config in POPULATIONS.items()
-        }
+                        lifted_over_chrom, lifted_over_pos = grch37_coord
+
+        result.update({
+            'familyGuids': sorted(family_guids),
+            'genotypes': genotypes,
+            'genomeVersion': genome_version,
+            'liftedOverGenomeVersion': lifted_over_genome_version,
+            'liftedOverChrom': lifted_over_chrom,
+            'liftedOverPos': lifted_over_pos,
+        })
+        return result
+
+    def _parse_hit_annotations(self, hit, index_name):
+        population_parsers = self._population_parsers_by_index.get(index_name)
+        if population_parsers is None:
+            population_parsers = _get_population_parsers(self.index_metadata[index_name]['fields'])
+            self._population_parsers_by_index[index_name] = population_parsers
+        populations = {population: parser(hit) for population, parser in population_parsers.items()}
 
         sorted_transcripts = [
-            {_to_camel_case(k): v for k, v in transcript.to_dict().items()}
+            {_to_camel_case(k): v for k, v in transcript.items()}
             for transcript in hit[SORTED_TRANSCRIPTS_FIELD_KEY] or []
         ]
         transcripts = defaultdict(list)
@@ -682,40 +1049,136 @@ class EsSearch(object):
         main_transcript_id = sorted_transcripts[0]['transcriptId'] \
             if len(sorted_transcripts) and 'transcriptRank' in sorted_transcripts[0] else None
 
-        result.update({
-            'familyGuids': sorted(family_guids),
-            'genotypes': genotypes,
-            'genomeVersion': genome_version,
-            'liftedOverGenomeVersion': lifted_over_genome_version,
-            'liftedOverChrom': lifted_over_chrom,
-            'liftedOverPos': lifted_over_pos,
+        annotations = {field_name: parser(hit) for field_name, parser in NESTED_FIELDS_PARSERS.items()}
+        annotations.update({
             'mainTranscriptId': main_transcript_id,
             'populations': populations,
-            'predictions': _get_field_values(
-                hit, PREDICTION_FIELDS_CONFIG, format_response_key=lambda key: key.split('_')[1].lower()
-            ),
+            'predictions': PREDICTION_FIELDS_PARSER(hit),
             'transcripts': dict(transcripts),
         })
-        return result
+        return annotations
+
+    def _get_grouped_family_guids(self, matched_queries, family_query_groups, hit, index_name):
+        matched_family_guids = set()
+        for query_name in matched_queries:
+            if query_name not in family_query_groups:
+                matched_family_guids.add(query_name)
+                continue
+
+            genotype_fields, sample_families = family_query_groups[query_name]
+            alt_samples = set()
+            for field in genotype_fields:
+                alt_samples.update(hit.get(field) or [])
+            for sample_id in alt_samples.intersection(sample_families.keys()):
+                matched_family_guids.update(sample_families[sample_id])
+
+        return sorted(matched_family_guids, key=self._family_positions_by_index[index_name].get)
+
+    def _iter_gene_agg_pages(self, response):
+        # Genes are loaded from a composite aggregation a page at a time, so searches with many genes are processed
+        # incrementally instead of being truncated. The next page is only searched once the current one is processed
+        search = response._search
+        while True:
+            genes_agg = response.aggregations.genes
+            after_key = genes_agg.to_dict().get('after_key') if len(genes_agg.buckets) >= GENE_AGG_PAGE_SIZE else None
+            yield search, genes_agg.buckets, after_key
+            if not after_key:
+                return
 
-    def _parse_compound_het_response(self, response):
-        if len(response.aggregations.genes.buckets) > MAX_COMPOUND_HET_GENES:
-            from seqr.utils.elasticsearch.utils import InvalidSearchException
-            raise InvalidSearchException('This search returned too many compound heterozygous variants. Please add stricter filters')
+            logger.info('Loading {}s for {} after {}'.format(self.AGGREGATION_NAME, ','.join(search._index), after_key))
+            search = _get_gene_agg_page_search(search, after_key)
+            response = self._execute_search(search)
+
+    def _get_gene_agg_hits(self, gene_aggs, gene_field, search, source):
+        hits_by_gene = {}
+        truncated_gene_counts = {}
+        for gene_agg in gene_aggs:
+            gene_id = gene_agg['key']['gene_id']
+            raw_hits = gene_agg['vars_by_gene'].to_dict()['hits']['hits']
+            num_hits = gene_agg['doc_count']
+            hits_by_gene[gene_id] = raw_hits
+            if len(raw_hits) < num_hits:
+                if num_hits > MAX_VARIANTS:
+                    from seqr.utils.elasticsearch.utils import InvalidSearchException
+                    raise InvalidSearchException('Unable to load more than {} variants in gene {} ({} requested)'.format(
+                        MAX_VARIANTS, gene_id, num_hits))
+                truncated_gene_counts[gene_id] = num_hits
+
+        if truncated_gene_counts:
+            # Genes with more variants than can be returned by the top_hits aggregation are loaded in a single multi
+            # search for the page
+            logger.info('Loading all variants in genes {}'.format(', '.join(truncated_gene_counts.keys())))
+            search_body = search.to_dict()
+            search_body.pop('aggs')
+            ms = MultiSearch(index=search._index)
+            for gene_id, num_hits in truncated_gene_counts.items():
+                ms = ms.add(Search(index=search._index).update_from_dict(search_body).filter(
+                    Q('term', **{gene_field: gene_id})).source(source)[:num_hits])
+            for gene_id, response in zip(truncated_gene_counts.keys(), self._execute_search(ms)):
+                hits_by_gene[gene_id] = response.to_dict()['hits']['hits']
+
+        return hits_by_gene
+
+    def has_loaded_compound_hets(self):
+        # Compound het queries are searched until all of their gene pages are loaded
+        return bool(self.previous_search_results.get('grouped_results')) and not (
+            self.COMPOUND_HET_AFTER_KEYS_KEY and self.previous_search_results.get(self.COMPOUND_HET_AFTER_KEYS_KEY))
+
+    def _get_compound_het_after_key(self, index_name):
+        if not self.COMPOUND_HET_AFTER_KEYS_KEY:
+            return None
+        return (self.previous_search_results.get(self.COMPOUND_HET_AFTER_KEYS_KEY) or {}).get(index_name)
+
+    def _set_compound_het_after_key(self, index_name, after_key):
+        after_keys = self.previous_search_results.pop(self.COMPOUND_HET_AFTER_KEYS_KEY, None) or {}
+        if after_key:
+            after_keys[index_name] = after_key
+        else:
+            after_keys.pop(index_name, None)
+        if after_keys:
+            self.previous_search_results[self.COMPOUND_HET_AFTER_KEYS_KEY] = after_keys
 
+    def _is_compound_het_search_loaded(self, index_name):
+        if not self.CACHED_COUNTS_KEY:
+            return False
+        loaded_counts = self.previous_search_results.get(self.CACHED_COUNTS_KEY) or {}
+        return '{}_compound_het'.format(index_name) in loaded_counts and not self._get_compound_het_after_key(index_name)
+
+    def _parse_compound_het_response(self, response, num_results=None):
         family_unaffected_individual_guids = {
             family_guid: {individual_guid for individual_guid, affected_status in individual_affected_status.items() if
                           affected_status == Individual.AFFECTED_STATUS_UNAFFECTED}
             for family_guid, individual_affected_status in self._family_individual_affected_status.items()
         }
 
+        # Gene pages are only loaded until there are enough pairs for the requested page of results, and the key for
+        # the next page is cached so the following request resumes from there
+        index_name = ','.join(response._search._index)
         compound_het_pairs_by_gene = {}
-        for gene_agg in response.aggregations.genes.buckets:
-            gene_variants = [self._parse_hit(hit) for hit in gene_agg['vars_by_gene']]
-            gene_id = gene_agg['key']
+        for search, gene_aggs, after_key in self._iter_gene_agg_pages(response):
+            self._parse_compound_het_genes(gene_aggs, search, compound_het_pairs_by_gene, family_unaffected_individual_guids)
+            self._set_compound_het_after_key(index_name, after_key)
+            if num_results and sum(len(pairs) for pairs in compound_het_pairs_by_gene.values()) >= num_results:
+                break
 
-            if gene_id in compound_het_pairs_by_gene:
-                continue
+        total_compound_het_results = sum(len(compound_het_pairs) for compound_het_pairs in compound_het_pairs_by_gene.values())
+        logger.info('Total compound het hits: {}'.format(total_compound_het_results))
+
+        compound_het_results = []
+        for k, compound_het_pairs in compound_het_pairs_by_gene.items():
+            compound_het_results.extend([{k: compound_het_pair} for compound_het_pair in compound_het_pairs])
+        return compound_het_results, total_compound_het_results
+
+    def _parse_compound_het_genes(self, gene_aggs, search, compound_het_pairs_by_gene, family_unaffected_individual_guids):
+        # The hits for all genes in the page are parsed together, so cached variant annotations are loaded and stored
+        # once per page instead of once per gene
+        gene_hits = list(self._get_gene_agg_hits(
+            [gene_agg for gene_agg in gene_aggs if gene_agg['doc_count'] >= 2], 'geneIds', search, QUERY_FIELD_NAMES,
+        ).items())
+        parsed_hits = iter(self._parse_hits([raw_hit for _, raw_hits in gene_hits for raw_hit in raw_hits]))
+
+        for gene_id, raw_hits in gene_hits:
+            gene_variants = [next(parsed_hits) for _ in raw_hits]
 
             # Variants are returned if any transcripts have the filtered consequence, but to be compound het
             # the filtered consequence needs to be present in at least one transcript in the gene of interest
@@ -740,12 +1203,8 @@ class EsSearch(object):
                 if not self._is_primary_compound_het_gene(gene_id, gene_variants, compound_het_pairs_by_gene):
                     continue
 
-            family_compound_het_pairs = defaultdict(list)
-            for variant in gene_variants:
-                for family_guid in variant['familyGuids']:
-                    family_compound_het_pairs[family_guid].append(variant)
-
-            self._filter_invalid_family_compound_hets(gene_id, family_compound_het_pairs, family_unaffected_individual_guids)
+            family_compound_het_pairs = self._get_valid_family_compound_hets(
+                gene_id, gene_variants, family_unaffected_individual_guids)
 
             gene_compound_het_pairs = [ch_pair for ch_pairs in family_compound_het_pairs.values() for ch_pair in ch_pairs]
             for compound_het_pair in gene_compound_het_pairs:
@@ -758,14 +1217,6 @@ class EsSearch(object):
             if gene_compound_het_pairs:
                 compound_het_pairs_by_gene[gene_id] = gene_compound_het_pairs
 
-        total_compound_het_results = sum(len(compound_het_pairs) for compound_het_pairs in compound_het_pairs_by_gene.values())
-        logger.info('Total compound het hits: {}'.format(total_compound_het_results))
-
-        compound_het_results = []
-        for k, compound_het_pairs in compound_het_pairs_by_gene.items():
-            compound_het_results.extend([{k: compound_het_pair} for compound_het_pair in compound_het_pairs])
-        return compound_het_results, total_compound_het_results
-
     def _is_primary_compound_het_gene(self, gene_id, gene_variants, compound_het_pairs_by_gene):
         primary_genes = set()
         for variant in gene_variants:
@@ -796,41 +1247,65 @@ class EsSearch(object):
                     return False
         return True
 
-    def _filter_invalid_family_compound_hets(self, gene_id, family_compound_het_pairs, family_unaffected_individual_guids):
-        for family_guid, variants in family_compound_het_pairs.items():
-            unaffected_individuals = family_unaffected_individual_guids.get(family_guid, [])
-
-            valid_combinations = []
-            for ch_1_index, ch_2_index in combinations(range(len(variants)), 2):
-                variant_1 = variants[ch_1_index]
-                variant_2 = variants[ch_2_index]
-
-                is_valid_for_individual = True
-                for individual_guid in unaffected_individuals:
-                    genotype_1 = variant_1['genotypes'].get(individual_guid)
-                    genotype_2 = variant_2['genotypes'].get(individual_guid)
-                    if genotype_1 and genotype_2 and genotype_1.get('numAlt') != 0 and not genotype_1.get('isRef') and \
-                            genotype_2.get('numAlt') != 0 and not genotype_2.get('isRef'):
-                        is_valid_for_individual = False
-                        break
-                if not is_valid_for_individual:
-                    continue
-
-                if self._allowed_consequences and self._allowed_consequences_secondary:
-                    # Make a copy of lists to prevent blowing up memory usage
-                    consequences = [] + variant_1['gene_consequences'].get(gene_id, [])
-                    consequences += variant_2['gene_consequences'].get(gene_id, [])
-                    if all(consequence not in self._allowed_consequences for consequence in consequences) or all(
-                            consequence not in self._allowed_consequences_secondary for consequence in consequences):
-                        continue
-
-                valid_combinations.append([ch_1_index, ch_2_index])
-
+    def _get_valid_family_compound_hets(self, gene_id, gene_variants, family_unaffected_individual_guids):
+        # Pairs are validated with matrix operations, as checking every pair in python is quadratic for large genes
+        unaffected_individual_index = {individual_guid: i for i, individual_guid in enumerate({
+            individual_guid for variant in gene_variants for family_guid in variant['familyGuids']
+            for individual_guid in family_unaffected_individual_guids.get(family_guid, [])
+        })}
+
+        family_variant_indices = defaultdict(list)
+        carriers = np.zeros((len(gene_variants), len(unaffected_individual_index)), dtype=np.int32)
+        for i, variant in enumerate(gene_variants):
+            for family_guid in variant['familyGuids']:
+                family_variant_indices[family_guid].append(i)
+            for individual_guid, j in unaffected_individual_index.items():
+                genotype = variant['genotypes'].get(individual_guid)
+                if genotype and genotype.get('numAlt') != 0 and not genotype.get('isRef'):
+                    carriers[i, j] = 1
+
+        consequence_masks = None
+        if self._allowed_consequences and self._allowed_consequences_secondary:
+            allowed_consequences = set(self._allowed_consequences)
+            allowed_consequences_secondary = set(self._allowed_consequences_secondary)
+            consequence_masks = np.zeros(len(gene_variants), dtype=np.uint8)
+            for i, variant in enumerate(gene_variants):
+                consequences = variant['gene_consequences'].get(gene_id, [])
+                if any(consequence in allowed_consequences for consequence in consequences):
+                    consequence_masks[i] |= PRIMARY_CONSEQUENCE_MASK
+                if any(consequence in allowed_consequences_secondary for consequence in consequences):
+                    consequence_masks[i] |= SECONDARY_CONSEQUENCE_MASK
+
+        family_compound_het_pairs = {}
+        for family_guid, variant_indices in family_variant_indices.items():
+            variant_indices = np.array(variant_indices)
+            valid_pairs = np.ones((len(variant_indices), len(variant_indices)), dtype=bool)
+
+            unaffected_indices = [
+                unaffected_individual_index[individual_guid]
+                for individual_guid in family_unaffected_individual_guids.get(family_guid, [])]
+            if unaffected_indices:
+                # A pair is invalid if any unaffected individual carries both variants
+                family_carriers = carriers[np.ix_(variant_indices, unaffected_indices)]
+                valid_pairs &= family_carriers.dot(family_carriers.T) == 0
+
+            if consequence_masks is not None:
+                family_masks = consequence_masks[variant_indices]
+                valid_pairs &= np.bitwise_or.outer(family_masks, family_masks) == ALL_CONSEQUENCES_MASK
+
+            ch_1_indices, ch_2_indices = np.triu_indices(len(variant_indices), k=1)
+            is_valid = valid_pairs[ch_1_indices, ch_2_indices]
             family_compound_het_pairs[family_guid] = [
-                [variants[valid_ch_1_index], variants[valid_ch_2_index]] for
-                valid_ch_1_index, valid_ch_2_index in valid_combinations]
+                [gene_variants[variant_indices[ch_1_index]], gene_variants[variant_indices[ch_2_index]]]
+                for ch_1_index, ch_2_index in zip(ch_1_indices[is_valid], ch_2_indices[is_valid])]
+
+        return family_compound_het_pairs
 
     def _deduplicate_results(self, sorted_new_results):
+        with timed_span('deduplicate'):
+            return self._deduplicate_sorted_results(sorted_new_results)
+
+    def _deduplicate_sorted_results(self, sorted_new_results):
         original_result_count = len(sorted_new_results)
 
         if self._filtered_variant_ids:
@@ -849,14 +1324,16 @@ class EsSearch(object):
                 else:
                     variant_results.append(variant)
 
+        self._update_duplicate_doc_count(original_result_count - len(variant_results))
+
+        return variant_results
+
+    def _update_duplicate_doc_count(self, new_duplicates):
         previous_duplicates = self.previous_search_results.get('duplicate_doc_count', 0)
-        new_duplicates = original_result_count - len(variant_results)
         self.previous_search_results['duplicate_doc_count'] = previous_duplicates + new_duplicates
 
         self.previous_search_results['total_results'] -= self.previous_search_results['duplicate_doc_count']
 
-        return variant_results
-
     @classmethod
     def _deduplicate_multi_genome_variant_results(cls, sorted_new_results):
         hg_38_variant_indices = {}
@@ -903,38 +1380,39 @@ class EsSearch(object):
                 variant['genotypes'][guid] = genotype
         variant['familyGuids'] = sorted(set(variant['familyGuids'] + duplicate_variant['familyGuids']))
 
-    def _deduplicate_compound_het_results(self, compound_het_results):
+    def _deduplicate_compound_het_results(self, compound_het_results, new_compound_het_results):
+        # Previously loaded results are already deduplicated, so only new pairs are checked against the merge state. The
+        # keys for all loaded pairs are cached so duplicates of pairs returned on earlier pages are also excluded
+        loaded_pair_keys = {
+            (gene, frozenset(variant_ids))
+            for gene, variant_ids in self.previous_search_results.get(self.COMPOUND_HET_PAIR_KEYS_KEY, [])
+        }
+        compound_het_pairs = {
+            _get_compound_het_pair_key(gene_compound_het_pair): gene_compound_het_pair
+            for gene_compound_het_pair in compound_het_results
+        }
+
         duplicates = 0
-        results = {}
-        for gene_compound_het_pair in compound_het_results:
-            gene = next(iter(gene_compound_het_pair))
-            compound_het_pair = gene_compound_het_pair[gene]
-            if gene in results:
-                variant_ids = {variant['variantId'] for variant in compound_het_pair}
-                existing_index = next(
-                    (i for i, existing in enumerate(results[gene]) if
-                     {variant['variantId'] for variant in existing} == variant_ids), None,
-                )
-                if existing_index is not None:
-                    existing_compound_het_pair = results[gene][existing_index]
-
-                    def _update_existing_variant(existing_variant, variant):
-                        existing_variant['genotypes'].update(variant['genotypes'])
-                        existing_variant['familyGuids'] = sorted(
-                            existing_variant['familyGuids'] + variant['familyGuids']
-                        )
-                    _update_existing_variant(existing_compound_het_pair[0], compound_het_pair[0])
-                    _update_existing_variant(existing_compound_het_pair[1], compound_het_pair[1])
-                    duplicates += 1
-                else:
-                    results[gene].append(compound_het_pair)
+        deduplicated_results = list(compound_het_results)
+        for gene_compound_het_pair in new_compound_het_results:
+            pair_key = _get_compound_het_pair_key(gene_compound_het_pair)
+            existing_gene_compound_het_pair = compound_het_pairs.get(pair_key)
+            if existing_gene_compound_het_pair:
+                existing_compound_het_pair = existing_gene_compound_het_pair[pair_key[0]]
+                compound_het_pair = gene_compound_het_pair[pair_key[0]]
+                _merge_compound_het_variant(existing_compound_het_pair[0], compound_het_pair[0])
+                _merge_compound_het_variant(existing_compound_het_pair[1], compound_het_pair[1])
+                duplicates += 1
+            elif pair_key in loaded_pair_keys:
+                duplicates += 1
             else:
-                results[gene] = [compound_het_pair]
-
-        deduplicated_results = []
-        for gene, compound_het_pairs in results.items():
-            deduplicated_results += [{gene: ch_pair} for ch_pair in compound_het_pairs]
+                compound_het_pairs[pair_key] = gene_compound_het_pair
+                loaded_pair_keys.add(pair_key)
+                deduplicated_results.append(gene_compound_het_pair)
 
+        self.previous_search_results[self.COMPOUND_HET_PAIR_KEYS_KEY] = sorted([
+            [gene, sorted(variant_ids)] for gene, variant_ids in loaded_pair_keys
+        ])
         self.previous_search_results['duplicate_doc_count'] = duplicates + self.previous_search_results.get('duplicate_doc_count', 0)
         self.previous_search_results['total_results'] -= duplicates
 
@@ -967,39 +1445,73 @@ class EsSearch(object):
                 break
 
         self.previous_search_results['compound_het_results'] = compound_het_results[num_compound_hets:]
-        self.previous_search_results['variant_results'] = variant_results[num_single_variants:]
+        remaining_variant_results = variant_results[num_single_variants:]
+        self.previous_search_results[self.VARIANT_RESULT_RUNS_KEY] = \
+            [remaining_variant_results] if remaining_variant_results else []
         return merged_variant_results
 
-    def _get_paginated_searches(self, index_name, page=1, num_results=100, start_index=None):
+    def _get_paginated_searches(self, index_name, page=1, num_results=100, start_index=None, variants_loaded=False):
         searches = []
         for search in self._index_searches.get(index_name, [self._search]):
             search = search.index(index_name.split(','))
 
             if search.aggs.to_dict():
                 # For compound het search get results from aggregation instead of top level hits
+                if self._is_compound_het_search_loaded(index_name):
+                    continue
                 search = search[:1]
+                after_key = self._get_compound_het_after_key(index_name)
+                if after_key:
+                    search = _get_gene_agg_page_search(search, after_key)
                 logger.info('Loading {}s for {}'.format(self.AGGREGATION_NAME, index_name))
+            elif variants_loaded:
+                continue
             else:
                 end_index = page * num_results
                 if start_index is None:
                     start_index = end_index - num_results
-                if end_index > MAX_VARIANTS:
+                search_after = self._get_search_after(index_name, start_index)
+                if search_after:
+                    # Resume after the last loaded variant, so ES does not need to skip over all the previous results
+                    search = search[:end_index - start_index].extra(search_after=search_after)
+                elif end_index > MAX_VARIANTS:
                     # ES request size limits are limited by offset + size, which is the same as end_index
                     from seqr.utils.elasticsearch.utils import InvalidSearchException
                     raise InvalidSearchException(
                         'Unable to load more than {} variants ({} requested)'.format(MAX_VARIANTS, end_index))
-
-                search = search[start_index:end_index]
+                else:
+                    search = search[start_index:end_index]
                 search = search.source(QUERY_FIELD_NAMES)
                 logger.info('Loading {} records {}-{}'.format(index_name, start_index, end_index))
 
+            if self._profile:
+                search = search.extra(profile=True)
             searches.append(search)
         return searches
 
+    def _get_search_after(self, index_name, start_index):
+        # Cursors are not tied to a point in time snapshot, as those require elasticsearch 7.10 and the deployed
+        # clusters run 7.8. If an index is updated between requests, later pages may skip or repeat variants
+        cursor = self.previous_search_results.get(self.SEARCH_AFTER_KEY, {}).get(index_name)
+        if start_index and cursor and cursor['start_index'] == start_index:
+            return cursor['sort']
+        return None
+
+    def _update_search_after(self, index_name, start_index, response):
+        raw_hits = response.to_dict()['hits']['hits']
+        if hasattr(response.aggregations, 'genes') or not raw_hits or 'sort' not in raw_hits[-1]:
+            return
+        if not self.previous_search_results.get(self.SEARCH_AFTER_KEY):
+            self.previous_search_results[self.SEARCH_AFTER_KEY] = {}
+        self.previous_search_results[self.SEARCH_AFTER_KEY][index_name] = {
+            'start_index': start_index + len(raw_hits), 'sort': list(raw_hits[-1]['sort']),
+        }
+
     def _execute_search(self, search):
         logger.debug(json.dumps(search.to_dict(), indent=2))
+        start = timer()
         try:
-            return search.using(self._client).execute()
+            response = search.using(self._client).execute()
         except elasticsearch.exceptions.ConnectionTimeout as e:
             canceled = self._delete_long_running_tasks()
             logger.warning('ES Query Timeout. Canceled {} long running searches'.format(canceled))
@@ -1010,6 +1522,48 @@ class EsSearch(object):
                 raise InvalidSearchException(
                     'This search is not supported for large numbers of cases. Try removing family-based inheritance filters or sample-level quality filters')
             raise e
+        self._record_search_timings(response, timer() - start)
+        return response
+
+    def _record_search_timings(self, response, duration):
+        # Multi searches return a response per search, which ES runs concurrently
+        responses = response if isinstance(response, list) else [response]
+        took = max(getattr(r, 'took', 0) for r in responses) / 1000.0 if responses else 0
+        add_span_duration('es_took', took)
+        add_span_duration('es_transport', max(duration - took, 0))
+        add_span_count('es_requests', 1)
+        if self._profile:
+            for r in responses:
+                profile = r.to_dict().get('profile')
+                if profile:
+                    add_es_profile(profile)
+
+    def get_compiled_search(self):
+        """Returns the serialized searches and the search state needed to execute them and parse the results"""
+        if self._missing_liftover:
+            # Searches built while liftover is unavailable are missing lifted variants, so should not be reused
+            return None
+
+        compiled_search = {attr: getattr(self, attr) for attr in COMPILED_SEARCH_ATTRS}
+        compiled_search.update({
+            '_search': self._search.to_dict(),
+            '_index_searches': {
+                index: [search.to_dict() for search in searches] for index, searches in self._index_searches.items()
+            },
+        })
+        return compiled_search
+
+    def set_compiled_search(self, compiled_search):
+        for attr in COMPILED_SEARCH_ATTRS:
+            setattr(self, attr, compiled_search[attr])
+        self._family_query_groups_by_index = defaultdict(dict, self._family_query_groups_by_index)
+        self._search = Search.from_dict(compiled_search['_search'])
+        self._index_searches = defaultdict(list, {
+            index: [Search.from_dict(search) for search in searches]
+            for index, searches in compiled_search['_index_searches'].items()
+        })
+        self._set_index_name()
+        return self
 
     def _delete_long_running_tasks(self):
         search_tasks = self._client.tasks.list(actions='*search', group_by='parents')
@@ -1051,27 +1605,74 @@ class EsSearch(object):
         return var_fields[0].lstrip('chr'), int(var_fields[1]), var_fields[2], var_fields[3]
 
 
-# TODO  move liftover to hail pipeline once upgraded to 0.2 (https://github.com/broadinstitute/seqr/issues/1010)
-LIFTOVER_GRCH38_TO_GRCH37 = None
-def _liftover_grch38_to_grch37():
-    global LIFTOVER_GRCH38_TO_GRCH37
-    if not LIFTOVER_GRCH38_TO_GRCH37:
-        try:
-            LIFTOVER_GRCH38_TO_GRCH37 = LiftOver('hg38', 'hg19')
-        except Exception as e:
-            logger.error('ERROR: Unable to set up liftover. {}'.format(e))
-    return LIFTOVER_GRCH38_TO_GRCH37
+COMPILED_SEARCH_ATTRS = [
+    '_indices', '_sort', '_allowed_consequences', '_allowed_consequences_secondary', '_filtered_variant_ids',
+    '_no_sample_filters', '_any_affected_sample_filters', '_family_individual_affected_status',
+    '_family_query_groups_by_index',
+]
+
+
+def _get_variant_id_keyed_index_cache_key(index_name):
+    return 'variant_id_keyed_index__{}'.format(index_name)
+
+
+def _is_variant_id_keyed_index(index_name):
+    return bool(safe_redis_get_json(_get_variant_id_keyed_index_cache_key(index_name)))
 
 
-LIFTOVER_GRCH37_TO_GRCH38 = None
-def _liftover_grch37_to_grch38():
-    global LIFTOVER_GRCH37_TO_GRCH38
-    if not LIFTOVER_GRCH37_TO_GRCH38:
+def _get_gene_agg_page_search(search, after_key):
+    search = search._clone()
+    genes_agg = search.aggs['genes'].to_dict()
+    genes_agg['composite']['after'] = after_key
+    search.aggs['genes'] = A(genes_agg)
+    return search
+
+
+def get_sort_script_params_version(sort):
+    model_cls = SORT_SCRIPT_REFERENCE_MODELS.get(sort)
+    if not model_cls:
+        return None
+    cache_key = 'sort_script_params_version__{}'.format(sort)
+    version = safe_redis_get_json(cache_key)
+    if version is None:
+        # Reference data is updated by replacing all its records, so the latest record ID and the number of records
+        # change with every update
+        version = '{max_id}_{count}'.format(**model_cls.objects.aggregate(max_id=Max('id'), count=Count('id')))
+        safe_redis_set_json(cache_key, version, expire=SORT_SCRIPT_PARAMS_VERSION_CACHE_EXPIRE)
+    return version
+
+
+@lru_cache(maxsize=SORT_SCRIPT_PARAMS_CACHE_SIZE)
+def _get_sort_script_params(sort, version):
+    cache_key = 'sort_script_params__{}__v{}'.format(sort, version)
+    params = safe_redis_get_json(cache_key)
+    if params is None:
+        params = {
+            key: val_func() for key, val_func in SORT_FIELDS[sort][0]['_script']['script']['params'].items()
+        }
+        safe_redis_set_json(cache_key, params, expire=SORT_SCRIPT_PARAMS_CACHE_EXPIRE, codec=MSGPACK_ZSTD_CODEC)
+    return params
+
+
+REGISTERED_SORT_SCRIPT_IDS = set()
+
+
+def _get_stored_sort_script_id(client, sort, source):
+    script_id = 'seqr_sort_{}_{}'.format(sort, hashlib.md5(source.encode('utf-8')).hexdigest()[:12])
+    if script_id in REGISTERED_SORT_SCRIPT_IDS:
+        return script_id
+
+    # Stored scripts are shared by all the workers, so a script is only stored by the first worker to use it
+    cache_key = 'stored_sort_script__{}'.format(script_id)
+    if not safe_redis_get_json(cache_key):
         try:
-            LIFTOVER_GRCH37_TO_GRCH38 = LiftOver('hg19', 'hg38')
-        except Exception as e:
-            logger.error('ERROR: Unable to set up liftover. {}'.format(e))
-    return LIFTOVER_GRCH37_TO_GRCH38
+            client.put_script(id=script_id, body={'script': {'lang': 'painless', 'source': source}})
+        except elasticsearch.ElasticsearchException as e:
+            logger.warning('Unable to store sort script {}: {}'.format(script_id, str(e)))
+            return None
+        safe_redis_set_json(cache_key, True, expire=SORT_SCRIPT_PARAMS_CACHE_EXPIRE)
+    REGISTERED_SORT_SCRIPT_IDS.add(script_id)
+    return script_id
 
 
 def _get_family_affected_status(family_samples_by_id, inheritance_filter):
@@ -1096,7 +1697,11 @@ def _quality_filters_by_family(quality_filter, samples_by_family_index, indices)
             raise Exception('Invalid {} filter {}'.format(config['field'], quality_filter[field]))
 
     quality_filters_by_family = {}
-    if any(quality_filter[field] for field in quality_field_configs.keys()):
+    min_quality_values = tuple(
+        (config['field'], quality_filter[field]) for field, config in sorted(quality_field_configs.items())
+        if quality_filter[field]
+    )
+    if min_quality_values:
         family_sample_ids = defaultdict(set)
         for index in indices:
             family_samples_by_id = samples_by_family_index[index]
@@ -1104,23 +1709,32 @@ def _quality_filters_by_family(quality_filter, samples_by_family_index, indices)
                 family_sample_ids[family_guid].update(samples_by_id.keys())
 
         for family_guid, sample_ids in sorted(family_sample_ids.items()):
-            quality_q = Q()
-            for sample_id in sorted(sample_ids):
-                for field, config in sorted(quality_field_configs.items()):
-                    if quality_filter[field]:
-                        q = _build_or_filter('term', [
-                            {'samples_{}_{}_to_{}'.format(config['field'], i, i + config['step']): sample_id}
-                            for i in range(0, quality_filter[field], config['step'])
-                        ])
-                        if field == 'min_ab':
-                            #  AB only relevant for hets
-                            quality_q &= ~Q(q) | ~Q('term', samples_num_alt_1=sample_id)
-                        else:
-                            quality_q &= ~Q(q)
-            quality_filters_by_family[family_guid] = quality_q
+            quality_filters_by_family[family_guid] = Q(
+                _get_sample_quality_filter(min_quality_values, tuple(sorted(sample_ids))))
     return quality_filters_by_family
 
 
+@lru_cache(maxsize=QUALITY_FILTER_CACHE_SIZE)
+def _get_sample_quality_filter(min_quality_values, sample_ids):
+    # Each quality bin field is filtered with a single terms query across all the samples, instead of a term query per
+    # sample. Returns the serialized query, so cached values are not modified when building searches
+    excluded_qs = []
+    for field, min_value in min_quality_values:
+        step = QUALITY_FIELDS[field]
+        bin_fields = ['samples_{}_{}_to_{}'.format(field, i, i + step) for i in range(0, min_value, step)]
+        if field == 'ab':
+            #  AB only relevant for hets
+            excluded_qs += [
+                Q('bool', must=[
+                    Q('term', samples_num_alt_1=sample_id),
+                    _build_or_filter('term', [{bin_field: sample_id} for bin_field in bin_fields]),
+                ]) for sample_id in sample_ids
+            ]
+        else:
+            excluded_qs += [Q('terms', **{bin_field: list(sample_ids)}) for bin_field in bin_fields]
+    return Q('bool', must_not=excluded_qs).to_dict()
+
+
 def _any_affected_sample_filter(sample_ids):
     sample_ids = sorted(sample_ids)
     return Q('terms', samples_num_alt_1=sample_ids) | Q('terms', samples_num_alt_2=sample_ids) | Q('terms', samples=sample_ids)
@@ -1128,13 +1742,33 @@ def _any_affected_sample_filter(sample_ids):
 
 def _family_genotype_inheritance_filter(inheritance_mode, inheritance_filter, samples_by_id, individual_affected_status, index_fields):
     samples_q = None
+    if inheritance_mode == X_LINKED_RECESSIVE:
+        samples_q = Q('match', contig='X')
+
+    for sample_id, num_alt_to_filter, is_excluded in _family_genotype_sample_filters(
+            inheritance_mode, inheritance_filter, samples_by_id, individual_affected_status, index_fields):
+        sample_filters = [{num_alt_key: sample_id} for num_alt_key in num_alt_to_filter]
+
+        sample_q = _build_or_filter('term', sample_filters)
+        if is_excluded:
+            sample_q = ~Q(sample_q)
+
+        if not samples_q:
+            samples_q = sample_q
+        else:
+            samples_q &= sample_q
+
+    return samples_q
+
+
+def _family_genotype_sample_filters(inheritance_mode, inheritance_filter, samples_by_id, individual_affected_status, index_fields):
+    sample_filters = []
 
     individuals = [sample.individual for sample in samples_by_id.values()]
 
     individual_genotype_filter = inheritance_filter.get('genotype') or {}
 
     if inheritance_mode == X_LINKED_RECESSIVE:
-        samples_q = Q('match', contig='X')
         for individual in individuals:
             if individual_affected_status[individual.guid] == Individual.AFFECTED_STATUS_UNAFFECTED \
                     and individual.sex == Individual.SEX_MALE:
@@ -1162,18 +1796,21 @@ def _family_genotype_inheritance_filter(inheritance_mode, inheritance_filter, sa
                 if num_alt in index_fields
             ]
             num_alt_to_filter = not_allowed_num_alt or allowed_num_alt
-            sample_filters = [{num_alt_key: sample_id} for num_alt_key in num_alt_to_filter]
+            sample_filters.append((sample_id, num_alt_to_filter, bool(not_allowed_num_alt)))
 
-            sample_q = _build_or_filter('term', sample_filters)
-            if not_allowed_num_alt:
-                sample_q = ~Q(sample_q)
+    return sample_filters
 
-            if not samples_q:
-                samples_q = sample_q
-            else:
-                samples_q &= sample_q
 
-    return samples_q
+def _or_family_queries(family_queries):
+    if len(family_queries) <= MAX_FAMILY_QUERY_CLAUSES:
+        return reduce(or_, family_queries)
+
+    # Combining queries with | flattens them into one bool query, so large numbers of queries are explicitly nested in
+    # batches to stay within the ES clause limit
+    return Q('bool', should=[
+        Q('bool', should=family_queries[i:i + MAX_FAMILY_QUERY_CLAUSES])
+        for i in range(0, len(family_queries), MAX_FAMILY_QUERY_CLAUSES)
+    ])
 
 
 def _named_family_sample_q(family_samples_q, family_guid, quality_filters_by_family):
@@ -1294,27 +1931,32 @@ def _build_or_filter(op, filters):
     return q
 
 
+def _get_compound_het_pair_key(gene_compound_het_pair):
+    gene, compound_het_pair = next(iter(gene_compound_het_pair.items()))
+    return gene, frozenset(variant['variantId'] for variant in compound_het_pair)
+
+
+def _merge_compound_het_variant(existing_variant, variant):
+    existing_variant['genotypes'].update(variant['genotypes'])
+    existing_variant['familyGuids'] = sorted(existing_variant['familyGuids'] + variant['familyGuids'])
+
+
 def _sort_compound_hets(grouped_variants):
     return sorted(grouped_variants, key=lambda variants: next(iter(variants.values()))[0]['_sort'])
 
 
 def _get_compound_het_page(grouped_variants, start_index, end_index):
-    skipped = 0
+    if not grouped_variants or len(grouped_variants) < end_index:
+        return None
+
     variant_results = []
-    variant_count = 0
-    for variants in grouped_variants:
+    for variants in grouped_variants[start_index:end_index]:
         curr_variant = next(iter(variants.values()))
-        if skipped < start_index:
-            skipped += 1
+        if len(curr_variant) == 1:
+            variant_results += curr_variant
         else:
-            if len(curr_variant) == 1:
-                variant_results += curr_variant
-            else:
-                variant_results.append(curr_variant)
-            variant_count += 1
-        if variant_count + skipped >= end_index:
-            return variant_results
-    return None
+            variant_results.append(curr_variant)
+    return variant_results
 
 
 def _parse_es_sort(sort, sort_config):
@@ -1327,21 +1969,57 @@ def _parse_es_sort(sort, sort_config):
     return sort
 
 
-def _get_field_values(hit, field_configs, format_response_key=_to_camel_case, get_addl_fields=None, lookup_field_prefix='', existing_fields=None):
-    return {
-        field_config.get('response_key', format_response_key(field)): _value_if_has_key(
-            hit,
-            (get_addl_fields(field) if get_addl_fields else []) +
-            ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field],
-            existing_fields=existing_fields,
-            **field_config
-        )
-        for field, field_config in field_configs.items()
-    }
-
-
-def _value_if_has_key(hit, keys, format_value=None, default_value=None, existing_fields=None, **kwargs):
-    for key in keys:
-        if key in hit:
-            return format_value(default_value if hit[key] is None else hit[key]) if format_value else hit[key]
-    return default_value if not existing_fields or any(key in existing_fields for key in keys) else None
\ No newline at end of file
+def _compile_field_values_parser(field_configs, format_response_key=_to_camel_case, get_addl_fields=None,
+                                 lookup_field_prefix='', existing_fields=None):
+    """Resolves the response keys, lookup keys and value formatting for the given field configs once, and returns a
+    function which parses the configured fields from a hit"""
+    compiled_fields = []
+    for field, field_config in field_configs.items():
+        keys = (get_addl_fields(field) if get_addl_fields else []) + \
+               ['{}_{}'.format(lookup_field_prefix, field) if lookup_field_prefix else field]
+        default_value = field_config.get('default_value')
+        missing_value = default_value if not existing_fields or any(key in existing_fields for key in keys) else None
+        compiled_fields.append((
+            field_config.get('response_key', format_response_key(field)), keys, field_config.get('format_value'),
+            default_value, missing_value,
+        ))
+
+    def _parse_field_values(hit):
+        values = {}
+        for response_key, keys, format_value, default_value, missing_value in compiled_fields:
+            value = missing_value
+            for key in keys:
+                if key in hit:
+                    value = hit[key]
+                    if format_value:
+                        value = format_value(default_value if value is None else value)
+                    break
+            values[response_key] = value
+        return values
+
+    return _parse_field_values
+
+
+CORE_FIELDS_PARSER = _compile_field_values_parser(CORE_FIELDS_CONFIG, format_response_key=str)
+NESTED_FIELDS_PARSERS = {
+    field_name: _compile_field_values_parser(fields, lookup_field_prefix=field_name)
+    for field_name, fields in NESTED_FIELDS.items()
+}
+PREDICTION_FIELDS_PARSER = _compile_field_values_parser(
+    PREDICTION_FIELDS_CONFIG, format_response_key=lambda key: key.split('_')[1].lower())
+GENOTYPE_FIELDS_PARSER = _compile_field_values_parser(GENOTYPE_FIELDS_CONFIG)
+
+# Population defaults depend on which fields are present in the index, so parsers are compiled once per index field set
+POPULATION_PARSERS = {}
+def _get_population_parsers(index_fields):
+    fields_key = frozenset(index_fields)
+    if fields_key not in POPULATION_PARSERS:
+        POPULATION_PARSERS[fields_key] = {
+            population: _compile_field_values_parser(
+                POPULATION_RESPONSE_FIELD_CONFIGS, format_response_key=lambda key: key.lower(),
+                lookup_field_prefix=population, existing_fields=index_fields,
+                get_addl_fields=lambda field: pop_config[field] if isinstance(pop_config[field], list) else [pop_config[field]],
+            )
+            for population, pop_config in POPULATIONS.items()
+        }
+    return POPULATION_PARSERS[fields_key]
@@ -7,13 +7,27 @@ from collections import defaultdict
 from datetime import timedelta
 from django.test import TestCase
 from elasticsearch.exceptions import ConnectionTimeout, TransportError
+from elasticsearch_dsl.utils import AttrDict
 from sys import maxsize
+from threading import current_thread
+from urllib.parse import urlparse, parse_qs
 from urllib3.exceptions import ReadTimeoutError
 
-from seqr.models import Family, Sample, VariantSearch, VariantSearchResults
+from reference_data.models import GeneConstraint, GeneInfo
+from seqr.models import Family, Individual, Sample, VariantSearch, VariantSearchResults
 from seqr.utils.elasticsearch.utils import get_es_variants_for_variant_tuples, get_single_es_variant, get_es_variants, \
-    get_es_variant_gene_counts, get_es_variants_for_variant_ids, InvalidIndexException, InvalidSearchException
-from seqr.utils.elasticsearch.es_search import EsSearch, _get_family_affected_status, _liftover_grch38_to_grch37
+    get_es_variant_gene_counts, get_es_variants_for_variant_ids, get_es_variants_for_variant_id_chunks, \
+    InvalidIndexException, InvalidSearchException, \
+    get_es_client, get_es_client_pool_stats, _get_cached_search_results, _load_cached_search_results, \
+    _set_cached_search_results, bump_search_samples_version, get_search_samples_by_family_index, \
+    SEARCH_SAMPLES_VERSION_KEY, SearchSample, SearchIndividual
+from seqr.utils.elasticsearch.es_gene_agg_search import EsGeneAggSearch
+from seqr.utils.elasticsearch.es_search import EsSearch, _get_family_affected_status, \
+    _quality_filters_by_family, _get_sample_quality_filter, _get_sort_script_params, REGISTERED_SORT_SCRIPT_IDS, \
+    get_sort_script_params_version, \
+    VARIANT_ANNOTATION_KEYS
+from seqr.utils.redis_utils import decode_cache_value, encode_cache_value, MSGPACK_ZSTD_CODEC
+from seqr.utils.timing_utils import request_timings
 from seqr.views.utils.test_utils import urllib3_responses, PARSED_VARIANTS, PARSED_SV_VARIANT, TRANSCRIPT_2
 
 INDEX_NAME = 'test_index'
@@ -675,38 +689,14 @@ INDEX_METADATA[NO_LIFT_38_INDEX_NAME] = INDEX_METADATA[SECOND_INDEX_NAME]
 
 ALL_INHERITANCE_QUERY = {
     'bool': {
-        'should': [
-            {'bool': {
-                'must': [
-                    {'bool': {'should': [
-                        {'terms': {'samples_num_alt_1': ['HG00731', 'HG00732', 'HG00733']}},
-                        {'terms': {'samples_num_alt_2': ['HG00731', 'HG00732', 'HG00733']}},
-                        {'terms': {'samples': ['HG00731', 'HG00732', 'HG00733']}},
-                    ]}}
-                ],
-                '_name': 'F000002_2'
-            }},
-            {'bool': {
-                'must': [
-                    {'bool': {'should': [
-                        {'terms': {'samples_num_alt_1': ['NA20870']}},
-                        {'terms': {'samples_num_alt_2': ['NA20870']}},
-                        {'terms': {'samples': ['NA20870']}},
-                    ]}}
-                ],
-                '_name': 'F000003_3'
-            }},
-            {'bool': {
-                'must': [
-                    {'bool': {'should': [
-                        {'terms': {'samples_num_alt_1': ['NA20874']}},
-                        {'terms': {'samples_num_alt_2': ['NA20874']}},
-                        {'terms': {'samples': ['NA20874']}},
-                    ]}}
-                ],
-                '_name': 'F000005_5'
-            }}
-        ]
+        'must': [
+            {'bool': {'should': [
+                {'terms': {'samples_num_alt_1': ['HG00731', 'HG00732', 'HG00733', 'NA20870', 'NA20874']}},
+                {'terms': {'samples_num_alt_2': ['HG00731', 'HG00732', 'HG00733', 'NA20870', 'NA20874']}},
+                {'terms': {'samples': ['HG00731', 'HG00732', 'HG00733', 'NA20870', 'NA20874']}},
+            ]}}
+        ],
+        '_name': 'family_group_0'
     }
 }
 
@@ -726,12 +716,8 @@ COMPOUND_HET_INHERITANCE_QUERY = {
                         'must': [{'term': {'samples_num_alt_1': 'HG00731'}}]
                     }},
                     {'bool': {'must_not': [
-                        {'term': {'samples_gq_0_to_5': 'HG00731'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00731'}},
-                        {'term': {'samples_gq_0_to_5': 'HG00732'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00732'}},
-                        {'term': {'samples_gq_0_to_5': 'HG00733'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00733'}},
+                        {'terms': {'samples_gq_0_to_5': ['HG00731', 'HG00732', 'HG00733']}},
+                        {'terms': {'samples_gq_5_to_10': ['HG00731', 'HG00732', 'HG00733']}},
                     ]}},
                 ]
             }},
@@ -740,8 +726,8 @@ COMPOUND_HET_INHERITANCE_QUERY = {
                 'must': [
                     {'term': {'samples_num_alt_1': 'NA20870'}},
                     {'bool': {'must_not': [
-                        {'term': {'samples_gq_0_to_5': 'NA20870'}},
-                        {'term': {'samples_gq_5_to_10': 'NA20870'}}
+                        {'terms': {'samples_gq_0_to_5': ['NA20870']}},
+                        {'terms': {'samples_gq_5_to_10': ['NA20870']}},
                     ]}}
                 ]
             }},
@@ -779,12 +765,8 @@ RECESSIVE_INHERITANCE_QUERY = {
                         ]
                     }},
                     {'bool': {'must_not': [
-                        {'term': {'samples_gq_0_to_5': 'HG00731'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00731'}},
-                        {'term': {'samples_gq_0_to_5': 'HG00732'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00732'}},
-                        {'term': {'samples_gq_0_to_5': 'HG00733'}},
-                        {'term': {'samples_gq_5_to_10': 'HG00733'}},
+                        {'terms': {'samples_gq_0_to_5': ['HG00731', 'HG00732', 'HG00733']}},
+                        {'terms': {'samples_gq_5_to_10': ['HG00731', 'HG00732', 'HG00733']}},
                     ]}},
                 ]
             }},
@@ -801,8 +783,8 @@ RECESSIVE_INHERITANCE_QUERY = {
                         ]
                     }},
                     {'bool': {'must_not': [
-                        {'term': {'samples_gq_0_to_5': 'NA20870'}},
-                        {'term': {'samples_gq_5_to_10': 'NA20870'}}
+                        {'terms': {'samples_gq_0_to_5': ['NA20870']}},
+                        {'terms': {'samples_gq_5_to_10': ['NA20870']}},
                     ]}}
                 ]
             }},
@@ -813,11 +795,22 @@ RECESSIVE_INHERITANCE_QUERY = {
 ANNOTATION_QUERY = {'terms': {'transcriptConsequenceTerms': ['frameshift_variant']}}
 
 REDIS_CACHE = {}
-def _set_cache(k, v):
+def _set_cache(k, v, **kwargs):
     REDIS_CACHE[k] = v
+def _set_hash_cache(k, mapping):
+    REDIS_CACHE[k] = {**(REDIS_CACHE.get(k) or {}), **mapping}
+def _incr_cache(k):
+    value = int(REDIS_CACHE.get(k) or 0) + 1
+    REDIS_CACHE[k] = str(value).encode('utf-8')
+    return value
 MOCK_REDIS = mock.MagicMock()
 MOCK_REDIS.get.side_effect = REDIS_CACHE.get
 MOCK_REDIS.set.side_effect =_set_cache
+MOCK_REDIS.mget.side_effect = lambda keys: [REDIS_CACHE.get(k) for k in keys]
+MOCK_REDIS.incr.side_effect = _incr_cache
+MOCK_REDIS.hmget.side_effect = lambda k, fields: [(REDIS_CACHE.get(k) or {}).get(field) for field in fields]
+MOCK_REDIS.hmset.side_effect = _set_hash_cache
+MOCK_REDIS.pipeline.return_value = MOCK_REDIS
 
 def mock_hits(hits, increment_sort=False, include_matched_queries=True, sort=None, index=INDEX_NAME):
     parsed_hits = deepcopy(hits)
@@ -847,7 +840,7 @@ def mock_hits(hits, increment_sort=False, include_matched_queries=True, sort=Non
                 sort_value = 'Infinity'
             if increment_sort:
                 sort_value += 100
-            hit['_sort'] = [sort_value]
+            hit['sort'] = [sort_value]
     return parsed_hits
 
 
@@ -879,19 +872,24 @@ def create_mock_response(search, index=INDEX_NAME):
 
     if search.get('aggs'):
         index_vars = COMPOUND_HET_INDEX_VARIANTS.get(index, {})
-        buckets = [{'key': gene_id, 'doc_count': 3} for gene_id in ['ENSG00000135953', 'ENSG00000228198']]
+        genes_agg = search['aggs']['genes']['composite']
+        gene_ids = [gene_id for gene_id in ['ENSG00000135953', 'ENSG00000228198']
+                    if gene_id > genes_agg.get('after', {}).get('gene_id', '')][:genes_agg['size']]
+        buckets = [{'key': {'gene_id': gene_id}, 'doc_count': 3} for gene_id in gene_ids]
         if search['aggs']['genes']['aggs'].get('vars_by_gene'):
             for bucket in buckets:
                 bucket['vars_by_gene'] = {
                     'hits': {
-                        'hits': mock_hits(index_vars.get(bucket['key'], ES_VARIANTS), increment_sort=True, index=index)
+                        'hits': mock_hits(
+                            index_vars.get(bucket['key']['gene_id'], ES_VARIANTS), increment_sort=True, index=index)
                     }}
+                bucket['doc_count'] = len(bucket['vars_by_gene']['hits']['hits'])
         else:
             for bucket in buckets:
                 doc_count = 0
                 for sample_field in ['samples', 'samples_num_alt_1', 'samples_num_alt_2']:
                     gene_samples = defaultdict(int)
-                    for var in index_vars.get(bucket['key'], ES_VARIANTS):
+                    for var in index_vars.get(bucket['key']['gene_id'], ES_VARIANTS):
                         for sample in var['_source'].get(sample_field, []):
                             gene_samples[sample] += 1
                     bucket[sample_field] = {'buckets': [{'key': k, 'doc_count': v} for k, v in gene_samples.items()]}
@@ -899,6 +897,8 @@ def create_mock_response(search, index=INDEX_NAME):
                 bucket['doc_count'] = doc_count
 
         response_dict['aggregations'] = {'genes': {'buckets': buckets}}
+        if buckets:
+            response_dict['aggregations']['genes']['after_key'] = buckets[-1]['key']
 
     return response_dict
 
@@ -927,6 +927,19 @@ def get_msearch_callback(request):
     }
     return 200, {}, json.dumps(response)
 
+def get_mget_callback(request):
+    index = get_indices_from_url(request.url)
+    source_fields = set(parse_qs(urlparse(request.url).query)['_source_includes'][0].split(','))
+    # SV indices are not keyed by variant ID, so documents are never found by variant ID
+    hits = {} if index == SV_INDEX_NAME else {
+        hit['_id']: dict(hit, _source={k: v for k, v in hit['_source'].items() if k in source_fields})
+        for hit in mock_hits(INDEX_ES_VARIANTS[index], include_matched_queries=False, index=index)}
+    response = {'docs': [
+        dict(found=True, **hits[variant_id]) if variant_id in hits else {'_index': index, '_id': variant_id, 'found': False}
+        for variant_id in json.loads(request.body)['ids']
+    ]}
+    return 200, {}, json.dumps(response)
+
 def setup_search_response():
     urllib3_responses.add_callback(
         urllib3_responses.POST, re.compile('^/[,\w]+/_search$'), callback=get_search_callback,
@@ -939,6 +952,12 @@ def setup_responses():
     urllib3_responses.add_callback(
         urllib3_responses.POST, re.compile('^/[,\w]+/_msearch$'), callback=get_msearch_callback,
         content_type='application/json', match_querystring=True)
+    urllib3_responses.add_callback(
+        urllib3_responses.POST, re.compile('^/[,\w]+/_mget\?'), callback=get_mget_callback,
+        content_type='application/json')
+    urllib3_responses.add_callback(
+        urllib3_responses.PUT, re.compile('^/_scripts/\w+$'), callback=lambda request: (200, {}, json.dumps({
+            'acknowledged': True})), content_type='application/json', match_querystring=True)
     setup_search_response()
 
 
@@ -949,24 +968,52 @@ class EsUtilsTest(TestCase):
 
     def setUp(self):
         Sample.objects.filter(sample_id='NA19678').update(is_active=False)
+        _incr_cache(SEARCH_SAMPLES_VERSION_KEY)
+        # Variant annotations are shared across searches, so each test starts without any cached annotations
+        for cache_key in [key for key in REDIS_CACHE.keys() if key.startswith('variant_annotations__')]:
+            del REDIS_CACHE[cache_key]
         self.families = Family.objects.filter(guid__in=['F000003_3', 'F000002_2', 'F000005_5'])
 
-    def assertExecutedSearch(self, filters=None, start_index=0, size=2, sort=None, gene_aggs=False, gene_count_aggs=None, index=INDEX_NAME):
+    def assertExecutedSearch(self, filters=None, start_index=0, size=2, sort=None, gene_aggs=False, gene_count_aggs=None, index=INDEX_NAME, search_after=None):
         executed_search = urllib3_responses.call_request_json()
         searched_indices = get_indices_from_url(urllib3_responses.calls[-1].request.url)
         self.assertListEqual(sorted(searched_indices.split(',')), sorted(index.split(',')))
         self.assertSameSearch(
             executed_search,
             dict(filters=filters, start_index=start_index, size=size, sort=sort, gene_aggs=gene_aggs,
-                 gene_count_aggs=gene_count_aggs)
+                 gene_count_aggs=gene_count_aggs, search_after=search_after)
         )
 
+    def assertExecutedVariantIdFetches(self, variant_ids, index=INDEX_NAME, search_index=None):
+        num_calls = len(index.split(',')) + (1 if search_index else 0)
+        calls = urllib3_responses.calls[-num_calls:]
+        for call, index_name in zip(calls, index.split(',')):
+            path, query_string = call.request.url.split('?')
+            self.assertEqual(path, '/{}/_mget'.format(index_name))
+            self.assertTrue(query_string.startswith('_source_includes='))
+            self.assertDictEqual(json.loads(call.request.body), {'ids': variant_ids})
+        if search_index:
+            self.assertEqual(get_indices_from_url(calls[-1].request.url), search_index)
+            self.assertSameSearch(json.loads(calls[-1].request.body), dict(
+                filters=[{'terms': {'variantId': variant_ids}}], start_index=0, size=len(variant_ids)))
+
     def assertExecutedSearches(self, searches):
-        executed_search = parse_msearch_body(urllib3_responses.calls[-1].request.body)
-        self.assertEqual(len(executed_search), len(searches) * 2)
-        for i, expected_search in enumerate(searches):
-            self.assertDictEqual(executed_search[i * 2], {'index': expected_search.get('index', INDEX_NAME).split(',')})
-            self.assertSameSearch(executed_search[(i * 2) + 1], expected_search)
+        # Each index is searched in a separate concurrent request, so requests may be sent in any order
+        expected_searches_by_index = defaultdict(list)
+        for expected_search in searches:
+            expected_searches_by_index[expected_search.get('index', INDEX_NAME)].append(expected_search)
+        executed_searches_by_index = {
+            get_indices_from_url(call.request.url): parse_msearch_body(call.request.body)
+            for call in urllib3_responses.calls[-len(expected_searches_by_index):]
+        }
+        self.assertSetEqual(set(executed_searches_by_index.keys()), set(expected_searches_by_index.keys()))
+
+        for index, expected_searches in expected_searches_by_index.items():
+            executed_search = executed_searches_by_index[index]
+            self.assertEqual(len(executed_search), len(expected_searches) * 2)
+            for i, expected_search in enumerate(expected_searches):
+                self.assertDictEqual(executed_search[i * 2], {'index': index.split(',')})
+                self.assertSameSearch(executed_search[(i * 2) + 1], expected_search)
 
     def assertSameSearch(self, executed_search, expected_search_params):
         expected_search = {
@@ -984,16 +1031,21 @@ class EsUtilsTest(TestCase):
         if expected_search_params.get('sort'):
             expected_search['sort'] = expected_search_params['sort']
 
+        if expected_search_params.get('search_after'):
+            expected_search['search_after'] = expected_search_params['search_after']
+
         if expected_search_params.get('gene_aggs'):
             expected_search['aggs'] = {
-                'genes': {'terms': {'field': 'geneIds', 'min_doc_count': 2, 'size': 1001}, 'aggs': {
+                'genes': {'composite': {
+                    'size': 1000, 'sources': [{'gene_id': {'terms': {'field': 'geneIds'}}}],
+                }, 'aggs': {
                     'vars_by_gene': {
                         'top_hits': {'sort': expected_search_params['sort'], '_source': mock.ANY, 'size': 100}
                     }
                 }}}
         elif expected_search_params.get('gene_count_aggs'):
             expected_search['aggs'] = {'genes': {
-                'terms': {'field': 'mainTranscript_gene_id', 'size': 1001},
+                'composite': {'size': 1000, 'sources': [{'gene_id': {'terms': {'field': 'mainTranscript_gene_id'}}}]},
                 'aggs': expected_search_params['gene_count_aggs']
             }}
         else:
@@ -1008,8 +1060,36 @@ class EsUtilsTest(TestCase):
 
     def assertCachedResults(self, results_model, expected_results, sort='xpos'):
         cache_key = 'search_results__{}__{}'.format(results_model.guid, sort)
-        self.assertDictEqual(json.loads(REDIS_CACHE.get(cache_key)), expected_results)
-        MOCK_REDIS.expire.assert_called_with(cache_key, timedelta(weeks=2))
+        # Compare results as JSON, which is how they are returned to the client
+        cached_results = _load_cached_search_results(cache_key, _get_cached_search_results(cache_key))
+        self.assertDictEqual(json.loads(json.dumps(cached_results)), expected_results)
+        MOCK_REDIS.set.assert_any_call(cache_key, mock.ANY, ex=timedelta(weeks=2))
+        MOCK_REDIS.expire.assert_any_call('{}__chunks'.format(cache_key), timedelta(weeks=2))
+
+    @mock.patch('seqr.utils.elasticsearch.utils.os.getpid')
+    def test_get_es_client(self, mock_getpid):
+        mock_getpid.return_value = 1
+        client = get_es_client()
+        self.assertIs(get_es_client(), client)
+        self.assertIs(get_es_client(timeout=60), client)
+
+        timeout_client = get_es_client(timeout=3, max_retries=0)
+        self.assertIsNot(timeout_client, client)
+        self.assertIs(get_es_client(timeout=3, max_retries=0), timeout_client)
+
+        client.transport.connection_pool.connections[0].pool.num_connections = 2
+        client.transport.connection_pool.connections[0].pool.num_requests = 10
+        self.assertListEqual(get_es_client_pool_stats(), [
+            {'timeout': 60, 'options': {}, 'connectionsInUse': 0, 'handshakes': 2, 'reuses': 8},
+            {'timeout': 3, 'options': {'max_retries': 0}, 'connectionsInUse': 0, 'handshakes': 0, 'reuses': 0},
+        ])
+
+        # Forked processes should not share connections
+        mock_getpid.return_value = 2
+        self.assertListEqual(get_es_client_pool_stats(), [])
+        forked_client = get_es_client()
+        self.assertIsNot(forked_client, client)
+        self.assertIs(get_es_client(), forked_client)
 
     @urllib3_responses.activate
     def test_get_es_variants_for_variant_tuples(self):
@@ -1024,28 +1104,114 @@ class EsUtilsTest(TestCase):
         self.assertDictEqual(variants[0], PARSED_NO_SORT_VARIANTS[0])
         self.assertDictEqual(variants[1], PARSED_NO_SORT_VARIANTS[1])
 
-        self.assertExecutedSearch(
-            filters=[{'terms': {'variantId': ['2-103343353-GAGA-G', '1-248367227-TC-T', 'MT-138367346-A-C']}}], size=3,
-        )
+        self.assertExecutedVariantIdFetches(['2-103343353-GAGA-G', '1-248367227-TC-T', 'MT-138367346-A-C'])
 
     @urllib3_responses.activate
     def test_get_es_variants_for_variant_ids(self):
         setup_responses()
-        get_es_variants_for_variant_ids(self.families, ['2-103343353-GAGA-G', '1-248367227-TC-T', 'prefix-938_DEL'])
-        self.assertExecutedSearch(
-            filters=[{'terms': {'variantId': ['2-103343353-GAGA-G', '1-248367227-TC-T', 'prefix-938_DEL']}}],
-            size=6, index=','.join([INDEX_NAME, SV_INDEX_NAME]),
+        variant_ids = ['2-103343353-GAGA-G', '1-248367227-TC-T', 'prefix-938_DEL', '2-103343353-GAGA-G']
+        variants = get_es_variants_for_variant_ids(self.families, variant_ids)
+        self.assertListEqual(variants, PARSED_NO_SORT_VARIANTS)
+
+        # Indices not keyed by variant ID are searched
+        self.assertExecutedVariantIdFetches(
+            variant_ids[:3], index=','.join([INDEX_NAME, SV_INDEX_NAME]), search_index=SV_INDEX_NAME)
+        self.assertTrue(REDIS_CACHE['variant_id_keyed_index__{}'.format(INDEX_NAME)])
+        self.assertNotIn('variant_id_keyed_index__{}'.format(SV_INDEX_NAME), REDIS_CACHE)
+
+        # Indices known to be keyed by variant ID are not searched for missing variants
+        urllib3_responses.reset()
+        setup_responses()
+        variants = get_es_variants_for_variant_ids(
+            self.families, ['10-10334333-A-G'], dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS)
+        self.assertListEqual(variants, [])
+        self.assertExecutedVariantIdFetches(['10-10334333-A-G'])
+        self.assertEqual(len([call for call in urllib3_responses.calls if '_search' in call.request.url]), 0)
+
+        # Large numbers of variants are fetched in chunks
+        with mock.patch('seqr.utils.elasticsearch.es_search.VARIANT_ID_FETCH_CHUNK_SIZE', 2):
+            variants = get_es_variants_for_variant_ids(self.families, variant_ids, dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS)
+        self.assertListEqual(variants, PARSED_NO_SORT_VARIANTS)
+        self.assertExecutedVariantIdFetches(['prefix-938_DEL'])
+        self.assertDictEqual(
+            json.loads(urllib3_responses.calls[-2].request.body), {'ids': ['2-103343353-GAGA-G', '1-248367227-TC-T']})
+
+    @urllib3_responses.activate
+    def test_cached_variant_annotations(self):
+        setup_responses()
+        variant_ids = ['2-103343353-GAGA-G', '1-248367227-TC-T']
+        variants = get_es_variants_for_variant_ids(
+            self.families, variant_ids, dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS)
+        self.assertListEqual(variants, PARSED_NO_SORT_VARIANTS)
+
+        cache_keys = sorted([key for key in REDIS_CACHE.keys() if key.startswith('variant_annotations__')])
+        self.assertEqual(len(cache_keys), 2)
+        self.assertRegex(cache_keys[0], r'^variant_annotations__test_index__[0-9a-f]{12}__1-248367227-TC-T$')
+        self.assertDictEqual(
+            decode_cache_value(REDIS_CACHE[cache_keys[0]]),
+            {key: PARSED_NO_SORT_VARIANTS[0][key] for key in VARIANT_ANNOTATION_KEYS},
         )
 
+        # Annotation fields are not fetched for variants with cached annotations
+        del REDIS_CACHE[cache_keys[1]]
+        urllib3_responses.reset()
+        setup_responses()
+        variants = get_es_variants_for_variant_ids(
+            self.families, variant_ids, dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS)
+        self.assertListEqual(variants, PARSED_NO_SORT_VARIANTS)
+        self.assertEqual(len(urllib3_responses.calls), 2)
+        uncached_call, cached_call = urllib3_responses.calls
+        self.assertDictEqual(json.loads(uncached_call.request.body), {'ids': ['2-103343353-GAGA-G']})
+        self.assertIn('sortedTranscriptConsequences', uncached_call.request.url)
+        self.assertDictEqual(json.loads(cached_call.request.body), {'ids': ['1-248367227-TC-T']})
+        self.assertNotIn('sortedTranscriptConsequences', cached_call.request.url)
+        self.assertIn('genotypes', cached_call.request.url)
+
+        # Searches use the cached annotations
+        cached_annotations = decode_cache_value(REDIS_CACHE[cache_keys[0]])
+        cached_annotations['mainTranscriptId'] = 'ENST_CACHED'
+        REDIS_CACHE[cache_keys[0]] = encode_cache_value(cached_annotations, codec=MSGPACK_ZSTD_CODEC)
+        search_model = VariantSearch.objects.create(search={'annotations': {'frameshift': ['frameshift_variant']}})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+        variants, _ = get_es_variants(results_model, num_results=2)
+        self.assertEqual(variants[0]['variantId'], '1-248367227-TC-T')
+        self.assertEqual(variants[0]['mainTranscriptId'], 'ENST_CACHED')
+        self.assertDictEqual(variants[1], PARSED_VARIANTS[1])
+
+    @urllib3_responses.activate
+    def test_get_es_variants_for_variant_id_chunks(self):
+        setup_responses()
+        samples_threads = []
+        fetch_threads = []
+        get_variants_by_id = EsSearch.get_variants_by_id
+
+        def _get_search_samples(*args):
+            samples_threads.append(current_thread())
+            return get_search_samples_by_family_index(*args)
+
+        def _get_variants_by_id(es_search, variant_ids):
+            fetch_threads.append(current_thread())
+            return get_variants_by_id(es_search, variant_ids)
+
+        with mock.patch('seqr.utils.elasticsearch.utils.get_search_samples_by_family_index', _get_search_samples), \
+                mock.patch.object(EsSearch, 'get_variants_by_id', autospec=True, side_effect=_get_variants_by_id):
+            variants = list(get_es_variants_for_variant_id_chunks(
+                self.families, [['2-103343353-GAGA-G'], ['1-248367227-TC-T']], max_workers=2))
+
+        self.assertListEqual(variants, [[PARSED_NO_SORT_VARIANTS[1]], [PARSED_NO_SORT_VARIANTS[0]]])
+        # Samples are only loaded once, from the calling thread, and the chunks are fetched from the worker threads
+        self.assertListEqual(samples_threads, [current_thread()])
+        self.assertEqual(len(fetch_threads), 2)
+        self.assertNotIn(current_thread(), fetch_threads)
+
     @urllib3_responses.activate
     def test_get_single_es_variant(self):
         setup_responses()
         variant = get_single_es_variant(self.families, '2-103343353-GAGA-G')
         self.assertDictEqual(variant, PARSED_NO_SORT_VARIANTS[1])
-        self.assertExecutedSearch(
-            filters=[{'terms': {'variantId': ['2-103343353-GAGA-G']}}],
-            size=2, index=','.join([INDEX_NAME, SV_INDEX_NAME]),
-        )
+        self.assertExecutedVariantIdFetches(
+            ['2-103343353-GAGA-G'], index=','.join([INDEX_NAME, SV_INDEX_NAME]), search_index=SV_INDEX_NAME)
 
         variant = get_single_es_variant(self.families, '1-248367227-TC-T', return_all_queried_families=True)
         all_family_variant = deepcopy(PARSED_NO_SORT_VARIANTS[0])
@@ -1055,17 +1221,13 @@ class EsUtilsTest(TestCase):
             'cn': 2, 'end': None, 'start': None, 'numExon': None, 'defragged': None, 'qs': None, 'sampleType': 'WES',
         }
         self.assertDictEqual(variant, all_family_variant)
-        self.assertExecutedSearch(
-            filters=[{'terms': {'variantId': ['1-248367227-TC-T']}}],
-            size=2, index=','.join([INDEX_NAME, SV_INDEX_NAME]),
-        )
+        self.assertExecutedVariantIdFetches(
+            ['1-248367227-TC-T'], index=','.join([INDEX_NAME, SV_INDEX_NAME]), search_index=SV_INDEX_NAME)
 
         with self.assertRaises(InvalidSearchException) as cm:
             get_single_es_variant(self.families, '10-10334333-A-G')
         self.assertEqual(str(cm.exception), 'Variant 10-10334333-A-G not found')
 
-    @mock.patch('seqr.utils.elasticsearch.es_search.MAX_COMPOUND_HET_GENES', 1)
-    @mock.patch('seqr.utils.elasticsearch.es_gene_agg_search.MAX_COMPOUND_HET_GENES', 1)
     @urllib3_responses.activate
     def test_invalid_get_es_variants(self):
         setup_responses()
@@ -1099,18 +1261,6 @@ class EsUtilsTest(TestCase):
             get_es_variants(results_model, page=200)
         self.assertEqual(str(cm.exception), 'Unable to load more than 10000 variants (20000 requested)')
 
-        search_model.search = {'inheritance': {'mode': 'compound_het'}}
-        search_model.save()
-        with self.assertRaises(InvalidSearchException) as cm:
-            get_es_variants(results_model)
-        self.assertEqual(
-            str(cm.exception),
-            'This search returned too many compound heterozygous variants. Please add stricter filters')
-
-        with self.assertRaises(InvalidSearchException) as cm:
-            get_es_variant_gene_counts(results_model)
-        self.assertEqual(str(cm.exception), 'This search returned too many genes')
-
         search_model.search = {'qualityFilter': {'min_gq': 7}}
         search_model.save()
         with self.assertRaises(Exception) as cm:
@@ -1120,8 +1270,10 @@ class EsUtilsTest(TestCase):
         search_model.search = {}
         search_model.save()
         urllib3_responses.reset()
+        urllib3_responses.add_json('/test_index/_msearch', {'responses': [
+            create_mock_response({}, index=INDEX_NAME)]}, method=urllib3_responses.POST)
         urllib3_responses.add(
-            urllib3_responses.POST, '/test_index_sv,test_index/_msearch', body=ReadTimeoutError('', '', 'timeout'))
+            urllib3_responses.POST, '/test_index_sv/_msearch', body=ReadTimeoutError('', '', 'timeout'))
         urllib3_responses.add_json('/_tasks?actions=*search&group_by=parents', {'tasks': {
             123: {'running_time_in_nanos': 10},
             456: {'running_time_in_nanos': 10 ** 12},
@@ -1130,18 +1282,20 @@ class EsUtilsTest(TestCase):
         with self.assertRaises(ConnectionTimeout):
             get_es_variants(results_model)
         self.assertListEqual(
-            [call.request.url for call in urllib3_responses.calls],
-            ['/test_index_sv,test_index/_msearch', '/_tasks?actions=%2Asearch&group_by=parents',
-             '/_tasks/_cancel?parent_task_id=456']
+            sorted([call.request.url for call in urllib3_responses.calls]),
+            ['/_tasks/_cancel?parent_task_id=456', '/_tasks?actions=%2Asearch&group_by=parents',
+             '/test_index/_msearch', '/test_index_sv/_msearch']
         )
 
         urllib3_responses.reset()
-        urllib3_responses.add_json('/test_index_sv,test_index/_msearch', {'responses': [
+        urllib3_responses.add_json('/test_index/_msearch', {'responses': [
+            create_mock_response({}, index=INDEX_NAME)]}, method=urllib3_responses.POST)
+        urllib3_responses.add_json('/test_index_sv/_msearch', {'responses': [
             {'error': {'type': 'search_phase_execution_exception'}}]}, method=urllib3_responses.POST)
         with self.assertRaises(TransportError):
             get_es_variants(results_model)
 
-        urllib3_responses.replace_json('/test_index_sv,test_index/_msearch', {'responses': [
+        urllib3_responses.replace_json('/test_index_sv/_msearch', {'responses': [
             {'error': {'type': 'search_phase_execution_exception', 'root_cause': [{'type': 'too_many_clauses'}]}}
         ]}, method=urllib3_responses.POST)
 
@@ -1177,23 +1331,31 @@ class EsUtilsTest(TestCase):
         self.assertDictEqual(variants[1], PARSED_VARIANTS[1])
         self.assertEqual(total_results, 5)
 
-        self.assertCachedResults(results_model, {'all_results': variants, 'total_results': 5})
+        search_after = {INDEX_NAME: {'start_index': 2, 'sort': [PARSED_VARIANTS[1]['xpos']]}}
+        self.assertCachedResults(
+            results_model, {'all_results': variants, 'total_results': 5, 'search_after': search_after})
         self.assertTrue('index_metadata__{},{}'.format(INDEX_NAME, SV_INDEX_NAME) in REDIS_CACHE)
 
-        self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos'])
+        self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos', 'variantId'])
 
         # does not save non-consecutive pages
         variants, total_results = get_es_variants(results_model, page=3, num_results=2)
         self.assertEqual(total_results, 5)
-        self.assertCachedResults(results_model, {'all_results': variants, 'total_results': 5})
-        self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=4, size=2)
+        self.assertCachedResults(
+            results_model, {'all_results': variants, 'total_results': 5, 'search_after': search_after})
+        self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos', 'variantId'], start_index=4, size=2)
 
         # test pagination
         variants, total_results = get_es_variants(results_model, page=2, num_results=2)
         self.assertEqual(len(variants), 2)
         self.assertEqual(total_results, 5)
-        self.assertCachedResults(results_model, {'all_results': PARSED_VARIANTS + PARSED_VARIANTS, 'total_results': 5})
-        self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=2, size=2)
+        search_after[INDEX_NAME]['start_index'] = 4
+        self.assertCachedResults(results_model, {
+            'all_results': PARSED_VARIANTS + PARSED_VARIANTS, 'total_results': 5, 'search_after': search_after,
+        })
+        self.assertExecutedSearch(
+            filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos', 'variantId'], start_index=0, size=2,
+            search_after=[PARSED_VARIANTS[1]['xpos']])
 
         # test does not re-fetch page
         urllib3_responses.reset()
@@ -1211,7 +1373,9 @@ class EsUtilsTest(TestCase):
 
         mock_max_variants.__int__.return_value = 100
         variants, _ = get_es_variants(results_model, page=1, num_results=2, load_all=True)
-        self.assertExecutedSearch(filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos'], start_index=4, size=1)
+        self.assertExecutedSearch(
+            filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos', 'variantId'], start_index=0, size=1,
+            search_after=[PARSED_VARIANTS[1]['xpos']])
         self.assertEqual(len(variants), 5)
         self.assertListEqual(variants, PARSED_VARIANTS + PARSED_VARIANTS + PARSED_VARIANTS[:1])
 
@@ -1222,6 +1386,97 @@ class EsUtilsTest(TestCase):
         self.assertEqual(len(variants), 5)
         self.assertListEqual(variants, PARSED_VARIANTS + PARSED_VARIANTS + PARSED_VARIANTS[:1])
 
+    @urllib3_responses.activate
+    def test_compiled_search_get_es_variants(self):
+        setup_responses()
+        search_model = VariantSearch.objects.create(search={
+            'annotations': {'frameshift': ['frameshift_variant']}, 'qualityFilter': {'min_gq': 10},
+        })
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+        cache_key = 'search_results__{}__xpos'.format(results_model.guid)
+
+        with mock.patch.object(
+                EsSearch, 'filter_by_annotation_and_genotype', autospec=True,
+                side_effect=EsSearch.filter_by_annotation_and_genotype) as mock_filter:
+            get_es_variants(results_model, num_results=2)
+            self.assertEqual(mock_filter.call_count, 1)
+            compiled_keys = [key for key in REDIS_CACHE.keys() if key.startswith('{}__compiled__'.format(cache_key))]
+            self.assertEqual(len(compiled_keys), 1)
+            first_search = urllib3_responses.call_request_json()
+
+            # Subsequent pages reuse the compiled search and only update pagination
+            variants, _ = get_es_variants(results_model, page=2, num_results=2)
+            self.assertEqual(mock_filter.call_count, 1)
+            self.assertEqual(len(variants), 2)
+            second_search = urllib3_responses.call_request_json()
+            self.assertDictEqual(second_search['query'], first_search['query'])
+            self.assertListEqual(second_search['sort'], first_search['sort'])
+            self.assertNotEqual(second_search.get('search_after'), first_search.get('search_after'))
+
+            # Changes to the searched samples invalidate the compiled search
+            _set_cache(cache_key, None)
+            bump_search_samples_version()
+            get_es_variants(results_model, num_results=2)
+            self.assertEqual(mock_filter.call_count, 2)
+            self.assertDictEqual(urllib3_responses.call_request_json()['query'], first_search['query'])
+
+    @mock.patch('seqr.utils.elasticsearch.es_search.MAX_VARIANTS', 3)
+    @urllib3_responses.activate
+    def test_search_after_get_es_variants(self):
+        setup_responses()
+        search_model = VariantSearch.objects.create(search={'annotations': {'frameshift': ['frameshift_variant']}})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+        get_es_variants(results_model, num_results=2)
+
+        # Offset pagination is limited by the ES max result window
+        with self.assertRaises(InvalidSearchException) as cm:
+            get_es_variants(results_model, page=3, num_results=2)
+        self.assertEqual(str(cm.exception), 'Unable to load more than 3 variants (6 requested)')
+
+        # Resuming from the last loaded variant is not limited
+        variants, _ = get_es_variants(results_model, page=2, num_results=2)
+        self.assertListEqual(variants, PARSED_VARIANTS)
+        self.assertExecutedSearch(
+            filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos', 'variantId'], start_index=0, size=2,
+            search_after=[PARSED_VARIANTS[1]['xpos']])
+
+        get_es_variants(results_model, page=3, num_results=2)
+        self.assertExecutedSearch(
+            filters=[ANNOTATION_QUERY, ALL_INHERITANCE_QUERY], sort=['xpos', 'variantId'], start_index=0, size=2,
+            search_after=[PARSED_VARIANTS[1]['xpos']])
+        self.assertCachedResults(results_model, {
+            'all_results': PARSED_VARIANTS + PARSED_VARIANTS + PARSED_VARIANTS, 'total_results': 5,
+            'search_after': {INDEX_NAME: {'start_index': 6, 'sort': [PARSED_VARIANTS[1]['xpos']]}},
+        })
+
+    @urllib3_responses.activate
+    def test_get_es_variants_timings(self):
+        setup_responses()
+        search_model = VariantSearch.objects.create(search={'annotations': {'frameshift': ['frameshift_variant']}})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+
+        with request_timings() as timings:
+            variants, _ = get_es_variants(results_model, num_results=2, profile=True)
+        self.assertEqual(len(variants), 2)
+        self.assertTrue(urllib3_responses.call_request_json()['profile'])
+
+        self.assertSetEqual(set(timings.durations.keys()), {
+            'search_samples', 'query_compile', 'es_took', 'es_transport', 'parse_hits'})
+        self.assertEqual(timings.durations['es_took'], 0.001)
+        self.assertDictEqual(dict(timings.counts), {
+            'query_clauses': 7, 'es_requests': 1, 'es_response_bytes': mock.ANY, 'hits_parsed': 2})
+        self.assertGreater(timings.counts['es_response_bytes'], 0)
+
+        # Cached compiled searches are not recompiled
+        with request_timings() as timings:
+            get_es_variants(results_model, page=2, num_results=2)
+        self.assertNotIn('query_compile', timings.durations)
+        self.assertNotIn('query_clauses', timings.counts)
+        self.assertNotIn('profile', urllib3_responses.call_request_json())
+
     @urllib3_responses.activate
     def test_filtered_get_es_variants(self):
         setup_responses()
@@ -1402,55 +1657,32 @@ class EsUtilsTest(TestCase):
                                     {'term': {'samples_num_alt_2': 'HG00731'}}
                                 ]
                             }},
-                            {'bool': {
-                                'minimum_should_match': 1,
-                                'should': [
-                                    {'bool': {
-                                        'must_not': [
-                                            {'term': {'samples_ab_0_to_5': 'HG00731'}},
-                                            {'term': {'samples_ab_5_to_10': 'HG00731'}},
-                                        ]
-                                    }},
-                                    {'bool': {'must_not': [{'term': {'samples_num_alt_1': 'HG00731'}}]}}
-                                ],
-                                'must_not': [
-                                    {'term': {'samples_gq_0_to_5': 'HG00731'}},
-                                    {'term': {'samples_gq_5_to_10': 'HG00731'}},
-                                    {'term': {'samples_gq_10_to_15': 'HG00731'}},
-                                    {'term': {'samples_gq_0_to_5': 'HG00732'}},
-                                    {'term': {'samples_gq_5_to_10': 'HG00732'}},
-                                    {'term': {'samples_gq_10_to_15': 'HG00732'}},
-                                    {'term': {'samples_gq_0_to_5': 'HG00733'}},
-                                    {'term': {'samples_gq_5_to_10': 'HG00733'}},
-                                    {'term': {'samples_gq_10_to_15': 'HG00733'}},
-                                ],
-                                'must': [
-                                    {'bool': {
-                                        'minimum_should_match': 1,
-                                        'should': [
-                                            {'bool': {
-                                                'must_not': [
-                                                    {'term': {'samples_ab_0_to_5': 'HG00732'}},
-                                                    {'term': {'samples_ab_5_to_10': 'HG00732'}},
-                                                ]
-                                            }},
-                                            {'bool': {'must_not': [{'term': {'samples_num_alt_1': 'HG00732'}}]}}
-                                        ]
-                                    }},
-                                    {'bool': {
-                                        'minimum_should_match': 1,
-                                        'should': [
-                                            {'bool': {
-                                                'must_not': [
-                                                    {'term': {'samples_ab_0_to_5': 'HG00733'}},
-                                                    {'term': {'samples_ab_5_to_10': 'HG00733'}},
-                                                ]
-                                            }},
-                                            {'bool': {'must_not': [{'term': {'samples_num_alt_1': 'HG00733'}}]}}
-                                        ]
-                                    }},
-                                ]
-                            }}
+                            {'bool': {'must_not': [
+                                {'bool': {'must': [
+                                    {'term': {'samples_num_alt_1': 'HG00731'}},
+                                    {'bool': {'should': [
+                                        {'term': {'samples_ab_0_to_5': 'HG00731'}},
+                                        {'term': {'samples_ab_5_to_10': 'HG00731'}},
+                                    ]}},
+                                ]}},
+                                {'bool': {'must': [
+                                    {'term': {'samples_num_alt_1': 'HG00732'}},
+                                    {'bool': {'should': [
+                                        {'term': {'samples_ab_0_to_5': 'HG00732'}},
+                                        {'term': {'samples_ab_5_to_10': 'HG00732'}},
+                                    ]}},
+                                ]}},
+                                {'bool': {'must': [
+                                    {'term': {'samples_num_alt_1': 'HG00733'}},
+                                    {'bool': {'should': [
+                                        {'term': {'samples_ab_0_to_5': 'HG00733'}},
+                                        {'term': {'samples_ab_5_to_10': 'HG00733'}},
+                                    ]}},
+                                ]}},
+                                {'terms': {'samples_gq_0_to_5': ['HG00731', 'HG00732', 'HG00733']}},
+                                {'terms': {'samples_gq_5_to_10': ['HG00731', 'HG00732', 'HG00733']}},
+                                {'terms': {'samples_gq_10_to_15': ['HG00731', 'HG00732', 'HG00733']}},
+                            ]}}
                         ],
                         '_name': 'F000002_2'
                     }},
@@ -1460,29 +1692,24 @@ class EsUtilsTest(TestCase):
                                 {'term': {'samples_num_alt_1': 'NA20870'}},
                                 {'term': {'samples_num_alt_2': 'NA20870'}}
                             ]}},
-                            {'bool': {
-                                'minimum_should_match': 1,
-                                'should': [
-                                    {'bool': {
-                                        'must_not': [
-                                            {'term': {'samples_ab_0_to_5': 'NA20870'}},
-                                            {'term': {'samples_ab_5_to_10': 'NA20870'}},
-                                        ]
-                                    }},
-                                    {'bool': {'must_not': [{'term': {'samples_num_alt_1': 'NA20870'}}]}}
-                                ],
-                                'must_not': [
-                                    {'term': {'samples_gq_0_to_5': 'NA20870'}},
-                                    {'term': {'samples_gq_5_to_10': 'NA20870'}},
-                                    {'term': {'samples_gq_10_to_15': 'NA20870'}},
-                                ]
-                            }}
+                            {'bool': {'must_not': [
+                                {'bool': {'must': [
+                                    {'term': {'samples_num_alt_1': 'NA20870'}},
+                                    {'bool': {'should': [
+                                        {'term': {'samples_ab_0_to_5': 'NA20870'}},
+                                        {'term': {'samples_ab_5_to_10': 'NA20870'}},
+                                    ]}},
+                                ]}},
+                                {'terms': {'samples_gq_0_to_5': ['NA20870']}},
+                                {'terms': {'samples_gq_5_to_10': ['NA20870']}},
+                                {'terms': {'samples_gq_10_to_15': ['NA20870']}},
+                            ]}}
                         ],
                         '_name': 'F000003_3'
                     }},
                 ]
             }}
-        ], sort=[{'cadd_PHRED': {'order': 'desc', 'unmapped_type': 'keyword'}}, 'xpos'])
+        ], sort=[{'cadd_PHRED': {'order': 'desc', 'unmapped_type': 'keyword'}}, 'xpos', 'variantId'])
 
     @urllib3_responses.activate
     def test_sv_get_es_variants(self):
@@ -1515,16 +1742,14 @@ class EsUtilsTest(TestCase):
                     }},
                     {'bool': {
                         'must_not': [
-                            {'term': {'samples_qs_0_to_10': 'HG00731'}},
-                            {'term': {'samples_qs_10_to_20': 'HG00731'}},
-                            {'term': {'samples_qs_0_to_10': 'HG00732'}},
-                            {'term': {'samples_qs_10_to_20': 'HG00732'}},
+                            {'terms': {'samples_qs_0_to_10': ['HG00731', 'HG00732']}},
+                            {'terms': {'samples_qs_10_to_20': ['HG00731', 'HG00732']}},
                         ],
                     }}
                 ],
                 '_name': 'F000002_2'
             }}
-        ], sort=['xpos'], index=SV_INDEX_NAME)
+        ], sort=['xpos', 'variantId'], index=SV_INDEX_NAME)
 
     @urllib3_responses.activate
     def test_multi_dataset_get_es_variants(self):
@@ -1544,8 +1769,8 @@ class EsUtilsTest(TestCase):
             ]
         }}
         self.assertExecutedSearches([
-            dict(filters=[path_filter], start_index=0, size=5, sort=['xpos'], index=SV_INDEX_NAME),
-            dict(filters=[path_filter, ALL_INHERITANCE_QUERY], start_index=0, size=5, sort=['xpos'], index=INDEX_NAME),
+            dict(filters=[path_filter], start_index=0, size=5, sort=['xpos', 'variantId'], index=SV_INDEX_NAME),
+            dict(filters=[path_filter, ALL_INHERITANCE_QUERY], start_index=0, size=5, sort=['xpos', 'variantId'], index=INDEX_NAME),
         ])
 
     @urllib3_responses.activate
@@ -1565,22 +1790,106 @@ class EsUtilsTest(TestCase):
         self.assertEqual(total_results, 1)
 
         self.assertCachedResults(results_model, {
+            'compound_het_results': [],
+            'variant_result_runs': [],
             'grouped_results': [{'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS}],
+            'duplicate_doc_count': 0,
+            'compound_het_pair_keys': [['ENSG00000228198', ['1-248367227-TC-T', '2-103343353-GAGA-G']]],
+            'loaded_variant_counts': {
+                'test_index_compound_het': {'total': 1, 'loaded': 1}, INDEX_NAME: {'loaded': 0, 'total': 0}},
             'total_results': 1,
         })
 
-        self.assertExecutedSearch(
+        self.assertExecutedSearches([dict(
             filters=[ANNOTATION_QUERY, COMPOUND_HET_INHERITANCE_QUERY],
             gene_aggs=True,
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             start_index=0,
             size=1
-        )
+        )])
 
         # test pagination does not fetch
         urllib3_responses.reset()
         get_es_variants(results_model, page=2, num_results=2)
 
+    @mock.patch('seqr.utils.elasticsearch.es_search.GENE_AGG_PAGE_SIZE', 1)
+    @urllib3_responses.activate
+    def test_paged_compound_het_get_es_variants(self):
+        setup_responses()
+        search_model = VariantSearch.objects.create(search={
+            'qualityFilter': {'min_gq': 10},
+            'annotations': {'frameshift': ['frameshift_variant']},
+            'inheritance': {'mode': 'compound_het'},
+        })
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        results_model.families.set(self.families)
+        cache_key = 'search_results__{}__xpos'.format(results_model.guid)
+
+        # Gene pages are only loaded until there are enough pairs for the requested page
+        variants, total_results = get_es_variants(results_model, num_results=1)
+        self.assertListEqual(variants, [PARSED_COMPOUND_HET_VARIANTS])
+        self.assertEqual(total_results, 2)
+        self.assertListEqual([call.request.url for call in urllib3_responses.calls[-2:]], [
+            '/{}/_msearch'.format(INDEX_NAME), '/{}/_search'.format(INDEX_NAME)])
+        first_page_search = parse_msearch_body(urllib3_responses.calls[-2].request.body)[1]
+        self.assertDictEqual(first_page_search['aggs']['genes']['composite'], {
+            'size': 1, 'sources': [{'gene_id': {'terms': {'field': 'geneIds'}}}]})
+        self.assertDictEqual(
+            urllib3_responses.call_request_json()['aggs']['genes']['composite']['after'],
+            {'gene_id': 'ENSG00000135953'})
+        cached_results = decode_cache_value(REDIS_CACHE[cache_key])
+        self.assertDictEqual(cached_results['compound_het_after_keys'], {INDEX_NAME: {'gene_id': 'ENSG00000228198'}})
+        self.assertDictEqual(cached_results['loaded_variant_counts'], {
+            'test_index_compound_het': {'total': 2, 'loaded': 1}, INDEX_NAME: {'loaded': 0, 'total': 0}})
+
+        # The next page resumes from the cached gene page
+        urllib3_responses.reset()
+        setup_responses()
+        variants, total_results = get_es_variants(results_model, page=2, num_results=1)
+        self.assertListEqual(variants, [])
+        self.assertEqual(total_results, 1)
+        self.assertEqual(len(urllib3_responses.calls), 1)
+        self.assertDictEqual(
+            parse_msearch_body(urllib3_responses.calls[0].request.body)[1]['aggs']['genes']['composite']['after'],
+            {'gene_id': 'ENSG00000228198'})
+        cached_results = decode_cache_value(REDIS_CACHE[cache_key])
+        self.assertNotIn('compound_het_after_keys', cached_results)
+        self.assertDictEqual(cached_results['loaded_variant_counts'], {
+            'test_index_compound_het': {'total': 1, 'loaded': 1}, INDEX_NAME: {'loaded': 0, 'total': 0}})
+
+        # Once all the gene pages are loaded the compound het search is not rerun
+        urllib3_responses.reset()
+        setup_responses()
+        variants, total_results = get_es_variants(results_model, page=3, num_results=1)
+        self.assertListEqual(variants, [])
+        self.assertEqual(total_results, 1)
+        self.assertEqual(len(urllib3_responses.calls), 0)
+
+        # Genes with more variants than are returned by the aggregation are loaded in a single search for the page
+        def _truncated_gene_mock_response(*args, **kwargs):
+            response = mock_response(*args, **kwargs)
+            for bucket in response.get('aggregations', {}).get('genes', {}).get('buckets', []):
+                bucket['doc_count'] += 1
+            return response
+
+        mock_response = create_mock_response
+        for key in list(REDIS_CACHE.keys()):
+            if key.startswith('search_results__{}'.format(results_model.guid)):
+                _set_cache(key, None)
+        with mock.patch('seqr.utils.elasticsearch.es_utils_tests.create_mock_response', _truncated_gene_mock_response), \
+                mock.patch('seqr.utils.elasticsearch.es_search.GENE_AGG_PAGE_SIZE', 2):
+            variants, _ = get_es_variants(results_model, num_results=2)
+        self.assertEqual(len(variants), 1)
+        self.assertListEqual([call.request.url for call in urllib3_responses.calls[-3:]], [
+            '/{}/_msearch'.format(INDEX_NAME), '/{}/_msearch'.format(INDEX_NAME), '/{}/_search'.format(INDEX_NAME)])
+        # The gene search is run before loading the next page of genes
+        gene_searches = parse_msearch_body(urllib3_responses.calls[-2].request.body)
+        self.assertEqual(len(gene_searches), 4)
+        for gene_search, gene_id in zip(gene_searches[1::2], ['ENSG00000135953', 'ENSG00000228198']):
+            self.assertNotIn('aggs', gene_search)
+            self.assertEqual(gene_search['size'], 4)
+            self.assertDictEqual(gene_search['query']['bool']['filter'][-1], {'term': {'geneIds': gene_id}})
+
     @urllib3_responses.activate
     def test_compound_het_get_es_variants_secondary_annotation(self):
         setup_responses()
@@ -1599,7 +1908,13 @@ class EsUtilsTest(TestCase):
         self.assertEqual(total_results, 1)
 
         self.assertCachedResults(results_model, {
+            'compound_het_results': [],
+            'variant_result_runs': [],
             'grouped_results': [{'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS}],
+            'duplicate_doc_count': 0,
+            'compound_het_pair_keys': [['ENSG00000228198', ['1-248367227-TC-T', '2-103343353-GAGA-G']]],
+            'loaded_variant_counts': {
+                'test_index_compound_het': {'total': 1, 'loaded': 1}, INDEX_NAME: {'loaded': 0, 'total': 0}},
             'total_results': 1,
         })
 
@@ -1607,13 +1922,13 @@ class EsUtilsTest(TestCase):
             {'terms': {'transcriptConsequenceTerms': ['frameshift_variant']}},
             {'terms': {'transcriptConsequenceTerms': ['frameshift_variant', 'intron']}}]}}
 
-        self.assertExecutedSearch(
+        self.assertExecutedSearches([dict(
             filters=[annotation_query, COMPOUND_HET_INHERITANCE_QUERY],
             gene_aggs=True,
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             start_index=0,
             size=1
-        )
+        )])
 
         # test pagination does not fetch
         urllib3_responses.reset()
@@ -1631,20 +1946,20 @@ class EsUtilsTest(TestCase):
         _set_cache('search_results__{}__xpos'.format(results_model.guid), None)
 
         variants, total_results = get_es_variants(results_model, num_results=2)
-        self.assertIsNone(variants)
+        self.assertListEqual(variants, [])
         self.assertEqual(total_results, 0)
 
         annotation_query = {'bool': {'should': [
             {'terms': {'transcriptConsequenceTerms': ['frameshift_variant']}},
             {'terms': {'transcriptConsequenceTerms': ['intron']}}]}}
 
-        self.assertExecutedSearch(
+        self.assertExecutedSearches([dict(
             filters=[annotation_query, COMPOUND_HET_INHERITANCE_QUERY],
             gene_aggs=True,
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             start_index=0,
             size=1
-        )
+        )])
 
     @urllib3_responses.activate
     def test_recessive_get_es_variants(self):
@@ -1666,10 +1981,12 @@ class EsUtilsTest(TestCase):
 
         self.assertCachedResults(results_model, {
             'compound_het_results': [],
-            'variant_results': [PARSED_VARIANTS[1]],
+            'variant_result_runs': [[PARSED_VARIANTS[1]]],
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS}],
             'duplicate_doc_count': 0,
+            'compound_het_pair_keys': [['ENSG00000228198', ['1-248367227-TC-T', '2-103343353-GAGA-G']]],
             'loaded_variant_counts': {'test_index_compound_het': {'total': 1, 'loaded': 1}, INDEX_NAME: {'loaded': 2, 'total': 5}},
+            'search_after': {INDEX_NAME: {'start_index': 2, 'sort': [2103343353]}},
             'total_results': 6,
         })
 
@@ -1679,12 +1996,12 @@ class EsUtilsTest(TestCase):
             dict(
                 filters=[pass_filter_query, ANNOTATION_QUERY, COMPOUND_HET_INHERITANCE_QUERY],
                 gene_aggs=True,
-                sort=['xpos'],
+                sort=['xpos', 'variantId'],
                 start_index=0,
                 size=1
             ),
             dict(
-                filters=[pass_filter_query, ANNOTATION_QUERY, RECESSIVE_INHERITANCE_QUERY], start_index=0, size=2, sort=['xpos'],
+                filters=[pass_filter_query, ANNOTATION_QUERY, RECESSIVE_INHERITANCE_QUERY], start_index=0, size=2, sort=['xpos', 'variantId'],
             ),
         ])
 
@@ -1698,16 +2015,21 @@ class EsUtilsTest(TestCase):
 
         self.assertCachedResults(results_model, {
             'compound_het_results': [],
-            'variant_results': [],
+            'variant_result_runs': [],
             'grouped_results': [
                 {'null': [PARSED_VARIANTS[0]]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS},
                 {'null': [PARSED_VARIANTS[0]]}, {'null': [PARSED_MULTI_SAMPLE_VARIANT]}],
             'duplicate_doc_count': 1,
+            'compound_het_pair_keys': [['ENSG00000228198', ['1-248367227-TC-T', '2-103343353-GAGA-G']]],
             'loaded_variant_counts': {'test_index_compound_het': {'total': 1, 'loaded': 1}, INDEX_NAME: {'loaded': 4, 'total': 5}},
+            'search_after': {INDEX_NAME: {'start_index': 4, 'sort': [2103343353]}},
             'total_results': 5,
         })
 
-        self.assertExecutedSearches([dict(filters=[pass_filter_query, ANNOTATION_QUERY, RECESSIVE_INHERITANCE_QUERY], start_index=2, size=4, sort=['xpos'])])
+        self.assertExecutedSearches([dict(
+            filters=[pass_filter_query, ANNOTATION_QUERY, RECESSIVE_INHERITANCE_QUERY], start_index=0, size=4,
+            sort=['xpos', 'variantId'], search_after=[2103343353],
+        )])
 
         urllib3_responses.reset()
         get_es_variants(results_model, page=2, num_results=2)
@@ -1763,7 +2085,7 @@ class EsUtilsTest(TestCase):
                             }
                         }]
                     }}
-                ], start_index=0, size=10, sort=['xpos'], index=SV_INDEX_NAME,
+                ], start_index=0, size=10, sort=['xpos', 'variantId'], index=SV_INDEX_NAME,
             ),
             dict(
                 filters=[{'bool': {
@@ -1787,7 +2109,7 @@ class EsUtilsTest(TestCase):
                     }},
                  ],
                 gene_aggs=True,
-                sort=['xpos'],
+                sort=['xpos', 'variantId'],
                 start_index=0,
                 size=1,
                 index=','.join([INDEX_NAME, SV_INDEX_NAME]),
@@ -1797,7 +2119,7 @@ class EsUtilsTest(TestCase):
                     {'bool': {'_name': 'F000003_3', 'must': [{'term': {'samples_num_alt_1': 'NA20870'}}]}},
                 ],
                 gene_aggs=True,
-                sort=['xpos'],
+                sort=['xpos', 'variantId'],
                 start_index=0,
                 size=1
             ),
@@ -1854,7 +2176,7 @@ class EsUtilsTest(TestCase):
                             ]
                         }
                     }
-                ], start_index=0, size=10, sort=['xpos'],
+                ], start_index=0, size=10, sort=['xpos', 'variantId'],
             ),
         ])
 
@@ -1911,7 +2233,7 @@ class EsUtilsTest(TestCase):
                             }
                         }]
                     }}
-                ], start_index=0, size=10, sort=['xpos'], index=SV_INDEX_NAME,
+                ], start_index=0, size=10, sort=['xpos', 'variantId'], index=SV_INDEX_NAME,
             ),
             dict(
                 filters=[annotation_secondary_query, {'bool': {
@@ -1935,7 +2257,7 @@ class EsUtilsTest(TestCase):
                     }},
                  ],
                 gene_aggs=True,
-                sort=['xpos'],
+                sort=['xpos', 'variantId'],
                 start_index=0,
                 size=1,
                 index=','.join([INDEX_NAME, SV_INDEX_NAME]),
@@ -1946,7 +2268,7 @@ class EsUtilsTest(TestCase):
                     {'bool': {'_name': 'F000003_3', 'must': [{'term': {'samples_num_alt_1': 'NA20870'}}]}},
                 ],
                 gene_aggs=True,
-                sort=['xpos'],
+                sort=['xpos', 'variantId'],
                 start_index=0,
                 size=1
             ),
@@ -1965,7 +2287,7 @@ class EsUtilsTest(TestCase):
         self.assertListEqual(variants, PARSED_VARIANTS)
         self.assertEqual(total_results, 5)
 
-        self.assertExecutedSearch(filters=[ANNOTATION_QUERY], sort=['xpos'])
+        self.assertExecutedSearch(filters=[ANNOTATION_QUERY], sort=['xpos', 'variantId'])
 
     @urllib3_responses.activate
     def test_all_samples_any_affected_get_es_variants(self):
@@ -1989,7 +2311,7 @@ class EsUtilsTest(TestCase):
                     {'terms': {'samples': ['HG00731', 'NA19675', 'NA20870']}},
                 ]
             }}
-        ], sort=['xpos'])
+        ], sort=['xpos', 'variantId'])
 
     @urllib3_responses.activate
     def test_multi_project_get_es_variants(self):
@@ -2002,24 +2324,39 @@ class EsUtilsTest(TestCase):
         results_model = VariantSearchResults.objects.create(variant_search=search_model)
         results_model.families.set(Family.objects.filter(guid__in=['F000011_11', 'F000003_3', 'F000002_2']))
 
+        MOCK_REDIS.mget.reset_mock()
         variants, total_results = get_es_variants(results_model, num_results=2)
         self.assertEqual(len(variants), 2)
         self.assertDictEqual(variants[0], PARSED_VARIANTS[0])
         self.assertDictEqual(variants[1][0], PARSED_COMPOUND_HET_VARIANTS_PROJECT_2[0])
         self.assertDictEqual(variants[1][1], PARSED_COMPOUND_HET_VARIANTS_PROJECT_2[1])
         self.assertEqual(total_results, 11)
+        # Cached annotations for the variants in all the genes in a compound het page are loaded together
+        compound_het_annotation_lookups = [
+            keys for (keys,), _ in MOCK_REDIS.mget.call_args_list
+            if keys[0].startswith('variant_annotations__{}__'.format(SECOND_INDEX_NAME))]
+        self.assertEqual(len(compound_het_annotation_lookups), 1)
+        self.assertEqual(len(compound_het_annotation_lookups[0]), 4)
 
         self.assertCachedResults(results_model, {
             'compound_het_results': [{'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS_MULTI_GENOME_VERSION}],
-            'variant_results': [PARSED_MULTI_GENOME_VERSION_VARIANT],
+            'variant_result_runs': [[PARSED_MULTI_GENOME_VERSION_VARIANT]],
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000135953': PARSED_COMPOUND_HET_VARIANTS_PROJECT_2}],
             'duplicate_doc_count': 2,
+            'compound_het_pair_keys': [
+                ['ENSG00000135953', ['1-248367227-TC-T-het', '2-103343353-GAGA-G-het']],
+                ['ENSG00000228198', ['1-248367227-TC-T', '2-103343353-GAGA-G']],
+            ],
             'loaded_variant_counts': {
                 SECOND_INDEX_NAME: {'loaded': 1, 'total': 5},
                 '{}_compound_het'.format(SECOND_INDEX_NAME): {'total': 2, 'loaded': 2},
                 INDEX_NAME: {'loaded': 2, 'total': 5},
                 '{}_compound_het'.format(INDEX_NAME): {'total': 1, 'loaded': 1},
             },
+            'search_after': {
+                SECOND_INDEX_NAME: {'start_index': 1, 'sort': [2103343363]},
+                INDEX_NAME: {'start_index': 2, 'sort': [2103343353]},
+            },
             'total_results': 11,
         })
         self.assertTrue('index_metadata__{}'.format(INDEX_NAME) in REDIS_CACHE)
@@ -2039,19 +2376,19 @@ class EsUtilsTest(TestCase):
                         ]}},
                         {'bool': {
                             'must_not': [
-                                {'term': {'samples_gq_0_to_5': 'NA20885'}},
-                                {'term': {'samples_gq_5_to_10': 'NA20885'}},
+                                {'terms': {'samples_gq_0_to_5': ['NA20885']}},
+                                {'terms': {'samples_gq_5_to_10': ['NA20885']}},
                             ]
                         }}
                     ],
                     '_name': 'F000011_11'
                 }}
-            ], start_index=0, size=2, sort=['xpos'], index=SECOND_INDEX_NAME)
+            ], start_index=0, size=2, sort=['xpos', 'variantId'], index=SECOND_INDEX_NAME)
         project_1_search = dict(
             filters=[
                 ANNOTATION_QUERY,
                 RECESSIVE_INHERITANCE_QUERY,
-            ], start_index=0, size=2, sort=['xpos'], index=INDEX_NAME)
+            ], start_index=0, size=2, sort=['xpos', 'variantId'], index=INDEX_NAME)
         self.assertExecutedSearches([
             dict(
                 filters=[
@@ -2061,18 +2398,18 @@ class EsUtilsTest(TestCase):
                         'must': [
                             {'term': {'samples_num_alt_1': 'NA20885'}},
                             {'bool': {'must_not': [
-                                {'term': {'samples_gq_0_to_5': 'NA20885'}},
-                                {'term': {'samples_gq_5_to_10': 'NA20885'}}
+                                {'terms': {'samples_gq_0_to_5': ['NA20885']}},
+                                {'terms': {'samples_gq_5_to_10': ['NA20885']}},
                             ]}}
                         ]
                     }}
                 ],
-                gene_aggs=True, sort=['xpos'], start_index=0, size=1, index=SECOND_INDEX_NAME,
+                gene_aggs=True, sort=['xpos', 'variantId'], start_index=0, size=1, index=SECOND_INDEX_NAME,
             ),
             project_2_search,
             dict(
                 filters=[ANNOTATION_QUERY, COMPOUND_HET_INHERITANCE_QUERY],
-                gene_aggs=True, sort=['xpos'], start_index=0, size=1, index=INDEX_NAME,
+                gene_aggs=True, sort=['xpos', 'variantId'], start_index=0, size=1, index=INDEX_NAME,
             ),
             project_1_search,
         ])
@@ -2085,7 +2422,7 @@ class EsUtilsTest(TestCase):
 
         cache_results = {
             'compound_het_results': [],
-            'variant_results': [PARSED_MULTI_SAMPLE_MULTI_GENOME_VERSION_VARIANT],
+            'variant_result_runs': [[PARSED_MULTI_SAMPLE_MULTI_GENOME_VERSION_VARIANT]],
             'grouped_results': [
                 {'null': [PARSED_VARIANTS[0]]},
                 {'ENSG00000135953': PARSED_COMPOUND_HET_VARIANTS_PROJECT_2},
@@ -2093,29 +2430,42 @@ class EsUtilsTest(TestCase):
                 {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS_MULTI_GENOME_VERSION}
             ],
             'duplicate_doc_count': 4,
+            'compound_het_pair_keys': [
+                ['ENSG00000135953', ['1-248367227-TC-T-het', '2-103343353-GAGA-G-het']],
+                ['ENSG00000228198', ['1-248367227-TC-T', '2-103343353-GAGA-G']],
+            ],
             'loaded_variant_counts': {
                 SECOND_INDEX_NAME: {'loaded': 2, 'total': 5},
                 '{}_compound_het'.format(SECOND_INDEX_NAME): {'total': 2, 'loaded': 2},
                 INDEX_NAME: {'loaded': 4, 'total': 5},
                 '{}_compound_het'.format(INDEX_NAME): {'total': 1, 'loaded': 1},
             },
+            'search_after': {
+                SECOND_INDEX_NAME: {'start_index': 2, 'sort': [2103343363]},
+                INDEX_NAME: {'start_index': 4, 'sort': [2103343353]},
+            },
             'total_results': 9,
         }
         self.assertCachedResults(results_model, cache_results)
 
-        project_2_search['start_index'] = 1
-        project_2_search['size'] = 3
-        project_1_search['start_index'] = 2
+        project_2_search.update({'start_index': 0, 'size': 3, 'search_after': [2103343363]})
+        project_1_search.update({'start_index': 0, 'search_after': [2103343353]})
         self.assertExecutedSearches([project_2_search, project_1_search])
 
         # If one project is fully loaded, only query the second project
         cache_results['loaded_variant_counts'][INDEX_NAME]['total'] = 4
         _set_cache('search_results__{}__xpos'.format(results_model.guid), json.dumps(cache_results))
         get_es_variants(results_model, num_results=2, page=3)
-        project_2_search['start_index'] = 2
         project_2_search['size'] = 4
         self.assertExecutedSearches([project_2_search])
 
+        # Falls back to paginating by offset if there is no cursor for the loaded results
+        del cache_results['search_after']
+        _set_cache('search_results__{}__xpos'.format(results_model.guid), json.dumps(cache_results))
+        get_es_variants(results_model, num_results=2, page=3)
+        project_2_search.update({'start_index': 2, 'search_after': None})
+        self.assertExecutedSearches([project_2_search])
+
     @urllib3_responses.activate
     def test_multi_project_all_samples_all_inheritance_get_es_variants(self):
         setup_responses()
@@ -2130,16 +2480,18 @@ class EsUtilsTest(TestCase):
         self.assertListEqual(variants, expected_variants)
         self.assertEqual(total_results, 4)
 
+        search_after_index = '{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME)
         self.assertCachedResults(results_model, {
             'all_results': expected_variants,
             'duplicate_doc_count': 1,
             'total_results': 4,
+            'search_after': {search_after_index: {'start_index': 3, 'sort': [2103343363]}},
         })
 
         self.assertExecutedSearch(
             index='{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME),
             filters=[ANNOTATION_QUERY],
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             size=4,
         )
 
@@ -2153,14 +2505,16 @@ class EsUtilsTest(TestCase):
             'all_results': expected_variants + expected_variants,
             'duplicate_doc_count': 2,
             'total_results': 3,
+            'search_after': {search_after_index: {'start_index': 6, 'sort': [2103343363]}},
         })
 
         self.assertExecutedSearch(
             index='{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME),
             filters=[ANNOTATION_QUERY],
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             size=5,
-            start_index=3,
+            start_index=0,
+            search_after=[2103343363],
         )
 
         # test skipping page fetches all consecutively
@@ -2169,7 +2523,7 @@ class EsUtilsTest(TestCase):
         self.assertExecutedSearch(
             index='{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME),
             filters=[ANNOTATION_QUERY],
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             size=8,
         )
 
@@ -2199,7 +2553,7 @@ class EsUtilsTest(TestCase):
                             {'terms': {'samples': ['NA20885']}},
                         ]
                     }}
-                ], start_index=0, size=2, sort=['xpos'], index=SECOND_INDEX_NAME),
+                ], start_index=0, size=2, sort=['xpos', 'variantId'], index=SECOND_INDEX_NAME),
             dict(
                 filters=[
                     ANNOTATION_QUERY,
@@ -2210,7 +2564,7 @@ class EsUtilsTest(TestCase):
                             {'terms': {'samples': ['HG00731', 'NA19675', 'NA20870']}},
                         ]
                     }},
-                ], start_index=0, size=2, sort=['xpos'], index=INDEX_NAME)
+                ], start_index=0, size=2, sort=['xpos', 'variantId'], index=INDEX_NAME)
         ])
 
     @urllib3_responses.activate
@@ -2227,14 +2581,13 @@ class EsUtilsTest(TestCase):
         self.assertExecutedSearch(
             index='{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME),
             filters=[{'terms': {'geneIds': ['ENSG00000223972']}}, ANNOTATION_QUERY],
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             size=4,
         )
 
-    @mock.patch('seqr.utils.elasticsearch.es_search.LIFTOVER_GRCH38_TO_GRCH37', None)
-    @mock.patch('seqr.utils.elasticsearch.es_search.LiftOver')
+    @mock.patch('seqr.utils.elasticsearch.es_search.get_liftover')
     @urllib3_responses.activate
-    def test_get_lifted_grch38_variants(self, mock_liftover):
+    def test_get_lifted_grch38_variants(self, mock_get_liftover):
         setup_responses()
         search_model = VariantSearch.objects.create(search={
             'annotations': {'frameshift': ['frameshift_variant']},
@@ -2252,13 +2605,14 @@ class EsUtilsTest(TestCase):
         variants, _ = get_es_variants(results_model, num_results=2)
         self.assertEqual(len(variants), 1)
         self.assertListEqual(variants, [expected_grch38_variant])
-        mock_liftover.assert_not_called()
+        mock_get_liftover.assert_not_called()
 
         # Test using python liftover
         _set_cache('search_results__{}__xpos'.format(results_model.guid), None)
         Sample.objects.filter(elasticsearch_index=SECOND_INDEX_NAME).update(elasticsearch_index=NO_LIFT_38_INDEX_NAME)
+        bump_search_samples_version()
 
-        mock_liftover.side_effect = Exception()
+        mock_get_liftover.return_value = None
         expected_no_lift_grch38_variant = deepcopy(expected_grch38_variant)
         expected_no_lift_grch38_variant.update({
             'liftedOverGenomeVersion': None,
@@ -2268,24 +2622,24 @@ class EsUtilsTest(TestCase):
         variants, _ = get_es_variants(results_model, num_results=2)
         self.assertEqual(len(variants), 1)
         self.assertListEqual(variants, [expected_no_lift_grch38_variant])
-        self.assertIsNone(_liftover_grch38_to_grch37())
-        mock_liftover.assert_called_with('hg38', 'hg19')
+        mock_get_liftover.assert_called_with('38')
 
         _set_cache('search_results__{}__xpos'.format(results_model.guid), None)
-        mock_liftover.side_effect = None
-        mock_liftover.return_value.convert_coordinate.side_effect = lambda chrom, pos: [[chrom, pos - 10]]
+        mock_liftover = mock.MagicMock()
+        mock_liftover.lift.side_effect = lambda chrom, pos: (chrom, pos - 10)
+        mock_get_liftover.return_value = mock_liftover
         variants, _ = get_es_variants(results_model, num_results=2)
         self.assertEqual(len(variants), 1)
         self.assertListEqual(variants, [expected_grch38_variant])
-        self.assertIsNotNone(_liftover_grch38_to_grch37())
-        mock_liftover.assert_called_with('hg38', 'hg19')
+        mock_get_liftover.assert_called_with('38')
+        # Hits are lifted in a batch before they are parsed
+        mock_liftover.lift_many.assert_called_once_with('2', [103343363])
+        mock_liftover.lift.assert_called_once_with('2', 103343363)
 
-    @mock.patch('seqr.utils.elasticsearch.es_search.LIFTOVER_GRCH38_TO_GRCH37', None)
-    @mock.patch('seqr.utils.elasticsearch.es_search.LIFTOVER_GRCH37_TO_GRCH38', None)
     @mock.patch('seqr.utils.elasticsearch.es_search.MAX_VARIANTS', 3)
-    @mock.patch('seqr.utils.elasticsearch.es_search.LiftOver')
+    @mock.patch('seqr.utils.elasticsearch.es_search.get_liftover')
     @urllib3_responses.activate
-    def test_multi_project_get_variants_by_id(self, mock_liftover):
+    def test_multi_project_get_variants_by_id(self, mock_get_liftover):
         setup_responses()
         search_model = VariantSearch.objects.create(search={
             'annotations': {'frameshift': ['frameshift_variant']},
@@ -2295,7 +2649,7 @@ class EsUtilsTest(TestCase):
         results_model.families.set(Family.objects.all())
 
         # Test liftover variant to hg37 when liftover fails
-        mock_liftover.side_effect = Exception()
+        mock_get_liftover.return_value = None
         get_es_variants(results_model, num_results=2)
         self.assertExecutedSearch(
             index='{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME),
@@ -2303,13 +2657,14 @@ class EsUtilsTest(TestCase):
                 {'terms': {'variantId': ['2-103343363-GAGA-G']}},
                 ANNOTATION_QUERY,
             ],
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             size=2,
         )
 
         # Test liftover variant to hg37
-        mock_liftover.side_effect = None
-        mock_liftover.return_value.convert_coordinate.side_effect = lambda chrom, pos: [[chrom, pos - 10]]
+        mock_liftover = mock.MagicMock()
+        mock_liftover.lift_many.side_effect = lambda chrom, positions: [(chrom, pos - 10) for pos in positions]
+        mock_get_liftover.return_value = mock_liftover
         _set_cache('search_results__{}__xpos'.format(results_model.guid), None)
         variants, _ = get_es_variants(results_model, num_results=2)
         self.assertEqual(len(variants), 1)
@@ -2318,6 +2673,7 @@ class EsUtilsTest(TestCase):
         self.assertCachedResults(results_model, {
             'all_results': [PARSED_MULTI_GENOME_VERSION_VARIANT],
             'duplicate_doc_count': 1,
+            'search_after': {'{},{}'.format(INDEX_NAME, SECOND_INDEX_NAME): {'start_index': 2, 'sort': [2103343363]}},
             'total_results': 4,
         })
         self.assertExecutedSearch(
@@ -2326,15 +2682,16 @@ class EsUtilsTest(TestCase):
                 {'terms': {'variantId': ['2-103343363-GAGA-G', '2-103343353-GAGA-G']}},
                 ANNOTATION_QUERY,
             ],
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             size=3,
         )
-        mock_liftover.assert_called_with('hg38', 'hg19')
+        mock_get_liftover.assert_called_with('38')
+        mock_liftover.lift_many.assert_called_with('2', [103343363])
 
         # Test liftover variant to hg38 when liftover fails
         search_model.search['locus']['genomeVersion'] = '37'
         search_model.save()
-        mock_liftover.side_effect = Exception()
+        mock_get_liftover.return_value = None
         _set_cache('search_results__{}__xpos'.format(results_model.guid), None)
         get_es_variants(results_model, num_results=2)
         self.assertExecutedSearch(
@@ -2343,13 +2700,13 @@ class EsUtilsTest(TestCase):
                 {'terms': {'variantId': ['2-103343363-GAGA-G']}},
                 ANNOTATION_QUERY,
             ],
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             size=2,
         )
 
         # Test liftover variant to hg38
-        mock_liftover.side_effect = None
-        mock_liftover.return_value.convert_coordinate.side_effect = lambda chrom, pos: [[chrom, pos + 10]]
+        mock_liftover.lift_many.side_effect = lambda chrom, positions: [(chrom, pos + 10) for pos in positions]
+        mock_get_liftover.return_value = mock_liftover
         _set_cache('search_results__{}__xpos'.format(results_model.guid), None)
         get_es_variants(results_model, num_results=2)
         self.assertExecutedSearch(
@@ -2358,10 +2715,10 @@ class EsUtilsTest(TestCase):
                 {'terms': {'variantId': ['2-103343363-GAGA-G', '2-103343373-GAGA-G']}},
                 ANNOTATION_QUERY,
             ],
-            sort=['xpos'],
+            sort=['xpos', 'variantId'],
             size=3,
         )
-        mock_liftover.assert_called_with('hg19', 'hg38')
+        mock_get_liftover.assert_called_with('37')
 
     @mock.patch('seqr.utils.elasticsearch.es_search.MAX_INDEX_NAME_LENGTH', 30)
     @urllib3_responses.activate
@@ -2377,7 +2734,7 @@ class EsUtilsTest(TestCase):
 
         get_es_variants(results_model, num_results=2)
 
-        self.assertExecutedSearch(index=INDEX_ALIAS, sort=['xpos'], size=6)
+        self.assertExecutedSearch(index=INDEX_ALIAS, sort=['xpos', 'variantId'], size=6)
         self.assertDictEqual(urllib3_responses.call_request_json(index=0), {
             'actions': [{'add': {'indices': [INDEX_NAME, SECOND_INDEX_NAME, SV_INDEX_NAME], 'alias': INDEX_ALIAS}}]})
 
@@ -2394,7 +2751,7 @@ class EsUtilsTest(TestCase):
 
         initial_cached_results = {
             'compound_het_results': [],
-            'variant_results': [PARSED_VARIANTS[1]],
+            'variant_result_runs': [[PARSED_VARIANTS[1]]],
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS}],
             'duplicate_doc_count': 0,
             'loaded_variant_counts': {'test_index_compound_het': {'total': 2, 'loaded': 2}, INDEX_NAME: {'loaded': 2, 'total': 5}},
@@ -2417,6 +2774,21 @@ class EsUtilsTest(TestCase):
         expected_cached_results.update(initial_cached_results)
         self.assertCachedResults(results_model, expected_cached_results)
 
+        # Test genes are loaded in pages
+        cache_key = 'search_results__{}__xpos'.format(results_model.guid)
+        _set_cache(cache_key, json.dumps(initial_cached_results))
+        for key in [key for key in REDIS_CACHE if key.startswith('{}__compiled__'.format(cache_key))]:
+            _set_cache(key, None)
+        with mock.patch('seqr.utils.elasticsearch.es_gene_agg_search.GENE_AGG_PAGE_SIZE', 1), mock.patch(
+                'seqr.utils.elasticsearch.es_search.GENE_AGG_PAGE_SIZE', 1):
+            self.assertDictEqual(get_es_variant_gene_counts(results_model), gene_counts)
+        self.assertDictEqual(
+            urllib3_responses.call_request_json(index=-2)['aggs']['genes']['composite']['after'],
+            {'gene_id': 'ENSG00000135953'})
+        self.assertDictEqual(
+            urllib3_responses.call_request_json()['aggs']['genes']['composite']['after'],
+            {'gene_id': 'ENSG00000228198'})
+
     @urllib3_responses.activate
     def test_multi_project_get_es_variant_gene_counts(self):
         setup_responses()
@@ -2430,7 +2802,7 @@ class EsUtilsTest(TestCase):
 
         initial_cached_results = {
             'compound_het_results': [{'ENSG00000228198': PARSED_COMPOUND_HET_VARIANTS_MULTI_PROJECT}],
-            'variant_results': [PARSED_MULTI_INDEX_VARIANT],
+            'variant_result_runs': [[PARSED_MULTI_INDEX_VARIANT]],
             'grouped_results': [{'null': [PARSED_VARIANTS[0]]}, {'ENSG00000135953': PARSED_COMPOUND_HET_VARIANTS_PROJECT_2}],
             'duplicate_doc_count': 3,
             'loaded_variant_counts': {
@@ -2465,8 +2837,8 @@ class EsUtilsTest(TestCase):
                         ]}},
                         {'bool': {
                             'must_not': [
-                                {'term': {'samples_gq_0_to_5': 'NA20885'}},
-                                {'term': {'samples_gq_5_to_10': 'NA20885'}},
+                                {'terms': {'samples_gq_0_to_5': ['NA20885']}},
+                                {'terms': {'samples_gq_5_to_10': ['NA20885']}},
                             ]
                         }}
                     ],
@@ -2583,7 +2955,200 @@ class EsUtilsTest(TestCase):
             'ENSG00000228198': {'total': 2, 'families': {'F000003_3': 2, 'F000011_11': 2}}
         })
 
+    def test_chunked_cached_get_es_variants(self):
+        search_model = VariantSearch.objects.create(search={})
+        results_model = VariantSearchResults.objects.create(variant_search=search_model)
+        cache_key = 'search_results__{}__xpos'.format(results_model.guid)
+        chunks_key = '{}__chunks'.format(cache_key)
+        all_results = [{'variantId': str(i), 'xpos': i} for i in range(250)]
+
+        _set_cached_search_results(cache_key, {
+            'all_results': all_results[:150], 'variant_result_runs': [all_results[150:160]], 'total_results': 250,
+        })
+        MOCK_REDIS.hmset.assert_called_with(chunks_key, {
+            'all_results:0': mock.ANY, 'all_results:1': mock.ANY, 'variant_result_runs:0': mock.ANY,
+        })
+        self.assertDictEqual(
+            decode_cache_value(REDIS_CACHE[cache_key]),
+            {'total_results': 250, '_cached_list_lengths': {'all_results': 150, 'variant_result_runs': 1}},
+        )
+
+        # Only the chunks for the requested page are loaded
+        MOCK_REDIS.hmget.reset_mock()
+        variants, total_results = get_es_variants(results_model, num_results=20, page=4)
+        self.assertListEqual(variants, all_results[60:80])
+        self.assertEqual(total_results, 250)
+        MOCK_REDIS.hmget.assert_called_once_with(chunks_key, ['all_results:0'])
+
+        MOCK_REDIS.hmget.reset_mock()
+        variants, _ = get_es_variants(results_model, num_results=50, page=2)
+        self.assertListEqual(variants, all_results[50:100])
+        variants, _ = get_es_variants(results_model, num_results=40, page=3)
+        self.assertListEqual(variants, all_results[80:120])
+        MOCK_REDIS.hmget.assert_has_calls([
+            mock.call(chunks_key, ['all_results:0']), mock.call(chunks_key, ['all_results:0', 'all_results:1']),
+        ])
+
+        # Appending results does not load previous chunks, and only writes the new and partially cached chunks
+        MOCK_REDIS.hmget.reset_mock()
+        MOCK_REDIS.hmset.reset_mock()
+        cached_results = _get_cached_search_results(cache_key)
+        cached_results['all_results'] = cached_results['all_results'] + all_results[150:240]
+        cached_results['all_results'].append(all_results[240])
+        cached_results['all_results'] += all_results[241:]
+        cached_results['variant_result_runs'] = []
+        self.assertListEqual(cached_results['all_results'][145:155], all_results[145:155])
+        self.assertListEqual(cached_results['all_results'][-5:], all_results[-5:])
+        MOCK_REDIS.hmget.assert_called_once_with(chunks_key, ['all_results:1'])
+
+        _set_cached_search_results(cache_key, cached_results)
+        MOCK_REDIS.hmset.assert_called_once_with(chunks_key, {'all_results:1': mock.ANY, 'all_results:2': mock.ANY})
+        cached_results = _load_cached_search_results(cache_key, _get_cached_search_results(cache_key))
+        self.assertDictEqual(cached_results, {'all_results': all_results, 'variant_result_runs': [], 'total_results': 250})
+
+        # Incomplete cached results are ignored
+        del REDIS_CACHE[chunks_key]['all_results:1']
+        with mock.patch('seqr.utils.elasticsearch.utils.logger') as mock_logger, \
+                self.assertRaises(InvalidSearchException):
+            get_es_variants(results_model, num_results=100, page=2)
+        mock_logger.warning.assert_called_with(
+            'Ignoring incomplete cached search results for {}: Missing cached results chunk "all_results:1"'.format(
+                cache_key))
+
+    @urllib3_responses.activate
+    def test_get_search_samples_by_family_index(self):
+        families = Family.objects.filter(guid__in=['F000002_2', 'F000011_11'])
+        samples_by_family_index = get_search_samples_by_family_index(families)
+        self.assertSetEqual(set(samples_by_family_index.keys()), {INDEX_NAME, SV_INDEX_NAME, SECOND_INDEX_NAME})
+        self.assertDictEqual(dict(samples_by_family_index[INDEX_NAME]), {'F000002_2': {
+            'HG00731': SearchSample('HG00731', 'WES', SearchIndividual('I000004_hg00731', 'A', 'F')),
+            'HG00732': SearchSample('HG00732', 'WES', SearchIndividual('I000005_hg00732', 'N', 'M')),
+            'HG00733': SearchSample('HG00733', 'WES', SearchIndividual('I000006_hg00733', 'N', 'F')),
+        }})
+        self.assertDictEqual(dict(samples_by_family_index[SECOND_INDEX_NAME]), {'F000011_11': {
+            'NA20885': SearchSample('NA20885', 'WES', SearchIndividual('I000015_na20885', 'A', 'M')),
+        }})
+
+        # Snapshots are cached per project
+        Sample.objects.filter(sample_id='HG00733').update(is_active=False)
+        with mock.patch('seqr.utils.elasticsearch.utils.Sample') as mock_sample:
+            self.assertDictEqual(get_search_samples_by_family_index(families), samples_by_family_index)
+            mock_sample.objects.filter.assert_not_called()
+
+        # Only requested families are returned from a cached snapshot
+        samples_by_family_index = get_search_samples_by_family_index(Family.objects.filter(guid='F000011_11'))
+        self.assertListEqual(list(samples_by_family_index.keys()), [SECOND_INDEX_NAME])
+
+        # Updating the version invalidates the cached snapshots
+        bump_search_samples_version()
+        samples_by_family_index = get_search_samples_by_family_index(families)
+        self.assertSetEqual(set(samples_by_family_index[INDEX_NAME]['F000002_2'].keys()), {'HG00731', 'HG00732'})
+
+        # Saving models only invalidates the cached snapshots when a field used in search changes
+        individual = Individual.objects.get(guid='I000004_hg00731')
+        individual.notes = 'updated notes'
+        individual.save()
+        with mock.patch('seqr.utils.elasticsearch.utils.Sample') as mock_sample:
+            get_search_samples_by_family_index(families)
+            mock_sample.objects.filter.assert_not_called()
+
+        individual.affected = 'N'
+        individual.save()
+        samples_by_family_index = get_search_samples_by_family_index(families)
+        self.assertEqual(samples_by_family_index[INDEX_NAME]['F000002_2']['HG00731'].individual.affected, 'N')
+
+        Sample.bulk_update(user=None, update_json={'is_active': True}, sample_id='HG00733')
+        samples_by_family_index = get_search_samples_by_family_index(families)
+        self.assertSetEqual(
+            set(samples_by_family_index[INDEX_NAME]['F000002_2'].keys()), {'HG00731', 'HG00732', 'HG00733'})
+
     @urllib3_responses.activate
+    def test_grouped_family_queries(self):
+        setup_responses()
+        inheritance = {'mode': 'de_novo', 'filter': {'affected': {'I000009_na20874': 'A'}}}
+        trio_query = {'bool': {'must': [{'bool': {
+            'should': [{'term': {'samples_num_alt_1': 'HG00731'}}, {'term': {'samples_num_alt_2': 'HG00731'}}],
+            'must_not': [
+                {'term': {'samples_no_call': 'HG00732'}},
+                {'term': {'samples_num_alt_1': 'HG00732'}},
+                {'term': {'samples_num_alt_2': 'HG00732'}},
+                {'term': {'samples_no_call': 'HG00733'}},
+                {'term': {'samples_num_alt_1': 'HG00733'}},
+                {'term': {'samples_num_alt_2': 'HG00733'}},
+            ],
+            'minimum_should_match': 1,
+        }}], '_name': 'F000002_2'}}
+        group_query = {'bool': {'must': [{'bool': {'should': [
+            {'terms': {'samples_num_alt_1': ['NA20870', 'NA20874']}},
+            {'terms': {'samples_num_alt_2': ['NA20870', 'NA20874']}},
+        ]}}], '_name': 'family_group_0'}}
+
+        es_search = EsSearch(self.families)
+        es_search.filter_by_annotation_and_genotype(deepcopy(inheritance))
+        self.assertDictEqual(es_search._index_searches[INDEX_NAME][0].to_dict(), {
+            'query': {'bool': {'filter': [{'bool': {'should': [trio_query, group_query]}}]}}
+        })
+
+        # Families in a group are determined from the samples with alt alleles
+        raw_hit = deepcopy(ES_VARIANTS[1])
+        raw_hit.update({'_index': INDEX_NAME, '_id': raw_hit['_source']['variantId'], 'matched_queries': ['family_group_0']})
+        self.assertListEqual(es_search._parse_hit(raw_hit)['familyGuids'], ['F000003_3'])
+
+        raw_hit['matched_queries'] = ['F000002_2', 'family_group_0']
+        raw_hit['_source']['samples_num_alt_2'] = ['HG00731', 'NA20874']
+        self.assertListEqual(es_search._parse_hit(raw_hit)['familyGuids'], ['F000002_2', 'F000003_3', 'F000005_5'])
+
+        # Gene aggregations load the alt samples needed to determine the families in a group
+        gene_agg_search = EsGeneAggSearch(self.families)
+        gene_agg_search.filter_by_annotation_and_genotype(deepcopy(inheritance))
+        gene_agg_search.aggregate_by_gene()
+        self.assertDictEqual(
+            gene_agg_search._index_searches[INDEX_NAME][0].to_dict()['aggs']['genes']['aggs']['vars_by_gene'],
+            {'top_hits': {'size': 100, '_source': ['samples_num_alt_1', 'samples_num_alt_2', 'samples']}})
+        gene_counts = defaultdict(lambda: {'total': 0, 'families': defaultdict(int), 'sample_ids': set()})
+        gene_agg = AttrDict({'key': {'gene_id': 'ENSG00000228198'}, 'doc_count': 1, 'vars_by_gene': {'hits': {'hits': [
+            raw_hit]}}})
+        gene_agg_search._parse_gene_agg(gene_agg, {'ENSG00000228198': [raw_hit]}, gene_counts)
+        self.assertDictEqual(gene_counts['ENSG00000228198']['families'], {'F000002_2': 1, 'F000003_3': 1, 'F000005_5': 1})
+
+        # Family queries are nested to stay within the clause limit
+        with mock.patch('seqr.utils.elasticsearch.es_search.MAX_FAMILY_QUERY_CLAUSES', 1):
+            es_search = EsSearch(self.families)
+            es_search.filter_by_annotation_and_genotype(deepcopy(inheritance))
+        self.assertDictEqual(es_search._index_searches[INDEX_NAME][0].to_dict(), {
+            'query': {'bool': {'filter': [{'bool': {'should': [
+                {'bool': {'should': [trio_query]}}, {'bool': {'should': [group_query]}},
+            ]}}]}}
+        })
+
+    def test_quality_filters_by_family(self):
+        sample_ids = ['S{}'.format(i) for i in range(500)]
+        samples_by_family_index = {INDEX_NAME: {'F1': {sample_id: None for sample_id in sample_ids}}}
+        quality_filter = {'min_gq': 60, 'min_ab': 10}
+
+        _get_sample_quality_filter.cache_clear()
+        quality_q = _quality_filters_by_family(quality_filter, samples_by_family_index, [INDEX_NAME])['F1']
+        excluded_qs = quality_q.to_dict()['bool']['must_not']
+        gq_terms = [q['terms'] for q in excluded_qs if 'terms' in q]
+        self.assertEqual(len(gq_terms), 12)
+        self.assertListEqual(gq_terms[0]['samples_gq_0_to_5'], sorted(sample_ids))
+        self.assertDictEqual(excluded_qs[0], {'bool': {'must': [
+            {'term': {'samples_num_alt_1': 'S0'}},
+            {'bool': {'should': [{'term': {'samples_ab_0_to_5': 'S0'}}, {'term': {'samples_ab_5_to_10': 'S0'}}]}},
+        ]}})
+
+        # The compiled filter is much smaller than a separate term query for each sample and quality bin
+        per_sample_gq_terms = [
+            {'term': {'samples_gq_{}_to_{}'.format(i, i + 5): sample_id}} for i in range(0, 60, 5) for sample_id in sample_ids
+        ]
+        self.assertLess(len(json.dumps(gq_terms)) * 5, len(json.dumps(per_sample_gq_terms)))
+
+        # Filters are memoized for the same quality filter and samples
+        _quality_filters_by_family(quality_filter, samples_by_family_index, [INDEX_NAME])
+        self.assertEqual(_get_sample_quality_filter.cache_info().hits, 1)
+        _quality_filters_by_family({'min_gq': 60}, samples_by_family_index, [INDEX_NAME])
+        self.assertEqual(_get_sample_quality_filter.cache_info().misses, 2)
+
     def test_get_family_affected_status(self):
         setup_responses()
         samples_by_id = {'F000002_2': {
@@ -2615,7 +3180,7 @@ class EsUtilsTest(TestCase):
 
         variants, _ = get_es_variants(results_model, sort='primate_ai', num_results=2)
         self.assertExecutedSearch(filters=[ANNOTATION_QUERY], sort=[
-            {'primate_ai_score': {'order': 'desc', 'unmapped_type': 'double'}}, 'xpos'])
+            {'primate_ai_score': {'order': 'desc', 'unmapped_type': 'double'}}, 'xpos', 'variantId'])
         self.assertEqual(variants[0]['_sort'][0], maxsize)
         self.assertEqual(variants[1]['_sort'][0], -1)
 
@@ -2629,24 +3194,108 @@ class EsUtilsTest(TestCase):
                         'source': mock.ANY,
                     }
                 }
-            }, 'xpos'])
+            }, 'xpos', 'variantId'])
         self.assertEqual(variants[0]['_sort'][0], 0.00012925741614425127)
         self.assertEqual(variants[1]['_sort'][0], maxsize)
 
+        REGISTERED_SORT_SCRIPT_IDS.clear()
+        _get_sort_script_params.cache_clear()
         variants, _ = get_es_variants(results_model, sort='in_omim', num_results=2)
+        omim_sort_params = {'omim_gene_ids': {'ENSG00000223972': 1, 'ENSG00000243485': 1, 'ENSG00000268020': 1}}
         self.assertExecutedSearch(filters=[ANNOTATION_QUERY], sort=[
             {
                 '_script': {
                     'type': 'number',
                     'order': 'desc',
                     'script': {
-                        'params': {
-                            'omim_gene_ids': ['ENSG00000223972', 'ENSG00000243485', 'ENSG00000268020']
-                        },
-                        'source': mock.ANY,
+                        'id': mock.ANY,
+                        'params': omim_sort_params,
                     }
                 }
-            }, 'xpos'])
+            }, 'xpos', 'variantId'])
+        omim_script_id = urllib3_responses.call_request_json()['sort'][0]['_script']['script']['id']
+        self.assertTrue(omim_script_id.startswith('seqr_sort_in_omim_'))
+        stored_script_request = urllib3_responses.calls[-2].request
+        self.assertEqual(stored_script_request.url, '/_scripts/{}'.format(omim_script_id))
+        self.assertEqual(json.loads(stored_script_request.body)['script']['lang'], 'painless')
+        omim_version = decode_cache_value(REDIS_CACHE['sort_script_params_version__in_omim'])
+        self.assertDictEqual(
+            decode_cache_value(REDIS_CACHE['sort_script_params__in_omim__v{}'.format(omim_version)]), omim_sort_params)
+        self.assertTrue(decode_cache_value(REDIS_CACHE['stored_sort_script__{}'.format(omim_script_id)]))
+
+        # Scripts are only stored once and params are loaded from the cache until the reference data is updated
+        num_calls = len(urllib3_responses.calls)
+        with mock.patch('seqr.utils.elasticsearch.constants.Omim.objects.filter') as mock_omim_filter:
+            get_es_variants(results_model, sort='in_omim', page=2, num_results=2)
+            mock_omim_filter.assert_not_called()
+        self.assertEqual(len(urllib3_responses.calls), num_calls + 1)
+        self.assertDictEqual(
+            urllib3_responses.call_request_json()['sort'][0]['_script']['script'],
+            {'id': omim_script_id, 'params': omim_sort_params})
+
+        # Scripts stored by other workers are not stored again
+        REGISTERED_SORT_SCRIPT_IDS.clear()
+        for key in [key for key in REDIS_CACHE if key.startswith('search_results__{}'.format(results_model.guid))]:
+            _set_cache(key, None)
+        with mock.patch('elasticsearch.Elasticsearch.put_script') as mock_put_script:
+            get_es_variants(results_model, sort='in_omim', num_results=2)
+            mock_put_script.assert_not_called()
+        self.assertEqual(urllib3_responses.call_request_json()['sort'][0]['_script']['script']['id'], omim_script_id)
+
+        _set_cache('search_results__{}__in_omim'.format(results_model.guid), None)
+        get_es_variants(results_model, sort='constraint', num_results=2)
+        self.assertExecutedSearch(filters=[ANNOTATION_QUERY], sort=[
+            {
+                '_script': {
+                    'type': 'number',
+                    'order': 'asc',
+                    'script': {
+                        'id': mock.ANY,
+                        'params': {'constraint_ranks_by_gene': {'ENSG00000223972': 2}},
+                    }
+                }
+            }, 'xpos', 'variantId'])
+        constraint_version = get_sort_script_params_version('constraint')
+        self.assertIn('sort_script_params__constraint__v{}'.format(constraint_version), REDIS_CACHE)
+
+        # Fall back to inline scripts if the script can not be stored
+        # Updating the reference data changes the params version once the cached version expires, so the params and the
+        # compiled search are rebuilt
+        GeneConstraint.objects.create(
+            gene=GeneInfo.objects.get(gene_id='ENSG00000227232'), mis_z=-0.5, mis_z_rank=2, pLI=0.001, pLI_rank=2,
+            louef=1.5, louef_rank=1)
+        self.assertEqual(get_sort_script_params_version('constraint'), constraint_version)
+        _set_cache('sort_script_params_version__constraint', None)
+        self.assertNotEqual(get_sort_script_params_version('constraint'), constraint_version)
+        REGISTERED_SORT_SCRIPT_IDS.clear()
+        for key in [key for key in REDIS_CACHE if key.startswith('stored_sort_script__seqr_sort_constraint')]:
+            _set_cache(key, None)
+        _set_cache('search_results__{}__constraint'.format(results_model.guid), None)
+        with mock.patch('elasticsearch.Elasticsearch.put_script') as mock_put_script:
+            mock_put_script.side_effect = TransportError(403, 'unauthorized')
+            get_es_variants(results_model, sort='constraint', num_results=2)
+        self.assertDictEqual(urllib3_responses.call_request_json()['sort'][0]['_script']['script'], {
+            'source': mock.ANY, 'params': {'constraint_ranks_by_gene': {'ENSG00000223972': 2, 'ENSG00000227232': 4}},
+        })
+        self.assertSetEqual(REGISTERED_SORT_SCRIPT_IDS, set())
+
+        # Sort on precomputed ranks when they are available in the index
+        _set_cache('search_results__{}__constraint'.format(results_model.guid), None)
+        index_metadata_cache_key = 'index_metadata__{},{}'.format(INDEX_NAME, SV_INDEX_NAME)
+        _set_cache(index_metadata_cache_key, None)
+        with mock.patch.dict(MAPPING_PROPERTIES, {'constraint_rank': {'type': 'integer'}}):
+            get_es_variants(results_model, sort='constraint', num_results=2)
+        # Ranks must be present in all the searched indices
+        self.assertIn('_script', urllib3_responses.call_request_json()['sort'][0])
+
+        _set_cache('search_results__{}__constraint'.format(results_model.guid), None)
+        _set_cache(index_metadata_cache_key, None)
+        with mock.patch.dict(MAPPING_PROPERTIES, {'constraint_rank': {'type': 'integer'}}), mock.patch.dict(
+                INDEX_METADATA[SV_INDEX_NAME]['properties'], {'constraint_rank': {'type': 'integer'}}):
+            get_es_variants(results_model, sort='constraint', num_results=2)
+        self.assertExecutedSearch(filters=[ANNOTATION_QUERY], sort=[
+            {'constraint_rank': {'order': 'asc'}}, 'xpos', 'variantId'])
+        _set_cache(index_metadata_cache_key, None)
 
     @urllib3_responses.activate
     def test_deduplicate_variants(self):
@@ -2662,6 +3311,71 @@ class EsUtilsTest(TestCase):
             deepcopy([PARSED_MULTI_GENOME_VERSION_VARIANT, PARSED_MULTI_GENOME_VERSION_VARIANT, PARSED_VARIANTS[1]])
         ), [PARSED_MULTI_SAMPLE_MULTI_GENOME_VERSION_VARIANT])
 
+    def test_merge_sorted_runs(self):
+        def _variant(variant_id, sort, family_guid='F000001_1'):
+            return {
+                'variantId': variant_id, '_sort': [sort], 'genomeVersion': '37', 'familyGuids': [family_guid],
+                'genotypes': {'I{}'.format(family_guid): {'numAlt': 1}},
+            }
+        sorted_runs = [
+            [_variant('1', 1), _variant('3', 3), _variant('5', 5)],
+            [_variant('2', 2), _variant('3', 3, family_guid='F000002_2'), _variant('6', 6)],
+        ]
+        es_search = EsSearch.from_samples({}, {}, previous_search_results={'total_results': 6})
+
+        # Merging stops once the page is full, and the rest of each run is kept
+        variant_results, remaining_runs = es_search._merge_sorted_runs(sorted_runs, 2)
+        self.assertListEqual([variant['variantId'] for variant in variant_results], ['1', '2'])
+        self.assertListEqual(remaining_runs, [sorted_runs[0][1:], sorted_runs[1][1:]])
+        self.assertEqual(es_search.previous_search_results['total_results'], 6)
+
+        # Duplicates of the last variant on the page are merged into it
+        variant_results, remaining_runs = es_search._merge_sorted_runs(remaining_runs, 1)
+        self.assertListEqual([variant['variantId'] for variant in variant_results], ['3'])
+        self.assertListEqual(variant_results[0]['familyGuids'], ['F000001_1', 'F000002_2'])
+        self.assertListEqual(remaining_runs, [sorted_runs[0][2:], sorted_runs[1][2:]])
+        self.assertEqual(es_search.previous_search_results['duplicate_doc_count'], 1)
+        self.assertEqual(es_search.previous_search_results['total_results'], 5)
+
+        variant_results, remaining_runs = es_search._merge_sorted_runs(remaining_runs, 5)
+        self.assertListEqual([variant['variantId'] for variant in variant_results], ['5', '6'])
+        self.assertListEqual(remaining_runs, [])
+
+    def test_deduplicate_compound_het_results(self):
+        es_search = EsSearch.from_samples({}, {}, previous_search_results={
+            'total_results': 6, 'duplicate_doc_count': 1,
+            'compound_het_pair_keys': [
+                ['ENSG00000135953', ['1-248367227-TC-T-het', '2-103343353-GAGA-G-het']],
+                ['ENSG00000228198', ['1-248367227-TC-T', '2-103343353-GAGA-G']],
+            ],
+        })
+        compound_het_results = [{'ENSG00000228198': deepcopy(PARSED_COMPOUND_HET_VARIANTS)}]
+        project_2_duplicate = deepcopy(PARSED_COMPOUND_HET_VARIANTS_PROJECT_2)
+        for variant, parsed_variant in zip(project_2_duplicate, PARSED_COMPOUND_HET_VARIANTS):
+            variant['variantId'] = parsed_variant['variantId']
+
+        results = es_search._deduplicate_compound_het_results(compound_het_results, [
+            {'ENSG00000228198': project_2_duplicate},
+            {'ENSG00000135953': deepcopy(PARSED_COMPOUND_HET_VARIANTS_PROJECT_2)},
+            {'ENSG00000135953': deepcopy(PARSED_COMPOUND_HET_VARIANTS)},
+        ])
+
+        # Duplicates of unreturned pairs are merged in place, and duplicates of returned pairs are excluded
+        self.assertEqual(len(results), 2)
+        self.assertIs(results[0], compound_het_results[0])
+        self.assertListEqual(results[1]['ENSG00000135953'], PARSED_COMPOUND_HET_VARIANTS)
+        for variant, parsed_variant in zip(results[0]['ENSG00000228198'], PARSED_COMPOUND_HET_VARIANTS):
+            self.assertListEqual(variant['familyGuids'], sorted(parsed_variant['familyGuids'] + ['F000011_11']))
+            self.assertSetEqual(set(variant['genotypes'].keys()), set(parsed_variant['genotypes'].keys()) | {'I000015_na20885'})
+        self.assertDictEqual(es_search.previous_search_results, {
+            'total_results': 4, 'duplicate_doc_count': 3,
+            'compound_het_pair_keys': [
+                ['ENSG00000135953', ['1-248367227-TC-T', '2-103343353-GAGA-G']],
+                ['ENSG00000135953', ['1-248367227-TC-T-het', '2-103343353-GAGA-G-het']],
+                ['ENSG00000228198', ['1-248367227-TC-T', '2-103343353-GAGA-G']],
+            ],
+        })
+
     @urllib3_responses.activate
     def test_genotype_inheritance_filter(self):
         setup_responses()
@@ -2690,14 +3404,17 @@ class EsUtilsTest(TestCase):
             annotation_query = {'terms': {'transcriptConsequenceTerms': [next(iter(annotations.values()))[0]]}}
             if expected_comp_het_filter:
                 self.assertExecutedSearches([
-                    dict(sort=['xpos'], gene_aggs=True, start_index=0, size=1, index=index, filters=[
+                    dict(sort=['xpos', 'variantId'], gene_aggs=True, start_index=0, size=1, index=index, filters=[
                         annotation_query, {'bool': {'_name': 'F000002_2', 'must': [expected_comp_het_filter]}}
                     ]),
-                    dict(sort=['xpos'], start_index=0, size=2, index=index, filters=[
+                    dict(sort=['xpos', 'variantId'], start_index=0, size=2, index=index, filters=[
                         annotation_query,  {'bool': {'_name': 'F000002_2', 'must': [expected_filter]}}])
                 ])
+            elif kwargs.get('gene_aggs'):
+                self.assertExecutedSearches([dict(sort=['xpos', 'variantId'], start_index=0, index=index, filters=[
+                    annotation_query, {'bool': {'_name': 'F000002_2', 'must': [expected_filter]}}], **kwargs)])
             else:
-                self.assertExecutedSearch(sort=['xpos'], index=index, filters=[
+                self.assertExecutedSearch(sort=['xpos', 'variantId'], index=index, filters=[
                     annotation_query, {'bool': {'_name': 'F000002_2', 'must': [expected_filter]}}], **kwargs)
 
         # custom genotype
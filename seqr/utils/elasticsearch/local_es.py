@@ -0,0 +1,709 @@
+from collections import defaultdict
+from datetime import datetime
+from fnmatch import fnmatch
+from functools import cmp_to_key
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+from threading import Lock
+from timeit import default_timer as timer
+from urllib.parse import urlparse, parse_qs
+
+from seqr.models import Sample
+from seqr.utils.elasticsearch.benchmark_utils import generate_es_hits
+from seqr.utils.elasticsearch.constants import QUALITY_FIELDS
+from seqr.utils.xpos_utils import get_xpos
+
+logger = logging.getLogger(__name__)
+
+LOCAL_ES_VERSION = '7.10.2'
+MAPPING_FILE = 'mapping.json'
+DOCS_FILE = 'docs.jsonl'
+DEFAULT_SEARCH_SIZE = 10
+DEFAULT_TOP_HITS_SIZE = 3
+DEFAULT_TERMS_AGG_SIZE = 10
+MISSING_SORT_VALUES = {False: 'Infinity', True: '-Infinity'}
+
+
+class LocalEsException(Exception):
+
+    def __init__(self, status, error_type, reason):
+        super(LocalEsException, self).__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+    def to_json(self):
+        error = {'type': self.error_type, 'reason': self.reason}
+        return {'error': dict(root_cause=[error], **error), 'status': self.status}
+
+
+class _LocalEsDoc(object):
+    __slots__ = ['index', 'id', 'source', '_values']
+
+    def __init__(self, index, doc_id, source):
+        self.index = index
+        self.id = doc_id
+        self.source = source
+        self._values = {}
+
+    def values(self, field):
+        # Field values are looked up as sets, as most queries check for any overlap with a list of terms
+        values = self._values.get(field)
+        if values is None:
+            value = self.source.get(field)
+            if value is None:
+                values = frozenset()
+            elif isinstance(value, list):
+                values = frozenset(v for v in value if v is not None and not isinstance(v, dict))
+            else:
+                values = frozenset([value])
+            self._values[field] = values
+        return values
+
+
+class LocalEsStore(object):
+    """An in-memory stand-in for the subset of the elasticsearch API used by seqr, for load testing the rest of the stack
+    without a cluster. Supports mappings, aliases, stored scripts and tasks, as well as searches with bool, term, terms,
+    range, exists and match queries, named queries, field sorts, from/ size and search_after pagination, and composite,
+    terms and top_hits aggregations.
+
+    Every document is checked for each search, so search times do not reflect a real cluster. Script sorts can not be
+    run, so documents all have the same value for them and are ordered by the remaining sort fields"""
+
+    def __init__(self):
+        self._indices = {}
+        self._aliases = defaultdict(set)
+        self._lock = Lock()
+
+    @classmethod
+    def load(cls, store_dir):
+        store = cls()
+        for index_name in sorted(os.listdir(store_dir)):
+            index_dir = os.path.join(store_dir, index_name)
+            if not os.path.isfile(os.path.join(index_dir, MAPPING_FILE)):
+                continue
+            with open(os.path.join(index_dir, MAPPING_FILE)) as f:
+                mapping = json.load(f)
+            with open(os.path.join(index_dir, DOCS_FILE)) as f:
+                docs = [json.loads(line) for line in f if line.strip()]
+            store.add_index(index_name, mapping, [(doc['_id'], doc['_source']) for doc in docs])
+        return store
+
+    def add_index(self, index_name, mapping, docs):
+        docs = [_LocalEsDoc(index_name, doc_id, source) for doc_id, source in docs]
+        with self._lock:
+            self._indices[index_name] = {
+                'mapping': mapping, 'docs': docs, 'docs_by_id': {doc.id: doc for doc in docs},
+                'created': datetime.now(),
+            }
+
+    def _resolve_indices(self, index_expr):
+        with self._lock:
+            index_names = set()
+            for name in (index_expr or '_all').split(','):
+                if name in {'_all', '*'}:
+                    index_names.update(self._indices.keys())
+                elif name in self._indices:
+                    index_names.add(name)
+                elif name in self._aliases:
+                    index_names.update(self._aliases[name])
+                elif '*' in name:
+                    index_names.update(index for index in self._indices.keys() if fnmatch(index, name))
+                else:
+                    raise LocalEsException(404, 'index_not_found_exception', 'no such index [{}]'.format(name))
+            return [self._indices[index] for index in sorted(index_names)], sorted(index_names)
+
+    def info(self):
+        return {
+            'name': 'local', 'cluster_name': 'seqr-local', 'version': {'number': LOCAL_ES_VERSION},
+            'tagline': 'You Know, for Search',
+        }
+
+    def get_mapping(self, index_expr):
+        indices, index_names = self._resolve_indices(index_expr)
+        return {index_name: {'mappings': index['mapping']} for index_name, index in zip(index_names, indices)}
+
+    def update_aliases(self, body):
+        for action in body.get('actions', []):
+            (action_type, config), = action.items()
+            index_names = config.get('indices') or [config['index']]
+            aliases = config.get('aliases') or [config['alias']]
+            if action_type == 'add':
+                # Raises an error for missing indices
+                self._resolve_indices(','.join(index_names))
+            with self._lock:
+                for alias in aliases:
+                    if action_type == 'add':
+                        self._aliases[alias].update(index_names)
+                    else:
+                        self._aliases[alias].difference_update(index_names)
+        return {'acknowledged': True}
+
+    def cat_aliases(self):
+        with self._lock:
+            return [
+                {'alias': alias, 'index': index} for alias, indices in sorted(self._aliases.items())
+                for index in sorted(indices)
+            ]
+
+    def cat_indices(self):
+        with self._lock:
+            return [{
+                'index': index_name, 'docs.count': str(len(index['docs'])), 'store.size': '0b',
+                'creation.date.string': index['created'].isoformat(),
+            } for index_name, index in sorted(self._indices.items())]
+
+    def cat_allocation(self):
+        with self._lock:
+            num_shards = len(self._indices)
+        return [{'node': 'local', 'shards': str(num_shards), 'disk.avail': '0b', 'disk.used': '0b', 'disk.percent': '0'}]
+
+    def search(self, index_expr, body):
+        start = timer()
+        indices, _ = self._resolve_indices(index_expr)
+        matches = _compile_query(body.get('query'))
+        matched_docs = []
+        for index in indices:
+            for doc in index['docs']:
+                matched_names = set()
+                if matches(doc, matched_names):
+                    matched_docs.append((doc, matched_names))
+
+        sort = body.get('sort')
+        hits = _get_sorted_hits(matched_docs, sort)
+        if body.get('search_after') is not None:
+            search_after = _parse_sort_values(body['search_after'])
+            descending = _get_sort_descending(sort)
+            hits = [hit for hit in hits if _compare_sort_values(hit[2], search_after, descending) > 0]
+        from_index = body.get('from') or 0
+        size = body.get('size', DEFAULT_SEARCH_SIZE)
+        response_hits = [
+            _format_hit(doc, matched_names, sort_values if sort else None, body.get('_source'))
+            for doc, matched_names, sort_values in hits[from_index:from_index + size]
+        ]
+
+        response = {
+            'timed_out': False,
+            '_shards': {'total': len(indices), 'successful': len(indices), 'skipped': 0, 'failed': 0},
+            'hits': {'total': {'value': len(matched_docs), 'relation': 'eq'}, 'max_score': None, 'hits': response_hits},
+        }
+        aggs = body.get('aggs') or body.get('aggregations')
+        if aggs:
+            response['aggregations'] = _aggregate(aggs, matched_docs)
+        if body.get('profile'):
+            response['profile'] = {'shards': []}
+        response['took'] = int((timer() - start) * 1000)
+        return response
+
+    def msearch(self, index_expr, lines):
+        start = timer()
+        responses = []
+        for header, body in zip(lines[::2], lines[1::2]):
+            header = json.loads(header)
+            header_index = header.get('index')
+            if isinstance(header_index, list):
+                header_index = ','.join(header_index)
+            try:
+                response = self.search(header_index or index_expr, json.loads(body))
+                response['status'] = 200
+            except LocalEsException as e:
+                response = e.to_json()
+            responses.append(response)
+        return {'took': int((timer() - start) * 1000), 'responses': responses}
+
+    def mget(self, index_expr, body, source_includes=None):
+        indices, index_names = self._resolve_indices(index_expr)
+        source = source_includes.split(',') if source_includes else None
+        docs = []
+        for doc_id in body['ids']:
+            doc = next((index['docs_by_id'][doc_id] for index in indices if doc_id in index['docs_by_id']), None)
+            if doc:
+                docs.append(dict(found=True, _version=1, **_format_hit(doc, None, None, source)))
+            else:
+                docs.append({'_index': index_names[0], '_type': '_doc', '_id': doc_id, 'found': False})
+        return {'docs': docs}
+
+    def list_tasks(self):
+        return {'tasks': {}}
+
+    def cancel_tasks(self):
+        return {'nodes': {}}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _get_query_field(params):
+    params = {k: v for k, v in params.items() if k not in {'_name', 'boost'}}
+    if len(params) != 1:
+        raise LocalEsException(400, 'parsing_exception', 'Expected a single field, found [{}]'.format(
+            ', '.join(sorted(params.keys()))))
+    return next(iter(params.items()))
+
+
+def _compile_query(query):
+    """Compiles an elasticsearch query to a function which returns whether a document matches it, and adds the names of
+    any matched named queries to the given set"""
+    if not query:
+        return lambda doc, matched_names: True
+    if len(query) != 1:
+        raise LocalEsException(400, 'parsing_exception', 'Expected a single query type, found [{}]'.format(
+            ', '.join(sorted(query.keys()))))
+    query_type, params = next(iter(query.items()))
+    compile_func = QUERY_COMPILERS.get(query_type)
+    if not compile_func:
+        raise LocalEsException(400, 'parsing_exception', 'Unsupported query type [{}]'.format(query_type))
+
+    name = params.get('_name')
+    matches = compile_func(params)
+    if query_type != 'bool':
+        field_config = next((v for k, v in params.items() if k not in {'_name', 'boost'}), None)
+        if isinstance(field_config, dict) and field_config.get('_name'):
+            name = field_config['_name']
+    if not name:
+        return matches
+
+    def _named_matches(doc, matched_names):
+        if matches(doc, matched_names):
+            matched_names.add(name)
+            return True
+        return False
+    return _named_matches
+
+
+def _compile_bool_query(params):
+    required = [_compile_query(q) for q in _as_list(params.get('must')) + _as_list(params.get('filter'))]
+    should = [_compile_query(q) for q in _as_list(params.get('should'))]
+    must_not = [_compile_query(q) for q in _as_list(params.get('must_not'))]
+    min_should_match = params.get('minimum_should_match')
+    min_should_match = int(min_should_match) if min_should_match is not None else int(bool(should and not required))
+
+    def _matches(doc, matched_names):
+        # Named queries are only matched if the whole bool query matches
+        bool_matched_names = set()
+        if not all(q(doc, bool_matched_names) for q in required):
+            return False
+        if any(q(doc, set()) for q in must_not):
+            return False
+        # All should clauses are checked, so every matched named query is returned
+        if should and sum([q(doc, bool_matched_names) for q in should]) < min_should_match:
+            return False
+        matched_names.update(bool_matched_names)
+        return True
+    return _matches
+
+
+def _compile_term_query(params):
+    field, value = _get_query_field(params)
+    if isinstance(value, dict):
+        value = value['value']
+    return lambda doc, matched_names: value in doc.values(field)
+
+
+def _compile_terms_query(params):
+    field, values = _get_query_field(params)
+    values = frozenset(values)
+    return lambda doc, matched_names: not values.isdisjoint(doc.values(field))
+
+
+def _compile_match_query(params):
+    field, value = _get_query_field(params)
+    if isinstance(value, dict):
+        value = value['query']
+    return lambda doc, matched_names: value in doc.values(field)
+
+
+def _compile_range_query(params):
+    field, bounds = _get_query_field(params)
+    comparisons = [(op, bounds[op]) for op in ['gt', 'gte', 'lt', 'lte'] if bounds.get(op) is not None]
+
+    def _in_range(value):
+        try:
+            return all(RANGE_COMPARISONS[op](value, bound) for op, bound in comparisons)
+        except TypeError:
+            return False
+
+    return lambda doc, matched_names: any(_in_range(value) for value in doc.values(field))
+
+
+def _compile_exists_query(params):
+    field = params['field']
+    return lambda doc, matched_names: doc.source.get(field) not in (None, [])
+
+
+def _compile_ids_query(params):
+    ids = frozenset(params['values'])
+    return lambda doc, matched_names: doc.id in ids
+
+
+RANGE_COMPARISONS = {
+    'gt': lambda value, bound: value > bound,
+    'gte': lambda value, bound: value >= bound,
+    'lt': lambda value, bound: value < bound,
+    'lte': lambda value, bound: value <= bound,
+}
+
+QUERY_COMPILERS = {
+    'bool': _compile_bool_query,
+    'term': _compile_term_query,
+    'terms': _compile_terms_query,
+    'match': _compile_match_query,
+    'range': _compile_range_query,
+    'exists': _compile_exists_query,
+    'ids': _compile_ids_query,
+    'match_all': lambda params: lambda doc, matched_names: True,
+}
+
+
+def _parse_sort_configs(sort):
+    sort_configs = []
+    for sort_spec in _as_list(sort):
+        if isinstance(sort_spec, str):
+            sort_configs.append((sort_spec, False))
+            continue
+        field, config = next(iter(sort_spec.items()))
+        order = config if isinstance(config, str) else config.get('order')
+        sort_configs.append((field, order == 'desc'))
+    return sort_configs
+
+
+def _get_sort_descending(sort):
+    return [descending for _, descending in _parse_sort_configs(sort)]
+
+
+def _get_doc_sort_values(doc, sort_configs):
+    # Sort values are (is_missing, value) so documents missing a sort field are always last, as in elasticsearch
+    sort_values = []
+    for field, descending in sort_configs:
+        if field == '_script':
+            sort_values.append((False, 0.0))
+            continue
+        values = doc.values(field)
+        if not values:
+            sort_values.append((True, MISSING_SORT_VALUES[descending]))
+        else:
+            sort_values.append((False, max(values) if descending else min(values)))
+    return sort_values
+
+
+def _parse_sort_values(sort_values):
+    return [(value in {'Infinity', '-Infinity', None}, value) for value in sort_values]
+
+
+def _compare_sort_values(sort_values, other_sort_values, descending):
+    for (missing, value), (other_missing, other_value), desc in zip(sort_values, other_sort_values, descending):
+        if missing or other_missing:
+            if missing != other_missing:
+                return 1 if missing else -1
+            continue
+        if value != other_value:
+            result = 1 if value > other_value else -1
+            return -result if desc else result
+    return 0
+
+
+def _get_sorted_hits(matched_docs, sort):
+    sort_configs = _parse_sort_configs(sort)
+    hits = [(doc, matched_names, _get_doc_sort_values(doc, sort_configs)) for doc, matched_names in matched_docs]
+    if sort_configs:
+        descending = [desc for _, desc in sort_configs]
+        hits.sort(key=cmp_to_key(lambda hit, other_hit: _compare_sort_values(hit[2], other_hit[2], descending)))
+    return hits
+
+
+def _filter_source(source, source_config):
+    if source_config is None or source_config is True:
+        return source
+    if source_config is False:
+        return None
+    excludes = []
+    if isinstance(source_config, dict):
+        includes = _as_list(source_config.get('includes'))
+        excludes = _as_list(source_config.get('excludes'))
+    else:
+        includes = _as_list(source_config)
+
+    include_fields = {field for field in includes if '*' not in field}
+    include_patterns = [field for field in includes if '*' in field]
+    return {
+        field: value for field, value in source.items()
+        if (not includes or field in include_fields or any(fnmatch(field, pattern) for pattern in include_patterns))
+        and not any(fnmatch(field, pattern) for pattern in excludes)
+    }
+
+
+def _format_hit(doc, matched_names, sort_values, source_config):
+    hit = {'_index': doc.index, '_type': '_doc', '_id': doc.id, '_score': None}
+    source = _filter_source(doc.source, source_config)
+    if source is not None:
+        hit['_source'] = source
+    if sort_values is not None:
+        hit['sort'] = [value for _, value in sort_values]
+    if matched_names:
+        hit['matched_queries'] = sorted(matched_names)
+    return hit
+
+
+def _aggregate(aggs, matched_docs):
+    results = {}
+    for name, agg in aggs.items():
+        agg = dict(agg)
+        sub_aggs = agg.pop('aggs', None) or agg.pop('aggregations', None) or {}
+        agg.pop('meta', None)
+        agg_type, params = next(iter(agg.items()))
+        agg_func = AGGREGATIONS.get(agg_type)
+        if not agg_func:
+            raise LocalEsException(400, 'parsing_exception', 'Unsupported aggregation type [{}]'.format(agg_type))
+        results[name] = agg_func(params, sub_aggs, matched_docs)
+    return results
+
+
+def _get_bucket(key, bucket_docs, sub_aggs):
+    bucket = {'key': key, 'doc_count': len(bucket_docs)}
+    bucket.update(_aggregate(sub_aggs, bucket_docs))
+    return bucket
+
+
+def _composite_agg(params, sub_aggs, matched_docs):
+    sources = []
+    for source in params['sources']:
+        source_name, source_config = next(iter(source.items()))
+        sources.append((source_name, source_config['terms']['field']))
+
+    # Multi-valued fields add the document to a bucket for each value
+    docs_by_key = defaultdict(list)
+    for doc, matched_names in matched_docs:
+        bucket_keys = [()]
+        for _, field in sources:
+            bucket_keys = [key + (value,) for key in bucket_keys for value in sorted(doc.values(field))]
+        for key in bucket_keys:
+            docs_by_key[key].append((doc, matched_names))
+
+    sorted_keys = sorted(docs_by_key.keys())
+    after = params.get('after')
+    if after:
+        after_key = tuple(after[source_name] for source_name, _ in sources)
+        sorted_keys = [key for key in sorted_keys if key > after_key]
+    sorted_keys = sorted_keys[:params.get('size', DEFAULT_TERMS_AGG_SIZE)]
+
+    result = {'buckets': [
+        _get_bucket(dict(zip([source_name for source_name, _ in sources], key)), docs_by_key[key], sub_aggs)
+        for key in sorted_keys
+    ]}
+    if result['buckets']:
+        result['after_key'] = result['buckets'][-1]['key']
+    return result
+
+
+def _terms_agg(params, sub_aggs, matched_docs):
+    docs_by_value = defaultdict(list)
+    for doc, matched_names in matched_docs:
+        for value in doc.values(params['field']):
+            docs_by_value[value].append((doc, matched_names))
+
+    sorted_values = sorted(docs_by_value.keys(), key=lambda value: (-len(docs_by_value[value]), value))
+    size = params.get('size', DEFAULT_TERMS_AGG_SIZE)
+    return {
+        'doc_count_error_upper_bound': 0,
+        'sum_other_doc_count': sum(len(docs_by_value[value]) for value in sorted_values[size:]),
+        'buckets': [_get_bucket(value, docs_by_value[value], sub_aggs) for value in sorted_values[:size]],
+    }
+
+
+def _top_hits_agg(params, sub_aggs, matched_docs):
+    sort = params.get('sort')
+    hits = _get_sorted_hits(matched_docs, sort)[:params.get('size', DEFAULT_TOP_HITS_SIZE)]
+    return {'hits': {
+        'total': {'value': len(matched_docs), 'relation': 'eq'}, 'max_score': None,
+        'hits': [
+            _format_hit(doc, matched_names, sort_values if sort else None, params.get('_source'))
+            for doc, matched_names, sort_values in hits
+        ],
+    }}
+
+
+AGGREGATIONS = {
+    'composite': _composite_agg,
+    'terms': _terms_agg,
+    'top_hits': _top_hits_agg,
+}
+
+
+def handle_local_es_request(store, method, path, params, body):
+    """Routes an elasticsearch REST API request to the store, and returns the response status and JSON"""
+    path = [part for part in path.split('/') if part]
+    if not path:
+        return 200, store.info()
+
+    if path[0] == '_cat' and len(path) > 1:
+        cat_funcs = {'aliases': store.cat_aliases, 'indices': store.cat_indices, 'allocation': store.cat_allocation}
+        if path[1] in cat_funcs:
+            return 200, cat_funcs[path[1]]()
+    elif path[0] == '_aliases':
+        return 200, store.update_aliases(json.loads(body))
+    elif path[0] == '_scripts':
+        return 200, {'acknowledged': True}
+    elif path[0] == '_tasks':
+        return 200, store.cancel_tasks() if path[-1] == '_cancel' else store.list_tasks()
+    else:
+        index_expr = path[0] if len(path) > 1 else None
+        action = path[-1]
+        if action == '_search':
+            return 200, store.search(index_expr, json.loads(body or '{}'))
+        if action == '_msearch':
+            return 200, store.msearch(index_expr, [line for line in body.splitlines() if line.strip()])
+        if action == '_mget':
+            return 200, store.mget(index_expr, json.loads(body), params.get('_source_includes'))
+        if action == '_mapping':
+            return 200, store.get_mapping(index_expr)
+
+    raise LocalEsException(400, 'unsupported_operation_exception', 'Unsupported request [{} /{}]'.format(
+        method, '/'.join(path)))
+
+
+class LocalEsRequestHandler(BaseHTTPRequestHandler):
+    # Connections are kept alive, as the elasticsearch client reuses them
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self._handle_request('HEAD')
+
+    def do_GET(self):
+        self._handle_request('GET')
+
+    def do_POST(self):
+        self._handle_request('POST')
+
+    def do_PUT(self):
+        self._handle_request('PUT')
+
+    def do_DELETE(self):
+        self._handle_request('DELETE')
+
+    def _handle_request(self, method):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        content_length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(content_length).decode('utf-8') if content_length else ''
+        try:
+            status, response = handle_local_es_request(self.server.store, method, url.path, params, body)
+        except LocalEsException as e:
+            status, response = e.status, e.to_json()
+        except Exception as e:
+            logger.error('Error handling {} {}: {}'.format(method, self.path, str(e)))
+            status, response = 500, LocalEsException(500, 'exception', str(e)).to_json()
+
+        content = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(0 if method == 'HEAD' else len(content)))
+        self.end_headers()
+        if method != 'HEAD':
+            self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def create_local_es_server(store, host='localhost', port=9200):
+    """Returns an HTTP server for the store, which handles each request in a separate thread. Port 0 uses any free port"""
+    server = ThreadingHTTPServer((host, port), LocalEsRequestHandler)
+    server.daemon_threads = True
+    server.store = store
+    return server
+
+
+def _get_field_type(value):
+    if isinstance(value, list):
+        value = next((v for v in value if v is not None), None)
+        if isinstance(value, dict):
+            return 'nested'
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'integer'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, dict):
+        return 'object'
+    return 'keyword'
+
+
+def _add_indexed_fields(source, is_sv):
+    # Adds the fields the seqr pipeline indexes for searching on locations, annotations and genotypes
+    transcripts = source['sortedTranscriptConsequences']
+    main_transcript = transcripts[0] if transcripts else {}
+    consequence_terms = {term for transcript in transcripts for term in transcript.get('consequence_terms', [])}
+    if is_sv:
+        consequence_terms.add(source['svType'])
+    source.update({
+        'xstop': get_xpos(source['contig'], source['end']),
+        'transcriptConsequenceTerms': sorted(consequence_terms),
+        'mainTranscript_gene_id': main_transcript.get('gene_id'),
+        'mainTranscript_major_consequence_rank': main_transcript.get('major_consequence_rank'),
+    })
+
+    genotype_sample_fields = defaultdict(list)
+    for genotype in source['genotypes']:
+        sample_id = genotype['sample_id']
+        for field, step in QUALITY_FIELDS.items():
+            value = genotype.get(field)
+            if value is None:
+                continue
+            if field == 'ab':
+                value *= 100
+            bin_start = int(value // step * step)
+            genotype_sample_fields['samples_{}_{}_to_{}'.format(field, bin_start, bin_start + step)].append(sample_id)
+        if is_sv:
+            cn = genotype['cn']
+            genotype_sample_fields['samples_cn_gte_4' if cn >= 4 else 'samples_cn_{}'.format(cn)].append(sample_id)
+        elif genotype['num_alt'] < 0:
+            genotype_sample_fields['samples_no_call'].append(sample_id)
+    source.update(genotype_sample_fields)
+    if not is_sv:
+        source.setdefault('samples_no_call', [])
+    return source
+
+
+def generate_local_es_index(num_variants, family_sample_ids, dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS,
+                            sample_type=Sample.SAMPLE_TYPE_WES, genome_version='37', seed=0):
+    """Returns the mapping and documents for an index of generated variants for the given families' sample IDs"""
+    is_sv = dataset_type == Sample.DATASET_TYPE_SV_CALLS
+    hits = generate_es_hits(num_variants, family_sample_ids=family_sample_ids, is_sv=is_sv, seed=seed)
+    docs = [(hit['_id'], _add_indexed_fields(hit['_source'], is_sv)) for hit in hits]
+
+    properties = {}
+    for _, source in docs:
+        for field, value in source.items():
+            if properties.get(field, {}).get('type') is None:
+                properties[field] = {'type': _get_field_type(value)}
+    for field_props in properties.values():
+        if field_props['type'] is None:
+            field_props['type'] = 'keyword'
+
+    mapping = {
+        '_meta': {
+            'genomeVersion': genome_version, 'sampleType': sample_type, 'datasetType': dataset_type,
+            'sourceFilePath': 'generated.bed' if is_sv else 'generated.vcf.gz',
+        },
+        'properties': properties,
+    }
+    return mapping, docs
+
+
+def write_local_es_index(store_dir, index_name, mapping, docs):
+    index_dir = os.path.join(store_dir, index_name)
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, MAPPING_FILE), 'w') as f:
+        json.dump(mapping, f)
+    with open(os.path.join(index_dir, DOCS_FILE), 'w') as f:
+        for doc_id, source in docs:
+            f.write(json.dumps({'_id': doc_id, '_source': source}))
+            f.write('\n')
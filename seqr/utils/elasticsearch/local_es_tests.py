@@ -0,0 +1,182 @@
+import mock
+from tempfile import TemporaryDirectory
+from threading import Thread
+
+from django.core.management import call_command
+from django.test import TestCase
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError
+
+from seqr.models import Family, VariantSearch, VariantSearchResults
+from seqr.utils.elasticsearch.local_es import LocalEsStore, LocalEsException, create_local_es_server
+
+MAPPING = {'_meta': {'genomeVersion': '37', 'datasetType': 'VARIANTS'}, 'properties': {'xpos': {'type': 'long'}}}
+DOCS = [
+    ('1-100-A-G', {'xpos': 1000000100, 'gene': ['ENSG1'], 'samples': ['S1', 'S2'], 'af': 0.1, 'rank': 3}),
+    ('1-200-A-G', {'xpos': 1000000200, 'gene': ['ENSG2'], 'samples': ['S2'], 'af': 0.5}),
+    ('2-100-A-G', {'xpos': 2000000100, 'gene': ['ENSG1', 'ENSG2'], 'samples': ['S3'], 'af': None, 'rank': 1}),
+]
+
+
+def _hit_ids(response):
+    return [hit['_id'] for hit in response['hits']['hits']]
+
+
+class LocalEsStoreTest(TestCase):
+
+    def setUp(self):
+        self.store = LocalEsStore()
+        self.store.add_index('test_index', MAPPING, DOCS)
+        self.store.add_index('test_index_2', MAPPING, [('3-100-A-G', {'xpos': 3000000100, 'samples': ['S4']})])
+
+    def test_search(self):
+        response = self.store.search('test_index', {})
+        self.assertEqual(response['hits']['total']['value'], 3)
+        self.assertListEqual(_hit_ids(response), ['1-100-A-G', '1-200-A-G', '2-100-A-G'])
+
+        response = self.store.search('test_index', {'query': {'bool': {
+            'filter': [{'terms': {'gene': ['ENSG1']}}, {'range': {'af': {'lte': 0.2}}}],
+        }}})
+        self.assertListEqual(_hit_ids(response), ['1-100-A-G'])
+
+        response = self.store.search('test_index', {'query': {'bool': {
+            'must_not': [{'exists': {'field': 'af'}}],
+        }}})
+        self.assertListEqual(_hit_ids(response), ['2-100-A-G'])
+
+        response = self.store.search('test_index', {'query': {'bool': {'should': [
+            {'term': {'samples': {'value': 'S1', '_name': 'F1'}}},
+            {'term': {'samples': {'value': 'S2', '_name': 'F2'}}},
+        ]}}})
+        self.assertListEqual(_hit_ids(response), ['1-100-A-G', '1-200-A-G'])
+        self.assertListEqual(response['hits']['hits'][0]['matched_queries'], ['F1', 'F2'])
+        self.assertListEqual(response['hits']['hits'][1]['matched_queries'], ['F2'])
+
+        response = self.store.search('test_index,test_index_2', {'query': {'ids': {'values': ['3-100-A-G', '1-200-A-G']}}})
+        self.assertListEqual(_hit_ids(response), ['1-200-A-G', '3-100-A-G'])
+        self.assertEqual(response['hits']['hits'][1]['_index'], 'test_index_2')
+
+        with self.assertRaises(LocalEsException) as cm:
+            self.store.search('test_index', {'query': {'fuzzy': {'gene': 'ENSG'}}})
+        self.assertDictEqual(cm.exception.to_json(), {'status': 400, 'error': {
+            'type': 'parsing_exception', 'reason': 'Unsupported query type [fuzzy]',
+            'root_cause': [{'type': 'parsing_exception', 'reason': 'Unsupported query type [fuzzy]'}],
+        }})
+
+        with self.assertRaises(LocalEsException) as cm:
+            self.store.search('missing_index', {})
+        self.assertEqual(cm.exception.status, 404)
+
+    def test_sort_and_pagination(self):
+        body = {'sort': [{'rank': {'order': 'desc'}}, 'xpos'], 'size': 2, '_source': ['xpos']}
+        response = self.store.search('test_index', body)
+        self.assertListEqual(_hit_ids(response), ['1-100-A-G', '2-100-A-G'])
+        self.assertListEqual(response['hits']['hits'][0]['sort'], [3, 1000000100])
+        self.assertDictEqual(response['hits']['hits'][0]['_source'], {'xpos': 1000000100})
+
+        body['search_after'] = response['hits']['hits'][-1]['sort']
+        response = self.store.search('test_index', body)
+        self.assertListEqual(_hit_ids(response), ['1-200-A-G'])
+        self.assertListEqual(response['hits']['hits'][0]['sort'], ['-Infinity', 1000000200])
+
+        response = self.store.search('test_index', {'sort': ['rank'], 'from': 1, 'size': 1})
+        self.assertListEqual(_hit_ids(response), ['1-100-A-G'])
+
+    def test_aggregations(self):
+        response = self.store.search('test_index', {'size': 0, 'aggs': {
+            'genes': {'terms': {'field': 'gene', 'size': 1}, 'aggs': {'vars': {'top_hits': {'sort': ['xpos'], 'size': 1}}}},
+        }})
+        self.assertListEqual(response['hits']['hits'], [])
+        buckets = response['aggregations']['genes']['buckets']
+        self.assertListEqual([(bucket['key'], bucket['doc_count']) for bucket in buckets], [('ENSG1', 2)])
+        self.assertListEqual([hit['_id'] for hit in buckets[0]['vars']['hits']['hits']], ['1-100-A-G'])
+        self.assertEqual(response['aggregations']['genes']['sum_other_doc_count'], 2)
+
+        body = {'size': 0, 'aggs': {'genes': {'composite': {
+            'sources': [{'gene_id': {'terms': {'field': 'gene'}}}], 'size': 1,
+        }}}}
+        response = self.store.search('test_index', body)
+        agg = response['aggregations']['genes']
+        self.assertListEqual(agg['buckets'], [{'key': {'gene_id': 'ENSG1'}, 'doc_count': 2}])
+        body['aggs']['genes']['composite']['after'] = agg['after_key']
+        response = self.store.search('test_index', body)
+        self.assertListEqual(response['aggregations']['genes']['buckets'], [{'key': {'gene_id': 'ENSG2'}, 'doc_count': 2}])
+
+    def test_metadata(self):
+        self.assertDictEqual(self.store.get_mapping('test_index'), {'test_index': {'mappings': MAPPING}})
+        self.assertListEqual(
+            [index['index'] for index in self.store.cat_indices()], ['test_index', 'test_index_2'])
+
+        self.store.update_aliases({'actions': [{'add': {'indices': ['test_index', 'test_index_2'], 'alias': 'all'}}]})
+        self.assertListEqual(self.store.cat_aliases(), [
+            {'alias': 'all', 'index': 'test_index'}, {'alias': 'all', 'index': 'test_index_2'}])
+        self.assertEqual(self.store.search('all', {})['hits']['total']['value'], 4)
+        self.assertListEqual(sorted(self.store.get_mapping('test*').keys()), ['test_index', 'test_index_2'])
+
+        response = self.store.msearch('test_index', [
+            '{}', '{"query": {"term": {"samples": "S3"}}}', '{"index": "missing_index"}', '{}',
+        ])
+        self.assertListEqual(_hit_ids(response['responses'][0]), ['2-100-A-G'])
+        self.assertEqual(response['responses'][1]['status'], 404)
+
+        response = self.store.mget('all', {'ids': ['3-100-A-G', '4-100-A-G']}, source_includes='xpos')
+        self.assertListEqual(response['docs'], [
+            {'_index': 'test_index_2', '_type': '_doc', '_id': '3-100-A-G', '_score': None, '_version': 1,
+             'found': True, '_source': {'xpos': 3000000100}},
+            {'_index': 'test_index', '_type': '_doc', '_id': '4-100-A-G', 'found': False},
+        ])
+
+    def test_server(self):
+        server = create_local_es_server(self.store, port=0)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            client = Elasticsearch(hosts=[{'host': 'localhost', 'port': server.server_address[1]}])
+            self.assertTrue(client.ping())
+            self.assertDictEqual(client.indices.get_mapping(index='test_index')['test_index']['mappings'], MAPPING)
+            response = client.search(index='test_index', body={'query': {'term': {'gene': 'ENSG2'}}, 'sort': ['xpos']})
+            self.assertListEqual(_hit_ids(response), ['1-200-A-G', '2-100-A-G'])
+            self.assertDictEqual(client.tasks.list(actions='*search'), {'tasks': {}})
+            with self.assertRaises(NotFoundError):
+                client.search(index='missing_index')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+@mock.patch('seqr.utils.redis_utils.redis.StrictRedis')
+class LocalEsSearchTest(TestCase):
+    databases = '__all__'
+    fixtures = ['users', '1kg_project', 'reference_data']
+
+    def test_get_es_variants(self, mock_redis):
+        mock_redis.return_value.get.return_value = None
+        from seqr.utils.elasticsearch import utils
+        from seqr.utils.elasticsearch.utils import get_es_variants
+
+        with TemporaryDirectory() as store_dir:
+            call_command('generate_local_es_store', store_dir, 'R0001_1kg', '--num-variants=100')
+            store = LocalEsStore.load(store_dir)
+        self.assertListEqual([index['index'] for index in store.cat_indices()], [
+            'test_index', 'test_index_old', 'test_index_sv'])
+
+        server = create_local_es_server(store, port=0)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            with mock.patch.object(utils, 'ELASTICSEARCH_SERVICE_PORT', server.server_address[1]), \
+                    mock.patch.object(utils, 'ELASTICSEARCH_SERVICE_HOSTNAME', 'localhost'), \
+                    mock.patch.dict(utils.ES_CLIENTS, clear=True):
+                families = Family.objects.filter(guid__in=['F000001_1', 'F000002_2'])
+                search_model = VariantSearch.objects.create(search={})
+                results_model = VariantSearchResults.objects.create(variant_search=search_model)
+                results_model.families.set(families)
+                variants, total_results = get_es_variants(results_model, num_results=10)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(variants), 10)
+        self.assertGreater(total_results, 10)
+        self.assertListEqual([variant['xpos'] for variant in variants], sorted(variant['xpos'] for variant in variants))
+        for variant in variants:
+            self.assertTrue(set(variant['familyGuids']).issubset({'F000001_1', 'F000002_2'}))
+            self.assertTrue(variant['familyGuids'])
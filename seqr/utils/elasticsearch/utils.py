@@ -1,28 +1,83 @@
+from collections import defaultdict, namedtuple
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 import elasticsearch
 from elasticsearch_dsl import Q
+import hashlib
+import json
 import logging
+import os
+from threading import Lock
 
 from settings import ELASTICSEARCH_SERVICE_HOSTNAME, ELASTICSEARCH_SERVICE_PORT, ELASTICSEARCH_CREDENTIALS, ELASTICSEARCH_PROTOCOL, ES_SSL_CONTEXT
 from seqr.models import Sample
-from seqr.utils.redis_utils import safe_redis_get_json, safe_redis_set_json
+from seqr.utils.redis_utils import safe_redis_get_json, safe_redis_set_json, safe_redis_hmget_json, \
+    safe_redis_hset_json, safe_redis_mget_json, safe_redis_mset_json, safe_redis_incr, redis_pipeline, \
+    MSGPACK_ZSTD_CODEC
 from seqr.utils.elasticsearch.constants import XPOS_SORT_KEY, MAX_VARIANTS
 from seqr.utils.elasticsearch.es_gene_agg_search import EsGeneAggSearch
-from seqr.utils.elasticsearch.es_search import EsSearch
+from seqr.utils.elasticsearch.es_search import EsSearch, get_sort_script_params_version
 from seqr.utils.gene_utils import parse_locus_list_items
+from seqr.utils.timing_utils import timed_span, add_span_count
 from seqr.utils.xpos_utils import get_xpos, get_chrom_pos
 
 logger = logging.getLogger(__name__)
 
 
+SEARCH_RESULTS_CACHE_CODEC = MSGPACK_ZSTD_CODEC
+SEARCH_RESULTS_CACHE_EXPIRE = timedelta(weeks=2)
+
+# Loaded result lists are cached in fixed size chunks in a redis hash alongside a small header with the search state, so
+# paging through results only fetches the chunks for the requested page
+SEARCH_RESULTS_CHUNK_SIZE = 100
+CHUNKED_SEARCH_RESULTS_KEYS = ['all_results', 'grouped_results']
+BUFFERED_SEARCH_RESULTS_KEYS = ['variant_result_runs', 'compound_het_results']
+CACHED_LIST_LENGTHS_KEY = '_cached_list_lengths'
+
+# Snapshots of the active samples needed to build searches are cached per project. Cache keys include a version which is
+# incremented whenever the samples, individuals or families used in search change (see the search_samples_fields model
+# Meta option), so outdated snapshots are never used
+SEARCH_SAMPLES_VERSION_KEY = 'search_samples_version'
+SEARCH_SAMPLES_CACHE_EXPIRE = timedelta(weeks=1)
+
+SearchIndividual = namedtuple('SearchIndividual', ['guid', 'affected', 'sex'])
+SearchSample = namedtuple('SearchSample', ['sample_id', 'sample_type', 'individual'])
+
+
 class InvalidIndexException(Exception):
     pass
 
 class InvalidSearchException(Exception):
     pass
 
+class _MissingCachedResultsException(Exception):
+    pass
+
+
+ES_CLIENTS = {}
+ES_CLIENTS_PID = None
+ES_CLIENTS_LOCK = Lock()
+
 
 def get_es_client(timeout=60, **kwargs):
+    # Clients are shared within a process so requests reuse open connections instead of opening a new pool per search.
+    # Individual requests can still override the client timeout with the "request_timeout" param
+    global ES_CLIENTS_PID
+    client_key = (timeout, ELASTICSEARCH_CREDENTIALS, tuple(sorted(kwargs.items())))
+    with ES_CLIENTS_LOCK:
+        pid = os.getpid()
+        if ES_CLIENTS_PID != pid:
+            # Connections opened in a parent process can not be safely used by a forked child
+            ES_CLIENTS.clear()
+            ES_CLIENTS_PID = pid
+
+        if client_key not in ES_CLIENTS:
+            ES_CLIENTS[client_key] = _create_es_client(timeout, **kwargs)
+        return ES_CLIENTS[client_key]
+
+
+def _create_es_client(timeout, **kwargs):
     client_kwargs = {
         'hosts': [{'host': ELASTICSEARCH_SERVICE_HOSTNAME, 'port': ELASTICSEARCH_SERVICE_PORT}],
         'timeout': timeout,
@@ -33,7 +88,44 @@ def get_es_client(timeout=60, **kwargs):
         client_kwargs['scheme'] = ELASTICSEARCH_PROTOCOL
     if ES_SSL_CONTEXT:
         client_kwargs['ssl_context'] = ES_SSL_CONTEXT
-    return elasticsearch.Elasticsearch(**client_kwargs, **kwargs)
+    return elasticsearch.Elasticsearch(connection_class=_TimedUrllib3HttpConnection, **client_kwargs, **kwargs)
+
+
+class _TimedUrllib3HttpConnection(elasticsearch.Urllib3HttpConnection):
+    """Records the size of ES responses in the request timings"""
+
+    def perform_request(self, *args, **kwargs):
+        status, headers, raw_data = super(_TimedUrllib3HttpConnection, self).perform_request(*args, **kwargs)
+        # Responses are decoded by the connection, and are almost entirely ASCII so the length approximates bytes received
+        add_span_count('es_response_bytes', len(raw_data or ''))
+        return status, headers, raw_data
+
+
+def get_es_client_pool_stats():
+    with ES_CLIENTS_LOCK:
+        clients = list(ES_CLIENTS.items()) if ES_CLIENTS_PID == os.getpid() else []
+
+    stats = []
+    for (timeout, _, client_kwargs), client in clients:
+        in_use = 0
+        handshakes = 0
+        num_requests = 0
+        for connection in client.transport.connection_pool.connections:
+            pool = getattr(connection, 'pool', None)
+            if pool is None:
+                continue
+            if pool.pool is not None:
+                in_use += pool.pool.maxsize - pool.pool.qsize()
+            handshakes += pool.num_connections
+            num_requests += pool.num_requests
+        stats.append({
+            'timeout': timeout,
+            'options': dict(client_kwargs),
+            'connectionsInUse': in_use,
+            'handshakes': handshakes,
+            'reuses': max(num_requests - handshakes, 0),
+        })
+    return stats
 
 
 def get_index_metadata(index_name, client, include_fields=False, use_cache=True):
@@ -62,20 +154,99 @@ def get_index_metadata(index_name, client, include_fields=False, use_cache=True)
     return index_metadata
 
 
+def bump_search_samples_version():
+    safe_redis_incr(SEARCH_SAMPLES_VERSION_KEY)
+
+
+def _get_search_samples_version():
+    return safe_redis_get_json(SEARCH_SAMPLES_VERSION_KEY) or 0
+
+
+def get_search_samples_by_family_index(families):
+    """Returns the active samples for the given families, as {index: {family_guid: {sample_id: SearchSample}}}"""
+    family_guids_by_project = defaultdict(set)
+    for family in families:
+        family_guids_by_project[family.project_id].add(family.guid)
+
+    version = _get_search_samples_version()
+    cache_keys = {
+        project_id: 'search_samples__{}__v{}'.format(project_id, version) for project_id in family_guids_by_project.keys()
+    }
+    cached_snapshots = safe_redis_mget_json(list(cache_keys.values()))
+    snapshots = {project_id: cached_snapshots[cache_key] for project_id, cache_key in cache_keys.items()}
+
+    missing_project_ids = [project_id for project_id, snapshot in snapshots.items() if snapshot is None]
+    if missing_project_ids:
+        missing_snapshots = {project_id: defaultdict(lambda: defaultdict(dict)) for project_id in missing_project_ids}
+        for project_id, index, family_guid, sample_id, sample_type, individual_guid, affected, sex in Sample.objects.filter(
+                is_active=True, individual__family__project_id__in=missing_project_ids).values_list(
+                'individual__family__project_id', 'elasticsearch_index', 'individual__family__guid', 'sample_id',
+                'sample_type', 'individual__guid', 'individual__affected', 'individual__sex'):
+            missing_snapshots[project_id][index][family_guid][sample_id] = [sample_type, individual_guid, affected, sex]
+        snapshots.update(missing_snapshots)
+        safe_redis_mset_json(
+            {cache_keys[project_id]: snapshot for project_id, snapshot in missing_snapshots.items()},
+            expire=SEARCH_SAMPLES_CACHE_EXPIRE,
+        )
+
+    samples_by_family_index = defaultdict(lambda: defaultdict(dict))
+    for project_id, snapshot in snapshots.items():
+        family_guids = family_guids_by_project[project_id]
+        for index, family_samples in snapshot.items():
+            for family_guid, samples in family_samples.items():
+                if family_guid not in family_guids:
+                    continue
+                for sample_id, (sample_type, individual_guid, affected, sex) in samples.items():
+                    samples_by_family_index[index][family_guid][sample_id] = SearchSample(
+                        sample_id, sample_type, SearchIndividual(individual_guid, affected, sex))
+    return samples_by_family_index
+
+
+def get_index_active_sample_count(index):
+    cache_key = 'search_index_sample_count__{}__v{}'.format(index, _get_search_samples_version())
+    sample_count = safe_redis_get_json(cache_key)
+    if sample_count is None:
+        sample_count = Sample.objects.filter(elasticsearch_index=index, is_active=True).count()
+        safe_redis_set_json(cache_key, sample_count, expire=SEARCH_SAMPLES_CACHE_EXPIRE)
+    return sample_count
+
+
 def get_single_es_variant(families, variant_id, return_all_queried_families=False):
     variants = EsSearch(
         families, return_all_queried_families=return_all_queried_families,
-    ).filter_by_location(variant_ids=[variant_id]).search(num_results=1)
+    ).get_variants_by_id([variant_id])
     if not variants:
         raise InvalidSearchException('Variant {} not found'.format(variant_id))
     return variants[0]
 
 
 def get_es_variants_for_variant_ids(families, variant_ids, dataset_type=None):
-    variants = EsSearch(families).filter_by_location(variant_ids=variant_ids)
+    es_search = EsSearch(families)
     if dataset_type:
-        variants = variants.update_dataset_type(dataset_type)
-    return variants.search(num_results=len(variant_ids))
+        es_search.update_dataset_type(dataset_type)
+    return es_search.get_variants_by_id(variant_ids)
+
+
+def get_es_variants_for_variant_id_chunks(families, variant_id_chunks, max_workers=1):
+    """Yields the variants for each chunk of variant IDs, in order. The chunks are fetched concurrently, but the samples
+    and index metadata are loaded once on the calling thread, so the fetching threads never query the database"""
+    es_search = EsSearch(families)
+
+    def _get_chunk_variants(variant_ids):
+        # Fetching variants updates the search state, so each chunk is fetched with its own search
+        return EsSearch.from_samples(
+            es_search.samples_by_family_index, es_search.index_metadata, client=get_es_client(),
+        ).get_variants_by_id(variant_ids)
+
+    with ThreadPoolExecutor(max_workers=max(min(len(variant_id_chunks), max_workers), 1)) as executor:
+        futures = [executor.submit(_get_chunk_variants, variant_id_chunk) for variant_id_chunk in variant_id_chunks]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # Chunks which have not started are not fetched if a chunk fails or the caller stops early
+            for future in futures:
+                future.cancel()
 
 
 def get_es_variants_for_variant_tuples(families, xpos_ref_alt_tuples):
@@ -88,9 +259,144 @@ def get_es_variants_for_variant_tuples(families, xpos_ref_alt_tuples):
     return get_es_variants_for_variant_ids(families, variant_ids, dataset_type=Sample.DATASET_TYPE_VARIANT_CALLS)
 
 
-def get_es_variants(search_model, es_search_cls=EsSearch, sort=XPOS_SORT_KEY, skip_genotype_filter=False, load_all=False, **kwargs):
-    cache_key = 'search_results__{}__{}'.format(search_model.guid, sort or XPOS_SORT_KEY)
+def _get_search_results_chunks_key(cache_key):
+    return '{}__chunks'.format(cache_key)
+
+
+def _get_chunk_field(key, chunk_index):
+    return '{}:{}'.format(key, chunk_index)
+
+
+def _get_chunk_fields(key, start, end):
+    if end <= start:
+        return []
+    return [_get_chunk_field(key, i) for i in range(start // SEARCH_RESULTS_CHUNK_SIZE, (end - 1) // SEARCH_RESULTS_CHUNK_SIZE + 1)]
+
+
+def _merge_chunks(chunks, fields):
+    results = []
+    for field in fields:
+        if chunks.get(field) is None:
+            raise _MissingCachedResultsException('Missing cached results chunk "{}"'.format(field))
+        results += chunks[field]
+    return results
+
+
+class CachedSearchResultsList(Sequence):
+    """List of cached results which only fetches the chunks needed for the accessed items. New results can be appended
+    without loading the previously cached results"""
+
+    def __init__(self, chunks_key, key, cached_length, appended=None):
+        self._chunks_key = chunks_key
+        self._key = key
+        self.cached_length = cached_length
+        self._appended = appended or []
+
+    def __len__(self):
+        return self.cached_length + len(self._appended)
+
+    def __add__(self, other):
+        return CachedSearchResultsList(self._chunks_key, self._key, self.cached_length, self._appended + list(other))
+
+    def append(self, value):
+        self._appended.append(value)
+
+    def _load_cached(self, start, end):
+        fields = _get_chunk_fields(self._key, start, end)
+        if not fields:
+            return []
+        results = _merge_chunks(safe_redis_hmget_json(self._chunks_key, fields), fields)
+        offset = (start // SEARCH_RESULTS_CHUNK_SIZE) * SEARCH_RESULTS_CHUNK_SIZE
+        return results[start - offset:end - offset]
+
+    def _load(self, start, end):
+        results = self._load_cached(start, min(end, self.cached_length))
+        if end > self.cached_length:
+            results += self._appended[max(start - self.cached_length, 0):end - self.cached_length]
+        return results
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            return self._load(start, end)
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('list index out of range')
+        return self._load(index, index + 1)[0]
+
+    def __iter__(self):
+        return iter(self._load(0, len(self)))
+
+
+def _get_cached_search_results(cache_key):
     previous_search_results = safe_redis_get_json(cache_key) or {}
+    # Results cached before chunking was introduced include the full lists in the header
+    list_lengths = previous_search_results.pop(CACHED_LIST_LENGTHS_KEY, {})
+    chunks_key = _get_search_results_chunks_key(cache_key)
+    for key, length in list_lengths.items():
+        previous_search_results[key] = CachedSearchResultsList(chunks_key, key, length)
+    return previous_search_results
+
+
+def _load_cached_search_results(cache_key, previous_search_results, keys=None):
+    """Fetches all the chunks for the given cached lists in a single round trip"""
+    list_fields = {
+        key: _get_chunk_fields(key, 0, len(value)) for key, value in previous_search_results.items()
+        if isinstance(value, CachedSearchResultsList) and (keys is None or key in keys)
+    }
+    fields = [field for key_fields in list_fields.values() for field in key_fields]
+    chunks = safe_redis_hmget_json(_get_search_results_chunks_key(cache_key), fields) if fields else {}
+
+    loaded_results = dict(previous_search_results)
+    for key, key_fields in list_fields.items():
+        loaded_results[key] = _merge_chunks(chunks, key_fields)[:len(previous_search_results[key])]
+    return loaded_results
+
+
+def _set_cached_search_results(cache_key, search_results):
+    """Writes the search header and any chunks with results which were not previously cached"""
+    header = {
+        key: value for key, value in search_results.items()
+        if key not in CHUNKED_SEARCH_RESULTS_KEYS + BUFFERED_SEARCH_RESULTS_KEYS
+    }
+    header[CACHED_LIST_LENGTHS_KEY] = {}
+
+    chunks = {}
+    for key in CHUNKED_SEARCH_RESULTS_KEYS + BUFFERED_SEARCH_RESULTS_KEYS:
+        if key not in search_results:
+            continue
+        results = search_results[key]
+        header[CACHED_LIST_LENGTHS_KEY][key] = len(results)
+        # Result lists are only ever appended to, so only the last partially cached chunk and new chunks are written.
+        # Buffered results are replaced on every search so are always written in full
+        start = 0
+        if isinstance(results, CachedSearchResultsList) and key in CHUNKED_SEARCH_RESULTS_KEYS:
+            start = (results.cached_length // SEARCH_RESULTS_CHUNK_SIZE) * SEARCH_RESULTS_CHUNK_SIZE
+        for chunk_start in range(start, len(results), SEARCH_RESULTS_CHUNK_SIZE):
+            chunks[_get_chunk_field(key, chunk_start // SEARCH_RESULTS_CHUNK_SIZE)] = \
+                list(results[chunk_start:chunk_start + SEARCH_RESULTS_CHUNK_SIZE])
+
+    safe_redis_set_json(cache_key, header, expire=SEARCH_RESULTS_CACHE_EXPIRE, codec=SEARCH_RESULTS_CACHE_CODEC)
+    safe_redis_hset_json(
+        _get_search_results_chunks_key(cache_key), chunks, expire=SEARCH_RESULTS_CACHE_EXPIRE,
+        codec=SEARCH_RESULTS_CACHE_CODEC)
+
+
+@redis_pipeline()
+def get_es_variants(search_model, sort=XPOS_SORT_KEY, **kwargs):
+    cache_key = 'search_results__{}__{}'.format(search_model.guid, sort or XPOS_SORT_KEY)
+    try:
+        return _get_es_variants(search_model, cache_key, _get_cached_search_results(cache_key), sort=sort, **kwargs)
+    except _MissingCachedResultsException as e:
+        logger.warning('Ignoring incomplete cached search results for {}: {}'.format(cache_key, str(e)))
+        return _get_es_variants(search_model, cache_key, {}, sort=sort, **kwargs)
+
+
+def _get_es_variants(search_model, cache_key, previous_search_results, es_search_cls=EsSearch, sort=XPOS_SORT_KEY, skip_genotype_filter=False, load_all=False, profile=False, **kwargs):
     total_results = previous_search_results.get('total_results')
 
     previously_loaded_results, search_kwargs = es_search_cls.process_previous_results(previous_search_results, load_all=load_all, **kwargs)
@@ -100,6 +406,10 @@ def get_es_variants(search_model, es_search_cls=EsSearch, sort=XPOS_SORT_KEY, sk
     if load_all and total_results and int(total_results) >= int(MAX_VARIANTS):
         raise InvalidSearchException('Too many variants to load. Please refine your search and try again')
 
+    # Previously loaded results are only appended to, so are not loaded unless needed for the new page
+    previous_search_results = _load_cached_search_results(
+        cache_key, previous_search_results, keys=BUFFERED_SEARCH_RESULTS_KEYS)
+
     search = search_model.variant_search.search
 
     genes, intervals, invalid_items = parse_locus_list_items(search.get('locus', {}))
@@ -109,11 +419,78 @@ def get_es_variants(search_model, es_search_cls=EsSearch, sort=XPOS_SORT_KEY, sk
     if invalid_items:
         raise InvalidSearchException('Invalid variants: {}'.format(', '.join(invalid_items)))
 
-    es_search = es_search_cls(
-        search_model.families.all(),
-        previous_search_results=previous_search_results,
-        skip_unaffected_families=search.get('inheritance'),
-    )
+    with timed_span('search_samples'):
+        es_search = es_search_cls(
+            search_model.families.all(),
+            previous_search_results=previous_search_results,
+            skip_unaffected_families=search.get('inheritance'),
+        )
+    if profile:
+        es_search.enable_profile()
+
+    # Building the search queries for large numbers of families is slow, so the compiled searches are cached and
+    # subsequent pages only update the pagination
+    compiled_search_cache_key = _get_compiled_search_cache_key(
+        cache_key, search, sort, es_search, skip_genotype_filter)
+    compiled_search = safe_redis_get_json(compiled_search_cache_key)
+    if compiled_search:
+        es_search.set_compiled_search(compiled_search['search'])
+    else:
+        with timed_span('query_compile'):
+            compiled_search = {'search_kwargs': _build_es_search(
+                es_search, search, sort, skip_genotype_filter, genes, intervals, rs_ids, variant_ids)}
+            compiled_search['search'] = es_search.get_compiled_search()
+        if compiled_search['search']:
+            add_span_count('query_clauses', _count_query_clauses(compiled_search['search']))
+            safe_redis_set_json(
+                compiled_search_cache_key, compiled_search, expire=SEARCH_RESULTS_CACHE_EXPIRE,
+                codec=SEARCH_RESULTS_CACHE_CODEC)
+    search_kwargs.update(compiled_search['search_kwargs'])
+
+    variant_results = es_search.search(**search_kwargs)
+
+    _set_cached_search_results(cache_key, es_search.previous_search_results)
+
+    return variant_results, es_search.previous_search_results.get('total_results')
+
+
+def _count_query_clauses(compiled_search):
+    queries = [compiled_search['_search'].get('query', {})] + [
+        search.get('query', {}) for searches in compiled_search['_index_searches'].values() for search in searches]
+    return sum(_count_bool_clauses(query) for query in queries)
+
+
+def _count_bool_clauses(query):
+    # Counts the clauses in all the bool queries, which is what ES limits with max_clause_count
+    if isinstance(query, list):
+        return sum(_count_bool_clauses(q) for q in query)
+    if not isinstance(query, dict):
+        return 0
+    count = 0
+    for key, value in query.items():
+        if key == 'bool':
+            for clauses in value.values():
+                if isinstance(clauses, (list, dict)):
+                    count += len(clauses) if isinstance(clauses, list) else 1
+                    count += _count_bool_clauses(clauses)
+        else:
+            count += _count_bool_clauses(value)
+    return count
+
+
+def _get_compiled_search_cache_key(cache_key, search, sort, es_search, skip_genotype_filter):
+    # Compiled searches depend on the active samples, sort parameters and index mappings as well as the search itself.
+    # Searches after compound hets are loaded do not include the compound het queries
+    compiled_search_hash = hashlib.md5(json.dumps([
+        search, type(es_search).__name__, bool(skip_genotype_filter),
+        es_search.has_loaded_compound_hets(), _get_search_samples_version(),
+        get_sort_script_params_version(sort), es_search.index_metadata,
+    ], sort_keys=True).encode('utf-8')).hexdigest()
+    return '{}__compiled__{}'.format(cache_key, compiled_search_hash)
+
+
+def _build_es_search(es_search, search, sort, skip_genotype_filter, genes, intervals, rs_ids, variant_ids):
+    search_kwargs = {}
 
     if search.get('customQuery'):
         custom_q = search['customQuery']
@@ -142,11 +519,7 @@ def get_es_variants(search_model, es_search_cls=EsSearch, sort=XPOS_SORT_KEY, sk
     if hasattr(es_search, 'aggregate_by_gene'):
         es_search.aggregate_by_gene()
 
-    variant_results = es_search.search(**search_kwargs)
-
-    safe_redis_set_json(cache_key, es_search.previous_search_results, expire=timedelta(weeks=2))
-
-    return variant_results, es_search.previous_search_results.get('total_results')
+    return search_kwargs
 
 
 def get_es_variant_gene_counts(search_model):
@@ -0,0 +1,154 @@
+import heapq
+import logging
+import numpy as np
+from collections import OrderedDict, defaultdict
+from pyliftover.liftover import LiftOver
+from threading import Lock, Thread
+
+from reference_data.models import GENOME_VERSION_GRCh37, GENOME_VERSION_GRCh38
+
+logger = logging.getLogger(__name__)
+
+# TODO  move liftover to hail pipeline once upgraded to 0.2 (https://github.com/broadinstitute/seqr/issues/1010)
+LIFTOVER_CHAIN_BUILDS = {
+    GENOME_VERSION_GRCh37: ('hg19', 'hg38'),
+    GENOME_VERSION_GRCh38: ('hg38', 'hg19'),
+}
+LIFTOVER_MEMO_SIZE = 100000
+
+
+class LiftoverIndex(object):
+    """Lifts positions from one genome build to another using sorted arrays of the liftover chain alignment blocks"""
+
+    def __init__(self, chains, memo_size=LIFTOVER_MEMO_SIZE):
+        blocks_by_chrom = defaultdict(list)
+        target_chroms = []
+        target_chrom_index = {}
+        for chain_index, chain in enumerate(chains):
+            target_chrom = chain.target_name.lstrip('chr')
+            if target_chrom not in target_chrom_index:
+                target_chrom_index[target_chrom] = len(target_chroms)
+                target_chroms.append(target_chrom)
+            # When blocks overlap, the block from the highest scoring chain is used
+            priority = (-chain.score, chain_index)
+            for source_start, source_end, target_start in chain.blocks:
+                blocks_by_chrom[chain.source_name.lstrip('chr')].append((
+                    source_start, source_end, priority, target_start - source_start, chain.target_size,
+                    chain.target_strand == '-', target_chrom_index[target_chrom],
+                ))
+
+        self._target_chroms = np.array(target_chroms, dtype=object)
+        self._chrom_segments = {chrom: _index_blocks(blocks) for chrom, blocks in blocks_by_chrom.items()}
+        self._memo = OrderedDict()
+        self._memo_size = memo_size
+        self._lock = Lock()
+
+    def lift(self, chrom, pos):
+        return self.lift_many(chrom, [pos])[0]
+
+    def lift_many(self, chrom, positions):
+        """Returns the lifted (chrom, pos) for each of the given positions, or None if the position can not be lifted"""
+        chrom = chrom.lstrip('chr')
+        results = [None] * len(positions)
+        unlifted_indices = []
+        with self._lock:
+            for i, pos in enumerate(positions):
+                key = (chrom, pos)
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    results[i] = self._memo[key]
+                else:
+                    unlifted_indices.append(i)
+
+        if not unlifted_indices:
+            return results
+
+        segments = self._chrom_segments.get(chrom)
+        if segments:
+            lifted = self._lift_positions(segments, np.array([positions[i] for i in unlifted_indices], dtype=np.int64))
+            for i, lifted_coord in zip(unlifted_indices, lifted):
+                results[i] = lifted_coord
+
+        with self._lock:
+            for i in unlifted_indices:
+                self._memo[(chrom, positions[i])] = results[i]
+            while len(self._memo) > self._memo_size:
+                self._memo.popitem(last=False)
+
+        return results
+
+    def _lift_positions(self, segments, positions):
+        starts, ends, offsets, target_sizes, is_negative_strand, target_chroms = segments
+        segment_indices = np.searchsorted(starts, positions, side='right') - 1
+        is_lifted = segment_indices >= 0
+        segment_indices = np.maximum(segment_indices, 0)
+        is_lifted &= positions < ends[segment_indices]
+
+        lifted_positions = positions + offsets[segment_indices]
+        lifted_positions = np.where(
+            is_negative_strand[segment_indices], target_sizes[segment_indices] - 1 - lifted_positions, lifted_positions)
+        lifted_chroms = self._target_chroms[target_chroms[segment_indices]]
+
+        return [
+            (lifted_chrom, int(lifted_pos)) if lifted else None
+            for lifted_chrom, lifted_pos, lifted in zip(lifted_chroms, lifted_positions, is_lifted)
+        ]
+
+
+def _index_blocks(blocks):
+    # Overlapping blocks are split into non-overlapping segments so each position maps to exactly one segment, which
+    # can be found with a binary search
+    blocks.sort(key=lambda block: block[0])
+    breakpoints = sorted({block[0] for block in blocks} | {block[1] for block in blocks})
+
+    segments = []
+    active_blocks = []
+    block_index = 0
+    for segment_start, segment_end in zip(breakpoints, breakpoints[1:]):
+        while block_index < len(blocks) and blocks[block_index][0] <= segment_start:
+            block = blocks[block_index]
+            heapq.heappush(active_blocks, (block[2], block[1], block_index))
+            block_index += 1
+        while active_blocks and active_blocks[0][1] <= segment_start:
+            heapq.heappop(active_blocks)
+        if not active_blocks:
+            continue
+
+        best_block_index = active_blocks[0][2]
+        if segments and segments[-1][2] == best_block_index and segments[-1][1] == segment_start:
+            segments[-1][1] = segment_end
+        else:
+            segments.append([segment_start, segment_end, best_block_index])
+
+    segment_blocks = [blocks[block_index] for _, _, block_index in segments]
+    return (
+        np.array([segment[0] for segment in segments], dtype=np.int64),
+        np.array([segment[1] for segment in segments], dtype=np.int64),
+        np.array([block[3] for block in segment_blocks], dtype=np.int64),
+        np.array([block[4] for block in segment_blocks], dtype=np.int64),
+        np.array([block[5] for block in segment_blocks], dtype=bool),
+        np.array([block[6] for block in segment_blocks], dtype=np.int64),
+    )
+
+
+LIFTOVER_INDEXES = {}
+LIFTOVER_INDEXES_LOCK = Lock()
+
+
+def get_liftover(genome_version):
+    """Returns the shared liftover from the given genome version, or None if the chain file can not be loaded"""
+    with LIFTOVER_INDEXES_LOCK:
+        if genome_version not in LIFTOVER_INDEXES:
+            try:
+                chain_file = LiftOver(*LIFTOVER_CHAIN_BUILDS[genome_version]).chain_file
+                LIFTOVER_INDEXES[genome_version] = LiftoverIndex(chain_file.chains)
+            except Exception as e:
+                logger.error('ERROR: Unable to set up liftover. {}'.format(e))
+                return None
+        return LIFTOVER_INDEXES[genome_version]
+
+
+def preload_liftover():
+    """Loads the liftover indexes in the background, so the first search in a process does not wait on the chain files"""
+    for genome_version in [GENOME_VERSION_GRCh38, GENOME_VERSION_GRCh37]:
+        Thread(target=get_liftover, args=(genome_version,), daemon=True).start()
@@ -0,0 +1,86 @@
+import mock
+from io import BytesIO
+from pyliftover.liftover import LiftOver
+from unittest import TestCase
+
+from seqr.utils.liftover_utils import LiftoverIndex, get_liftover, preload_liftover
+
+# Overlapping chains on chr1 are resolved by score, and the second chain maps to the negative strand
+CHAIN_FILE = b"""chain 1000 chr1 1000 + 0 100 chr1 1000 + 200 300 1
+50 10 10
+40
+
+chain 500 chr1 1000 + 20 60 chr2 500 - 100 140 2
+40
+
+chain 800 chrX 1000 + 300 400 chrX 600 + 0 100 3
+100
+"""
+
+
+def _get_liftover():
+    return LiftOver(BytesIO(CHAIN_FILE))
+
+
+class LiftoverUtilsTest(TestCase):
+
+    def test_lift_many(self):
+        liftover = _get_liftover()
+        liftover_index = LiftoverIndex(liftover.chain_file.chains)
+
+        positions = list(range(-5, 1005))
+        for chrom in ['1', 'chrX', '2']:
+            expected = []
+            for pos in positions:
+                lifted_coords = liftover.convert_coordinate('chr{}'.format(chrom.lstrip('chr')), pos)
+                expected.append((lifted_coords[0][0].lstrip('chr'), lifted_coords[0][1]) if lifted_coords else None)
+            self.assertListEqual(liftover_index.lift_many(chrom, positions), expected)
+
+        self.assertTupleEqual(liftover_index.lift('1', 55), ('2', 364))
+        self.assertTupleEqual(liftover_index.lift('chr1', 65), ('1', 265))
+        self.assertIsNone(liftover_index.lift('1', 100))
+
+    def test_lift_many_memo(self):
+        liftover_index = LiftoverIndex(_get_liftover().chain_file.chains, memo_size=2)
+        with mock.patch.object(liftover_index, '_lift_positions', wraps=liftover_index._lift_positions) as mock_lift:
+            self.assertListEqual(liftover_index.lift_many('1', [10, 65]), [('1', 210), ('1', 265)])
+            self.assertListEqual(list(mock_lift.call_args.args[1]), [10, 65])
+
+            # Only positions which are not memoized are lifted
+            self.assertListEqual(liftover_index.lift_many('1', [65, 70]), [('1', 265), ('1', 270)])
+            self.assertListEqual(list(mock_lift.call_args.args[1]), [70])
+
+            # Least recently used results are evicted
+            mock_lift.reset_mock()
+            self.assertListEqual(liftover_index.lift_many('1', [65, 70]), [('1', 265), ('1', 270)])
+            mock_lift.assert_not_called()
+            self.assertTupleEqual(liftover_index.lift('1', 10), ('1', 210))
+            mock_lift.assert_called_once()
+
+    @mock.patch('seqr.utils.liftover_utils.logger')
+    @mock.patch('seqr.utils.liftover_utils.LiftOver')
+    @mock.patch.dict('seqr.utils.liftover_utils.LIFTOVER_INDEXES', clear=True)
+    def test_get_liftover(self, mock_liftover, mock_logger):
+        mock_liftover.side_effect = Exception('Unable to download chain file')
+        self.assertIsNone(get_liftover('38'))
+        mock_liftover.assert_called_with('hg38', 'hg19')
+        mock_logger.error.assert_called_with('ERROR: Unable to set up liftover. Unable to download chain file')
+
+        mock_liftover.side_effect = None
+        mock_liftover.return_value = _get_liftover()
+        liftover_index = get_liftover('37')
+        self.assertTupleEqual(liftover_index.lift('1', 10), ('1', 210))
+        mock_liftover.assert_called_with('hg19', 'hg38')
+
+        # The index is shared across calls
+        mock_liftover.reset_mock()
+        self.assertIs(get_liftover('37'), liftover_index)
+        mock_liftover.assert_not_called()
+
+    @mock.patch('seqr.utils.liftover_utils.Thread')
+    def test_preload_liftover(self, mock_thread):
+        preload_liftover()
+        mock_thread.assert_has_calls([
+            mock.call(target=get_liftover, args=('38',), daemon=True), mock.call().start(),
+            mock.call(target=get_liftover, args=('37',), daemon=True), mock.call().start(),
+        ])
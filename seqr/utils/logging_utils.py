@@ -25,6 +25,9 @@ class JsonLogFormatter(logging.Formatter):
         if hasattr(record, 'traceback'):
             log_json['traceback'] = record.traceback
 
+        if getattr(record, 'timings', None):
+            log_json['timings'] = record.timings
+
         if record.levelname == 'ERROR':
             # Allows GCP Error to detect that this is an error log
             log_json['@type'] = 'type.googleapis.com/google.devtools.clouderrorreporting.v1beta1.ReportedErrorEvent'
@@ -8,6 +8,8 @@ import logging
 import traceback
 
 from seqr.utils.elasticsearch.utils import InvalidIndexException, InvalidSearchException
+from seqr.utils.redis_utils import redis_pipeline
+from seqr.utils.timing_utils import request_timings
 from seqr.views.utils.json_utils import create_json_response
 from seqr.views.utils.terra_api_utils import TerraAPIException
 from settings import DEBUG
@@ -109,8 +111,34 @@ class LogRequestMiddleware(MiddlewareMixin):
             message = error
         else:
             level = logger.info
+        timings = getattr(request, 'timings', None)
         level(message, extra={
             'http_request_json': http_json, 'request_body': request_body, 'traceback': traceback, 'user': request.user,
+            'timings': timings.to_json() if timings else None,
         })
 
         return response
+
+class RedisPipelineMiddleware(object):
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Share redis lookups within a request and send all cache writes in a single round trip
+        with redis_pipeline():
+            return self.get_response(request)
+
+class ServerTimingMiddleware(object):
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Reports the duration of each stage of the request that was timed in a Server-Timing header and in the request log
+        with request_timings() as timings:
+            response = self.get_response(request)
+        if timings.durations or timings.counts:
+            request.timings = timings
+            response['Server-Timing'] = timings.get_server_timing_header()
+        return response
@@ -1,31 +1,198 @@
+from contextlib import contextmanager
 import json
 import logging
+import msgpack
 import redis
+from threading import local
+import zlib
+import zstandard
 
 from settings import REDIS_SERVICE_HOSTNAME
 
 logger = logging.getLogger(__name__)
 
+# Connections are pooled per process, redis-py resets the pool's connections after a fork
+REDIS_CONNECTION_POOL = redis.ConnectionPool(host=REDIS_SERVICE_HOSTNAME, socket_connect_timeout=3)
+
+_pipeline_state = local()
+
+# Values written with a codec are prefixed with a header and the codec version so they can be decoded independently of
+# the current default codec. Values with no header are legacy plain JSON
+CACHE_CODEC_HEADER = b'seqr:'
+JSON_ZLIB_CODEC = 1
+MSGPACK_ZSTD_CODEC = 2
+CACHE_CODECS = {
+    JSON_ZLIB_CODEC: {
+        'encode': lambda value: zlib.compress(json.dumps(value).encode('utf-8'), 1),
+        'decode': lambda value: json.loads(zlib.decompress(value)),
+    },
+    MSGPACK_ZSTD_CODEC: {
+        'encode': lambda value: zstandard.ZstdCompressor(level=3).compress(msgpack.packb(value, use_bin_type=True)),
+        'decode': lambda value: msgpack.unpackb(
+            zstandard.ZstdDecompressor().decompress(value), raw=False, strict_map_key=False),
+    },
+}
+
+
+def encode_cache_value(value, codec=None):
+    if not codec:
+        return json.dumps(value)
+    return CACHE_CODEC_HEADER + bytes([codec]) + CACHE_CODECS[codec]['encode'](value)
+
+
+def decode_cache_value(value):
+    if isinstance(value, bytes) and value.startswith(CACHE_CODEC_HEADER):
+        codec = value[len(CACHE_CODEC_HEADER)]
+        if codec not in CACHE_CODECS:
+            raise ValueError('Unknown cache codec "{}"'.format(codec))
+        return CACHE_CODECS[codec]['decode'](value[len(CACHE_CODEC_HEADER) + 1:])
+    return json.loads(value)
+
+
+def get_redis_client():
+    return redis.StrictRedis(connection_pool=REDIS_CONNECTION_POOL)
+
+
+def _get_pipeline():
+    return getattr(_pipeline_state, 'pipeline', None)
+
+
+@contextmanager
+def redis_pipeline():
+    """Shares redis state for all the cache operations within the context, i.e. for the duration of a request.
+
+    Values are only fetched from redis once, and all writes are deferred and sent together in a single pipelined
+    round trip when the context exits. Nested contexts share the outermost pipeline.
+    """
+    if _get_pipeline() is not None:
+        yield
+        return
+
+    _pipeline_state.pipeline = {'values': {}, 'writes': {}, 'hash_writes': {}}
+    try:
+        yield
+    finally:
+        writes = _pipeline_state.pipeline['writes']
+        hash_writes = _pipeline_state.pipeline['hash_writes']
+        _pipeline_state.pipeline = None
+        if writes or hash_writes:
+            _safe_redis_set_values(writes, hash_writes)
+
+
+def _parse_json(cache_key, value):
+    if value:
+        logger.info('Loaded {} from redis'.format(cache_key))
+        try:
+            return decode_cache_value(value)
+        except (ValueError, TypeError, zlib.error, zstandard.ZstdError, msgpack.UnpackException) as e:
+            logger.warning('Unable to fetch "{}" from redis:\t{}'.format(cache_key, str(e)))
+    return None
+
 
 def safe_redis_get_json(cache_key):
+    return safe_redis_mget_json([cache_key])[cache_key]
+
+
+def safe_redis_mget_json(cache_keys):
+    pipeline = _get_pipeline()
+    values = {}
+    if pipeline is not None:
+        values.update({key: pipeline['values'][key] for key in cache_keys if key in pipeline['values']})
+
+    keys_to_fetch = [key for key in cache_keys if key not in values]
+    if keys_to_fetch:
+        try:
+            redis_client = get_redis_client()
+            if len(keys_to_fetch) == 1:
+                fetched = [redis_client.get(keys_to_fetch[0])]
+            else:
+                fetched = redis_client.mget(keys_to_fetch)
+            values.update(dict(zip(keys_to_fetch, fetched)))
+            if pipeline is not None:
+                pipeline['values'].update(dict(zip(keys_to_fetch, fetched)))
+        except Exception as e:
+            logger.error('Unable to connect to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
+
+    return {key: _parse_json(key, values.get(key)) for key in cache_keys}
+
+
+def safe_redis_set_json(cache_key, value, expire=None, codec=None):
+    safe_redis_mset_json({cache_key: value}, expire=expire, codec=codec)
+
+
+def safe_redis_mset_json(values_by_key, expire=None, codec=None):
+    writes = {key: (encode_cache_value(value, codec=codec), expire) for key, value in values_by_key.items()}
+
+    pipeline = _get_pipeline()
+    if pipeline is not None:
+        pipeline['writes'].update(writes)
+        pipeline['values'].update({key: value for key, (value, _) in writes.items()})
+    else:
+        _safe_redis_set_values(writes)
+
+
+def safe_redis_incr(cache_key):
+    pipeline = _get_pipeline()
+    if pipeline is not None:
+        pipeline['values'].pop(cache_key, None)
+
     try:
-        redis_client = redis.StrictRedis(host=REDIS_SERVICE_HOSTNAME, socket_connect_timeout=3)
-        value = redis_client.get(cache_key)
-        if value:
-            logger.info('Loaded {} from redis'.format(cache_key))
-            return json.loads(value)
-    except ValueError as e:
-        logger.warning('Unable to fetch "{}" from redis:\t{}'.format(cache_key, str(e)))
+        return get_redis_client().incr(cache_key)
     except Exception as e:
-        logger.error('Unable to connect to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
-    return None
+        logger.error('Unable to write to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
+        return None
+
+
+def safe_redis_hmget_json(cache_key, fields):
+    pipeline = _get_pipeline()
+    values = {}
+    if pipeline is not None:
+        values.update({
+            field: pipeline['values'][(cache_key, field)] for field in fields if (cache_key, field) in pipeline['values']
+        })
+
+    fields_to_fetch = [field for field in fields if field not in values]
+    if fields_to_fetch:
+        try:
+            fetched = dict(zip(fields_to_fetch, get_redis_client().hmget(cache_key, fields_to_fetch)))
+            values.update(fetched)
+            if pipeline is not None:
+                pipeline['values'].update({(cache_key, field): value for field, value in fetched.items()})
+        except Exception as e:
+            logger.error('Unable to connect to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
+
+    return {field: _parse_json('{}.{}'.format(cache_key, field), values.get(field)) for field in fields}
+
+
+def safe_redis_hset_json(cache_key, values_by_field, expire=None, codec=None):
+    """Sets the given fields in a redis hash. The expiry applies to the whole hash and is refreshed on every write"""
+    values = {field: encode_cache_value(value, codec=codec) for field, value in values_by_field.items()}
+
+    pipeline = _get_pipeline()
+    if pipeline is not None:
+        pending_values, _ = pipeline['hash_writes'].get(cache_key, ({}, None))
+        pending_values.update(values)
+        pipeline['hash_writes'][cache_key] = (pending_values, expire)
+        pipeline['values'].update({(cache_key, field): value for field, value in values.items()})
+    else:
+        _safe_redis_set_values({}, {cache_key: (values, expire)})
 
 
-def safe_redis_set_json(cache_key, value, expire=None):
+def _safe_redis_set_values(writes, hash_writes=None):
+    hash_writes = hash_writes or {}
+    num_commands = len(writes) + sum(bool(values) + bool(expire) for values, expire in hash_writes.values())
     try:
-        redis_client = redis.StrictRedis(host=REDIS_SERVICE_HOSTNAME, socket_connect_timeout=3)
-        redis_client.set(cache_key, json.dumps(value))
-        if expire:
-            redis_client.expire(cache_key, expire)
+        redis_client = get_redis_client()
+        if num_commands > 1:
+            redis_client = redis_client.pipeline(transaction=False)
+        for cache_key, (value, expire) in writes.items():
+            redis_client.set(cache_key, value, ex=expire)
+        for cache_key, (values, expire) in hash_writes.items():
+            if values:
+                redis_client.hmset(cache_key, values)
+            if expire:
+                redis_client.expire(cache_key, expire)
+        if num_commands > 1:
+            redis_client.execute()
     except Exception as e:
         logger.error('Unable to write to redis host {}: {}'.format(REDIS_SERVICE_HOSTNAME, str(e)))
@@ -1,7 +1,9 @@
 import json
 import mock
 from unittest import TestCase
-from seqr.utils.redis_utils import safe_redis_set_json, safe_redis_get_json
+from seqr.utils.redis_utils import safe_redis_set_json, safe_redis_get_json, safe_redis_mget_json, \
+    safe_redis_mset_json, safe_redis_hmget_json, safe_redis_hset_json, safe_redis_incr, redis_pipeline, encode_cache_value, \
+    JSON_ZLIB_CODEC, MSGPACK_ZSTD_CODEC
 
 
 @mock.patch('seqr.utils.redis_utils.logger')
@@ -41,13 +43,14 @@ class RedisUtilsTest(TestCase):
 
     def test_safe_redis_set_json(self, mock_redis, mock_logger):
         safe_redis_set_json('test_key', {'a': 1})
-        mock_redis.return_value.set.assert_called_with('test_key', '{"a": 1}')
+        mock_redis.return_value.set.assert_called_with('test_key', '{"a": 1}', ex=None)
         mock_redis.return_value.expire.assert_not_called()
         mock_logger.error.assert_not_called()
 
         safe_redis_set_json('test_key', {'a': 1}, expire=100)
-        mock_redis.return_value.set.assert_called_with('test_key', '{"a": 1}')
-        mock_redis.return_value.expire.assert_called_with('test_key', 100)
+        mock_redis.return_value.set.assert_called_with('test_key', '{"a": 1}', ex=100)
+        mock_redis.return_value.expire.assert_not_called()
+        mock_redis.return_value.pipeline.assert_not_called()
         mock_logger.error.assert_not_called()
 
         # test with redis connection error
@@ -55,3 +58,160 @@ class RedisUtilsTest(TestCase):
         mock_redis.side_effect = Exception('invalid redis')
         safe_redis_set_json('test_key', {'a': 1})
         mock_logger.error.assert_called_with('Unable to write to redis host localhost: invalid redis')
+
+    def test_cache_codecs(self, mock_redis, mock_logger):
+        value = {'all_results': [{'variantId': '1-248367227-TC-T', 'pos': 248367227, 'af': 0.063}], 'total': 1}
+        for codec in [JSON_ZLIB_CODEC, MSGPACK_ZSTD_CODEC]:
+            encoded = encode_cache_value(value, codec=codec)
+            self.assertTrue(encoded.startswith(b'seqr:'))
+            self.assertEqual(encoded[5], codec)
+
+            safe_redis_set_json('test_key', value, expire=100, codec=codec)
+            mock_redis.return_value.set.assert_called_with('test_key', encoded, ex=100)
+
+            mock_redis.return_value.get.return_value = encoded
+            self.assertDictEqual(safe_redis_get_json('test_key'), value)
+
+        # test legacy JSON values
+        mock_redis.return_value.get.return_value = json.dumps(value).encode('utf-8')
+        self.assertDictEqual(safe_redis_get_json('test_key'), value)
+        mock_logger.warning.assert_not_called()
+
+        # test unknown or corrupted values
+        for invalid_value in [b'seqr:\x09abc', b'seqr:\x01abc', b'seqr:\x02abc']:
+            mock_logger.reset_mock()
+            mock_redis.return_value.get.return_value = invalid_value
+            self.assertIsNone(safe_redis_get_json('test_key'))
+            self.assertEqual(
+                mock_logger.warning.call_args.args[0].split('\t')[0], 'Unable to fetch "test_key" from redis:')
+        mock_logger.error.assert_not_called()
+
+    def test_safe_redis_mget_json(self, mock_redis, mock_logger):
+        mock_redis.return_value.mget.side_effect = lambda keys: [
+            json.dumps({key: 'test'}) if key != 'missing_key' else None for key in keys]
+        self.assertDictEqual(safe_redis_mget_json(['test_key', 'missing_key', 'test_key_2']), {
+            'test_key': {'test_key': 'test'}, 'missing_key': None, 'test_key_2': {'test_key_2': 'test'},
+        })
+        mock_redis.return_value.mget.assert_called_once_with(['test_key', 'missing_key', 'test_key_2'])
+        mock_logger.info.assert_has_calls([
+            mock.call('Loaded test_key from redis'), mock.call('Loaded test_key_2 from redis'),
+        ])
+
+        # test with redis connection error
+        mock_logger.reset_mock()
+        mock_redis.side_effect = Exception('invalid redis')
+        self.assertDictEqual(safe_redis_mget_json(['test_key', 'test_key_2']), {'test_key': None, 'test_key_2': None})
+        mock_logger.error.assert_called_with('Unable to connect to redis host localhost: invalid redis')
+
+    def test_safe_redis_mset_json(self, mock_redis, mock_logger):
+        mock_pipeline = mock_redis.return_value.pipeline.return_value
+        safe_redis_mset_json({'test_key': {'a': 1}, 'test_key_2': [1, 2]}, expire=100)
+        mock_redis.return_value.pipeline.assert_called_with(transaction=False)
+        mock_pipeline.set.assert_has_calls([
+            mock.call('test_key', '{"a": 1}', ex=100), mock.call('test_key_2', '[1, 2]', ex=100),
+        ])
+        mock_pipeline.execute.assert_called_once()
+        mock_redis.return_value.set.assert_not_called()
+        mock_logger.error.assert_not_called()
+
+        # test with redis connection error
+        mock_redis.side_effect = Exception('invalid redis')
+        safe_redis_mset_json({'test_key': {'a': 1}, 'test_key_2': [1, 2]})
+        mock_logger.error.assert_called_with('Unable to write to redis host localhost: invalid redis')
+
+    def test_safe_redis_incr(self, mock_redis, mock_logger):
+        mock_redis.return_value.incr.return_value = 2
+        self.assertEqual(safe_redis_incr('test_key'), 2)
+        mock_redis.return_value.incr.assert_called_with('test_key')
+
+        # Incremented values are not read from the pipeline cache
+        mock_redis.return_value.get.side_effect = lambda key: b'2'
+        with redis_pipeline():
+            self.assertEqual(safe_redis_get_json('test_key'), 2)
+            safe_redis_incr('test_key')
+            mock_redis.return_value.get.side_effect = lambda key: b'3'
+            self.assertEqual(safe_redis_get_json('test_key'), 3)
+        mock_logger.error.assert_not_called()
+
+        # test with redis connection error
+        mock_redis.side_effect = Exception('invalid redis')
+        self.assertIsNone(safe_redis_incr('test_key'))
+        mock_logger.error.assert_called_with('Unable to write to redis host localhost: invalid redis')
+
+    def test_safe_redis_hmget_json(self, mock_redis, mock_logger):
+        mock_redis.return_value.hmget.side_effect = lambda key, fields: [
+            json.dumps([field]) if field != 'missing' else None for field in fields]
+        self.assertDictEqual(safe_redis_hmget_json('test_key', ['a:0', 'missing', 'a:1']), {
+            'a:0': ['a:0'], 'missing': None, 'a:1': ['a:1'],
+        })
+        mock_redis.return_value.hmget.assert_called_once_with('test_key', ['a:0', 'missing', 'a:1'])
+        mock_logger.info.assert_has_calls([
+            mock.call('Loaded test_key.a:0 from redis'), mock.call('Loaded test_key.a:1 from redis'),
+        ])
+
+        # test with redis connection error
+        mock_logger.reset_mock()
+        mock_redis.side_effect = Exception('invalid redis')
+        self.assertDictEqual(safe_redis_hmget_json('test_key', ['a:0']), {'a:0': None})
+        mock_logger.error.assert_called_with('Unable to connect to redis host localhost: invalid redis')
+
+    def test_safe_redis_hset_json(self, mock_redis, mock_logger):
+        safe_redis_hset_json('test_key', {'a:0': [1], 'a:1': [2]})
+        mock_redis.return_value.hmset.assert_called_with('test_key', {'a:0': '[1]', 'a:1': '[2]'})
+        mock_redis.return_value.pipeline.assert_not_called()
+
+        mock_pipeline = mock_redis.return_value.pipeline.return_value
+        safe_redis_hset_json('test_key', {'a:0': [1]}, expire=100)
+        mock_pipeline.hmset.assert_called_with('test_key', {'a:0': '[1]'})
+        mock_pipeline.expire.assert_called_with('test_key', 100)
+        mock_pipeline.execute.assert_called_once()
+
+        # Expiry is refreshed even with no new values
+        mock_redis.reset_mock()
+        safe_redis_hset_json('test_key', {}, expire=100)
+        mock_redis.return_value.hmset.assert_not_called()
+        mock_redis.return_value.expire.assert_called_with('test_key', 100)
+        mock_logger.error.assert_not_called()
+
+        # test with redis connection error
+        mock_redis.side_effect = Exception('invalid redis')
+        safe_redis_hset_json('test_key', {'a:0': [1]})
+        mock_logger.error.assert_called_with('Unable to write to redis host localhost: invalid redis')
+
+    def test_redis_pipeline(self, mock_redis, mock_logger):
+        mock_redis.return_value.get.side_effect = lambda key: json.dumps({key: 'test'})
+        mock_pipeline = mock_redis.return_value.pipeline.return_value
+
+        with redis_pipeline():
+            self.assertDictEqual(safe_redis_get_json('test_key'), {'test_key': 'test'})
+            self.assertDictEqual(safe_redis_get_json('test_key'), {'test_key': 'test'})
+            mock_redis.return_value.get.assert_called_once_with('test_key')
+
+            with redis_pipeline():
+                safe_redis_set_json('test_key', {'a': 1}, expire=100)
+            safe_redis_set_json('test_key_2', {'b': 2})
+            mock_redis.return_value.set.assert_not_called()
+            mock_pipeline.set.assert_not_called()
+
+            # Reads should reflect pending writes
+            self.assertDictEqual(safe_redis_get_json('test_key'), {'a': 1})
+            mock_redis.return_value.get.assert_called_once()
+
+            safe_redis_hset_json('test_hash', {'a:0': [1]})
+            safe_redis_hset_json('test_hash', {'a:1': [2]}, expire=100)
+            self.assertDictEqual(safe_redis_hmget_json('test_hash', ['a:0', 'a:1']), {'a:0': [1], 'a:1': [2]})
+            mock_redis.return_value.hmget.assert_not_called()
+            mock_pipeline.hmset.assert_not_called()
+
+        mock_pipeline.set.assert_has_calls([
+            mock.call('test_key', '{"a": 1}', ex=100), mock.call('test_key_2', '{"b": 2}', ex=None),
+        ])
+        mock_pipeline.hmset.assert_called_once_with('test_hash', {'a:0': '[1]', 'a:1': '[2]'})
+        mock_pipeline.expire.assert_called_once_with('test_hash', 100)
+        mock_pipeline.execute.assert_called_once()
+
+        # Values are not shared outside of the context
+        mock_redis.return_value.get.reset_mock()
+        self.assertDictEqual(safe_redis_get_json('test_key'), {'test_key': 'test'})
+        mock_redis.return_value.get.assert_called_once_with('test_key')
+        mock_logger.error.assert_not_called()
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from threading import local, Lock
+from timeit import default_timer as timer
+
+_timing_state = local()
+
+
+class RequestTimings(object):
+    """Accumulates the durations and counts of the stages of a single request"""
+
+    def __init__(self):
+        self.durations = OrderedDict()
+        self.counts = OrderedDict()
+        self.es_profiles = []
+        self._lock = Lock()
+
+    def add_duration(self, name, duration):
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0) + duration
+
+    def add_count(self, name, count):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def add_es_profile(self, profile):
+        with self._lock:
+            self.es_profiles.append(profile)
+
+    def to_json(self):
+        return {
+            'durations': OrderedDict((name, round(duration * 1000, 1)) for name, duration in self.durations.items()),
+            'counts': OrderedDict(self.counts),
+        }
+
+    def get_server_timing_header(self):
+        # Durations are reported in milliseconds. Counts have no duration, so are reported as the metric description
+        metrics = ['{};dur={:.1f}'.format(name, duration * 1000) for name, duration in self.durations.items()]
+        metrics += ['{};desc="{}"'.format(name, count) for name, count in self.counts.items()]
+        return ', '.join(metrics)
+
+
+def get_request_timings():
+    return getattr(_timing_state, 'timings', None)
+
+
+@contextmanager
+def request_timings(timings=None):
+    """Collects the timings of all the spans within the context, i.e. for the duration of a request.
+
+    Nested contexts share the outermost timings. Existing timings can be passed in to record spans for work done on
+    behalf of a request in another thread.
+    """
+    existing_timings = get_request_timings()
+    if existing_timings is not None:
+        yield existing_timings
+        return
+
+    _timing_state.timings = timings or RequestTimings()
+    try:
+        yield _timing_state.timings
+    finally:
+        _timing_state.timings = None
+
+
+@contextmanager
+def timed_span(name):
+    timings = get_request_timings()
+    if timings is None:
+        yield
+        return
+
+    start = timer()
+    try:
+        yield
+    finally:
+        timings.add_duration(name, timer() - start)
+
+
+def add_span_duration(name, duration):
+    timings = get_request_timings()
+    if timings is not None:
+        timings.add_duration(name, duration)
+
+
+def add_span_count(name, count):
+    timings = get_request_timings()
+    if timings is not None:
+        timings.add_count(name, count)
+
+
+def add_es_profile(profile):
+    timings = get_request_timings()
+    if timings is not None:
+        timings.add_es_profile(profile)
+
+
+def with_request_timings(func):
+    """Wraps the function so spans are recorded in the calling thread's timings when it runs in a thread pool"""
+    timings = get_request_timings()
+
+    @wraps(func)
+    def _wrapped(*args, **kwargs):
+        with request_timings(timings):
+            return func(*args, **kwargs)
+    return _wrapped
@@ -0,0 +1,48 @@
+import mock
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from seqr.utils.timing_utils import request_timings, timed_span, add_span_count, add_span_duration, add_es_profile, \
+    get_request_timings, with_request_timings
+
+
+class TimingUtilsTest(TestCase):
+
+    @mock.patch('seqr.utils.timing_utils.timer')
+    def test_request_timings(self, mock_timer):
+        # Spans outside of a request are not recorded
+        with timed_span('search'):
+            add_span_count('hits_parsed', 2)
+        self.assertIsNone(get_request_timings())
+        mock_timer.assert_not_called()
+
+        mock_timer.side_effect = [1, 1.5, 2, 2.25]
+        with request_timings() as timings:
+            with timed_span('search'):
+                add_span_count('hits_parsed', 2)
+            with request_timings() as nested_timings:
+                self.assertIs(nested_timings, timings)
+                with timed_span('search'):
+                    add_span_count('hits_parsed', 3)
+            add_span_duration('es_took', 0.0123)
+            add_es_profile({'shards': []})
+        self.assertIsNone(get_request_timings())
+
+        self.assertDictEqual(timings.to_json(), {
+            'durations': {'search': 750.0, 'es_took': 12.3}, 'counts': {'hits_parsed': 5},
+        })
+        self.assertEqual(timings.get_server_timing_header(), 'search;dur=750.0, es_took;dur=12.3, hits_parsed;desc="5"')
+        self.assertListEqual(timings.es_profiles, [{'shards': []}])
+
+    def test_with_request_timings(self):
+        def _count_hits(num_hits):
+            add_span_count('hits_parsed', num_hits)
+
+        with request_timings() as timings:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(with_request_timings(_count_hits), [1, 2, 3]))
+            # Work in other threads is only recorded when wrapped
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(_count_hits, [4]))
+
+        self.assertDictEqual(dict(timings.counts), {'hits_parsed': 6})
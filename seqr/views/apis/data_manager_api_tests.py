@@ -260,7 +260,8 @@ class DataManagerAPITest(AuthenticationTestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         response_json = response.json()
-        self.assertSetEqual(set(response_json.keys()), {'indices', 'errors', 'diskStats', 'elasticsearchHost'})
+        self.assertSetEqual(
+            set(response_json.keys()), {'indices', 'errors', 'diskStats', 'elasticsearchHost', 'clientPoolStats'})
 
         self.assertEqual(len(response_json['indices']), 5)
         self.assertDictEqual(response_json['indices'][0], TEST_INDEX_EXPECTED_DICT)
@@ -270,6 +271,9 @@ class DataManagerAPITest(AuthenticationTestCase):
         self.assertListEqual(response_json['errors'], EXPECTED_ERRORS)
 
         self.assertListEqual(response_json['diskStats'], EXPECTED_DISK_ALLOCATION)
+        self.assertIn(
+            {'timeout': 60, 'options': {}, 'connectionsInUse': 0, 'handshakes': 0, 'reuses': 0},
+            response_json['clientPoolStats'])
 
 
     @mock.patch('seqr.utils.file_utils.subprocess.Popen')
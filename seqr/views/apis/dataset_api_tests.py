@@ -21,11 +21,12 @@ ADD_DATASET_PAYLOAD = json.dumps({'elasticsearchIndex': INDEX_NAME, 'datasetType
 
 class DatasetAPITest(object):
 
+    @mock.patch('seqr.views.utils.variant_utils.get_es_variants_for_variant_id_chunks')
     @mock.patch('seqr.utils.redis_utils.redis.StrictRedis')
     @mock.patch('seqr.views.utils.dataset_utils.random.randint')
     @mock.patch('seqr.utils.file_utils.open')
     @urllib3_responses.activate
-    def test_add_variants_dataset(self, mock_open, mock_random, mock_redis):
+    def test_add_variants_dataset(self, mock_open, mock_random, mock_redis, mock_get_variants):
         mock_file_iter = mock_open.return_value.__enter__.return_value.__iter__
 
         url = reverse(add_variants_dataset_handler, args=[PROJECT_GUID])
@@ -293,6 +294,9 @@ class DatasetAPITest(object):
         self.assertSetEqual({sv_sample_guid, existing_index_sample_guid, new_sample_type_sample_guid}, {sample.guid for sample in sample_models})
         self.assertSetEqual({True}, {sample.is_active for sample in sample_models})
 
+        # Saved variants are refreshed outside of the request by the reload_saved_variant_json command
+        mock_get_variants.assert_not_called()
+
     def test_receive_alignment_table_handler(self):
         url = reverse(receive_igv_table_handler, args=[PROJECT_GUID])
         self.check_data_manager_login(url)
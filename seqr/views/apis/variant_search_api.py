@@ -1,6 +1,9 @@
 import json
 import jmespath
+import pickle
 from collections import defaultdict
+from itertools import chain
+from tempfile import TemporaryFile
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import MultipleObjectsReturned
@@ -15,8 +18,9 @@ from seqr.utils.elasticsearch.utils import get_es_variants, get_single_es_varian
 from seqr.utils.elasticsearch.constants import XPOS_SORT_KEY, PATHOGENICTY_SORT_KEY, PATHOGENICTY_HGMD_SORT_KEY
 from seqr.utils.xpos_utils import get_xpos
 from seqr.views.apis.saved_variant_api import _add_locus_lists
-from seqr.views.utils.export_utils import export_table
+from seqr.views.utils.export_utils import stream_export_table
 from seqr.utils.gene_utils import get_genes
+from seqr.utils.timing_utils import timed_span, get_request_timings
 from seqr.views.utils.json_utils import create_json_response
 from seqr.views.utils.json_to_orm_utils import update_model_from_json, get_or_create_model_from_json, \
     create_model_from_json
@@ -60,6 +64,7 @@ def query_variants_handler(request, search_hash):
     sort = request.GET.get('sort') or XPOS_SORT_KEY
     if sort == PATHOGENICTY_SORT_KEY and user_is_analyst(request.user):
         sort = PATHOGENICTY_HGMD_SORT_KEY
+    profile = request.GET.get('profile') == 'true' and user_is_analyst(request.user)
 
     search_context = json.loads(request.body or '{}')
     try:
@@ -70,8 +75,9 @@ def query_variants_handler(request, search_hash):
     _check_results_permission(results_model, request.user)
     is_all_project_search = _is_all_project_family_search(search_context)
 
-    variants, total_results = get_es_variants(results_model, sort=sort, page=page, num_results=per_page,
-                                              skip_genotype_filter=is_all_project_search)
+    with timed_span('search'):
+        variants, total_results = get_es_variants(results_model, sort=sort, page=page, num_results=per_page,
+                                                  skip_genotype_filter=is_all_project_search, profile=profile)
 
     response_context = {}
     if is_all_project_search and len(variants) == total_results:
@@ -85,12 +91,17 @@ def query_variants_handler(request, search_hash):
         projects = Project.objects.filter(family__in=families).distinct()
         response_context = _get_projects_details(projects, request.user)
 
-    response = _process_variants(variants or [], results_model.families.all(), request.user)
+    with timed_span('saved_variants'):
+        response = _process_variants(variants or [], results_model.families.all(), request.user)
     response['search'] = _get_search_context(results_model)
     response['search']['totalResults'] = total_results
     response.update(response_context)
+    if profile:
+        timings = get_request_timings()
+        response['esProfiles'] = timings.es_profiles if timings else []
 
-    return create_json_response(response)
+    with timed_span('json_encode'):
+        return create_json_response(response)
 
 
 def _is_all_project_family_search(search_context):
@@ -197,6 +208,8 @@ def _get_variant_main_transcript_field_val(parsed_variant):
     ).get('value')
 
 
+EXPORT_BATCH_SIZE = 500
+
 VARIANT_EXPORT_DATA = [
     {'header': 'chrom'},
     {'header': 'pos'},
@@ -265,31 +278,21 @@ def export_variants_handler(request, search_hash):
     families = results_model.families.all()
     family_ids_by_guid = {family.guid: family.family_id for family in families}
 
-    variants, _ = get_es_variants(results_model, page=1, load_all=True)
-    variants = _flatten_variants(variants)
-
-    json, variants_to_saved_variants = _get_saved_variants(variants, families)
-
-    max_families_per_variant = max([len(variant['familyGuids']) for variant in variants])
-    max_samples_per_variant = max([len(variant['genotypes']) for variant in variants])
-
-    rows = []
-    for variant in variants:
-        row = [_get_field_value(variant, config) for config in VARIANT_EXPORT_DATA]
-        for i in range(max_families_per_variant):
-            family_guid = variant['familyGuids'][i] if i < len(variant['familyGuids']) else ''
-            variant_guid = variants_to_saved_variants.get(variant['variantId'], {}).get(family_guid, '')
-            family_tags = {
-                'family_id': family_ids_by_guid.get(family_guid),
-                'tags': [tag for tag in json['variantTagsByGuid'].values() if variant_guid in tag['variantGuids']],
-                'notes': [note for note in json['variantNotesByGuid'].values() if variant_guid in note['variantGuids']],
-            }
-            row += [_get_field_value(family_tags, config) for config in VARIANT_FAMILY_EXPORT_DATA]
-        genotypes = list(variant['genotypes'].values())
-        for i in range(max_samples_per_variant):
-            genotype = genotypes[i] if i < len(genotypes) else {}
-            row += [_get_field_value(genotype, config) for config in VARIANT_SAMPLE_DATA]
-        rows.append(row)
+    # Variants are loaded in batches and their rows are spooled to a temporary file, so memory use does not depend on
+    # the total number of results. All the variants are loaded before the response starts, so the family and sample
+    # columns are sized from the exported variants and search errors are returned instead of a truncated file
+    rows_file = TemporaryFile()
+    max_families_per_variant = 0
+    max_samples_per_variant = 0
+    try:
+        for variant_row in _get_export_rows(results_model, families, family_ids_by_guid):
+            max_families_per_variant = max(max_families_per_variant, len(variant_row[1]))
+            max_samples_per_variant = max(max_samples_per_variant, len(variant_row[2]))
+            pickle.dump(variant_row, rows_file)
+    except Exception:
+        rows_file.close()
+        raise
+    rows_file.seek(0)
 
     header = [config['header'] for config in VARIANT_EXPORT_DATA]
     for i in range(max_families_per_variant):
@@ -297,9 +300,73 @@ def export_variants_handler(request, search_hash):
     for i in range(max_samples_per_variant):
         header += ['{}_{}'.format(config['header'], i+1) for config in VARIANT_SAMPLE_DATA]
 
+    rows = _load_spooled_export_rows(rows_file, max_families_per_variant, max_samples_per_variant)
+
     file_format = request.GET.get('file_format', 'tsv')
 
-    return export_table('search_results_{}'.format(search_hash), header, rows, file_format, titlecase_header=False)
+    return stream_export_table(
+        'search_results_{}'.format(search_hash), header, rows, file_format, titlecase_header=False)
+
+
+def _get_export_variant_batches(results_model):
+    page = 1
+    while True:
+        variants, total_results = get_es_variants(results_model, page=page, num_results=EXPORT_BATCH_SIZE)
+        variants = _flatten_variants(variants)
+        if not variants:
+            return
+        yield variants
+        if page * EXPORT_BATCH_SIZE >= total_results:
+            return
+        page += 1
+
+
+def _get_export_rows(results_model, families, family_ids_by_guid):
+    for variants in _get_export_variant_batches(results_model):
+        json, variants_to_saved_variants = _get_saved_variants(variants, families)
+
+        tags_by_variant_guid = defaultdict(list)
+        for tag in json['variantTagsByGuid'].values():
+            for variant_guid in tag['variantGuids']:
+                tags_by_variant_guid[variant_guid].append(tag)
+        notes_by_variant_guid = defaultdict(list)
+        for note in json['variantNotesByGuid'].values():
+            for variant_guid in note['variantGuids']:
+                notes_by_variant_guid[variant_guid].append(note)
+
+        for variant in variants:
+            row = [_get_field_value(variant, config) for config in VARIANT_EXPORT_DATA]
+            family_rows = []
+            for family_guid in variant['familyGuids']:
+                variant_guid = variants_to_saved_variants.get(variant['variantId'], {}).get(family_guid, '')
+                family_rows.append(_get_family_export_row(
+                    family_ids_by_guid.get(family_guid), tags_by_variant_guid.get(variant_guid, []),
+                    notes_by_variant_guid.get(variant_guid, [])))
+            sample_rows = [
+                [_get_field_value(genotype, config) for config in VARIANT_SAMPLE_DATA]
+                for genotype in variant['genotypes'].values()
+            ]
+            yield row, family_rows, sample_rows
+
+
+def _get_family_export_row(family_id, tags, notes):
+    family_tags = {'family_id': family_id, 'tags': tags, 'notes': notes}
+    return [_get_field_value(family_tags, config) for config in VARIANT_FAMILY_EXPORT_DATA]
+
+
+def _load_spooled_export_rows(rows_file, max_families_per_variant, max_samples_per_variant):
+    # Variants with fewer families or samples than the exported maximum have empty values in the remaining columns
+    empty_family_row = _get_family_export_row(None, [], [])
+    empty_sample_row = [_get_field_value({}, config) for config in VARIANT_SAMPLE_DATA]
+    with rows_file:
+        while True:
+            try:
+                row, family_rows, sample_rows = pickle.load(rows_file)
+            except EOFError:
+                return
+            family_rows += [empty_family_row] * (max_families_per_variant - len(family_rows))
+            sample_rows += [empty_sample_row] * (max_samples_per_variant - len(sample_rows))
+            yield row + list(chain.from_iterable(family_rows)) + list(chain.from_iterable(sample_rows))
 
 
 def _get_field_value(value, config):
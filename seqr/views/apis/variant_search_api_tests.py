@@ -8,6 +8,7 @@ from elasticsearch.exceptions import ConnectionTimeout, TransportError
 
 from seqr.models import VariantSearchResults, LocusList, Project, VariantSearch
 from seqr.utils.elasticsearch.utils import InvalidIndexException, InvalidSearchException
+from seqr.utils.timing_utils import add_es_profile
 from seqr.views.apis.variant_search_api import query_variants_handler, query_single_variant_handler, \
     export_variants_handler, search_context_handler, get_saved_search_handler, create_saved_search_handler, \
     update_saved_search_handler, delete_saved_search_handler, get_variant_gene_breakdown
@@ -159,19 +160,20 @@ class VariantSearchAPITest(object):
         )
 
         results_model = VariantSearchResults.objects.get(search_hash=SEARCH_HASH)
-        mock_get_variants.assert_called_with(results_model, sort='xpos', page=1, num_results=100, skip_genotype_filter=False)
+        mock_get_variants.assert_called_with(results_model, sort='xpos', page=1, num_results=100, skip_genotype_filter=False, profile=False)
         mock_error_logger.assert_not_called()
 
         # Test pagination
         response = self.client.get('{}?page=3'.format(url))
         self.assertEqual(response.status_code, 200)
-        mock_get_variants.assert_called_with(results_model, sort='xpos', page=3, num_results=100, skip_genotype_filter=False)
+        self.assertNotIn('esProfiles', response.json())
+        mock_get_variants.assert_called_with(results_model, sort='xpos', page=3, num_results=100, skip_genotype_filter=False, profile=False)
         mock_error_logger.assert_not_called()
 
         # Test sort
         response = self.client.get('{}?sort=pathogenicity'.format(url))
         self.assertEqual(response.status_code, 200)
-        mock_get_variants.assert_called_with(results_model, sort='pathogenicity', page=1, num_results=100, skip_genotype_filter=False)
+        mock_get_variants.assert_called_with(results_model, sort='pathogenicity', page=1, num_results=100, skip_genotype_filter=False, profile=False)
         mock_error_logger.assert_not_called()
 
         # Test export
@@ -193,11 +195,28 @@ class VariantSearchAPITest(object):
             ['12', '48367227', 'TC', 'T', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
              '', '2', 'Known gene for phenotype (None)|Excluded (None)', 'test n\xf8te (None)', '', '', '', '', '', '',
              '', '', '', '', '']]
-        self.assertEqual(response.content, ('\n'.join(['\t'.join(line) for line in expected_content])+'\n').encode('utf-8'))
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            ('\n'.join(['\t'.join(line) for line in expected_content])+'\n').encode('utf-8'))
 
-        mock_get_variants.assert_called_with(results_model, page=1, load_all=True)
+        mock_get_variants.assert_called_with(results_model, page=1, num_results=500)
+        self.assertEqual(
+            len([call for call in mock_get_variants.call_args_list if call.kwargs.get('num_results') == 500]), 1)
         mock_error_logger.assert_not_called()
 
+        # Test export error after the first batch is loaded
+        def _get_paged_es_variants(results_model, page=1, **kwargs):
+            if page > 1:
+                raise TransportError('N/A', 'search_phase_execution_exception', {'error': 'Invalid'})
+            variants, _ = _get_es_variants(results_model)
+            return variants, 1000
+        mock_get_variants.side_effect = _get_paged_es_variants
+        response = self.client.get(export_url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], "TransportError: N/A - 'search_phase_execution_exception' - {'error': 'Invalid'}")
+        mock_get_variants.assert_called_with(results_model, page=2, num_results=500)
+        mock_get_variants.side_effect = _get_es_variants
+
         # Test gene breakdown
         gene_counts = {
             'ENSG00000227232': {'total': 2, 'families': {'F000001_1': 2, 'F000002_2': 1}},
@@ -251,9 +270,20 @@ class VariantSearchAPITest(object):
 
         self.assertListEqual(response_json['searchedVariants'], VARIANTS_WITH_DISCOVERY_TAGS)
         self.assertSetEqual(set(response_json['familiesByGuid'].keys()), {'F000011_11'})
-        mock_get_variants.assert_called_with(results_model, sort='pathogenicity_hgmd', page=1, num_results=100, skip_genotype_filter=False)
+        mock_get_variants.assert_called_with(results_model, sort='pathogenicity_hgmd', page=1, num_results=100, skip_genotype_filter=False, profile=False)
         mock_error_logger.assert_not_called()
 
+        # Test search profiling for analyst users
+        def _get_profiled_es_variants(results_model, **kwargs):
+            add_es_profile({'shards': []})
+            return _get_es_variants(results_model, **kwargs)
+        mock_get_variants.side_effect = _get_profiled_es_variants
+        response = self.client.get('{}?profile=true'.format(url))
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(response.json()['esProfiles'], [{'shards': []}])
+        self.assertRegex(response['Server-Timing'], r'^search;dur=[\d.]+, saved_variants;dur=[\d.]+, json_encode;dur=[\d.]+$')
+        mock_get_variants.assert_called_with(results_model, sort='xpos', page=1, num_results=100, skip_genotype_filter=False, profile=True)
+
         # Test no results
         mock_get_variants.side_effect = _get_empty_es_variants
         response = self.client.post(url, content_type='application/json', data=json.dumps({
@@ -299,7 +329,7 @@ class VariantSearchAPITest(object):
                 'totalResults': 3,
         }})
         results_model = VariantSearchResults.objects.get(search_hash=SEARCH_HASH)
-        mock_get_variants.assert_called_with(results_model, sort='xpos', page=1, num_results=100, skip_genotype_filter=True)
+        mock_get_variants.assert_called_with(results_model, sort='xpos', page=1, num_results=100, skip_genotype_filter=True, profile=False)
 
         results_model.delete()
         self.login_collaborator()
@@ -334,7 +364,7 @@ class VariantSearchAPITest(object):
 
         results_model = VariantSearchResults.objects.get(search_hash=SEARCH_HASH)
         mock_get_variants.assert_called_with(results_model, sort='xpos', page=1, num_results=100,
-                                             skip_genotype_filter=True)
+                                             skip_genotype_filter=True, profile=False)
 
     @mock.patch('seqr.views.apis.variant_search_api.get_es_variants')
     def test_query_all_project_families_variants(self, mock_get_variants):
@@ -598,7 +628,7 @@ class AnvilVariantSearchAPITest(AnvilAuthenticationTestCase, VariantSearchAPITes
 
     def test_query_variants(self, *args):
         super(AnvilVariantSearchAPITest, self).test_query_variants(*args)
-        assert_no_list_ws_has_al(self, 13)
+        assert_no_list_ws_has_al(self, 14)
 
     def test_query_all_projects_variants(self, *args):
         super(AnvilVariantSearchAPITest, self).test_query_all_projects_variants(*args)
@@ -1,10 +1,11 @@
 from collections import OrderedDict
+from itertools import chain
 import json
 import openpyxl as xl
 from tempfile import NamedTemporaryFile
 import zipfile
 
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse
 
 from seqr.views.utils.json_utils import _to_title_case
 
@@ -13,6 +14,15 @@ DELIMITERS = {
     'tsv': '\t',
 }
 
+STREAMING_CHUNK_SIZE = 64 * 1024
+
+
+def _format_row(header, row):
+    if len(header) != len(row):
+        raise ValueError('len(header) != len(row): %s != %s\n%s\n%s' % (
+            len(header), len(row), ','.join(header), ','.join(row)))
+    return ['' if value is None else value for value in row]
+
 
 def export_table(filename_prefix, header, rows, file_format='tsv', titlecase_header=True):
     """Generates an HTTP response for a table with the given header and rows, exported into the given file_format.
@@ -26,43 +36,70 @@ def export_table(filename_prefix, header, rows, file_format='tsv', titlecase_hea
         Django HttpResponse object with the table data as an attachment.
     """
 
-    for i, row in enumerate(rows):
-        if len(header) != len(row):
-            raise ValueError('len(header) != len(row): %s != %s\n%s\n%s' % (
-                len(header), len(row), ','.join(header), ','.join(row)))
-        rows[i] = ['' if value is None else value for value in row]
+    # Rows are all formatted before the response is created, so invalid rows raise an error instead of a partial file
+    rows = [_format_row(header, row) for row in rows]
+    content, content_type, extension = _get_table_content(header, rows, file_format, titlecase_header)
+    return _set_content_disposition(HttpResponse(content, content_type=content_type), filename_prefix, extension)
+
+
+def stream_export_table(filename_prefix, header, rows, file_format='tsv', titlecase_header=True):
+    """Generates a streaming HTTP response for a table with the given header and rows, exported into the given
+    file_format. Rows are only consumed as the response is sent, so can be lazily generated.
+
+    Args:
+        filename_prefix (string): Filename without the extension.
+        header (list): List of column names
+        rows (iterable): Iterable of rows, where each row is a list of column values
+        file_format (string): "tsv", "xls", or "json"
+    Returns:
+        Django StreamingHttpResponse object with the table data as an attachment.
+    """
+    rows = (_format_row(header, row) for row in rows)
+    content, content_type, extension = _get_table_content(header, rows, file_format, titlecase_header)
+    return _set_content_disposition(
+        StreamingHttpResponse(content, content_type=content_type), filename_prefix, extension)
+
 
+def _get_table_content(header, rows, file_format, titlecase_header):
     if file_format == "tsv":
-        response = HttpResponse(content_type='text/tsv')
-        response['Content-Disposition'] = 'attachment; filename="{}.tsv"'.format(filename_prefix).encode('ascii', 'ignore')
-        response.writelines(['\t'.join(header)+'\n'])
-        response.writelines(('\t'.join(map(str, row))+'\n' for row in rows))
-        return response
+        content = chain(['\t'.join(header)+'\n'], ('\t'.join(map(str, row))+'\n' for row in rows))
+        content_type = 'text/tsv'
+        extension = 'tsv'
     elif file_format == "json":
-        response = HttpResponse(content_type='application/json')
-        response['Content-Disposition'] = 'attachment; filename="{}.json"'.format(filename_prefix).encode('ascii', 'ignore')
-        for row in rows:
-            json_keys = [s.replace(" ", "_").lower() for s in header]
-            json_values = list(map(str, row))
-            response.write(json.dumps(OrderedDict(zip(json_keys, json_values)))+'\n')
-        return response
+        json_keys = [s.replace(" ", "_").lower() for s in header]
+        content = (json.dumps(OrderedDict(zip(json_keys, map(str, row))))+'\n' for row in rows)
+        content_type = 'application/json'
+        extension = 'json'
     elif file_format == "xls":
-        wb = xl.Workbook(write_only=True)
-        ws = wb.create_sheet()
         if titlecase_header:
             header = list(map(_to_title_case, header))
-        ws.append(header)
-        for row in rows:
-            ws.append(row)
-        with NamedTemporaryFile() as temporary_file:
-            wb.save(temporary_file.name)
-            temporary_file.seek(0)
-            response = HttpResponse(temporary_file.read(), content_type="application/ms-excel")
-            response['Content-Disposition'] = 'attachment; filename="{}.xlsx"'.format(filename_prefix).encode('ascii', 'ignore')
-            return response
+        content = _stream_xls(header, rows)
+        content_type = 'application/ms-excel'
+        extension = 'xlsx'
     else:
         raise ValueError("Invalid file_format: %s" % file_format)
 
+    return content, content_type, extension
+
+
+def _set_content_disposition(response, filename_prefix, extension):
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename_prefix, extension).encode('ascii', 'ignore')
+    return response
+
+
+def _stream_xls(header, rows):
+    # Write-only worksheets flush appended rows to a temporary file, so the rows are never all held in memory
+    wb = xl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    with NamedTemporaryFile() as temporary_file:
+        wb.save(temporary_file.name)
+        temporary_file.seek(0)
+        for chunk in iter(lambda: temporary_file.read(STREAMING_CHUNK_SIZE), b''):
+            yield chunk
+
 
 def export_multiple_files(files, zip_filename, file_format='csv', add_header_prefix=False, blank_value=''):
     if file_format not in DELIMITERS:
@@ -5,7 +5,7 @@ from openpyxl import load_workbook
 from io import BytesIO
 import mock
 
-from seqr.views.utils.export_utils import export_table, export_multiple_files
+from seqr.views.utils.export_utils import export_table, stream_export_table, export_multiple_files
 
 
 class ExportTableUtilsTest(TestCase):
@@ -42,6 +42,50 @@ class ExportTableUtilsTest(TestCase):
             export_table('test_file', ['column1'], rows)
         self.assertEqual(str(cm.exception), 'len(header) != len(row): 1 != 2\ncolumn1\nrow1_v1\xe2,row1_v2')
 
+    def test_stream_export_table(self):
+        header = ['column1', 'column 2']
+        rows = [['row1_v1\xe2', 'row1_v2'], ['row2_v1', None]]
+
+        def _get_rows():
+            for row in rows:
+                yield row
+
+        # test tsv format
+        response = stream_export_table('test_file', header, _get_rows(), file_format='tsv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('content-disposition'), 'attachment; filename="test_file.tsv"')
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            'column1\tcolumn 2\nrow1_v1\xe2\trow1_v2\nrow2_v1\t\n'.encode('utf-8'))
+
+        # test json format
+        response = stream_export_table('test_file', header, _get_rows(), file_format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('content-disposition'), 'attachment; filename="test_file.json"')
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            '{"column1": "row1_v1\\u00e2", "column_2": "row1_v2"}\n{"column1": "row2_v1", "column_2": ""}\n'.encode('utf-8'))
+
+        # test Excel format
+        response = stream_export_table('test_file', header, _get_rows(), file_format='xls')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('content-disposition'), 'attachment; filename="test_file.xlsx"')
+        wb = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        worksheet = wb.active
+
+        self.assertListEqual([cell.value for cell in worksheet['A']], ['Column1', 'row1_v1\xe2', 'row2_v1'])
+        self.assertListEqual([cell.value for cell in worksheet['B']], ['Column 2', 'row1_v2', None])
+
+        # test invalid input
+        with self.assertRaises(ValueError) as cm:
+            stream_export_table('test_file', header, _get_rows(), file_format='unknown_format')
+        self.assertEqual(str(cm.exception), 'Invalid file_format: unknown_format')
+
+        response = stream_export_table('test_file', ['column1'], _get_rows())
+        with self.assertRaises(ValueError) as cm:
+            b''.join(response.streaming_content)
+        self.assertEqual(str(cm.exception), 'len(header) != len(row): 1 != 2\ncolumn1\nrow1_v1\xe2,row1_v2')
+
     @mock.patch('seqr.views.utils.export_utils.zipfile.ZipFile')
     def test_export_multiple_files(self, mock_zip):
         mock_zip_content = {}
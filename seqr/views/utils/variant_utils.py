@@ -1,16 +1,26 @@
+from collections import defaultdict
+from contextlib import closing
+from django.db import transaction
+from django.utils import timezone
 import logging
 import redis
 
-from seqr.models import SavedVariant, VariantSearchResults
-from seqr.utils.elasticsearch.utils import get_es_variants_for_variant_ids
+from seqr.models import SavedVariant, VariantSearchResults, Sample
+from seqr.utils.elasticsearch.utils import get_es_variants_for_variant_id_chunks
 from seqr.utils.gene_utils import get_genes
-from seqr.views.utils.json_to_orm_utils import update_model_from_json
+from seqr.utils.logging_utils import log_model_bulk_update
 from settings import REDIS_SERVICE_HOSTNAME
 
 logger = logging.getLogger(__name__)
 
+SAVED_VARIANT_JSON_CHUNK_SIZE = 1000
+MAX_CONCURRENT_SAVED_VARIANT_JSON_FETCHES = 4
+SAVED_VARIANT_JSON_UPDATE_BATCH_SIZE = 200
+SAVED_VARIANT_JSON_UPDATE_FIELDS = ['saved_variant_json', 'saved_variant_json_index', 'saved_variant_json_loaded_date']
 
-def update_project_saved_variant_json(project, family_id=None, user=None):
+
+def update_project_saved_variant_json(project, family_id=None, user=None, changed_sources_only=False,
+                                      max_workers=MAX_CONCURRENT_SAVED_VARIANT_JSON_FETCHES):
     saved_variants = SavedVariant.objects.filter(family__project=project).select_related('family')
     if family_id:
         saved_variants = saved_variants.filter(family__family_id=family_id)
@@ -18,6 +28,12 @@ def update_project_saved_variant_json(project, family_id=None, user=None):
     if not saved_variants:
         return []
 
+    family_sources = _get_family_data_sources({v.family for v in saved_variants})
+    if changed_sources_only:
+        saved_variants = [v for v in saved_variants if _has_changed_data_source(v, family_sources)]
+        if not saved_variants:
+            return []
+
     families = set()
     variant_ids = set()
     saved_variants_map = {}
@@ -26,16 +42,76 @@ def update_project_saved_variant_json(project, family_id=None, user=None):
         variant_ids.add(v.variant_id)
         saved_variants_map[(v.variant_id, v.family.guid)] = v
 
-    variants_json = get_es_variants_for_variant_ids(sorted(families, key=lambda f: f.guid), sorted(variant_ids))
+    families = sorted(families, key=lambda f: f.guid)
+    variant_ids = sorted(variant_ids)
+    variant_id_chunks = [
+        variant_ids[i:i + SAVED_VARIANT_JSON_CHUNK_SIZE] for i in range(0, len(variant_ids), SAVED_VARIANT_JSON_CHUNK_SIZE)
+    ]
+
+    # Chunks are only fetched from elasticsearch concurrently, and are written to the database from this thread. The
+    # remaining fetches are cancelled if a chunk can not be written
+    updated_saved_variant_guids = []
+    with closing(get_es_variants_for_variant_id_chunks(
+            families, variant_id_chunks, max_workers=max_workers)) as variants_json_chunks:
+        for variants_json in variants_json_chunks:
+            updated_saved_variant_guids += _update_saved_variant_json(
+                variants_json, saved_variants_map, family_sources, user)
+
+    return updated_saved_variant_guids
+
 
+def _get_family_data_sources(families):
+    """Returns the active indices and their latest loaded date, keyed by family guid and dataset type"""
+    indices = defaultdict(set)
+    loaded_dates = {}
+    for sample in Sample.objects.filter(individual__family__in=families, is_active=True).values(
+            'individual__family__guid', 'dataset_type', 'elasticsearch_index', 'loaded_date'):
+        key = (sample['individual__family__guid'], sample['dataset_type'])
+        indices[key].add(sample['elasticsearch_index'])
+        if key not in loaded_dates or sample['loaded_date'] > loaded_dates[key]:
+            loaded_dates[key] = sample['loaded_date']
+    return {key: (','.join(sorted(key_indices)), loaded_dates[key]) for key, key_indices in indices.items()}
+
+
+def _get_data_source(variant_json, family_guid, family_sources):
+    dataset_type = Sample.DATASET_TYPE_SV_CALLS if variant_json.get('svType') else Sample.DATASET_TYPE_VARIANT_CALLS
+    return family_sources.get((family_guid, dataset_type), (None, None))
+
+
+def _has_changed_data_source(saved_variant, family_sources):
+    source = _get_data_source(saved_variant.saved_variant_json, saved_variant.family.guid, family_sources)
+    # Variants in families with no active data can not be refreshed
+    return source[0] is not None and \
+        (saved_variant.saved_variant_json_index, saved_variant.saved_variant_json_loaded_date) != source
+
+
+def _update_saved_variant_json(variants_json, saved_variants_map, family_sources, user):
     updated_saved_variant_guids = []
+    changed_saved_variants = []
     for var in variants_json:
         for family_guid in var['familyGuids']:
             saved_variant = saved_variants_map.get((var['variantId'], family_guid))
             if saved_variant:
-                update_model_from_json(saved_variant, {'saved_variant_json': var}, user)
+                source_index, source_loaded_date = _get_data_source(var, family_guid, family_sources)
+                if saved_variant.saved_variant_json != var or \
+                        saved_variant.saved_variant_json_index != source_index or \
+                        saved_variant.saved_variant_json_loaded_date != source_loaded_date:
+                    saved_variant.saved_variant_json = var
+                    saved_variant.saved_variant_json_index = source_index
+                    saved_variant.saved_variant_json_loaded_date = source_loaded_date
+                    changed_saved_variants.append(saved_variant)
                 updated_saved_variant_guids.append(saved_variant.guid)
 
+    if changed_saved_variants:
+        last_modified_date = timezone.now()
+        for saved_variant in changed_saved_variants:
+            saved_variant.last_modified_date = last_modified_date
+        with transaction.atomic():
+            SavedVariant.objects.bulk_update(
+                changed_saved_variants, SAVED_VARIANT_JSON_UPDATE_FIELDS + ['last_modified_date'],
+                batch_size=SAVED_VARIANT_JSON_UPDATE_BATCH_SIZE)
+        log_model_bulk_update(logger, changed_saved_variants, user, 'update', update_fields=SAVED_VARIANT_JSON_UPDATE_FIELDS)
+
     return updated_saved_variant_guids
 
 
@@ -59,6 +59,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'seqr.utils.middleware.LogRequestMiddleware',
     'seqr.utils.middleware.JsonErrorMiddleware',
+    'seqr.utils.middleware.RedisPipelineMiddleware',
+    'seqr.utils.middleware.ServerTimingMiddleware',
 ]
 
 ALLOWED_HOSTS = ['*']